@@ -41,16 +41,67 @@ class ArrayToPng(object):
         arrayToPng.putdata(xbins, ybins, reddata, greendata, bluedata, alphadata)
         svg.image(**{defs.XLINK_HREF: "data:image/png;base64," + arrayToPng.b64encode(),
                   "x": repr(X1), "y": repr(Y2), "width": repr(X2 - X1), "height": repr(Y1 - Y2)})
+
+    Images with at most 256 distinct colors (common for heatmaps
+    with simple gradients) are written in indexed-color mode, one
+    byte per pixel, and are not filtered, as the PNG specification
+    recommends.  Other images are written as 8-bit RGBA.  Their
+    scanlines are filtered and compressed in blocks of
+    C{blockRows}, so the memory overhead does not grow with the
+    image.  Every C{trialBlocks} blocks, a sample of C{sampleRows}
+    scanlines is trial-compressed with each of the None, Sub, Up,
+    and Paeth filters, and the smallest is used until the next
+    trial.  Colors that come from a gradient often compress best
+    unfiltered, especially with noise, which the per-scanline
+    heuristic of the PNG specification (C{filterScanlines} with
+    C{filterType=None}) does not recognize.
+
+    The default compression level is lower than zlib's default
+    of 6 because filtered scanlines take much longer to compress
+    at level 6 than unfiltered ones.  At level 4, a smooth image
+    with a filter is both smaller and faster to encode than the
+    same image unfiltered at level 6.  A noisy image, which is left
+    unfiltered, is encoded several times faster at level 4 and is
+    only a few percent larger.
+
+    @type compressionLevel: int
+    @param compressionLevel: Default zlib compression level, from 0 (none) to 9 (smallest).
+    @type blockRows: int
+    @param blockRows: Number of scanlines to filter and compress at a time.
+    @type sampleRows: int
+    @param sampleRows: Number of scanlines used to choose a filter.
+    @type trialBlocks: int
+    @param trialBlocks: Number of blocks that reuse a filter before the next trial.
     """
 
-    def __init__(self, file=None):
-        """Create an ArrayToPng with an empty internal buffer."""
+    compressionLevel = 4
+    blockRows = 256
+    sampleRows = 16
+    trialBlocks = 4
+
+    _filterNone = 0
+    _filterSub = 1
+    _filterUp = 2
+    _filterPaeth = 4
+    _filterTypes = [_filterNone, _filterSub, _filterUp, _filterPaeth]
+
+    def __init__(self, file=None, compressionLevel=None):
+        """Create an ArrayToPng with an empty internal buffer.
+
+        @type file: file-like object or None
+        @param file: If None, write to an internal buffer; otherwise, write to this stream.
+        @type compressionLevel: int or None
+        @param compressionLevel: If None, use the class's C{compressionLevel}; otherwise, a zlib compression level from 0 to 9.
+        """
 
         if file is None:
             self.file = StringIO.StringIO()
         else:
             self.file = file
 
+        if compressionLevel is not None:
+            self.compressionLevel = compressionLevel
+
     def _writeChunk(self, tag, data):
         """Used by putdata."""
 
@@ -61,7 +112,169 @@ class ArrayToPng(object):
         cyclicRedundancyCheck = zlib.crc32(data, cyclicRedundancyCheck)
         cyclicRedundancyCheck &= 0xffffffff
         self.file.write(struct.pack("!I", cyclicRedundancyCheck))
-        
+
+    @classmethod
+    def palette(cls, pixels):
+        """Represent an RGBA image with a palette of at most 256
+        colors, if possible.
+
+        The colors are found with a hash table of 65536 slots that
+        is filled and checked with vectorized operations, which is
+        several times faster than sorting the pixels.  The table is
+        first filled from every sixteenth scanline, so that images
+        with many colors are rejected quickly and the whole image
+        usually only needs to be looked up in the table.
+
+        @type pixels: 2d Numpy array of type uint32
+        @param pixels: Each pixel's red, green, blue, and alpha bytes packed into one integer.
+        @rtype: 2-tuple or None
+        @return: The index of each pixel (same shape as C{pixels}, type uint8) and the packed colors of the palette (1d array of type uint32), or None if there are more than 256 colors.
+        """
+
+        if len(pixels) >= 256:
+            sample = pixels[::16]
+        else:
+            sample = pixels
+
+        for multiplier in 0x9e3779b1, 0x85ebca6b, 0xc2b2ae35:
+            # the sample's colors are a subset of the image's, so too many of them rules out a palette
+            slots = cls._paletteSlots(sample, multiplier)
+            occupied = NP("zeros", 65536, dtype=NP.dtype(bool))
+            occupied[slots] = True
+            if NP("count_nonzero", occupied) > 256:
+                return None
+
+            # every empty slot holds a color that does not hash to it (0 hashes to slot 0), so no pixel matches one
+            table = NP("zeros", 65536, dtype=NP.uint32)
+            table[0] = 1
+            table[slots] = sample
+
+            if sample is not pixels:
+                slots = cls._paletteSlots(pixels, multiplier)
+
+            if not NP(table[slots] == pixels).all():
+                if sample is pixels:
+                    continue
+
+                # colors that are not in the sample, or collisions
+                occupied[slots] = True
+                if NP("count_nonzero", occupied) > 256:
+                    return None
+                table[slots] = pixels
+                if not NP(table[slots] == pixels).all():
+                    continue
+
+            ranks = NP(NP("cumsum", occupied) - 1).astype(NP.uint8)
+            return ranks[slots], table[occupied]
+
+        return None    # two colors collided under every multiplier
+
+    @staticmethod
+    def _paletteSlots(pixels, multiplier):
+        """Used by C{palette}."""
+
+        slots = NP(pixels * NP.uint32(multiplier))
+        slots >>= NP.uint32(16)
+        return slots.astype(NP.dtype(int))    # converted once, rather than by each indexing operation
+
+    @classmethod
+    def _filter(cls, rows, previous, bytesPerPixel, filterType):
+        """Used by C{filterScanlines}."""
+
+        if filterType == cls._filterNone:
+            return rows
+
+        numRows, rowBytes = rows.shape
+
+        # uint8 arithmetic wraps around modulo 256, as the PNG filters require
+        left = NP("zeros", (numRows, rowBytes), dtype=NP.uint8)
+        left[:,bytesPerPixel:] = rows[:,:-bytesPerPixel]
+        if filterType == cls._filterSub:
+            return NP(rows - left)
+
+        up = NP("empty", (numRows, rowBytes), dtype=NP.uint8)
+        up[0] = previous
+        up[1:] = rows[:-1]
+        if filterType == cls._filterUp:
+            return NP(rows - up)
+
+        upLeft = NP("zeros", (numRows, rowBytes), dtype=NP.uint8)
+        upLeft[:,bytesPerPixel:] = up[:,:-bytesPerPixel]
+
+        a = left.astype(NP.int16)
+        b = up.astype(NP.int16)
+        c = upLeft.astype(NP.int16)
+        pa = NP("absolute", NP(b - c))
+        pb = NP("absolute", NP(a - c))
+        pc = NP("absolute", NP(NP(a + b) - NP(2 * c)))
+        predictor = NP("where", NP("logical_and", NP(pa <= pb), NP(pa <= pc)), left, NP("where", NP(pb <= pc), up, upLeft))
+        return NP(rows - predictor)
+
+    @classmethod
+    def filterScanlines(cls, rows, previous, bytesPerPixel, filterType=None):
+        """Apply a PNG filter to each of a block of scanlines.
+
+        @type rows: 2d Numpy array of type uint8
+        @param rows: Unfiltered scanlines, one per row.
+        @type previous: 1d Numpy array of type uint8
+        @param previous: The unfiltered scanline before the block (all zeros for the first block).
+        @type bytesPerPixel: int
+        @param bytesPerPixel: Number of bytes per pixel, which is the distance that the Sub and Paeth filters look to the left.
+        @type filterType: int or None
+        @param filterType: The PNG filter type to apply to all scanlines (0, 1, 2, or 4); if None, choose the filter with the minimum sum of absolute differences for each scanline.
+        @rtype: 2d Numpy array of type uint8
+        @return: Filtered scanlines, each starting with its filter type byte.
+        """
+
+        numRows, rowBytes = rows.shape
+        output = NP("empty", (numRows, rowBytes + 1), dtype=NP.uint8)
+
+        if filterType is not None:
+            output[:,0] = filterType
+            output[:,1:] = cls._filter(rows, previous, bytesPerPixel, filterType)
+            return output
+
+        candidates = [cls._filter(rows, previous, bytesPerPixel, x) for x in cls._filterTypes]
+
+        # minimum sum of absolute differences, interpreting the filtered bytes as signed
+        scores = NP("vstack", [NP("absolute", filtered.view(NP.int8).astype(NP.int32)).sum(axis=1) for filtered in candidates])
+        best = NP("argmin", scores, axis=0)
+
+        for index, filtered in enumerate(candidates):
+            selection = NP(best == index)
+            output[selection,0] = cls._filterTypes[index]
+            output[selection,1:] = filtered[selection]
+        return output
+
+    def chooseFilter(self, rows, previous, bytesPerPixel):
+        """Choose how to filter a block of scanlines by
+        trial-compressing a sample of C{sampleRows} from its middle
+        at the C{compressionLevel}.
+
+        @type rows: 2d Numpy array of type uint8
+        @param rows: Unfiltered scanlines, one per row.
+        @type previous: 1d Numpy array of type uint8
+        @param previous: The unfiltered scanline before the block (all zeros for the first block).
+        @type bytesPerPixel: int
+        @param bytesPerPixel: Number of bytes per pixel.
+        @rtype: int
+        @return: The C{filterType} argument for C{filterScanlines}.
+        """
+
+        start = max(0, (len(rows) - self.sampleRows) // 2)
+        if start > 0:
+            previous = rows[start - 1]
+        rows = rows[start:start + self.sampleRows]
+
+        bestFilter = None
+        bestSize = None
+        for filterType in self._filterTypes:
+            size = len(zlib.compress(self.filterScanlines(rows, previous, bytesPerPixel, filterType).tostring(), self.compressionLevel))
+            if bestSize is None or size < bestSize:
+                bestFilter = filterType
+                bestSize = size
+        return bestFilter
+
     def putdata(self, width, height, red, green, blue, alpha, flipy=True, onePixelBeyondBorder=False):
         """Fill the internal buffer with a PNG-encoded version of arrays red, green, and blue.
 
@@ -84,41 +297,60 @@ class ArrayToPng(object):
         """
 
         # red, green, blue, alpha are assumed to be flat, uint8 Numpy arrays of the same length
-        interleaved = NP("empty", 4 * width * height, dtype=NP.uint8)
-        interleaved[0::4] = red
-        interleaved[1::4] = green
-        interleaved[2::4] = blue
-        interleaved[3::4] = alpha
-        interleaved = NP("reshape", interleaved, (height, 4 * width))
-
+        interleaved = NP("empty", (height, width, 4), dtype=NP.uint8)
         if flipy:
-            interleaved = interleaved[-1::-1,:]
+            target = interleaved[-1::-1,:,:]    # fill in flipped order, rather than copying afterward
+        else:
+            target = interleaved
+        target[:,:,0] = NP("reshape", red, (height, width))
+        target[:,:,1] = NP("reshape", green, (height, width))
+        target[:,:,2] = NP("reshape", blue, (height, width))
+        target[:,:,3] = NP("reshape", alpha, (height, width))
 
         if onePixelBeyondBorder:
             width += 2
             height += 2
+            interleaved = NP("pad", interleaved, ((1, 1), (1, 1), (0, 0)), mode="edge")
 
-            scanlines = NP("empty", (height, 4 * width + 1), dtype=NP.uint8)
-            scanlines[:,0] = 0  # first byte of each scanline is zero
+        indexed = self.palette(interleaved.view(NP.uint32)[:,:,0])
 
-            scanlines[1:-1,5:-4] = interleaved
-            scanlines[1:-1,1:5] = scanlines[1:-1,5:9]
-            scanlines[1:-1,-4:] = scanlines[1:-1,-8:-4]
+        self.file.write("\211PNG\r\n\032\n")
 
-            scanlines[0,:] = scanlines[1,:]
-            scanlines[-1,:] = scanlines[-2,:]
+        if indexed is not None:
+            pixels, colors = indexed
+            colors = colors.view(NP.uint8).reshape(len(colors), 4)
+            self._writeChunk("IHDR", struct.pack("!2I5B", width, height, 8, 3, 0, 0, 0))
+            self._writeChunk("PLTE", colors[:,:3].tostring())
+            if NP(colors[:,3] != 255).any():
+                self._writeChunk("tRNS", colors[:,3].tostring())
+            bytesPerPixel = None
 
-            scanlines = NP("reshape", scanlines, height * (4 * width + 1))
-            
         else:
-            scanlines = NP("empty", (height, 4 * width + 1), dtype=NP.uint8)
-            scanlines[:,0] = 0  # first byte of each scanline is zero
-            scanlines[:,1:] = interleaved
-            scanlines = NP("reshape", scanlines, height * (4 * width + 1))
+            pixels = NP("reshape", interleaved, (height, 4 * width))
+            self._writeChunk("IHDR", struct.pack("!2I5B", width, height, 8, 6, 0, 0, 0))
+            bytesPerPixel = 4
 
-        self.file.write("\211PNG\r\n\032\n")
-        self._writeChunk("IHDR", struct.pack("!2I5B", width, height, 8, 6, 0, 0, 0))
-        self._writeChunk("IDAT", zlib.compress(str(scanlines.data)))
+        compressor = zlib.compressobj(self.compressionLevel)
+        previous = NP("zeros", pixels.shape[1], dtype=NP.uint8)
+
+        for blockIndex, start in enumerate(xrange(0, height, self.blockRows)):
+            rows = pixels[start:start + self.blockRows]
+
+            if bytesPerPixel is None:
+                scanlines = NP("empty", (rows.shape[0], rows.shape[1] + 1), dtype=NP.uint8)
+                scanlines[:,0] = self._filterNone
+                scanlines[:,1:] = rows
+            else:
+                if blockIndex % self.trialBlocks == 0:
+                    filterType = self.chooseFilter(rows, previous, bytesPerPixel)
+                scanlines = self.filterScanlines(rows, previous, bytesPerPixel, filterType)
+                previous = rows[-1]
+
+            data = compressor.compress(scanlines.tostring())
+            if len(data) > 0:
+                self._writeChunk("IDAT", data)
+
+        self._writeChunk("IDAT", compressor.flush())
         self._writeChunk("IEND", "")
 
     def close(self):
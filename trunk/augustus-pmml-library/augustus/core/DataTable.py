@@ -28,6 +28,7 @@ from augustus.core.PmmlBinding import PmmlBinding
 from augustus.core.DataTableFields import DataTableFields
 from augustus.core.DataTablePlots import DataTablePlots
 from augustus.core.DataTableState import DataTableState
+from augustus.core.DataTableExpressions import DataTableExpressions
 from augustus.core.FieldType import FieldType
 from augustus.core.FakeFieldType import FakeFieldType
 from augustus.core.OrderedDict import OrderedDict
@@ -277,6 +278,7 @@ class DataTable(object):
             self.state = inputState
 
         self.plots = DataTablePlots()
+        self.expressions = DataTableExpressions()
         self.output = DataTableFields()
         self.output._name = "output"
         self.score = None
@@ -310,6 +312,9 @@ class DataTable(object):
             namespace
           - C{plots} so that generated plots are not hidden by nested
             namespaces
+          - C{expressions} if the sub-table is not filtered, so that
+            shared subexpressions are evaluated only once (a filtered
+            sub-table gets a new DataTableExpressions)
 
         @type selection: 1d Numpy array of dtype bool, or None
         @param selection: If None, create a DataTable of the same length; otherwise, use the boolean array to filter it.
@@ -331,6 +336,12 @@ class DataTable(object):
         # REFERENCE, do not copy, the plots so that a single table accumulates
         table.plots = self.plots
 
+        # REFERENCE, do not copy, the shared expressions if the data are the same; otherwise start anew
+        if selection is None:
+            table.expressions = self.expressions
+        else:
+            table.expressions = DataTableExpressions()
+
         # create a NEW output, since these are merged as subTables pop
         table.output = DataTableFields()
 
@@ -339,6 +350,77 @@ class DataTable(object):
 
         return table
 
+    class _ScopedFields(object):
+        """Read-only view of a DataTable's fields with some local
+        fields added, possibly shadowing the original ones."""
+
+        def __init__(self, localFields, fields):
+            self._localFields = localFields
+            self._fields = fields
+            self._name = "fields"
+
+        @property
+        def name(self):
+            return self._name
+
+        def __getitem__(self, name):
+            try:
+                return self._localFields[name]
+            except KeyError:
+                return self._fields[name]
+
+        def __contains__(self, name):
+            return name in self._localFields or name in self._fields
+
+        def get(self, name, default=None):
+            if name in self:
+                return self[name]
+            else:
+                return default
+
+        def keys(self):
+            return self._fields.keys() + [x for x in self._localFields if x not in self._fields]
+
+        def __iter__(self):
+            return iter(self.keys())
+
+        def values(self):
+            return [self[x] for x in self.keys()]
+
+        def items(self):
+            return [(x, self[x]) for x in self.keys()]
+
+        def __len__(self):
+            return len(self._fields)
+
+        def __repr__(self):
+            return "<DataTable.%s %d rows; %s at 0x%x>" % (self.name, len(self), " ".join(["\"%s\"" % f for f in self]), id(self))
+
+    def scope(self, localFields):
+        """Return a view of this DataTable with some local fields
+        added, such as the parameters of a user-defined function.
+
+        Unlike C{subTable}, this does not duplicate the DataColumns of
+        the existing fields, so it is inexpensive to create.  The
+        fields of the view are read-only; C{state}, C{plots}, and
+        C{expressions} are referenced and C{output} and C{score} are
+        new, as in C{subTable}.
+
+        @type localFields: dict
+        @param localFields: Dictionary from field names to DataColumns of the same length as this DataTable.  These may shadow existing fields.
+        @rtype: DataTable
+        @return: A table of the same length.
+        """
+
+        table = self.__class__.__new__(self.__class__)
+        table.fields = self._ScopedFields(localFields, self.fields)
+        table.state = self.state
+        table.plots = self.plots
+        table.expressions = self.expressions
+        table.output = DataTableFields()
+        table.score = None
+        return table
+
     def __repr__(self):
         return "<DataTable at 0x%x>" % id(self)
 
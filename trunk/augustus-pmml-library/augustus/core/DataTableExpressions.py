@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the DataTableExpressions class."""
+
+class DataTableExpressions(dict):
+    """DataTableExpressions is a dictionary of expression results
+    that are shared among the transformations applied to a
+    DataTable.
+
+    When the same expression subtree appears in several
+    DerivedFields (see C{PMML.sharedExpressions}), it is evaluated
+    once and reused.  The keys of this dictionary combine the
+    structural key of the expression with the identities of the
+    DataColumns that it references, so a field that has been
+    replaced (e.g. by a MiningField) is never confused with the
+    original, and with the identity and C{version} of the
+    FunctionTable, so a function that has been added or replaced is
+    never confused with the old one.  The values keep references to
+    those DataColumns and the FunctionTable, so that their
+    identities remain valid for as long as the result is held.
+
+    Unfiltered sub-tables reference the same DataTableExpressions as
+    their parent (so that LocalTransformations can reuse the results
+    of the TransformationDictionary); filtered sub-tables start with
+    a new one.
+
+    Plots also keep their expressions and selections here, so that
+    plot elements that are overlaid or arranged on the same
+    PlotCanvas evaluate common expressions only once (see
+    C{PlotCanvas.makePlot}).
+    """
+
+    @property
+    def name(self):
+        return self._name
+
+    def __init__(self, *args, **kwds):
+        self._name = "expressions"
+        super(DataTableExpressions, self).__init__(*args, **kwds)
+
+    def __repr__(self):
+        return "<DataTable.%s %d records at 0x%x>" % (self.name, len(self), id(self))
+
+    def evaluate(self, expression, structuralKey, dataTable, functionTable, performanceTable, statistic="shared expressions"):
+        """Evaluate an expression or reuse the result of a
+        structurally identical expression.
+
+        @type expression: PmmlExpression
+        @param expression: The expression to evaluate.
+        @type structuralKey: tuple
+        @param structuralKey: The expression's structural key.
+        @type dataTable: DataTable
+        @param dataTable: The input DataTable, containing any fields that might be used to evaluate this expression.
+        @type functionTable: FunctionTable
+        @param functionTable: The FunctionTable, containing any functions that might be called in this expression.
+        @type performanceTable: PerformanceTable
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @type statistic: string
+        @param statistic: Prefix of the PerformanceTable counts of evaluated and reused results.
+        @rtype: DataColumn
+        @return: The result of the calculation as a DataColumn.
+        """
+
+        return self.reuse(structuralKey, expression.referencedFields(), lambda: expression.evaluate(dataTable, functionTable, performanceTable), dataTable, functionTable, performanceTable, statistic)
+
+    def reuse(self, structuralKey, fieldNames, calculate, dataTable, functionTable, performanceTable, statistic):
+        """Return a result that depends only on a structural key and
+        the values of some fields, calculating it if a result with
+        the same key has not been stored for the same fields.
+
+        @type structuralKey: tuple
+        @param structuralKey: Hashable representation of the calculation.
+        @type fieldNames: tuple of strings
+        @param fieldNames: Names of the fields that the calculation uses.
+        @type calculate: callable
+        @param calculate: Function of no arguments that computes the result.  It is also called (and expected to raise an error) if any of the fields are missing from the DataTable.
+        @type dataTable: DataTable
+        @param dataTable: The input DataTable, containing the fields.
+        @type functionTable: FunctionTable
+        @param functionTable: The FunctionTable used by the calculation.
+        @type performanceTable: PerformanceTable
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @type statistic: string
+        @param statistic: Prefix of the PerformanceTable counts of evaluated and reused results.
+        @rtype: any
+        @return: The result of C{calculate}, which must not be modified by the caller.
+        """
+
+        try:
+            dataColumns = tuple(dataTable.fields[x] for x in fieldNames)
+        except LookupError:
+            # let the calculation raise its usual error
+            return calculate()
+
+        key = (structuralKey, id(functionTable), functionTable.version, tuple((id(x.data), id(x.mask)) for x in dataColumns))
+        if key in self:
+            performanceTable.count(statistic + " reused")
+            return self[key][2]
+
+        result = calculate()
+        self[key] = (functionTable, dataColumns, result)
+        performanceTable.count(statistic + " evaluated")
+        return result
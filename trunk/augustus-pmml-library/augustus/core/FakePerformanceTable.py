@@ -33,6 +33,9 @@ class FakePerformanceTable(PerformanceTable):
     def absorb(self, performanceTable):
         pass
 
+    def accumulate(self, performanceTable):
+        pass
+
     def begin(self, key):
         pass
 
@@ -45,6 +48,9 @@ class FakePerformanceTable(PerformanceTable):
     def unpause(self, key):
         pass
 
+    def count(self, key, increment=1):
+        pass
+
     def block(self):
         pass
 
@@ -39,12 +39,51 @@ class FunctionTable(dict):
 
     Additional functions may be added to a FunctionTable instance or defined
     more generally in a FunctionTable subclass.  See FunctionTableExtra.
+
+    The C{version} attribute is incremented whenever a function is
+    added, replaced, or removed, so that anything compiled against
+    the table (e.g. the plan of an Apply) can tell that it is stale.
+    Assigning the same function to the same name does not change the
+    version.
     """
 
     def __init__(self):
         super(FunctionTable, self).__init__()
+        self.version = 0
         self._defineBuiltins()
 
+    def __setitem__(self, name, function):
+        if name not in self or dict.__getitem__(self, name) is not function:
+            self.version += 1
+        super(FunctionTable, self).__setitem__(name, function)
+
+    def __delitem__(self, name):
+        super(FunctionTable, self).__delitem__(name)
+        self.version += 1
+
+    def update(self, *args, **kwds):
+        for name, function in dict(*args, **kwds).items():
+            self[name] = function
+
+    def setdefault(self, name, function=None):
+        if name not in self:
+            self[name] = function
+        return self[name]
+
+    def pop(self, name, *default):
+        if name in self:
+            self.version += 1
+        return super(FunctionTable, self).pop(name, *default)
+
+    def popitem(self):
+        item = super(FunctionTable, self).popitem()
+        self.version += 1
+        return item
+
+    def clear(self):
+        super(FunctionTable, self).clear()
+        self.version += 1
+
     def _defineBuiltins(self):
         for fcnClass in self.Addition, self.Subtraction, self.Multiplication, self.TrueDivision, self.Minimum, self.Maximum, self.Sum, self.Average, self.Median, self.Product, self.LogBase10, self.LogBaseE, self.SquareRoot, self.Absolute, self.Exponential, self.Power, self.Threshold, self.Floor, self.Ceiling, self.Round, self.IsMissing, self.IsNotMissing, self.Equal, self.NotEqual, self.LessThan, self.LessOrEqual, self.GreaterThan, self.GreaterOrEqual, self.LogicalAnd, self.LogicalOr, self.LogicalNot, self.Contains, self.NotContains, self.IfThenElse, self.Uppercase, self.Lowercase, self.Substring, self.TrimBlanks, self.FormatNumber, self.FormatDatetime, self.DateDaysSinceYear, self.DateSecondsSinceYear, self.DateSecondsSinceMidnight, self.Negative:
             self[fcnClass.name] = fcnClass()
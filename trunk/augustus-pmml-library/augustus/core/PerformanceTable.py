@@ -56,6 +56,11 @@ class PerformanceTable(object):
     neglecting exceptions.  (Exceptions invalidate the
     PerformanceTable anyway, so it is not necessary to include
     C{try}-C{finally} blocks everywhere.)
+
+    Statistics that are not timings, such as the number of times a
+    cached result was reused, can be accumulated with C{count}::
+
+        performanceTable.count("My statistic")
     """
 
     def __init__(self):
@@ -66,6 +71,7 @@ class PerformanceTable(object):
         self._calls = {}
         self._pauseBegin = {}
         self._pauseTime = {}
+        self._counts = {}
 
         self._memBegin = {}
         self._mem = {}
@@ -90,6 +96,19 @@ class PerformanceTable(object):
     def __repr__(self):
         return "<PerformanceTable at 0x%x>" % id(self)
 
+    def __getstate__(self):
+        """Used by Pickle to serialize the PerformanceTable."""
+
+        serialization = self.__dict__.copy()
+        del serialization["_logger"]
+        return serialization
+
+    def __setstate__(self, serialization):
+        """Used by Pickle to unserialize the PerformanceTable."""
+
+        self.__dict__.update(serialization)
+        self._logger = logging.getLogger("PerformanceTable")
+
     @staticmethod
     def combine(performanceTables):
         """Combine a list of PerformanceTables and output a new
@@ -112,7 +131,7 @@ class PerformanceTable(object):
             if hasattr(performanceTable, "_globalMemEnd"):
                 output._globalMemFromOtherSources += (performanceTable._globalMemEnd - performanceTable._globalMemBegin)
 
-            for name in "_time", "_calls", "_mem":
+            for name in "_time", "_calls", "_mem", "_counts":
                 tofill = getattr(output, name)
                 for tag, value in getattr(performanceTable, name).items():
                     if tag in tofill:
@@ -136,6 +155,28 @@ class PerformanceTable(object):
         combination = PerformanceTable.combine([self, performanceTable])
         self.__dict__ = combination.__dict__
 
+    def accumulate(self, performanceTable):
+        """Add a given PerformanceTable's timings, memory use, and
+        counts to this PerformanceTable in-place, without disturbing
+        the keys that this one is currently measuring.
+
+        Unlike C{absorb}, this may be called in the middle of a
+        calculation.  It is intended for the results of worker
+        processes, so their elapsed time is not added to the total
+        (it overlaps with this PerformanceTable's own).
+
+        @type performanceTable: PerformanceTable
+        @param performanceTable: The PerformanceTable to add.
+        """
+
+        for name in "_time", "_calls", "_mem", "_counts":
+            tofill = getattr(self, name)
+            for tag, value in getattr(performanceTable, name).items():
+                if tag in tofill:
+                    tofill[tag] += value
+                else:
+                    tofill[tag] = value
+
     def begin(self, key):
         """Starts the stopwatch and memory counter for a given key.
 
@@ -256,6 +297,25 @@ class PerformanceTable(object):
 
         self._logger.debug("unpause \"%s\", keyStack: %r", key, self._keyStack)
 
+    def count(self, key, increment=1):
+        """Adds to a counter for a given key.
+
+        Unlike C{begin} and C{end}, counters are not nested: the same
+        key accumulates wherever it is counted.
+
+        @type key: string
+        @param key: The key to count.
+        @type increment: int
+        @param increment: The amount to add to the counter.
+        """
+
+        if self._blocked: return
+
+        if key in self._counts:
+            self._counts[key] += increment
+        else:
+            self._counts[key] = increment
+
     def block(self):
         """Turns off PerformanceTable data collection."""
 
@@ -306,7 +366,7 @@ class PerformanceTable(object):
 
         Structure of the output::
 
-            {"TotalTime": ##.##, "TotalNumpyMem": ##.##, "SortedBy": sortby, "Profile": [...]}
+            {"TotalTime": ##.##, "TotalNumpyMem": ##.##, "SortedBy": sortby, "Profile": [...], "Counts": {...}}
 
         where items in the C{"Profile"} list are::
 
@@ -314,7 +374,8 @@ class PerformanceTable(object):
 
         If any locations are nested (indented names in the C{look}
         output), this item would have an additional C{"Profile"}
-        key pointing to the sub-list.
+        key pointing to the sub-list.  The C{"Counts"} dictionary maps
+        the keys of C{count} to their totals.
 
         @type sortby: string
         @param sortby: The field used for sorting, may be "time", "calls", "timePerCall", or "memory".
@@ -335,7 +396,7 @@ class PerformanceTable(object):
         else:
             totalMem = (self._globalMemEnd - self._globalMemBegin) + self._globalMemFromOtherSources
 
-        output = {"TotalTime": totalTime, "TotalNumpyMem": totalMem/1024.0/1024.0, "SortedBy": sortby, "Profile": []}
+        output = {"TotalTime": totalTime, "TotalNumpyMem": totalMem/1024.0/1024.0, "SortedBy": sortby, "Profile": [], "Counts": dict(self._counts)}
         tofill = output["Profile"]
 
         def fillIt(key, n, head, tofill):
@@ -426,4 +487,17 @@ class PerformanceTable(object):
             totalMem = (self._globalMemEnd - self._globalMemBegin) + self._globalMemFromOtherSources
 
         stream.write("%sTotal time (s): %g   Total Numpy mem (MB): %g%s" % (os.linesep, totalTime, totalMem/1024.0/1024.0, os.linesep))
+
+        if len(self._counts) > 0:
+            formatter = "%%-%ds   %%12s%s" % (columnWidth, os.linesep)
+            stream.write(os.linesep)
+            stream.write(formatter % ("Counter", "count"))
+            stream.write("-" * (columnWidth + 15))
+            stream.write(os.linesep)
+            for key in sorted(self._counts):
+                name = key
+                if len(name) > columnWidth:
+                    name = name[:(columnWidth - 3)] + "..."
+                stream.write(formatter % (name, self._counts[key]))
+
         stream.flush()
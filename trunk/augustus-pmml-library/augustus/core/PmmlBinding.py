@@ -176,6 +176,93 @@ class PmmlBinding(XmlBinding):
         else:
             return " (line %d)" % self.sourceline
 
+    ### precompiled data that survive lxml's regeneration of Python instances
+
+    def cached(self, key, build):
+        """Return precompiled data associated with this element,
+        building it on first use.
+
+        lxml deletes and regenerates PmmlBinding instances whenever
+        their only references are in the element tree, taking any
+        Python attributes with them.  This method anchors the
+        instance to the root of its tree, so the cached data persist
+        as long as the root is referenced (e.g. by the user who
+        loaded the model).  If the root is not referenced, the cache
+        is simply rebuilt on the next call.
+
+        If the PMML is modified in place, call C{clearCache} on the
+        root to discard data compiled from the old version.
+
+        @type key: string
+        @param key: Name of the cached item, unique within this element.
+        @type build: callable
+        @param build: Function of no arguments that computes the item.
+        @rtype: any
+        @return: The cached item.
+        """
+
+        try:
+            cache = self._cache
+        except AttributeError:
+            cache = self._cache = {}
+            root = self.getroottree().getroot()
+            if root is not self:
+                try:
+                    root._cachedElements.append(self)
+                except AttributeError:
+                    root._cachedElements = [self]
+
+        try:
+            return cache[key]
+        except KeyError:
+            value = cache[key] = build()
+            return value
+
+    def clearCache(self):
+        """Discard all data cached by C{cached} in this element and
+        its descendants.
+
+        This must be called after modifying PMML in place if the
+        modified elements have already been evaluated.
+        """
+
+        for elem in self.iter():
+            if isinstance(elem, PmmlBinding):
+                elem.__dict__.pop("_cache", None)
+                elem.__dict__.pop("_cachedElements", None)
+
+    def cachedStructuralKey(self, shareable=None):
+        """Return a hashable representation of this element's
+        subtree, such that structurally identical subtrees have equal
+        keys, building it on first use (see C{cached}).
+
+        Whitespace and comments are ignored.
+
+        @type shareable: callable or None
+        @param shareable: Function of an element that returns False if no subtree that contains it may have a key; if None, all elements are allowed.
+        @rtype: tuple or None
+        @return: The key, or None if the subtree contains an element that is not shareable.
+        """
+
+        def build():
+            def key(elem):
+                if shareable is not None and not shareable(elem):
+                    return None
+                text = elem.text
+                if text is not None:
+                    text = text.strip()
+                children = []
+                for child in elem.iterchildren():
+                    if isinstance(child.tag, basestring):
+                        childKey = key(child)
+                        if childKey is None:
+                            return None
+                        children.append(childKey)
+                return (elem.tag, tuple(sorted(elem.attrib.items())), text, tuple(children))
+            return key(self)
+
+        return self.cached("structuralKey", build)
+
     ### overload for additional validity checks
 
     def postValidate(self):
@@ -26,9 +26,144 @@ class PmmlExpression(PmmlBinding):
     """PmmlExpression is an abstract base class for all PMML
     expressions.
 
+    Expressions whose result depends only on their structure and the
+    fields they reference (C{shareable = True}) can be evaluated once
+    and shared among all structurally identical copies in a PMML
+    document; see C{evaluateShared}.
+
     U{PMML specification<http://www.dmg.org/v4-1/Transformations.html>}.
     """
 
+    shareable = False
+
+    def isShareable(self):
+        """Determine whether this expression, not including its
+        subexpressions, is a pure function of its fields.
+
+        @rtype: bool
+        @return: True if the result can be shared with structurally identical expressions.
+        """
+
+        return self.shareable
+
+    def structuralKey(self):
+        """Return a hashable representation of this expression's
+        subtree, such that structurally identical subtrees have equal
+        keys.
+
+        Whitespace and comments are ignored.  Subtrees containing an
+        expression that is not shareable (e.g. one that maintains a
+        state, like Aggregate) have no key.
+
+        @rtype: tuple or None
+        @return: The key, or None if this subtree cannot be shared.
+        """
+
+        return self.cachedStructuralKey(lambda elem: not isinstance(elem, PmmlExpression) or elem.isShareable())
+
+    def indirectFields(self):
+        """Return the names of fields that this expression, not
+        including its subexpressions, references through something
+        other than a C{field} attribute.
+
+        @rtype: set of strings
+        @return: Field names.
+        """
+
+        return set()
+
+    def referencedFields(self):
+        """Return the names of all fields referenced by this
+        expression's subtree.
+
+        @rtype: tuple of strings
+        @return: Sorted field names.
+        """
+
+        def build():
+            output = set()
+            for x in self.iter():
+                if isinstance(x, PmmlBinding) and x.get("field") is not None:
+                    output.add(x.get("field"))
+                if isinstance(x, PmmlExpression):
+                    output.update(x.indirectFields())
+            return tuple(sorted(output))
+
+        return self.cached("referencedFields", build)
+
+    def sharingKey(self):
+        """Return this expression's structural key if the expression
+        appears more than once among the transformations of its PMML
+        document.
+
+        @rtype: tuple or None
+        @return: The structural key, or None if this expression is not shared.
+        """
+
+        def build():
+            try:
+                sharedExpressions = self.getroottree().getroot().sharedExpressions
+            except AttributeError:
+                return None
+            key = self.structuralKey()
+            if key is not None and key in sharedExpressions():
+                return key
+            else:
+                return None
+
+        return self.cached("sharingKey", build)
+
+    def evaluateShared(self, dataTable, functionTable, performanceTable):
+        """Evaluate the expression or, if a structurally identical
+        expression has already been evaluated with the same fields of
+        this DataTable, reuse its result.
+
+        Results are held by the DataTable's C{expressions}.
+
+        @type dataTable: DataTable
+        @param dataTable: The input DataTable, containing any fields that might be used to evaluate this expression.
+        @type functionTable: FunctionTable
+        @param functionTable: The FunctionTable, containing any functions that might be called in this expression.
+        @type performanceTable: PerformanceTable
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: The result of the calculation as a DataColumn.
+        """
+
+        key = self.sharingKey()
+        if key is None:
+            return self.evaluate(dataTable, functionTable, performanceTable)
+        else:
+            return dataTable.expressions.evaluate(self, key, dataTable, functionTable, performanceTable)
+
+    def evaluateCached(self, dataTable, functionTable, performanceTable, statistic="shared expressions"):
+        """Evaluate the expression or, if any structurally identical
+        expression has already been evaluated with the same fields of
+        this DataTable, reuse its result.
+
+        Unlike C{evaluateShared}, the expression does not need to
+        appear more than once among the transformations of its PMML
+        document.  This is intended for expressions outside of the
+        transformations, such as those in plots.
+
+        @type dataTable: DataTable
+        @param dataTable: The input DataTable, containing any fields that might be used to evaluate this expression.
+        @type functionTable: FunctionTable
+        @param functionTable: The FunctionTable, containing any functions that might be called in this expression.
+        @type performanceTable: PerformanceTable
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @type statistic: string
+        @param statistic: Prefix of the PerformanceTable counts of evaluated and reused results.
+        @rtype: DataColumn
+        @return: The result of the calculation as a DataColumn.
+        """
+
+        key = self.structuralKey()
+        if key is None:
+            return self.evaluate(dataTable, functionTable, performanceTable)
+        else:
+            return dataTable.expressions.evaluate(self, key, dataTable, functionTable, performanceTable, statistic)
+
     def evaluate(self, dataTable, functionTable, performanceTable):
         """Evaluate the expression, using a DataTable as input.
 
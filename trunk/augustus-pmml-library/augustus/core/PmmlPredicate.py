@@ -43,3 +43,33 @@ class PmmlPredicate(PmmlBinding):
         """
 
         raise NotImplementedError("Subclasses of PmmlPredicate must implement evaluate(dataTable, functionTable, performanceTable, returnUnknowns=False)")
+
+    def structuralKey(self):
+        """Return a hashable representation of this predicate's
+        subtree, such that structurally identical predicates have
+        equal keys.
+
+        Whitespace and comments are ignored.
+
+        @rtype: tuple
+        @return: The key.
+        """
+
+        return self.cachedStructuralKey()
+
+    def referencedFields(self):
+        """Return the names of all fields referenced by this
+        predicate's subtree.
+
+        @rtype: tuple of strings
+        @return: Sorted field names.
+        """
+
+        def build():
+            output = set()
+            for x in self.iter():
+                if isinstance(x, PmmlBinding) and x.get("field") is not None:
+                    output.add(x.get("field"))
+            return tuple(sorted(output))
+
+        return self.cached("referencedFields", build)
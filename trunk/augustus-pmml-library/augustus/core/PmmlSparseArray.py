@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This module defines the PmmlSparseArray class."""
+
+from augustus.core.defs import defs
+from augustus.core.PmmlArray import PmmlArray
+
+class PmmlSparseArray(PmmlArray):
+    """PmmlSparseArray is an abstract base class for sparse arrays
+    (INT-SparseArray and REAL-SparseArray).
+
+    @type entriesTag: string
+    @param entriesTag: Tag of the subelement that contains the entries.
+    @type entryType: type
+    @param entryType: Python type of the entries.
+    """
+
+    entriesTag = None
+    entryType = None
+
+    def sparseValues(self):
+        """Extract values from the PMML without expanding them into
+        a dense list.
+
+        @rtype: 4-tuple
+        @return: The length of the array, a list of zero-based indices, a list of the values at those indices (converted to numbers), and the default value for all other indices.
+        @raise PmmlValidationError: If the Indices and Entries have different lengths or an index is out of range.
+        """
+
+        n = self.get("n")
+        defaultValue = self.get("defaultValue", defaultFromXsd=True, convertType=True)
+        indices = self.childOfTag("Indices")
+        entries = self.childOfTag(self.entriesTag)
+
+        if indices is None or indices.text is None:
+            indices = []
+        else:
+            indices = [int(x) - 1 for x in indices.text.strip().split()]
+
+        if entries is None or entries.text is None:
+            entries = []
+        else:
+            entries = map(self.entryType, entries.text.strip().split())
+
+        if len(indices) != len(entries):
+            raise defs.PmmlValidationError("%s has %d Indices but %d Entries" % (self.t, len(indices), len(entries)))
+
+        if n is None:
+            n = max(indices) + 1 if len(indices) > 0 else 0
+        else:
+            n = int(n)
+
+        if len(indices) > 0 and (min(indices) < 0 or max(indices) >= n):
+            raise defs.PmmlValidationError("%s index out of range" % self.t)
+
+        return n, indices, entries, defaultValue
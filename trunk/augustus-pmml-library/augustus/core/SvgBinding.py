@@ -30,7 +30,9 @@ except ImportError:
     except ImportError:
         from io import BytesIO as StringIO
 
-from lxml.etree import ElementTree, XMLParser, ElementDefaultClassLookup, parse
+from xml.sax.saxutils import quoteattr
+
+from lxml.etree import ElementTree, XMLParser, ElementDefaultClassLookup, parse, fromstring
 from lxml.builder import ElementMaker
 
 from augustus.core.defs import defs
@@ -140,6 +142,32 @@ class SvgBinding(XmlBinding):
         file.write(defs.SVG_FILE_HEADER)
         ElementTree(elem).write(file, *args, **kwds)
 
+    @staticmethod
+    def loadFragments(fragments, **attrib):
+        """Build an SVG group from serialized SVG elements in a
+        single parsing step.
+
+        Creating many small elements with the C{elementMaker} is
+        dominated by Python overhead; formatting them as text (for
+        instance with C{PlotNumberFormat.formatArrays}) and parsing
+        the text once is much faster for large plots.
+
+        @type fragments: string
+        @param fragments: Serialized SVG elements, which may use the default namespace for SVG and the "xlink" prefix for XLink.
+        @param **attrib: Attributes of the new group.
+        @rtype: SvgBinding
+        @return: A C{<g>} element containing the parsed elements.
+        """
+
+        attributes = "".join(" %s=%s" % (name, quoteattr(value)) for name, value in attrib.items())
+        data = "<g xmlns=\"%s\" xmlns:xlink=\"%s\"%s>%s</g>" % (defs.SVG_NAMESPACE, defs.XLINK_NAMESPACE, attributes, fragments)
+
+        parser = XMLParser(huge_tree=True)
+        lookup = ElementDefaultClassLookup(element=SvgBinding)
+        parser.set_element_class_lookup(lookup)
+
+        return fromstring(data, parser)
+
 def makeElementMaker():
     """Obtain a factory for making in-memory SVG objects.
 
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the PlotQuantileSketch class."""
+
+import math
+
+from augustus.core.NumpyInterface import NP
+
+class PlotQuantileSketch(object):
+    """PlotQuantileSketch is a bag of functions that maintain a
+    mergeable summary of a distribution, so that quantiles of a
+    stream can be estimated in bounded memory.
+
+    A sketch is an ordinary dictionary of numbers and Numpy arrays,
+    so that it can be stored in a DataTableState and serialized by
+    SerializedState.  It contains:
+
+      - "compression": the t-digest compression parameter M{delta}.
+      - "exactLimit": the number of values kept verbatim before the
+        sketch starts compressing.
+      - "means", "weights": centroids, each representing C{weight}
+        values with mean C{mean}.
+      - "exact": True until the sketch is first compressed.
+      - "min", "max": the exact extremes.
+      - "count", "mean", "m2": exact moments (M{m2} is the sum of
+        squared deviations from the mean).
+
+    Until a sketch has seen more than C{exactLimit} values, every
+    centroid has weight 1 and C{quantiles} agrees exactly with
+    C{numpy.percentile}.  Beyond that, centroids are merged with the
+    t-digest arcsine scale function, which keeps at most about
+    M{delta} centroids and makes them smallest in the tails.  The
+    rank of an estimated quantile M{q} is then within about
+    M{pi sqrt(q(1 - q))/delta} of the requested rank (1.6% at the
+    median and 0.31% at the 1st and 99th percentiles for M{delta} =
+    100), and the 0th and 100th percentiles are always exact.
+
+    How much of that bound is used depends on how often the sketch
+    is compressed.  A sketch that is compressed only a few times
+    (values added in chunks larger than C{exactLimit}) is usually
+    within a few hundredths of a percent, but a long stream of
+    chunks smaller than C{exactLimit} compresses once every
+    C{exactLimit} values and can be off by 1% at the median.  The
+    bound scales as M{1/delta}, so a larger compression parameter is
+    the way to get tighter quantiles.
+
+    Sketches are merged by concatenating their centroids and
+    compressing again, which is associative up to these error
+    bounds, so sketches computed from separate chunks or separate
+    MapReduce workers can be combined in any order.
+    """
+
+    @staticmethod
+    def new(compression=100, exactLimit=10000):
+        """Create an empty sketch.
+
+        @type compression: number
+        @param compression: The t-digest compression parameter; the sketch keeps at most about this many centroids.
+        @type exactLimit: int
+        @param exactLimit: Number of values kept verbatim before the sketch starts compressing.
+        @rtype: dict
+        @return: An empty sketch.
+        """
+
+        return {"compression": float(compression),
+                "exactLimit": int(exactLimit),
+                "exact": True,
+                "means": NP("empty", 0, dtype=NP.dtype(float)),
+                "weights": NP("empty", 0, dtype=NP.dtype(float)),
+                "min": float("inf"),
+                "max": float("-inf"),
+                "count": 0.0,
+                "mean": 0.0,
+                "m2": 0.0}
+
+    @classmethod
+    def fromArray(cls, array, compression=100, exactLimit=10000, weights=None):
+        """Create a sketch from an array of values.
+
+        @type array: 1d Numpy array
+        @param array: The values.
+        @type compression: number
+        @param compression: The t-digest compression parameter.
+        @type exactLimit: int
+        @param exactLimit: Number of values kept verbatim before the sketch starts compressing.
+        @type weights: 1d Numpy array or None
+        @param weights: Optional weight for each value (see C{update}).
+        @rtype: dict
+        @return: A new sketch.
+        """
+
+        sketch = cls.new(compression, exactLimit)
+        cls.update(sketch, array, weights)
+        return sketch
+
+    @staticmethod
+    def _moments(count, mean, m2, otherCount, otherMean, otherM2):
+        """Used by C{update} and C{merge}."""
+
+        total = count + otherCount
+        if total == 0.0:
+            return 0.0, 0.0, 0.0
+        delta = otherMean - mean
+        return total, mean + delta * otherCount / total, m2 + otherM2 + delta**2 * count * otherCount / total
+
+    @classmethod
+    def update(cls, sketch, array, weights=None):
+        """Add an array of values to a sketch.
+
+        @type sketch: dict
+        @param sketch: The sketch to update.  Modified in place.
+        @type array: 1d Numpy array
+        @param array: The new values.
+        @type weights: 1d Numpy array or None
+        @param weights: Optional weight for each value; values with non-positive weights are ignored.  Quantiles are exact for an uncompressed sketch only if the weights are integers.
+        """
+
+        array = NP("array", array, dtype=NP.dtype(float))
+        if weights is not None:
+            weights = NP("array", weights, dtype=NP.dtype(float))
+            selection = NP(weights > 0.0)
+            array = array[selection]
+            weights = weights[selection]
+
+        if len(array) == 0:
+            return
+
+        if weights is None:
+            weights = NP("ones", len(array), dtype=NP.dtype(float))
+            count = float(len(array))
+            mean = float(NP("mean", array))
+            m2 = float(NP("sum", NP("square", NP(array - mean))))
+        else:
+            count = float(NP("sum", weights))
+            mean = float(NP("sum", NP(array * weights)) / count)
+            m2 = float(NP("sum", NP(NP("square", NP(array - mean)) * weights)))
+
+        sketch["count"], sketch["mean"], sketch["m2"] = cls._moments(sketch["count"], sketch["mean"], sketch["m2"], count, mean, m2)
+        sketch["min"] = min(sketch["min"], float(NP("amin", array)))
+        sketch["max"] = max(sketch["max"], float(NP("amax", array)))
+
+        sketch["means"] = NP("concatenate", (sketch["means"], array))
+        sketch["weights"] = NP("concatenate", (sketch["weights"], weights))
+
+        if len(sketch["means"]) > sketch["exactLimit"]:
+            cls.compress(sketch)
+
+    @classmethod
+    def merge(cls, sketch, other):
+        """Merge two sketches into a new one.
+
+        @type sketch: dict
+        @param sketch: The first sketch (not modified).
+        @type other: dict
+        @param other: The second sketch (not modified).
+        @rtype: dict
+        @return: A sketch summarizing the values of both, with the compression and exactLimit of C{sketch}.
+        """
+
+        output = cls.new(sketch["compression"], sketch["exactLimit"])
+        output["exact"] = sketch.get("exact", False) and other.get("exact", False)
+        output["count"], output["mean"], output["m2"] = cls._moments(sketch["count"], sketch["mean"], sketch["m2"], other["count"], other["mean"], other["m2"])
+        output["min"] = min(sketch["min"], other["min"])
+        output["max"] = max(sketch["max"], other["max"])
+        output["means"] = NP("concatenate", (sketch["means"], other["means"]))
+        output["weights"] = NP("concatenate", (sketch["weights"], other["weights"]))
+
+        if len(output["means"]) > output["exactLimit"]:
+            cls.compress(output)
+        return output
+
+    @staticmethod
+    def compress(sketch):
+        """Merge neighboring centroids of a sketch according to the
+        t-digest arcsine scale function.
+
+        @type sketch: dict
+        @param sketch: The sketch to compress.  Modified in place.
+        """
+
+        if len(sketch["means"]) == 0:
+            return
+
+        order = NP("argsort", sketch["means"], kind="mergesort")
+        means = sketch["means"][order]
+        weights = sketch["weights"][order]
+
+        cumulative = NP("cumsum", weights)
+        before = NP(NP(cumulative - weights) / cumulative[-1])
+        NP("clip", before, 0.0, 1.0, before)
+
+        # k(q) = delta * (asin(2q - 1)/pi + 1/2) runs from 0 to delta; each unit of k is one centroid
+        scale = NP(NP(NP("arcsin", NP(NP(2.0 * before) - 1.0)) / math.pi) + 0.5)
+        groups = NP("floor", NP(sketch["compression"] * scale)).astype(NP.dtype(int))
+
+        starts = NP("ones", len(groups), dtype=NP.dtype(bool))
+        starts[1:] = NP(groups[1:] != groups[:-1])
+        starts = NP("nonzero", starts)[0]
+
+        newWeights = NP.add.reduceat(weights, starts)
+        newMeans = NP(NP.add.reduceat(NP(means * weights), starts) / newWeights)
+        NP("clip", newMeans, sketch["min"], sketch["max"], newMeans)    # roundoff
+
+        sketch["means"] = newMeans
+        sketch["weights"] = newWeights
+        sketch["exact"] = False
+
+    @staticmethod
+    def quantiles(sketch, percentiles):
+        """Estimate quantiles from a sketch.
+
+        Each centroid is placed at the middle of the ranks that it
+        represents and quantiles are linearly interpolated between
+        them, with the exact minimum and maximum at the ends.  For an
+        uncompressed sketch, this is the same as
+        C{numpy.percentile}.
+
+        @type sketch: dict
+        @param sketch: The sketch.
+        @type percentiles: list of numbers
+        @param percentiles: Requested quantiles as percentages (from 0 to 100).
+        @rtype: 1d Numpy array
+        @return: The estimated quantiles, or NaN if the sketch is empty.
+        """
+
+        percentiles = NP("array", percentiles, dtype=NP.dtype(float))
+        if sketch["count"] == 0.0:
+            return NP("ones", len(percentiles), dtype=NP.dtype(float)) * float("nan")
+
+        order = NP("argsort", sketch["means"], kind="mergesort")
+        means = sketch["means"][order]
+        weights = sketch["weights"][order]
+
+        centers = NP(NP(NP("cumsum", weights) - weights) + NP(NP(weights - 1.0) / 2.0))
+        last = sketch["count"] - 1.0
+
+        if centers[0] > 0.0:
+            centers = NP("concatenate", ([0.0], centers))
+            means = NP("concatenate", ([sketch["min"]], means))
+        if centers[-1] < last:
+            centers = NP("concatenate", (centers, [last]))
+            means = NP("concatenate", (means, [sketch["max"]]))
+
+        return NP("interp", NP(NP(percentiles / 100.0) * last), centers, means)
+
+    @staticmethod
+    def histogram(sketch, numBins, low, high):
+        """Estimate the total weight in equal-width bins from a sketch.
+
+        Until the sketch is compressed, the weight of each value is
+        assigned to the bin that contains it, so the counts are
+        exact.  After that, each centroid is spread over the values
+        between its neighbors by linearly interpolating the
+        cumulative weight between centroid means, which avoids
+        steps of a whole centroid's weight in bins that contain only
+        a few centroids.
+
+        @type sketch: dict
+        @param sketch: The sketch.
+        @type numBins: int
+        @param numBins: Number of bins.
+        @type low: number
+        @param low: Low edge of the first bin.
+        @type high: number
+        @param high: High edge of the last bin; values outside of C{low} and C{high} are not counted.
+        @rtype: 1d Numpy array
+        @return: The total weight in each bin.
+        """
+
+        if sketch.get("exact", False):
+            binWidth = (high - low) / float(numBins)
+            binAssignments = NP("array", NP("floor", NP(NP(sketch["means"] - low)/binWidth)), dtype=NP.dtype(int))
+            selection = NP("logical_and", NP(binAssignments >= 0), NP(binAssignments < numBins))
+            return NP("bincount", binAssignments[selection], weights=sketch["weights"][selection], minlength=numBins)
+
+        if sketch["count"] == 0.0:
+            return NP("zeros", numBins, dtype=NP.dtype(float))
+
+        order = NP("argsort", sketch["means"], kind="mergesort")
+        means = NP("concatenate", ([sketch["min"]], sketch["means"][order], [sketch["max"]]))
+        weights = sketch["weights"][order]
+        below = NP("concatenate", ([0.0], NP(NP("cumsum", weights) - NP(weights / 2.0)), [sketch["count"]]))
+
+        edges = NP("linspace", low, high, numBins + 1)
+        return NP("diff", NP("interp", edges, means, below))
+
+    @staticmethod
+    def standardDeviation(sketch):
+        """Return the sample standard deviation (with one degree of
+        freedom removed) of the values summarized by a sketch.
+
+        @type sketch: dict
+        @param sketch: The sketch.
+        @rtype: number
+        @return: The standard deviation, or NaN if there are fewer than two values.
+        """
+
+        if sketch["count"] < 2.0:
+            return float("nan")
+        return math.sqrt(sketch["m2"] / (sketch["count"] - 1.0))
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the PlotScheduler class."""
+
+import os
+import random
+import weakref
+import multiprocessing
+import cPickle as pickle
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from augustus.core.NumpyInterface import NP
+from augustus.core.FieldType import FieldType
+from augustus.core.PerformanceTable import PerformanceTable
+from augustus.core.FakePerformanceTable import FakePerformanceTable
+from augustus.core.plot.PmmlPlotContent import PmmlPlotContent
+from augustus.core.plot.PlotRange import PlotRange
+
+def _prepareInWorker(index):
+    """Used by C{PlotScheduler.prepareAll} (the multiprocessing
+    module can only call functions defined at module level)."""
+
+    return PlotScheduler.prepareJob(index)
+
+class PlotScheduler(object):
+    """PlotScheduler is a bag of functions that run the C{prepare}
+    stage of the plot elements of a PlotCanvas in a pool of worker
+    processes.
+
+    The workers are forked after the DataTable has been built, so
+    they read its arrays from memory pages that are shared with the
+    parent process; nothing is copied or serialized on the way in.
+    Each worker prepares one plot element at a time, recording the
+    requests that it makes of its PlotRange, and sends back its
+    drawing state, the recorded requests, its entries in the
+    DataTableState, and its PerformanceTable.  The SVG is then drawn
+    serially, in document order, and each PlotWindow applies these
+    results when it would otherwise call C{prepare}, so the output
+    is the same as serial rendering.
+
+    A plot element is prepared again in the parent process, in its
+    usual turn, if its worker's result could not be reproduced
+    exactly:
+
+      - if C{prepare} raised an exception (so that the error is
+        raised in the same place as in serial rendering);
+      - if it drew random numbers from Python's or Numpy's global
+        generator, which would otherwise be drawn in a different
+        order;
+      - if its state cannot be pickled, for instance because it
+        contains PMML or SVG elements;
+      - if it refers to a string-valued FieldType that was created
+        or extended by the worker, since the internal values of new
+        strings are only meaningful in the process that made them.
+
+    Plot elements are expected to keep their persistent state under
+    their own C{stateId} (and C{stateId + "."} prefixes); other
+    modifications of the DataTable in a worker are not seen by the
+    parent.
+    """
+
+    _prepared = weakref.WeakKeyDictionary()
+    _jobs = None
+
+    class _State(object):
+        pass
+
+    class _RecordingPlotRange(PlotRange):
+        """A PlotRange that records the requests made of it, so that
+        they can be replayed on the real PlotRange."""
+
+        def __init__(self, *args, **kwds):
+            super(PlotScheduler._RecordingPlotRange, self).__init__(*args, **kwds)
+            self.requests = []
+
+        def _record(name):
+            def method(self, *args, **kwds):
+                self.requests.append((name, args, kwds))
+                return getattr(super(PlotScheduler._RecordingPlotRange, self), name)(*args, **kwds)
+            method.__name__ = name
+            return method
+
+        xminPush = _record("xminPush")
+        yminPush = _record("yminPush")
+        zminPush = _record("zminPush")
+        xmaxPush = _record("xmaxPush")
+        ymaxPush = _record("ymaxPush")
+        zmaxPush = _record("zmaxPush")
+        expand = _record("expand")
+        del _record
+
+    @staticmethod
+    def plotContents(plotCanvas):
+        """List the plot elements that a PlotCanvas would prepare.
+
+        @type plotCanvas: PlotCanvas
+        @param plotCanvas: The PlotCanvas.
+        @rtype: list of (PmmlPlotContent, PlotOverlay) pairs
+        @return: The plot elements in document order, with the PlotOverlay that contains each of them.
+        """
+
+        output = []
+        for overlay in plotCanvas.xpath(".//pmml:PlotWindow/pmml:PlotOverlay"):
+            for plotContent in overlay.childrenOfClass(PmmlPlotContent):
+                output.append((plotContent, overlay))
+        return output
+
+    @classmethod
+    def prepareAll(cls, plotCanvas, dataTable, functionTable, performanceTable, processes):
+        """Prepare all plot elements of a PlotCanvas in worker
+        processes and hold the results for C{prepare}.
+
+        This does nothing if C{processes} is less than 2, if there
+        are fewer than two plot elements, or if the platform cannot
+        fork processes.
+
+        @type plotCanvas: PlotCanvas
+        @param plotCanvas: The PlotCanvas to prepare.
+        @type dataTable: DataTable
+        @param dataTable: Contains the data to plot.
+        @type functionTable: FunctionTable
+        @param functionTable: Defines functions that may be used to transform data for plotting.
+        @type performanceTable: PerformanceTable
+        @param performanceTable: Measures and records performance (time and memory consumption) of the drawing process.
+        @type processes: int
+        @param processes: Maximum number of worker processes.
+        """
+
+        plotContents = cls.plotContents(plotCanvas)
+        if processes < 2 or len(plotContents) < 2 or not hasattr(os, "fork"):
+            return
+
+        performanceTable.begin("PlotScheduler")
+
+        # FieldTypes that already exist are the same objects in the workers and are passed back by reference
+        shared = {}
+        for dataColumn in dataTable.fields.values():
+            shared[id(dataColumn.fieldType)] = dataColumn.fieldType
+        for plotContent, overlay in plotContents:
+            for name in dir(plotContent.__class__):
+                value = getattr(plotContent.__class__, name, None)
+                if isinstance(value, FieldType):
+                    shared[id(value)] = value
+        sizes = dict((key, len(getattr(fieldType, "_stringToValue", ()))) for key, fieldType in shared.items())
+
+        jobs = []
+        for plotContent, overlay in plotContents:
+            strictlyPositive = [overlay.get(x, defaultFromXsd=True, convertType=True) for x in ("xlog", "ylog", "zlog")]
+            jobs.append((plotContent, strictlyPositive))
+
+        recordPerformance = not isinstance(performanceTable, FakePerformanceTable)
+
+        cls._jobs = (jobs, dataTable, functionTable, recordPerformance, shared, sizes)
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            results = pool.map(_prepareInWorker, xrange(len(jobs)), chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+            cls._jobs = None
+
+        prepared = {}
+        for (plotContent, strictlyPositive), result in zip(jobs, results):
+            if result is not None:
+                unpickler = pickle.Unpickler(StringIO(result))
+                unpickler.persistent_load = lambda key: shared[int(key)]
+                prepared[plotContent] = unpickler.load()
+        cls._prepared[dataTable] = prepared
+
+        performanceTable.count("plot elements prepared by workers", len(prepared))
+        performanceTable.count("plot elements prepared by the parent process", len(jobs) - len(prepared))
+        performanceTable.end("PlotScheduler")
+
+    @classmethod
+    def prepareJob(cls, index):
+        """Prepare one plot element in a worker process.
+
+        @type index: int
+        @param index: Index of the plot element in the list made by C{prepareAll}.
+        @rtype: string or None
+        @return: The pickled result, or None if the plot element must be prepared by the parent process.
+        """
+
+        jobs, dataTable, functionTable, recordPerformance, shared, sizes = cls._jobs
+        plotContent, strictlyPositive = jobs[index]
+
+        try:
+            state = cls._State()
+            plotRange = cls._RecordingPlotRange(*strictlyPositive)
+            if recordPerformance:
+                performanceTable = PerformanceTable()
+            else:
+                performanceTable = FakePerformanceTable()
+
+            pythonRandomState = random.getstate()
+            numpyRandomState = NP.random.get_state()
+
+            plotContent.prepare(state, dataTable, functionTable, performanceTable, plotRange)
+
+            if random.getstate() != pythonRandomState:
+                return None
+            newRandomState = NP.random.get_state()
+            if newRandomState[2:] != numpyRandomState[2:] or not NP("array_equal", newRandomState[1], numpyRandomState[1]):
+                return None
+
+            stateId = plotContent.get("stateId")
+            persistentStates = []
+            if stateId is not None:
+                for key, value in dataTable.state.items():
+                    if key == stateId or key.startswith(stateId + "."):
+                        persistentStates.append((key, value))
+
+            def persistentId(obj):
+                if isinstance(obj, FieldType):
+                    if shared.get(id(obj)) is obj:
+                        if len(getattr(obj, "_stringToValue", ())) != sizes[id(obj)]:
+                            raise pickle.PicklingError("string values were added to a FieldType in a worker")
+                        return str(id(obj))
+                    elif obj.isstring():
+                        raise pickle.PicklingError("string-valued FieldType was created in a worker")
+                return None
+
+            output = StringIO()
+            pickler = pickle.Pickler(output, pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = persistentId
+            pickler.dump((state.__dict__, plotRange.requests, persistentStates, performanceTable))
+            return output.getvalue()
+
+        except Exception:
+            return None
+
+    @classmethod
+    def prepare(cls, plotContent, state, dataTable, functionTable, performanceTable, plotRange):
+        """Prepare a plot element, using the result of a worker
+        process if C{prepareAll} obtained one.
+
+        The arguments are the same as C{PmmlPlotContent.prepare},
+        with the plot element first.
+        """
+
+        prepared = cls._prepared.get(dataTable)
+        if prepared is None or plotContent not in prepared:
+            plotContent.prepare(state, dataTable, functionTable, performanceTable, plotRange)
+            return
+
+        stateDict, requests, persistentStates, workerPerformanceTable = prepared.pop(plotContent)
+        state.__dict__.update(stateDict)
+        for name, args, kwds in requests:
+            getattr(plotRange, name)(*args, **kwds)
+        for key, value in persistentStates:
+            dataTable.state[key] = value
+        performanceTable.accumulate(workerPerformanceTable)
+
+    @classmethod
+    def discard(cls, dataTable):
+        """Forget any unused results of C{prepareAll}.
+
+        @type dataTable: DataTable
+        @param dataTable: The DataTable that was passed to C{prepareAll}.
+        """
+
+        cls._prepared.pop(dataTable, None)
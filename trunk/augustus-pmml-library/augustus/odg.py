@@ -37,6 +37,7 @@ from augustus.core.DataTable import DataTable
 from augustus.core.DataTableFields import DataTableFields
 from augustus.core.DataTableState import DataTableState
 from augustus.core.DataTablePlots import DataTablePlots
+from augustus.core.DataTableExpressions import DataTableExpressions
 from augustus.core.FakeFieldType import FakeFieldType
 
 ### functions
@@ -145,6 +146,26 @@ from augustus.pmml.model.trees.odg import *
 register(modelLoader)
 from augustus.pmml.model.clustering.odg import *
 register(modelLoader)
+from augustus.pmml.model.regression.odg import *
+register(modelLoader)
+from augustus.pmml.model.generalregression.odg import *
+register(modelLoader)
+from augustus.pmml.model.naivebayes.odg import *
+register(modelLoader)
+from augustus.pmml.model.ruleset.odg import *
+register(modelLoader)
+from augustus.pmml.model.neuralnetwork.odg import *
+register(modelLoader)
+from augustus.pmml.model.svm.odg import *
+register(modelLoader)
+from augustus.pmml.model.scorecard.odg import *
+register(modelLoader)
+from augustus.pmml.model.nearestneighbor.odg import *
+register(modelLoader)
+from augustus.pmml.model.association.odg import *
+register(modelLoader)
+from augustus.pmml.model.timeseries.odg import *
+register(modelLoader)
 
 del register
 
@@ -20,12 +20,18 @@
 
 """This module defines the DefineFunction class."""
 
+import copy
+
 from augustus.core.defs import defs
 from augustus.core.Function import Function
 from augustus.core.PmmlCalculable import PmmlCalculable
 from augustus.core.PmmlExpression import PmmlExpression
 from augustus.core.FakeFieldType import FakeFieldType
 from augustus.core.FieldCastMethods import FieldCastMethods
+from augustus.core.FunctionTable import FunctionTable
+from augustus.core.FakePerformanceTable import FakePerformanceTable
+from augustus.pmml.expression.Constant import Constant
+from augustus.pmml.expression.FieldRef import FieldRef
 
 class DefineFunction(PmmlCalculable, Function):
     """DefineFunction implements user-defined functions in PMML.
@@ -34,13 +40,59 @@ class DefineFunction(PmmlCalculable, Function):
     and the C{evaluate} method is invoked when it is used in an Apply
     element.
 
+    When the function is evaluated, its parameters are bound to the
+    argument DataColumns in a lightweight view of the caller's
+    DataTable (see C{DataTable.scope}), rather than a copy of it.
+    Small functions are inlined into the Apply that calls them (see
+    C{inline}).  Recursive functions and calls nested more deeply
+    than C{maxCallDepth} are rejected when the PMML is loaded.
+
     U{PMML specification<http://www.dmg.org/v4-1/Functions.html>}.
     """
 
+    maxInlineSize = 16
+    maxCallDepth = 32
+
     @property
     def name(self):
         return self.get("name")
 
+    def postValidate(self):
+        """After XSD validation, check that parameter names are
+        unique, that all Apply elements calling this function have
+        the right number of arguments, that the function is not
+        recursive (directly or through other user-defined functions),
+        and that calls are not nested more deeply than
+        C{maxCallDepth}.
+        """
+
+        names = [x["name"] for x in self.childrenOfTag("ParameterField")]
+        if len(set(names)) != len(names):
+            raise defs.PmmlValidationError("DefineFunction \"%s\" has duplicate ParameterField names" % self.name)
+
+        root = self.getroottree().getroot()
+        for apply in root.xpath("//pmml:Apply[@function=$name]", name=self.name):
+            numberOfArguments = len(apply.childrenOfClass(PmmlExpression))
+            if numberOfArguments != len(names):
+                raise defs.PmmlValidationError("Apply function=\"%s\"%s has %d arguments but the corresponding DefineFunction has %d parameters" % (self.name, apply.sourcelineAsString(), numberOfArguments, len(names)))
+
+        calls = {}
+        for defineFunction in root.xpath("//pmml:DefineFunction"):
+            calls[defineFunction.get("name")] = set(x.get("function") for x in defineFunction.xpath(".//pmml:Apply"))
+
+        depths = {}
+        def depth(name, path):
+            if name in path:
+                raise defs.PmmlValidationError("User-defined functions are recursive: %s" % " -> ".join(path + [name]))
+            path = path + [name]
+            if len(path) > self.maxCallDepth:
+                raise defs.PmmlValidationError("User-defined functions are nested more than %d deep: %s" % (self.maxCallDepth, " -> ".join(path)))
+            if name not in depths:
+                depths[name] = 1 + max([0] + [depth(x, path) for x in calls[name] if x in calls])
+            return depths[name]
+
+        depth(self.name, [])
+
     def calculate(self, dataTable, functionTable=None, performanceTable=None):
         """Define a new function.
 
@@ -56,12 +108,101 @@ class DefineFunction(PmmlCalculable, Function):
         @return: A DataTable containing the result, usually a modified version of the input.
         """
 
-        dataTable, functionTable, performanceTable = self._setupCalculate(dataTable, functionTable, performanceTable)
+        if functionTable is None:
+            functionTable = FunctionTable()
+        if performanceTable is None:
+            performanceTable = FakePerformanceTable()
 
-        if self.name in functionTable:
+        if functionTable.get(self.name, self) is not self:
             raise defs.PmmlValidationError("DefineFunction \"%s\" overshadows previously defined function" % self.name)
         functionTable[self.name] = self
 
+    def parameters(self):
+        """Return the names and declared types of the parameters.
+
+        @rtype: list of 3-tuples
+        @return: C{(name, dataType, optype)} for each ParameterField, with None for undeclared types.
+        """
+
+        return self.cached("parameters", lambda: [(x["name"], x.get("dataType"), x.get("optype")) for x in self.childrenOfTag("ParameterField")])
+
+    def castResult(self, dataColumn):
+        """Cast the result of the function's body to the declared
+        type of the function, if necessary.
+
+        @type dataColumn: DataColumn
+        @param dataColumn: The result of the function's body.
+        @rtype: DataColumn
+        @return: The result of the function.
+        """
+
+        dataType = self.get("dataType", dataColumn.fieldType.dataType)
+        optype = self.get("optype", dataColumn.fieldType.optype)
+        if dataType != dataColumn.fieldType.dataType or optype != dataColumn.fieldType.optype:
+            dataColumn = FieldCastMethods.cast(FakeFieldType(dataType, optype), dataColumn)
+        return dataColumn
+
+    def inline(self, arguments):
+        """Substitute a set of arguments into a copy of the function's
+        body.
+
+        The substitution is only performed if it is equivalent to
+        calling the function: the body must have no more than
+        C{maxInlineSize} elements, the parameters must not declare
+        types (which would require a cast), they must only be
+        referenced by FieldRefs without C{mapMissingTo}, and an
+        argument that is referenced more than once must be a FieldRef
+        or a Constant (so that no work is repeated).
+
+        The result of the substituted expression must still be passed
+        through C{castResult}.
+
+        @type arguments: list of PmmlExpressions
+        @param arguments: The arguments, as they appear in the calling Apply.
+        @rtype: PmmlExpression or None
+        @return: A new expression, detached from the PMML document, or None if the function cannot be inlined.
+        """
+
+        parameters = self.parameters()
+        if len(arguments) != len(parameters):
+            return None
+        for name, dataType, optype in parameters:
+            if dataType is not None or optype is not None:
+                return None
+
+        body = self.childOfClass(PmmlExpression)
+        elements = [x for x in body.iter() if isinstance(x.tag, basestring)]
+        if len(elements) > self.maxInlineSize:
+            return None
+
+        names = set(name for name, dataType, optype in parameters)
+        references = dict((name, 0) for name in names)
+        for elem in elements:
+            if isinstance(elem, FieldRef) and elem.get("field") in names and elem.get("mapMissingTo") is None:
+                references[elem.get("field")] += 1
+            elif names.intersection(elem.attrib.values()):
+                return None
+            elif elem.text is not None and not isinstance(elem, Constant) and any(name in elem.text for name in names):
+                return None
+
+        for argument, (name, dataType, optype) in zip(arguments, parameters):
+            if references[name] > 1 and not isinstance(argument, (FieldRef, Constant)):
+                return None
+
+        expression = copy.deepcopy(body)
+        argumentsByName = dict((name, argument) for argument, (name, dataType, optype) in zip(arguments, parameters))
+        fieldRefs = [x for x in expression.iter() if isinstance(x, FieldRef) and x.get("field") in names]
+        for fieldRef in fieldRefs:
+            replacement = copy.deepcopy(argumentsByName[fieldRef.get("field")])
+            replacement.tail = fieldRef.tail
+            parent = fieldRef.getparent()
+            if parent is None:
+                expression = replacement
+            else:
+                parent.replace(fieldRef, replacement)
+
+        return expression
+
     def evaluate(self, dataTable, functionTable, performanceTable, arguments):
         """Evaluate the function, using a DataTable as input.
 
@@ -78,29 +219,27 @@ class DefineFunction(PmmlCalculable, Function):
         arguments = [x.evaluate(dataTable, functionTable, performanceTable) for x in arguments]
         performanceTable.begin("user-defined \"%s\"" % self.name)
 
-        parameters = self.childrenOfTag("ParameterField")
+        parameters = self.parameters()
 
         if len(arguments) != len(parameters):
             raise defs.PmmlValidationError("Apply function=\"%s\" has %d arguments but the corresponding DefineFunction has %d parameters" % (self.name, len(arguments), len(parameters)))
 
-        subTable = dataTable.subTable()
-
-        for argument, parameter in zip(arguments, parameters):
-            dataType = parameter.get("dataType", argument.fieldType.dataType)
-            optype = parameter.get("optype", argument.fieldType.optype)
+        localFields = {}
+        for argument, (name, dataType, optype) in zip(arguments, parameters):
+            if dataType is None:
+                dataType = argument.fieldType.dataType
+            if optype is None:
+                optype = argument.fieldType.optype
             if dataType != argument.fieldType.dataType or optype != argument.fieldType.optype:
                 argument = FieldCastMethods.cast(FakeFieldType(dataType, optype), argument)
 
-            subTable.fields[parameter["name"]] = argument
+            localFields[name] = argument
 
         performanceTable.pause("user-defined \"%s\"" % self.name)
-        dataColumn = self.childOfClass(PmmlExpression).evaluate(subTable, functionTable, performanceTable)
+        dataColumn = self.childOfClass(PmmlExpression).evaluate(dataTable.scope(localFields), functionTable, performanceTable)
         performanceTable.unpause("user-defined \"%s\"" % self.name)
 
-        dataType = self.get("dataType", dataColumn.fieldType.dataType)
-        optype = self.get("optype", dataColumn.fieldType.optype)
-        if dataType != dataColumn.fieldType.dataType or optype != dataColumn.fieldType.optype:
-            dataColumn = FieldCastMethods.cast(FakeFieldType(dataType, optype), dataColumn)
+        dataColumn = self.castResult(dataColumn)
 
         performanceTable.end("user-defined \"%s\"" % self.name)
         return dataColumn
@@ -54,6 +54,10 @@ class DerivedField(PmmlCalculable):
         PerformanceTable with DerivedField name, to help the user
         debug their PMML.
 
+        If the same expression appears in other DerivedFields of the
+        document, its result is shared through the DataTable (see
+        C{PMML.sharedExpressions}).
+
         @type dataTable: DataTable
         @param dataTable: The pre-built DataTable.
         @type functionTable: FunctionTable or None
@@ -69,19 +73,52 @@ class DerivedField(PmmlCalculable):
         if performanceTable is None:
             performanceTable = FakePerformanceTable()
 
+        dataColumn = self.childOfClass(PmmlExpression).evaluateShared(dataTable, functionTable, performanceTable)
+        performanceTable.begin("DerivedField")
+        dataTable.fields[self.name] = self.castResult(dataColumn, performanceTable)
+        performanceTable.end("DerivedField")
+
+        return dataTable.fields[self.name]
+
+    def evaluate(self, dataTable, functionTable, performanceTable, fieldType=None):
+        """Evaluate the DerivedField without adding it to the
+        DataTable.
+
+        This is for DerivedFields nested in model inputs (such as
+        BayesInput and NeuralInput), which usually have no name.
+
+        @type dataTable: DataTable
+        @param dataTable: The input DataTable, containing any fields that might be used to evaluate the expression.
+        @type functionTable: FunctionTable
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @type fieldType: FieldType or None
+        @param fieldType: The FieldType of this DerivedField, if the caller keeps one from call to call; if None, a new one is made when the result needs to be cast.
+        @rtype: DataColumn
+        @return: The result, cast to the dataType and optype of the DerivedField.
+        """
+
         dataColumn = self.childOfClass(PmmlExpression).evaluate(dataTable, functionTable, performanceTable)
         performanceTable.begin("DerivedField")
+        dataColumn = self.castResult(dataColumn, performanceTable, fieldType)
+        performanceTable.end("DerivedField")
+        return dataColumn
+
+    def castResult(self, dataColumn, performanceTable, fieldType=None):
+        """Used by C{calculate} and C{evaluate} to cast the result of
+        the expression if its data type or optype does not match the
+        DerivedField."""
 
         dataType = dataColumn.fieldType.dataType
         optype = dataColumn.fieldType.optype
         if self.get("dataType", dataType) == dataType and self.get("optype", optype) == optype and len(self.childrenOfTag("Value")) == 0:
-            dataTable.fields[self.name] = dataColumn
-
-        else:
-            performanceTable.begin("cast (\"%s\")" % self.name)
-            dataTable.fields[self.name] = FieldCastMethods.cast(FieldType(self), dataColumn)
-            performanceTable.end("cast (\"%s\")" % self.name)
+            return dataColumn
 
-        performanceTable.end("DerivedField")
+        if fieldType is None:
+            fieldType = FieldType(self)
 
-        return dataTable.fields[self.name]
+        performanceTable.begin("cast (\"%s\")" % self.name)
+        dataColumn = FieldCastMethods.cast(fieldType, dataColumn)
+        performanceTable.end("cast (\"%s\")" % self.name)
+        return dataColumn
@@ -34,6 +34,20 @@ class OutputField(PmmlBinding):
     U{PMML specification<http://www.dmg.org/v4-1/Output.html>}.
     """
 
+    def ruleValueKey(self):
+        """Return the key of the score feature that an OutputField
+        with feature="ruleValue" selects, which depends on its
+        algorithm, rankBasis, rankOrder, rank, and ruleFeature.  The
+        rank is formatted as an integer, as in AssociationModel, so
+        that equivalent spellings such as rank="01" select the same
+        feature.
+
+        @rtype: string
+        @return: The key, "ruleValue.ALGORITHM.RANKBASIS.RANKORDER.RANK.RULEFEATURE".
+        """
+
+        return "ruleValue.%s.%s.%s.%d.%s" % (self.get("algorithm", defaultFromXsd=True), self.get("rankBasis", defaultFromXsd=True), self.get("rankOrder", defaultFromXsd=True), int(self.get("rank", defaultFromXsd=True)), self.get("ruleFeature", defaultFromXsd=True))
+
     def format(self, subTable, functionTable, performanceTable, score):
         """Extract or post-process output for the output field of a DataTable.
 
@@ -111,6 +125,15 @@ class OutputField(PmmlBinding):
 
             dataColumn = DataColumn(fieldType, data, mask)
 
+        elif feature == "probability" and self.get("value") is not None and "probability.%s" % self["value"] in score:
+            dataColumn = score["probability.%s" % self["value"]]
+
+        elif feature in ("reasonCode", "entityId", "entityAffinity") and "%s.%s" % (feature, self.get("rank", defaultFromXsd=True)) in score:
+            dataColumn = score["%s.%s" % (feature, self.get("rank", defaultFromXsd=True))]
+
+        elif feature == "ruleValue" and self.ruleValueKey() in score:
+            dataColumn = score[self.ruleValueKey()]
+
         elif feature in score:
             dataColumn = score[feature]
 
@@ -20,20 +20,32 @@
 
 """This module defines the PMML class."""
 
+import heapq
+
 from augustus.core.defs import defs
 from augustus.core.PmmlCalculable import PmmlCalculable
 from augustus.core.DataColumn import DataColumn
 from augustus.core.OrderedDict import OrderedDict
 from augustus.core.FunctionTable import FunctionTable
 from augustus.core.FakePerformanceTable import FakePerformanceTable
+from augustus.core.PmmlExpression import PmmlExpression
+from augustus.pmml.expression.Apply import Apply
+from augustus.pmml.expression.Constant import Constant
+from augustus.pmml.expression.FieldRef import FieldRef
+from augustus.pmml.DerivedField import DerivedField
+from augustus.pmml.DefineFunction import DefineFunction
 
 class PMML(PmmlCalculable):
     """PMML represents the top-level element of a PMML document.
 
     U{PMML specification<http://www.dmg.org/v4-1/GeneralStructure.html>}.
+
+    @type pruneTransformations: bool
+    @param pruneTransformations: Default for the C{pruneTransformations} argument of C{calculate}.  Set it on the class (or a subclass) to prune in calculations that do not pass the argument, such as C{calc}.
     """
 
     version = "4.1"
+    pruneTransformations = False
 
     @property
     def name(self):
@@ -49,7 +61,7 @@ class PMML(PmmlCalculable):
         if self.get("version") != self.version:
             raise defs.PmmlValidationError("PMML version is \"%s\" when \"%s\" is expected for this class" % (self.get("version"), self.version))
 
-    def calculate(self, dataTable, functionTable=None, performanceTable=None):
+    def calculate(self, dataTable, functionTable=None, performanceTable=None, pruneTransformations=None):
         """Perform a calculation directly, without constructing a
         DataTable first.
 
@@ -59,12 +71,22 @@ class PMML(PmmlCalculable):
 
         This method modifies the input DataTable and FunctionTable.
 
+        If C{pruneTransformations} is True, DerivedFields in the
+        <TransformationDictionary> that no model needs are not
+        calculated (see C{transformationReport}), and so do not appear
+        in the DataTable.  This is only appropriate for callers that
+        read nothing but the models' results, so it is off unless the
+        caller opts in, either by passing C{pruneTransformations=True}
+        or by setting the C{pruneTransformations} class attribute.
+
         @type dataTable: DataTable
         @param dataTable: The pre-built DataTable.
         @type functionTable: FunctionTable or None
         @param functionTable: A table of functions.  Initially, it contains only the built-in functions, but any user functions defined in PMML would be added to it.
         @type performanceTable: PerformanceTable or None
         @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @type pruneTransformations: bool or None
+        @param pruneTransformations: If True, calculate only the transformations that are needed, in dependency order; if False, calculate all of them in document order; if None, use the C{pruneTransformations} class attribute.
         @rtype: DataTable
         @return: A DataTable containing the result, usually a modified version of the input.
         """
@@ -74,7 +96,17 @@ class PMML(PmmlCalculable):
         if performanceTable is None:
             performanceTable = FakePerformanceTable()
 
-        for calculable in self.calculableTrans():
+        if pruneTransformations is None:
+            pruneTransformations = self.pruneTransformations
+
+        if pruneTransformations:
+            calculables, deadFields = self._transformationPlan()
+            if len(deadFields) > 0:
+                performanceTable.count("DerivedFields pruned", len(deadFields))
+        else:
+            calculables = self.calculableTrans()
+
+        for calculable in calculables:
             calculable.calculate(dataTable, functionTable, performanceTable)
 
         calculableModels = self.calculableModels()
@@ -109,6 +141,183 @@ class PMML(PmmlCalculable):
         else:
             return transformationDictionary.childrenOfClass(PmmlCalculable)
 
+    def _referencedNames(self, element, names, visited=None):
+        """Used by C{_transformationPlan}.
+
+        Return the subset of C{names} that may be referenced in the
+        subtree of C{element}: exact attribute values (such as the
+        C{field} of FieldRef, NormContinuous or Aggregate, or the
+        C{groupField} of Aggregate) and substrings of text (such as a
+        Formula).  Applies of user-defined functions also reference
+        the names in the function's body, other than its parameters.
+        Non-standard elements are therefore treated conservatively:
+        a name that is not really used may be reported, but not the
+        reverse.
+        """
+
+        if visited is None:
+            visited = set()
+
+        attributeValues = set()
+        texts = []
+        functions = set()
+        for elem in element.iter():
+            if isinstance(elem.tag, basestring):
+                attributeValues.update(elem.attrib.values())
+                if elem.text is not None:
+                    texts.append(elem.text)
+                if isinstance(elem, Apply):
+                    functions.add(elem.get("function"))
+        text = "\0".join(texts)
+
+        output = set(x for x in names if x in attributeValues or x in text)
+
+        for defineFunction in self.xpath("pmml:TransformationDictionary/pmml:DefineFunction"):
+            name = defineFunction.get("name")
+            if name in functions and name not in visited:
+                visited.add(name)
+                parameters = set(x.get("name") for x in defineFunction.childrenOfTag("ParameterField"))
+                for expression in defineFunction.childrenOfClass(PmmlExpression):
+                    output.update(self._referencedNames(expression, names, visited).difference(parameters))
+
+        return output
+
+    def _transformationPlan(self):
+        """Used by C{calculate} and C{transformationReport}.
+
+        Build the dependency graph of the <TransformationDictionary>
+        and determine which DerivedFields are needed by the models.
+
+        @rtype: 2-tuple
+        @return: List of PmmlCalculables to evaluate in dependency order and list of the names of dead DerivedFields in document order.
+        """
+
+        def build():
+            calculables = self.calculableTrans()
+            calculableModels = self.calculableModels()
+
+            names = set(x.name for x in calculables if isinstance(x, DerivedField) and x.name is not None)
+            producers = {}
+            for index, calculable in enumerate(calculables):
+                if calculable.name in names:
+                    producers.setdefault(calculable.name, []).append(index)
+
+            dependencies = []
+            for calculable in calculables:
+                if isinstance(calculable, DerivedField):
+                    referenced = set()
+                    for expression in calculable.childrenOfClass(PmmlExpression):
+                        referenced.update(self._referencedNames(expression, names))
+                elif isinstance(calculable, DefineFunction):
+                    # the function's body is evaluated where it is applied, so it must be defined first
+                    referenced = set()
+                else:
+                    referenced = self._referencedNames(calculable, names)
+                    referenced.discard(calculable.name)
+                dependencies.append(sorted(set(index for name in referenced for index in producers[name])))
+
+            # DerivedFields are needed if a model uses them (or if there are no models, in which case they are the output);
+            # DefineFunctions and models in the TransformationDictionary are always needed
+            if len(calculableModels) == 0:
+                live = set(range(len(calculables)))
+            else:
+                live = set(index for index, calculable in enumerate(calculables) if not isinstance(calculable, DerivedField) or calculable.name is None)
+                for calculableModel in calculableModels:
+                    for name in self._referencedNames(calculableModel, names):
+                        live.update(producers[name])
+
+            stack = list(live)
+            while len(stack) > 0:
+                for index in dependencies[stack.pop()]:
+                    if index not in live:
+                        live.add(index)
+                        stack.append(index)
+
+            # topological order, preferring document order (which also resolves any cycles, as in an unpruned calculation)
+            waitingOn = dict((index, set(dependencies[index]).intersection(live).difference([index])) for index in live)
+            dependents = dict((index, []) for index in live)
+            for index in live:
+                for other in waitingOn[index]:
+                    dependents[other].append(index)
+
+            order = []
+            ready = [index for index in live if len(waitingOn[index]) == 0]
+            heapq.heapify(ready)
+            remaining = set(live)
+            while len(remaining) > 0:
+                if len(ready) > 0:
+                    index = heapq.heappop(ready)
+                else:
+                    index = min(remaining)
+                if index not in remaining:
+                    continue
+                remaining.discard(index)
+                order.append(index)
+                for other in dependents[index]:
+                    waitingOn[other].discard(index)
+                    if len(waitingOn[other]) == 0 and other in remaining:
+                        heapq.heappush(ready, other)
+
+            deadFields = [calculable.name for index, calculable in enumerate(calculables) if index not in live]
+            return [calculables[index] for index in order], deadFields
+
+        return self.cached("transformationPlan", build)
+
+    def transformationReport(self):
+        """Report which DerivedFields in the <TransformationDictionary>
+        are calculated and which are dead (not needed by any model).
+
+        Structure of the output::
+
+            {"Evaluated": ["name", ...], "Dead": ["name", ...]}
+
+        where C{"Evaluated"} lists the transformations in the order
+        that C{calculate} evaluates them when C{pruneTransformations}
+        is True (unnamed transformations appear as None) and
+        C{"Dead"} lists the DerivedFields that it skips, in document
+        order.
+
+        @rtype: dict
+        @return: Keys and values are defined above.
+        """
+
+        calculables, deadFields = self._transformationPlan()
+        return {"Evaluated": [x.name for x in calculables], "Dead": list(deadFields)}
+
+    def sharedExpressions(self):
+        """Find the expressions that appear more than once among the
+        DerivedFields of the <TransformationDictionary> and of all
+        models' <LocalTransformations>.
+
+        Each DerivedField's expression and, recursively, the arguments
+        of each Apply are considered.  Constants and FieldRefs without
+        C{mapMissingTo} are too simple to be worth sharing.  The
+        analysis is performed once per document; call C{clearCache}
+        after modifying the PMML.
+
+        @rtype: frozenset of tuples
+        @return: The structural keys (see C{PmmlExpression.structuralKey}) of the repeated expressions.
+        """
+
+        def build():
+            counts = {}
+            def count(expression):
+                if not isinstance(expression, Constant) and not (isinstance(expression, FieldRef) and expression.get("mapMissingTo") is None):
+                    key = expression.structuralKey()
+                    if key is not None:
+                        counts[key] = counts.get(key, 0) + 1
+                if isinstance(expression, Apply):
+                    for argument in expression.childrenOfClass(PmmlExpression):
+                        count(argument)
+
+            for derivedField in self.xpath("pmml:TransformationDictionary/pmml:DerivedField | .//pmml:LocalTransformations/pmml:DerivedField"):
+                for expression in derivedField.childrenOfClass(PmmlExpression):
+                    count(expression)
+
+            return frozenset(key for key, number in counts.items() if number > 1)
+
+        return self.cached("sharedExpressions", build)
+
     def calculableModels(self):
         """Return a list of top-level models.
 
@@ -23,14 +23,17 @@
 import re
 
 from augustus.core.defs import defs
-from augustus.core.PmmlArray import PmmlArray
+from augustus.core.PmmlSparseArray import PmmlSparseArray
 
-class REALSparseArray(PmmlArray):
+class REALSparseArray(PmmlSparseArray):
     """REALSparseArray implements a sparse array of real-valued constants.
 
     U{PMML specification<http://www.dmg.org/v4-1/GeneralStructure.html>}.
     """
 
+    entriesTag = "REAL-Entries"
+    entryType = float
+
     def values(self, convertType=False):
         """Extract values from the PMML and represent them in a
         Pythonic form.
@@ -21,16 +21,281 @@
 """This module defines the Apply class."""
 
 from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP
 from augustus.core.PmmlExpression import PmmlExpression
 from augustus.core.DataColumn import DataColumn
 from augustus.core.FieldCastMethods import FieldCastMethods
+from augustus.core.FunctionTable import FunctionTable
+from augustus.pmml.expression.Constant import Constant
+from augustus.pmml.DefineFunction import DefineFunction
 
 class Apply(PmmlExpression):
     """Apply implements an expression that applies a predefined
     function on a set of input arguments.
 
+    The first time an Apply is evaluated with a given FunctionTable,
+    it compiles itself into an evaluation plan: function names are
+    resolved once and nested chains of the arithmetic built-ins
+    (+, -, *, /, negative) are fused.  A fused chain computes its
+    intermediate results in place, passes Constants as scalars
+    rather than full-length columns, and combines the masks of its
+    leaves once at the end (and at each division, which may
+    introduce INVALID values).  The results are identical to
+    evaluating each Apply separately.
+
+    Arguments that are shared with other transformations (see
+    C{PmmlExpression.evaluateShared}) are not fused, so that their
+    results can be reused.  Calls to small user-defined functions
+    are replaced by the function's body with the arguments
+    substituted (see C{DefineFunction.inline}).
+
     U{PMML specification<http://www.dmg.org/v4-1/Transformations.html>}.
     """
+
+    shareable = True
+
+    _fusable = {FunctionTable.Addition: ("add", 2),
+                FunctionTable.Subtraction: ("subtract", 2),
+                FunctionTable.Multiplication: ("multiply", 2),
+                FunctionTable.TrueDivision: ("true_divide", 2),
+                FunctionTable.Negative: ("negative", 1),
+                }
+
+    class _Leaf(object):
+        """Part of a fused plan that is evaluated as an ordinary expression."""
+
+        def __init__(self, expression):
+            self.expression = expression
+
+        def evaluate(self, dataTable, functionTable, performanceTable):
+            dataColumn = self.expression.evaluateShared(dataTable, functionTable, performanceTable)
+            return dataColumn.data, dataColumn.fieldType.dataType, [dataColumn.mask], False
+
+    class _SharedArgument(object):
+        """Argument of an ordinary function call that may reuse the
+        result of a structurally identical expression."""
+
+        def __init__(self, expression):
+            self.expression = expression
+
+        def __getattr__(self, name):
+            return getattr(self.expression, name)
+
+        def evaluate(self, dataTable, functionTable, performanceTable):
+            return self.expression.evaluateShared(dataTable, functionTable, performanceTable)
+
+    class _ConstantLeaf(object):
+        """Part of a fused plan that is a Constant, used as a scalar."""
+
+        def __init__(self, constant):
+            fieldType = constant.fieldType
+            self.dataType = fieldType.dataType
+            self.value = NP.dtype(fieldType.dtype).type(constant.evaluateOne())
+
+        def evaluate(self, dataTable, functionTable, performanceTable):
+            return self.value, self.dataType, [], False
+
+    class _Operation(object):
+        """Part of a fused plan that applies a built-in arithmetic function."""
+
+        def __init__(self, function, ufunc, arguments):
+            self.function = function
+            self.ufunc = ufunc
+            self.arguments = arguments
+
+        def evaluate(self, dataTable, functionTable, performanceTable):
+            # each step returns (data, dataType, masks to be combined, whether data is a temporary that may be overwritten)
+            results = [x.evaluate(dataTable, functionTable, performanceTable) for x in self.arguments]
+
+            signature = tuple(self.function._typeMap[dataType] for data, dataType, masks, owned in results)
+            outputType = self.function.signatures.get(signature)
+            if outputType is None:
+                raise defs.PmmlValidationError("Function \"%s\" has no signature matching its arguments" % self.function.name)
+            dataType = self.function._typeReverseMap[outputType].dataType
+
+            # promote by dtype, as though the scalars were full-length columns
+            arrays = [data for data, dt, masks, owned in results]
+            resultType = NP("result_type", *[x.dtype for x in arrays])
+            if self.ufunc == "true_divide" and resultType.kind != "f":
+                resultType = NP.dtype(float)
+
+            out = None
+            for data, dt, masks, owned in results:
+                if owned and data.dtype == resultType:
+                    out = data
+                    break
+
+            if out is None:
+                data = NP(self.ufunc, *arrays, dtype=resultType)
+            else:
+                data = NP(self.ufunc, *arrays, dtype=resultType, out=out)
+
+            masks = sum((m for d, dt, m, o in results), [])
+            if self.ufunc == "true_divide":
+                if not isinstance(data, NP.ndarray):
+                    data = NP(NP("zeros", len(dataTable), dtype=resultType) + data)
+                masks = [self.function.maskInvalid(data, DataColumn.mapAnyMissingInvalid(masks))]
+
+            return data, dataType, masks, isinstance(data, NP.ndarray)
+
+        def evaluateColumn(self, dataTable, functionTable, performanceTable):
+            performanceTable.begin("fused arithmetic")
+
+            data, dataType, masks, owned = self.evaluate(dataTable, functionTable, performanceTable)
+            if not isinstance(data, NP.ndarray) or data.shape != (len(dataTable),):
+                data = NP(NP("zeros", len(dataTable), dtype=data.dtype) + data)
+            dataColumn = DataColumn(self.function._typeReverseMap[self.function._typeMap[dataType]], data, DataColumn.mapAnyMissingInvalid(masks))
+
+            performanceTable.end("fused arithmetic")
+            return dataColumn
+
+    class _Inlined(object):
+        """Plan for a call to a user-defined function whose body has
+        been substituted into the call site."""
+
+        def __init__(self, function, expression):
+            self.function = function
+            self.expression = expression
+
+        def evaluateColumn(self, dataTable, functionTable, performanceTable):
+            performanceTable.begin("user-defined \"%s\" (inlined)" % self.function.name)
+
+            performanceTable.pause("user-defined \"%s\" (inlined)" % self.function.name)
+            dataColumn = self.expression.evaluate(dataTable, functionTable, performanceTable)
+            performanceTable.unpause("user-defined \"%s\" (inlined)" % self.function.name)
+
+            dataColumn = self.function.castResult(dataColumn)
+
+            performanceTable.end("user-defined \"%s\" (inlined)" % self.function.name)
+            return dataColumn
+
+    def isShareable(self, visited=None):
+        """Determine whether this Apply, not including its arguments,
+        is a pure function of its arguments.
+
+        Built-in functions are pure; a user-defined function is pure
+        if the expressions in its DefineFunction are.
+
+        @type visited: set of strings
+        @param visited: Names of user-defined functions already being checked (to stop recursion).
+        @rtype: bool
+        @return: True if the result can be shared with structurally identical expressions.
+        """
+
+        if not self.shareable:
+            return False
+        if visited is None:
+            visited = set()
+        name = self.get("function")
+        if name in visited:
+            return True
+        visited.add(name)
+
+        for defineFunction in self.getroottree().getroot().xpath("//pmml:DefineFunction[@name=$name]", name=name):
+            for expression in defineFunction.iterdescendants():
+                if isinstance(expression, Apply):
+                    if not expression.isShareable(visited):
+                        return False
+                elif isinstance(expression, PmmlExpression) and not expression.isShareable():
+                    return False
+        return True
+
+    def indirectFields(self):
+        """Return the names of fields that the body of a user-defined
+        function called by this Apply references, other than its
+        parameters (directly or through other user-defined
+        functions).
+
+        @rtype: set of strings
+        @return: Field names.
+        """
+
+        root = self.getroottree().getroot()
+        output = set()
+        visited = set()
+        stack = [self.get("function")]
+        while len(stack) > 0:
+            name = stack.pop()
+            if name in visited:
+                continue
+            visited.add(name)
+            for defineFunction in root.xpath("//pmml:DefineFunction[@name=$name]", name=name):
+                parameters = set(x.get("name") for x in defineFunction.childrenOfTag("ParameterField"))
+                for elem in defineFunction.iterdescendants():
+                    if isinstance(elem, PmmlExpression):
+                        if elem.get("field") is not None and elem.get("field") not in parameters:
+                            output.add(elem.get("field"))
+                        if isinstance(elem, Apply):
+                            stack.append(elem.get("function"))
+        return output
+
+    def _fusableFunction(self, functionTable):
+        """Return the built-in arithmetic function of this Apply if it
+        can be part of a fused plan, None otherwise."""
+
+        if self.get("invalidValueTreatment") == "asMissing" or self.get("mapMissingTo") is not None:
+            return None
+        function = functionTable.get(self.get("function"))
+        if type(function) in self._fusable and len(self.childrenOfClass(PmmlExpression)) == self._fusable[type(function)][1]:
+            return function
+        return None
+
+    def _compileFused(self, function, functionTable):
+        """Build a fused plan for this Apply and its fusable descendants."""
+
+        arguments = []
+        for argument in self.childrenOfClass(PmmlExpression):
+            if isinstance(argument, Constant):
+                arguments.append(self._ConstantLeaf(argument))
+            elif isinstance(argument, Apply) and argument.sharingKey() is None and argument._fusableFunction(functionTable) is not None:
+                arguments.append(argument._compileFused(argument._fusableFunction(functionTable), functionTable))
+            else:
+                arguments.append(self._Leaf(argument))
+
+        return self._Operation(function, self._fusable[type(function)][0], arguments)
+
+    def plan(self, functionTable):
+        """Compile this Apply into an evaluation plan.
+
+        The plan is cached for the most recent FunctionTable and its
+        C{version}, so function lookups are only performed once and
+        are repeated if functions are added to or replaced in the
+        table.
+
+        @type functionTable: FunctionTable
+        @param functionTable: The FunctionTable, containing any functions that might be called in this expression.
+        @rtype: 2-tuple
+        @return: Either C{(function, arguments)} for an ordinary function call or C{(None, compiled)} for a fused chain of arithmetic or an inlined user-defined function.
+        @raise LookupError: If the function does not exist in the FunctionTable.
+        """
+
+        cache = self.cached("plan", lambda: [None, None, None])
+        if cache[0] is not functionTable or cache[2] != functionTable.version:
+            function = functionTable.get(self.get("function"))
+            if function is None:
+                raise LookupError("Apply references function \"%s\", but it does not exist" % self.get("function"))
+
+            fusableFunction = self._fusableFunction(functionTable)
+            inlined = None
+            if isinstance(function, DefineFunction):
+                inlined = function.inline(self.childrenOfClass(PmmlExpression))
+
+            if fusableFunction is not None:
+                cache[1] = (None, self._compileFused(fusableFunction, functionTable))
+            elif inlined is not None:
+                cache[1] = (None, self._Inlined(function, inlined))
+            else:
+                arguments = []
+                for argument in self.childrenOfClass(PmmlExpression):
+                    if not isinstance(argument, Constant) and argument.sharingKey() is not None:
+                        argument = self._SharedArgument(argument)
+                    arguments.append(argument)
+                cache[1] = (function, arguments)
+            cache[0] = functionTable
+            cache[2] = functionTable.version
+
+        return cache[1]
+
     def evaluate(self, dataTable, functionTable, performanceTable):
         """Evaluate the expression, using a DataTable as input.
 
@@ -46,15 +311,15 @@ class Apply(PmmlExpression):
 
         performanceTable.begin("Apply")
         
-        function = functionTable.get(self.get("function"))
-        if function is None:
-            raise LookupError("Apply references function \"%s\", but it does not exist" % self.get("function"))
+        function, arguments = self.plan(functionTable)
 
-        arguments = self.childrenOfClass(PmmlExpression)
+        if function is None:
+            dataColumn = arguments.evaluateColumn(dataTable, functionTable, performanceTable)
 
-        performanceTable.pause("Apply")
-        dataColumn = function.evaluate(dataTable, functionTable, performanceTable, arguments)
-        performanceTable.unpause("Apply")
+        else:
+            performanceTable.pause("Apply")
+            dataColumn = function.evaluate(dataTable, functionTable, performanceTable, arguments)
+            performanceTable.unpause("Apply")
 
         mask = FieldCastMethods.applyInvalidValueTreatment(dataColumn.mask, self.get("invalidValueTreatment"))
         data, mask = FieldCastMethods.applyMapMissingTo(dataColumn.fieldType, dataColumn.data, mask, self.get("mapMissingTo"))
@@ -33,6 +33,8 @@ class Constant(PmmlExpression):
     U{PMML specification<http://www.dmg.org/v4-1/Transformations.html>}.
     """
 
+    shareable = True
+
     @property
     def fieldType(self):
         dataType = self.get("dataType")
@@ -36,6 +36,8 @@ class Discretize(PmmlExpression):
     U{PMML specification<http://www.dmg.org/v4-1/Transformations.html>}.
     """
 
+    shareable = True
+
     _optype = "categorical"
 
     @classmethod
@@ -32,6 +32,8 @@ class FieldRef(PmmlExpression):
     U{PMML specification<http://www.dmg.org/v4-1/Transformations.html>}.
     """
 
+    shareable = True
+
     def evaluate(self, dataTable, functionTable, performanceTable):
         """Evaluate the expression, using a DataTable as input.
 
@@ -34,6 +34,9 @@ class MapValues(PmmlExpression):
 
     U{PMML specification<http://www.dmg.org/v4-1/Transformations.html>}.
     """
+
+    shareable = True
+
     _optype = "continuous"
 
     @classmethod
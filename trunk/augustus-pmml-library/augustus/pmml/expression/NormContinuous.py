@@ -35,29 +35,37 @@ class NormContinuous(PmmlExpression):
     U{PMML specification<http://www.dmg.org/v4-1/Transformations.html>}.
     """
 
+    shareable = True
+
     _fieldType = FakeFieldType("double", "continuous")
 
-    def transformSelection(self, linearNorm1, linearNorm2, indata, outdata, selection):
-        """Linearly transform a Subset of the dataset as part of an
-        overall piecewise linear transformation.
-
-        @type linearNorm1: PmmlBinding
-        @param linearNorm1: The left-side <LinearNorm> object.
-        @type linearNorm2: PmmlBinding
-        @param linearNorm2: The right-side <LinearNorm> object.
-        @type indata: 1d Numpy array
-        @param indata: Unselected input data.
-        @type outdata: 1d Numpy array
-        @param outdata: Output data, modified by this function.
-        @type selection: 1d Numpy array of bool
-        @param selection: The Numpy selector for this piecewise region.
+    def knots(self):
+        """Compile the <LinearNorm> children into arrays of knots.
+
+        The result is cached, so the XML is only read the first time
+        the expression is evaluated.
+
+        @rtype: 2-tuple of 1d Numpy arrays
+        @return: The C{orig} and C{norm} values, sorted by C{orig}.
+        @raise PmmlValidationError: If there are fewer than two LinearNorms or two share the same C{orig}.
         """
 
-        a1 = linearNorm1.orig
-        b1 = linearNorm1.norm
-        a2 = linearNorm2.orig
-        b2 = linearNorm2.norm
-        outdata[selection] = NP(b1 + NP(NP(NP(indata[selection] - a1)/NP(a2 - a1))*NP(b2 - b1)))
+        def build():
+            linearNorms = [(float(linearNorm["orig"]), float(linearNorm["norm"])) for linearNorm in self.childrenOfTag("LinearNorm")]
+            if len(linearNorms) < 2:
+                raise defs.PmmlValidationError("NormContinuous requires at least two LinearNorms, not %d" % len(linearNorms))
+
+            linearNorms.sort()   # technically, it's invalid if not already sorted
+            orig = NP("array", [x for x, y in linearNorms], dtype=NP.dtype(float))
+            norm = NP("array", [y for x, y in linearNorms], dtype=NP.dtype(float))
+            if (NP("diff", orig) <= 0.0).any():
+                raise defs.PmmlValidationError("NormContinuous LinearNorms must have distinct orig values")
+
+            orig.setflags(write=False)
+            norm.setflags(write=False)
+            return orig, norm
+
+        return self.cached("knots", build)
 
     def evaluate(self, dataTable, functionTable, performanceTable):
         """Evaluate the expression, using a DataTable as input.
@@ -79,39 +87,27 @@ class NormContinuous(PmmlExpression):
             raise defs.PmmlValidationError("NormContinuous requires a numeric input field, but \"%s\" is" % dataColumn.fieldType.dataType)
 
         outliers = self.get("outliers")
+        orig, norm = self.knots()
 
-        linearNorms = self.childrenOfTag("LinearNorm")
-        for linearNorm in linearNorms:
-            linearNorm.orig = float(linearNorm["orig"])
-            linearNorm.norm = float(linearNorm["norm"])
-
-        linearNorms.sort(lambda x, y: cmp(x.orig, y.orig))   # technically, it's invalid if not already sorted
-
-        data = NP("empty", len(dataTable), self._fieldType.dtype)
+        # interp clamps to the first and last norm, which is the asExtremeValues treatment
+        data = NP("interp", dataColumn.data, orig, norm)
         mask = dataColumn.mask
 
-        # extrapolate before the first
-        selection = NP(dataColumn.data <= linearNorms[0].orig)
-        if outliers == "asMissingValues":
-            mask = FieldCastMethods.outliersAsMissing(mask, dataColumn.mask, selection)
-        elif outliers == "asExtremeValues":
-            data[selection] = linearNorms[0].norm
-        else:
-            self.transformSelection(linearNorms[0], linearNorms[1], dataColumn.data, data, selection)
-
-        for i in xrange(len(linearNorms) - 1):
-            selection = NP(linearNorms[i].orig < dataColumn.data)
-            NP("logical_and", selection, NP(dataColumn.data <= linearNorms[i+1].orig), selection)
-
-            self.transformSelection(linearNorms[i], linearNorms[i+1], dataColumn.data, data, selection)
+        below = NP(dataColumn.data < orig[0])
+        above = NP(dataColumn.data > orig[-1])
 
-        selection = NP(linearNorms[-1].orig < dataColumn.data)
         if outliers == "asMissingValues":
-            mask = FieldCastMethods.outliersAsMissing(mask, dataColumn.mask, selection)
-        elif outliers == "asExtremeValues":
-            data[selection] = linearNorms[-1].norm
-        else:
-            self.transformSelection(linearNorms[-2], linearNorms[-1], dataColumn.data, data, selection)
+            mask = FieldCastMethods.outliersAsMissing(mask, dataColumn.mask, below)
+            mask = FieldCastMethods.outliersAsMissing(mask, dataColumn.mask, above)
+
+        elif outliers != "asExtremeValues":
+            # asIs: extrapolate with the first and last linear pieces
+            if below.any():
+                slope = (norm[1] - norm[0]) / (orig[1] - orig[0])
+                data[below] = NP(NP(NP(dataColumn.data[below] - orig[0]) * slope) + norm[0])
+            if above.any():
+                slope = (norm[-1] - norm[-2]) / (orig[-1] - orig[-2])
+                data[above] = NP(NP(NP(dataColumn.data[above] - orig[-1]) * slope) + norm[-1])
 
         data, mask = FieldCastMethods.applyMapMissingTo(self._fieldType, data, mask, self.get("mapMissingTo"))
 
@@ -35,8 +35,30 @@ class NormDiscrete(PmmlExpression):
     U{PMML specification<http://www.dmg.org/v4-1/Transformations.html>}.
     """
 
+    shareable = True
+
     _fieldType = FakeFieldType("integer", "continuous")
 
+    def comparisonValue(self, fieldType):
+        """Convert the C{value} attribute into the internal
+        representation of a given FieldType.
+
+        The conversion is cached for the most recent FieldType, since
+        the same input field is usually seen on every evaluation.
+
+        @type fieldType: FieldType
+        @param fieldType: The FieldType of the input DataColumn.
+        @rtype: any
+        @return: The internal value to compare with the DataColumn's data.
+        """
+
+        # FieldTypes that compare equal can have different string-to-value maps, so check identity
+        cache = self.cached("comparisonValue", lambda: [None, None])
+        if cache[0] is not fieldType:
+            cache[1] = fieldType.stringToValue(self["value"])
+            cache[0] = fieldType
+        return cache[1]
+
     def evaluate(self, dataTable, functionTable, performanceTable):
         """Evaluate the expression, using a DataTable as input.
 
@@ -53,8 +75,8 @@ class NormDiscrete(PmmlExpression):
         performanceTable.begin("NormDiscrete")
 
         dataColumn = dataTable.fields[self["field"]]
-        value = dataColumn.fieldType.stringToValue(self["value"])
-        data = NP("array", NP(dataColumn.data == value), dtype=self._fieldType.dtype)
+        value = self.comparisonValue(dataColumn.fieldType)
+        data = NP("equal", dataColumn.data, value).astype(self._fieldType.dtype)
         data, mask = FieldCastMethods.applyMapMissingTo(self._fieldType, data, dataColumn.mask, self.get("mapMissingTo"))
 
         performanceTable.end("NormDiscrete")
@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the AssociationModel class."""
+
+from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP
+from augustus.core.PmmlModel import PmmlModel
+from augustus.core.FakeFieldType import FakeFieldType
+from augustus.core.DataColumn import DataColumn
+
+class AssociationModel(PmmlModel):
+    """AssociationModel implements association rules in PMML, which
+    recommend items based on the items already in a transaction.
+
+    U{PMML specification<http://www.dmg.org/v4-1/AssociationRules.html>}.
+
+    If the MiningSchema has a field with usageType="group", each row
+    of the DataTable is one item (the single active field) of the
+    transaction named by the group field, and every row of a
+    transaction gets that transaction's results.  Otherwise, each row
+    is a transaction containing the values of all active fields.
+    Values that are not the value of any Item are ignored.
+
+    Items are numbered once and the antecedent and consequent of each
+    AssociationRule are packed into bitsets (one bit per item in
+    64-bit words), keeping only their non-empty words.  Transactions
+    are packed the same way.  An itemset is contained in a transaction
+    if ANDing their words returns the itemset's words.  For a block of
+    transactions, this is first computed for all pairs of transactions
+    and rules with only the first word of each antecedent, which
+    eliminates most pairs, and then completed for the remaining pairs
+    one word at a time.  Each OutputField with feature="ruleValue" then selects, for every
+    transaction, the rule of the requested rank among the rules that
+    pass its algorithm, in the order of its rankBasis and rankOrder
+    (ties in document order):
+
+      - recommendation: the antecedent is in the transaction;
+      - exclusiveRecommendation: the antecedent is in the transaction but the consequent is not;
+      - ruleAssociation: the antecedent and the consequent are in the transaction.
+
+    Transactions with fewer passing rules than the rank are missing.
+    Itemsets are reported as "{value,value}" (Item mappedValue, if
+    present) and rules as "{antecedent}->{consequent}".  The
+    predictedValue is the consequent of the highest-confidence
+    exclusiveRecommendation, which are the OutputField defaults.
+
+    @type blockSize: int
+    @param blockSize: Maximum number of elements (transactions times rules) in each block of the calculation, which bounds its working memory.
+    """
+
+    blockSize = 1048576
+    scoreType = FakeFieldType("string", "categorical")
+
+    _defaultKey = ("exclusiveRecommendation", "confidence", "descending", 1, "consequent")
+    _numericFeatures = ("confidence", "support", "lift", "leverage", "affinity")
+
+    class _Plan(object):
+        """Compiled form of the Items, Itemsets, and AssociationRules."""
+        pass
+
+    def plan(self):
+        """Return the compiled Items, Itemsets, and AssociationRules,
+        building them on first use.
+
+        @rtype: AssociationModel._Plan
+        @return: An object with the following attributes: C{values} (Item value strings, one per item number), C{numberOfWords} (words per bitset), C{antecedents} and C{consequents} (pairs of 2d arrays, one row per rule, with the index and contents of each non-empty bitset word), C{antecedentStrings}, C{consequentStrings}, C{ruleStrings}, and C{ruleIds} (lists of strings, one per rule), C{measures} (dict from rankBasis to 1d arrays, NaN where a rule does not have the attribute), and C{requests} (dict from (algorithm, rankBasis, rankOrder) to the set of (rank, ruleFeature) pairs to compute).
+        @raise PmmlValidationError: If an Itemset or AssociationRule refers to an undefined id.
+        """
+
+        return self.cached("plan", self._compile)
+
+    def _compile(self):
+        if self["functionName"] != "associationRules":
+            raise defs.PmmlValidationError("AssociationModel functionName may only be \"associationRules\", not \"%s\"" % self["functionName"])
+
+        plan = self._Plan()
+        plan.values = []
+        valueIndex = {}
+        itemCodes = {}
+        itemLabels = {}
+        for item in self.childrenOfTag("Item"):
+            if item["id"] in itemCodes:
+                raise defs.PmmlValidationError("More than one Item has id \"%s\"%s" % (item["id"], item.sourcelineAsString()))
+            if item["value"] not in valueIndex:          # Items with the same value are the same item
+                valueIndex[item["value"]] = len(plan.values)
+                plan.values.append(item["value"])
+            itemCodes[item["id"]] = valueIndex[item["value"]]
+            itemLabels[item["id"]] = item.get("mappedValue", item["value"])
+
+        plan.numberOfWords = max(1, (len(plan.values) + 63) // 64)
+
+        itemsets = {}
+        for itemset in self.childrenOfTag("Itemset"):
+            codes = []
+            labels = []
+            for itemRef in itemset.childrenOfTag("ItemRef"):
+                try:
+                    codes.append(itemCodes[itemRef["itemRef"]])
+                except KeyError:
+                    raise defs.PmmlValidationError("ItemRef \"%s\" does not refer to an Item%s" % (itemRef["itemRef"], itemRef.sourcelineAsString()))
+                labels.append(itemLabels[itemRef["itemRef"]])
+            itemsets[itemset["id"]] = (codes, "{%s}" % ",".join(labels))
+
+        rules = self.childrenOfTag("AssociationRule")
+        plan.antecedentStrings = []
+        plan.consequentStrings = []
+        plan.ruleStrings = []
+        plan.ruleIds = []
+        plan.measures = dict((x, NP("empty", len(rules), dtype=NP.dtype(float))) for x in self._numericFeatures)
+
+        words = {"antecedent": [], "consequent": []}
+        for index, rule in enumerate(rules):
+            strings = []
+            for side in "antecedent", "consequent":
+                try:
+                    codes, string = itemsets[rule[side]]
+                except KeyError:
+                    raise defs.PmmlValidationError("AssociationRule %s \"%s\" does not refer to an Itemset%s" % (side, rule[side], rule.sourcelineAsString()))
+                bitset = {}
+                for code in codes:
+                    bitset[code // 64] = bitset.get(code // 64, 0) | (1 << (code % 64))
+                words[side].append(sorted(bitset.items()))
+                strings.append(string)
+
+            plan.antecedentStrings.append(strings[0])
+            plan.consequentStrings.append(strings[1])
+            plan.ruleStrings.append("%s->%s" % tuple(strings))
+            plan.ruleIds.append(rule.get("id", "%d" % (index + 1)))
+            for measure in self._numericFeatures:
+                plan.measures[measure][index] = float(rule.get(measure, "nan"))
+
+        for side in "antecedent", "consequent":
+            width = max([len(x) for x in words[side]] + [0])
+            wordIndexes = NP("zeros", (len(rules), width), dtype=NP.dtype(int))
+            wordMasks = NP("zeros", (len(rules), width), dtype=NP.uint64)       # padding words have an empty mask, which is always contained
+            for index, bitset in enumerate(words[side]):
+                for column, (word, mask) in enumerate(bitset):
+                    wordIndexes[index, column] = word
+                    wordMasks[index, column] = mask
+            setattr(plan, side + "s", (wordIndexes, wordMasks))
+
+        plan.requests = {}
+        requested = [self._defaultKey]
+        for outputField in self.xpath("pmml:Output/pmml:OutputField[@feature='ruleValue']"):
+            requested.append(tuple(outputField.get(x, defaultFromXsd=True) for x in ("algorithm", "rankBasis", "rankOrder", "rank", "ruleFeature")))
+        for algorithm, rankBasis, rankOrder, rank, ruleFeature in requested:
+            if int(rank) < 1:
+                raise defs.PmmlValidationError("OutputField rank must be at least 1, not %s" % rank)
+            plan.requests.setdefault((algorithm, rankBasis, rankOrder), set()).add((int(rank), ruleFeature))
+
+        return plan
+
+    def _itemCodes(self, dataColumn, values):
+        """Convert a field's values to item numbers.
+
+        @type dataColumn: DataColumn
+        @param dataColumn: The field.
+        @type values: list of strings
+        @param values: Item values, one per item number.
+        @rtype: 1d Numpy array
+        @return: Item number for each row, or -1 for values that are not Items and invalid or missing values.
+        """
+
+        keys = []
+        codes = []
+        for code, value in enumerate(values):
+            try:
+                keys.append(dataColumn.fieldType.stringToValue(value))
+            except (ValueError, TypeError):
+                pass
+            else:
+                codes.append(code)
+
+        result = NP("empty", len(dataColumn), dtype=NP.dtype(int))
+        result[:] = -1
+        if len(keys) > 0:
+            keys = NP("array", keys, dtype=dataColumn.fieldType.dtype)
+            order = NP("argsort", keys, kind="mergesort")
+            keys = keys[order]
+            codes = NP("array", codes, dtype=NP.dtype(int))[order]
+
+            position = NP("searchsorted", keys, dataColumn.data)
+            NP("minimum", position, len(keys) - 1, position)
+            found = NP(keys[position] == dataColumn.data)
+            result[found] = codes[position[found]]
+
+        if dataColumn.mask is not None:
+            result[NP(dataColumn.mask != defs.VALID)] = -1
+        return result
+
+    def _pack(self, rows, codes, numberOfRows, numberOfWords):
+        """Pack (row, item number) pairs into bitsets.
+
+        @type rows: 1d Numpy array
+        @param rows: Row of each pair.
+        @type codes: 1d Numpy array
+        @param codes: Item number of each pair.
+        @type numberOfRows: int
+        @param numberOfRows: Number of bitsets.
+        @type numberOfWords: int
+        @param numberOfWords: Number of 64-bit words in each bitset.
+        @rtype: 2d Numpy array
+        @return: Bitsets with one row per C{rows} value.
+        """
+
+        bitsets = NP("zeros", (numberOfRows, numberOfWords), dtype=NP.uint64)
+        if len(rows) > 0:
+            pairs = NP("unique", NP(NP(rows * (numberOfWords * 64)) + codes))      # sorted and without duplicates, so adding bits is the same as ORing them
+            slots = NP(NP(pairs // (numberOfWords * 64)) * numberOfWords + NP(NP(pairs % (numberOfWords * 64)) // 64))
+            bits = NP("left_shift", NP.uint64(1), NP(pairs % 64).astype(NP.uint64))
+            starts = NP("flatnonzero", NP("concatenate", ([True], NP(slots[1:] != slots[:-1]))))
+            bitsets.reshape(-1)[slots[starts]] = NP.add.reduceat(bits, starts)
+        return bitsets
+
+    def _contains(self, transactions, itemsets, rows, rules, firstColumn):
+        """Determine whether itemsets are contained in transactions,
+        one (transaction, rule) pair at a time.
+
+        @type transactions: 2d Numpy array
+        @param transactions: Bitsets with one row per transaction.
+        @type itemsets: 2-tuple of 2d Numpy arrays
+        @param itemsets: Word indexes and word contents of the non-empty words of each rule's itemset, with one row per rule.
+        @type rows: 1d Numpy array
+        @param rows: Transaction of each pair.
+        @type rules: 1d Numpy array
+        @param rules: Rule of each pair.
+        @type firstColumn: int
+        @param firstColumn: Number of leading non-empty words that are already known to be contained.
+        @rtype: 1d Numpy array of bool
+        @return: True for each pair in which the rule's itemset is contained in the transaction.
+        """
+
+        wordIndexes, wordMasks = itemsets
+        result = NP("ones", len(rows), dtype=NP.dtype(bool))
+        for column in xrange(firstColumn, wordIndexes.shape[1]):
+            masks = wordMasks[rules, column]
+            contained = transactions[rows, wordIndexes[rules, column]]
+            contained &= masks
+            NP("logical_and", result, NP(contained == masks), result)
+        return result
+
+    def calculateScore(self, dataTable, functionTable, performanceTable):
+        """Calculate the score of this model.
+
+        This method is called by C{calculate} to separate operations
+        that are performed by all models (in C{calculate}) from
+        operations that are performed by specific models (in
+        C{calculateScore}).
+
+        @type subTable: DataTable
+        @param subTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: A DataColumn containing the score.
+        """
+
+        performanceTable.begin("AssociationModel")
+
+        performanceTable.begin("transactions")
+        plan = self.plan()
+        length = len(dataTable)
+
+        activeFields = [x["name"] for x in self.xpath("pmml:MiningSchema/pmml:MiningField[not(@usageType) or @usageType='active']")]
+        groupFields = [x["name"] for x in self.xpath("pmml:MiningSchema/pmml:MiningField[@usageType='group']")]
+
+        if len(groupFields) > 0:
+            if len(groupFields) != 1 or len(activeFields) != 1:
+                raise defs.PmmlValidationError("AssociationModel with a group field requires exactly one group field and one active field, not %d and %d" % (len(groupFields), len(activeFields)))
+
+            groupColumn = dataTable.fields[groupFields[0]]
+            codes = self._itemCodes(dataTable.fields[activeFields[0]], plan.values)
+            if groupColumn.mask is None:
+                grouped = NP("arange", length)
+            else:
+                grouped = NP("flatnonzero", NP(groupColumn.mask == defs.VALID))
+            groups, inverse = NP("unique", groupColumn.data[grouped], return_inverse=True)
+
+            numberOfTransactions = len(groups)
+            selection = NP(codes[grouped] >= 0)
+            transactions = self._pack(inverse[selection], codes[grouped][selection], numberOfTransactions, plan.numberOfWords)
+
+        else:
+            numberOfTransactions = length
+            rows = []
+            codes = []
+            for fieldName in activeFields:
+                fieldCodes = self._itemCodes(dataTable.fields[fieldName], plan.values)
+                selection = NP("flatnonzero", NP(fieldCodes >= 0))
+                rows.append(selection)
+                codes.append(fieldCodes[selection])
+            if len(rows) > 0:
+                transactions = self._pack(NP("concatenate", rows), NP("concatenate", codes), numberOfTransactions, plan.numberOfWords)
+            else:
+                transactions = self._pack(NP("empty", 0, dtype=NP.dtype(int)), NP("empty", 0, dtype=NP.dtype(int)), numberOfTransactions, plan.numberOfWords)
+
+        performanceTable.end("transactions")
+
+        performanceTable.begin("matching")
+        numberOfRules = len(plan.ruleIds)
+        algorithms = set(x[0] for x in plan.requests)
+        orders = {}
+        positions = {}
+        for algorithm, rankBasis, rankOrder in plan.requests:
+            if (rankBasis, rankOrder) not in orders:
+                measure = plan.measures[rankBasis]
+                if rankOrder == "descending":
+                    measure = NP("negative", measure)
+                measure = NP("where", NP("isnan", measure), NP.inf, measure)      # rules without the measure go last
+                order = NP("argsort", measure, kind="mergesort")
+                orders[rankBasis, rankOrder] = order
+                positions[rankBasis, rankOrder] = NP("empty", numberOfRules, dtype=NP.dtype(int))
+                positions[rankBasis, rankOrder][order] = NP("arange", numberOfRules)
+
+        selected = {}
+        for key, ranks in plan.requests.items():
+            for rank, ruleFeature in ranks:
+                selected[key, rank] = NP("empty", numberOfTransactions, dtype=NP.dtype(int))
+                selected[key, rank][:] = -1
+
+        wordIndexes, wordMasks = plan.antecedents
+        blockSize = max(1, min(numberOfTransactions, self.blockSize // max(numberOfRules, 1)))
+        for start in xrange(0, numberOfTransactions, blockSize):
+            stop = min(start + blockSize, numberOfTransactions)
+            block = transactions[start:stop]
+            if numberOfRules == 0:
+                break
+
+            # dense pass over all (transaction, rule) pairs with the first word of each antecedent,
+            # which leaves only a few pairs to check word by word
+            if wordIndexes.shape[1] > 0:
+                first = block[:,wordIndexes[:,0]]
+                first &= wordMasks[:,0]
+                rows, rules = NP("nonzero", NP(first == wordMasks[:,0]))
+                del first
+            else:
+                rows, rules = NP("nonzero", NP("ones", (stop - start, numberOfRules), dtype=NP.dtype(bool)))
+
+            antecedentIn = self._contains(block, plan.antecedents, rows, rules, 1)
+            rows = rows[antecedentIn]
+            rules = rules[antecedentIn]
+
+            eligible = {}
+            if "recommendation" in algorithms:
+                eligible["recommendation"] = (rows, rules)
+            if "exclusiveRecommendation" in algorithms or "ruleAssociation" in algorithms:
+                consequentIn = self._contains(block, plan.consequents, rows, rules, 0)
+                if "exclusiveRecommendation" in algorithms:
+                    consequentOut = NP("logical_not", consequentIn)
+                    eligible["exclusiveRecommendation"] = (rows[consequentOut], rules[consequentOut])
+                if "ruleAssociation" in algorithms:
+                    eligible["ruleAssociation"] = (rows[consequentIn], rules[consequentIn])
+
+            # sort the passing pairs by transaction, then rank; the Nth pair of each transaction is its rank-N rule
+            boundaries = NP(NP("arange", stop - start + 1) * numberOfRules)
+            for key, ranks in plan.requests.items():
+                algorithm, rankBasis, rankOrder = key
+                passingRows, passingRules = eligible[algorithm]
+                sortKeys = NP(NP(passingRows * numberOfRules) + positions[rankBasis, rankOrder][passingRules])
+                sortKeys.sort()
+                edges = NP("searchsorted", sortKeys, boundaries)
+
+                for rank in set(x[0] for x in ranks):
+                    index = NP(edges[:-1] + (rank - 1))
+                    found = NP(index < edges[1:])
+                    selected[key, rank][start:stop][found] = orders[rankBasis, rankOrder][NP(sortKeys[index[found]] % numberOfRules)]
+
+        performanceTable.end("matching")
+
+        performanceTable.begin("set scores")
+        if len(groupFields) > 0:
+            rowToTransaction = NP("empty", length, dtype=NP.dtype(int))
+            rowToTransaction[:] = -1
+            rowToTransaction[grouped] = inverse
+        else:
+            rowToTransaction = None
+
+        stringType = FakeFieldType("string", "categorical")
+        doubleType = FakeFieldType("double", "continuous")
+        tables = {}
+        for ruleFeature, strings in (("antecedent", plan.antecedentStrings), ("consequent", plan.consequentStrings), ("rule", plan.ruleStrings), ("ruleId", plan.ruleIds)):
+            tables[ruleFeature] = NP("array", [stringType.stringToValue(x) for x in strings + [""]], dtype=stringType.dtype)
+        for ruleFeature in self._numericFeatures:
+            tables[ruleFeature] = NP("append", plan.measures[ruleFeature], NP.nan)
+
+        score = {}
+        for key, ranks in plan.requests.items():
+            for rank, ruleFeature in ranks:
+                rules = selected[key, rank]
+                if rowToTransaction is not None:
+                    rules = NP("where", NP(rowToTransaction >= 0), rules[rowToTransaction], -1)
+
+                data = tables[ruleFeature][rules]           # rule -1 picks the appended placeholder
+                missing = NP(rules < 0)
+                if ruleFeature in self._numericFeatures:
+                    fieldType = doubleType
+                    NP("logical_or", missing, NP("isnan", data), missing)
+                else:
+                    fieldType = stringType
+                if missing.any():
+                    mask = NP(missing * defs.MISSING)
+                else:
+                    mask = None
+
+                score["ruleValue.%s.%s.%s.%d.%s" % (key + (rank, ruleFeature))] = DataColumn(fieldType, data, mask)
+
+        score[None] = score["ruleValue.%s.%s.%s.%d.%s" % self._defaultKey]
+
+        performanceTable.end("set scores")
+        performanceTable.end("AssociationModel")
+        return score
@@ -43,14 +43,14 @@ class BinarySimilarity(PmmlClusteringMetricBinary):
         @return: The array of distances or similarities for center-based clustering, and number of standard deviations for distribution-based clustering.
         """
 
-        c00 = self["c00-parameter"]
-        c01 = self["c01-parameter"]
-        c10 = self["c10-parameter"]
-        c11 = self["c11-parameter"]
-        d00 = self["d00-parameter"]
-        d01 = self["d01-parameter"]
-        d10 = self["d10-parameter"]
-        d11 = self["d11-parameter"]
+        c00 = self.get("c00-parameter", convertType=True)
+        c01 = self.get("c01-parameter", convertType=True)
+        c10 = self.get("c10-parameter", convertType=True)
+        c11 = self.get("c11-parameter", convertType=True)
+        d00 = self.get("d00-parameter", convertType=True)
+        d01 = self.get("d01-parameter", convertType=True)
+        d10 = self.get("d10-parameter", convertType=True)
+        d11 = self.get("d11-parameter", convertType=True)
 
         return NP(NP(NP(NP(NP(c11 * state.a11) + NP(c10 * state.a10)) + NP(c01 * state.a01)) + NP(c00 * state.a00)) /
                   NP(NP(NP(NP(d11 * state.a11) + NP(d10 * state.a10)) + NP(d01 * state.a01)) + NP(d00 * state.a00)))
@@ -42,7 +42,7 @@ class Minkowski(PmmlClusteringMetric):
         """
 
         state.powerSum = NP("zeros", numberOfRecords, dtype=NP.dtype(float))
-        state.power = state.get("p-parameter", convertType=True)
+        state.power = self.get("p-parameter", convertType=True)
         if distributionBased:
             raise NotImplementedError("Distribution-based clustering has not been implemented for the %s metric" % self.t)
 
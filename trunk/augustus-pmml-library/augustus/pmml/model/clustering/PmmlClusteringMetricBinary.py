@@ -20,6 +20,7 @@
 
 """This module defines the PmmlClusteringMetricBinary class."""
 
+from augustus.core.NumpyInterface import NP
 from augustus.core.PmmlBinding import PmmlBinding
 
 class PmmlClusteringMetricBinary(PmmlBinding):
@@ -0,0 +1,563 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the GeneralRegressionModel class."""
+
+import math
+
+from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP, erf
+from augustus.core.PmmlModel import PmmlModel
+from augustus.core.FakeFieldType import FakeFieldType
+from augustus.core.DataColumn import DataColumn
+
+class GeneralRegressionModel(PmmlModel):
+    """GeneralRegressionModel implements general linear, generalized
+    linear, multinomial logistic, and ordinal multinomial regression
+    models in PMML, which are defined by a predictor-to-parameter
+    correlation matrix (PPMatrix) and a parameter matrix (ParamMatrix).
+
+    U{PMML specification<http://www.dmg.org/v4-1/GeneralRegression.html>}.
+
+    The PPMatrix is sparse: most parameters involve one predictor and
+    the intercept involves none.  It is compiled once into three
+    parts: the intercepts, a lookup table for each factor whose
+    parameters are simple main effects (indexed by category, like a
+    one-hot encoding without the one-hot columns), and a dense
+    coefficient matrix for the remaining parameters (covariate powers
+    and interactions), whose design columns are computed for a block
+    of rows at a time.  A PPCell with a C{targetCategory} applies only
+    to the linear predictor of that category.  C{modelType="CoxRegression"}
+    and contrast matrices are not supported and are reported as
+    validation errors.
+
+    @type subFields: dict
+    @param subFields: To globally turn on the calculation of "probability" (the probability of the predicted category and "probability.CATEGORY" for each category), set C{subFields["probability"]} to True.  It is also turned on by any OutputField with feature="probability".
+    @type blockSize: int
+    @param blockSize: Maximum number of elements (rows times design columns) in each block of the design matrix, which bounds the working memory of the calculation.
+    """
+
+    subFields = {"probability": False}
+    blockSize = 1048576
+
+    @property
+    def scoreType(self):
+        if self.get("functionName") == "classification":
+            return FakeFieldType("string", "categorical")
+        else:
+            return FakeFieldType("double", "continuous")
+
+    class _Plan(object):
+        """Compiled form of the PPMatrix and ParamMatrix."""
+        pass
+
+    def plan(self):
+        """Return the compiled PPMatrix and ParamMatrix, building them
+        on first use.
+
+        @rtype: GeneralRegressionModel._Plan
+        @return: An object with the following attributes: C{categories} (target categories, or [None] for regression), C{rows} (indexes of the categories that have a linear predictor), C{intercepts} (1d array, one per row), C{columns} (list of design columns, each a tuple of (fieldName, factor value or None, exponent or None)), C{matrix} (2d array with one row per row and one column per entry in C{columns}), C{factors} (list of (fieldName, value strings, 2d array with one row per row and one column per value, plus a column of zeros)), C{fields} (all referenced field names), and C{probability} (whether probabilities are requested by an OutputField).
+        @raise PmmlValidationError: If the PPMatrix or ParamMatrix is inconsistent with the rest of the model.
+        """
+
+        return self.cached("plan", self._compile)
+
+    def _targetCategories(self, pCells):
+        """Determine the ordered list of target categories.
+
+        The order is taken from the target DataField's valid Values,
+        if any; otherwise, it is the order of appearance in the
+        ParamMatrix followed by the targetReferenceCategory.
+
+        @type pCells: list of PmmlBinding
+        @param pCells: The <PCell> elements.
+        @rtype: list of strings
+        @return: The target categories.
+        """
+
+        targetName = self.get("targetVariableName")
+        if targetName is None:
+            predicted = self.xpath("pmml:MiningSchema/pmml:MiningField[@usageType='predicted' or @usageType='target']")
+            if len(predicted) == 1:
+                targetName = predicted[0]["name"]
+
+        categories = []
+        if targetName is not None:
+            dataField = self.getroottree().getroot().xpath("pmml:DataDictionary/pmml:DataField[@name=$name]", name=targetName)
+            if len(dataField) == 1:
+                categories = [value["value"] for value in dataField[0].childrenOfTag("Value") if value.get("property", "valid") == "valid"]
+
+        if len(categories) == 0:
+            for pCell in pCells:
+                targetCategory = pCell.get("targetCategory")
+                if targetCategory is not None and targetCategory not in categories:
+                    categories.append(targetCategory)
+
+        targetReferenceCategory = self.get("targetReferenceCategory")
+        if targetReferenceCategory is not None and targetReferenceCategory not in categories:
+            categories.append(targetReferenceCategory)
+
+        return categories
+
+    def _compile(self):
+        modelType = self["modelType"]
+        functionName = self["functionName"]
+
+        if modelType in ("regression", "generalLinear", "generalizedLinear"):
+            if functionName != "regression":
+                raise defs.PmmlValidationError("GeneralRegressionModel with modelType \"%s\" must have functionName \"regression\", not \"%s\"" % (modelType, functionName))
+        elif modelType in ("multinomialLogistic", "ordinalMultinomial"):
+            if functionName != "classification":
+                raise defs.PmmlValidationError("GeneralRegressionModel with modelType \"%s\" must have functionName \"classification\", not \"%s\"" % (modelType, functionName))
+        else:
+            raise defs.PmmlValidationError("GeneralRegressionModel with modelType \"%s\" is not supported" % modelType)
+
+        if modelType == "generalizedLinear" and self.get("linkFunction") is None:
+            raise defs.PmmlValidationError("GeneralRegressionModel with modelType \"generalizedLinear\" requires a linkFunction")
+        if modelType == "ordinalMultinomial" and self.get("cumulativeLink") is None:
+            raise defs.PmmlValidationError("GeneralRegressionModel with modelType \"ordinalMultinomial\" requires a cumulativeLink")
+
+        if len(self.xpath("pmml:FactorList/pmml:Predictor/pmml:Matrix | pmml:CovariateList/pmml:Predictor/pmml:Matrix")) > 0:
+            raise defs.PmmlValidationError("GeneralRegressionModel with contrast matrices (Predictor/Matrix) is not supported")
+
+        factors = set(predictor["name"] for predictor in self.xpath("pmml:FactorList/pmml:Predictor"))
+        covariates = set(predictor["name"] for predictor in self.xpath("pmml:CovariateList/pmml:Predictor"))
+
+        parameterCells = {}
+        for ppCell in self.xpath("pmml:PPMatrix/pmml:PPCell"):
+            predictorName = ppCell["predictorName"]
+            if predictorName in factors:
+                cell = (predictorName, ppCell["value"], None)
+            elif predictorName in covariates:
+                try:
+                    cell = (predictorName, None, float(ppCell["value"]))
+                except ValueError:
+                    raise defs.PmmlValidationError("PPCell value for covariate \"%s\" must be a number, not \"%s\"%s" % (predictorName, ppCell["value"], ppCell.sourcelineAsString()))
+            else:
+                raise defs.PmmlValidationError("PPCell predictorName \"%s\" is not in the FactorList or CovariateList%s" % (predictorName, ppCell.sourcelineAsString()))
+
+            parameterCells.setdefault(ppCell["parameterName"], []).append((ppCell.get("targetCategory"), cell, ppCell))
+
+        pCells = self.xpath("pmml:ParamMatrix/pmml:PCell")
+
+        if functionName == "regression":
+            categories = [None]
+            rows = [0]
+
+        else:
+            categories = self._targetCategories(pCells)
+            if len(categories) < 2:
+                raise defs.PmmlValidationError("GeneralRegressionModel with modelType \"%s\" must have at least two target categories" % modelType)
+
+            if modelType == "ordinalMultinomial":
+                rows = range(len(categories) - 1)
+            else:
+                targeted = set(pCell.get("targetCategory") for pCell in pCells)
+                rows = [index for index, category in enumerate(categories) if category in targeted]
+
+        rowIndex = dict((categories[row], index) for index, row in enumerate(rows))
+        allRows = range(len(rows))
+
+        for cells in parameterCells.values():
+            for targetCategory, cell, ppCell in cells:
+                if targetCategory is not None and targetCategory not in rowIndex:
+                    raise defs.PmmlValidationError("PPCell targetCategory \"%s\" does not have a linear predictor in this model%s" % (targetCategory, ppCell.sourcelineAsString()))
+
+        entries = []
+        columnIndex = {}
+        columnCells = []
+        factorIndex = {}
+        factorValues = []
+
+        for pCell in pCells:
+            targetCategory = pCell.get("targetCategory")
+            if targetCategory is None:
+                affected = allRows
+            else:
+                try:
+                    affected = [rowIndex[targetCategory]]
+                except KeyError:
+                    raise defs.PmmlValidationError("PCell targetCategory \"%s\" does not have a linear predictor in this model%s" % (targetCategory, pCell.sourcelineAsString()))
+
+            try:
+                beta = float(pCell["beta"])
+            except ValueError:
+                raise defs.PmmlValidationError("PCell beta must be a number, not \"%s\"%s" % (pCell["beta"], pCell.sourcelineAsString()))
+
+            # PPCells with a targetCategory only belong to that category's linear predictor,
+            # so the affected rows are grouped by the cells that apply to them
+            groups = {}
+            for row in affected:
+                cells = tuple(sorted(cell for targetCategory, cell, ppCell in parameterCells.get(pCell["parameterName"], []) if targetCategory is None or rowIndex[targetCategory] == row))
+                groups.setdefault(cells, []).append(row)
+
+            for cells, groupRows in sorted(groups.items()):
+                if len(cells) == 0:
+                    entries.append((groupRows, "intercept", None, beta))
+
+                elif len(cells) == 1 and cells[0][1] is not None:
+                    fieldName, value, exponent = cells[0]
+                    if fieldName not in factorIndex:
+                        factorIndex[fieldName] = (len(factorValues), {})
+                        factorValues.append((fieldName, []))
+                    index, values = factorIndex[fieldName]
+                    if value not in values:
+                        values[value] = len(values)
+                        factorValues[index][1].append(value)
+                    entries.append((groupRows, "factor", (index, values[value]), beta))
+
+                else:
+                    if cells not in columnIndex:
+                        columnIndex[cells] = len(columnCells)
+                        columnCells.append(cells)
+                    entries.append((groupRows, "column", columnIndex[cells], beta))
+
+        plan = self._Plan()
+        plan.modelType = modelType
+        plan.categories = categories
+        plan.rows = rows
+        plan.intercepts = NP("zeros", len(rows), dtype=NP.dtype(float))
+        plan.columns = columnCells
+        plan.matrix = NP("zeros", (len(rows), len(columnCells)), dtype=NP.dtype(float))
+        plan.factors = [(fieldName, values, NP("zeros", (len(rows), len(values) + 1), dtype=NP.dtype(float))) for fieldName, values in factorValues]
+
+        for affected, kind, index, beta in entries:
+            if kind == "intercept":
+                plan.intercepts[affected] += beta
+            elif kind == "factor":
+                plan.factors[index[0]][2][affected, index[1]] += beta
+            else:
+                plan.matrix[affected, index] += beta
+
+        plan.fields = set()
+        for cells in plan.columns:
+            plan.fields.update(fieldName for fieldName, value, exponent in cells)
+        for fieldName, values, coefficients in plan.factors:
+            plan.fields.add(fieldName)
+
+        plan.offsetVariable = self.get("offsetVariable")
+        plan.offsetValue = float(self.get("offsetValue", 0.0))
+        plan.trialsVariable = self.get("trialsVariable")
+        plan.trialsValue = self.get("trialsValue")
+        if plan.trialsValue is not None:
+            plan.trialsValue = float(plan.trialsValue)
+        for fieldName in plan.offsetVariable, plan.trialsVariable:
+            if fieldName is not None:
+                plan.fields.add(fieldName)
+
+        plan.link = self.get("linkFunction")
+        plan.linkParameter = self.get("linkParameter")
+        if plan.linkParameter is not None:
+            plan.linkParameter = float(plan.linkParameter)
+        plan.distParameter = self.get("distParameter")
+        if plan.distParameter is not None:
+            plan.distParameter = float(plan.distParameter)
+        plan.cumulativeLink = self.get("cumulativeLink")
+
+        if plan.link in ("oddspower", "power") and plan.linkParameter is None:
+            raise defs.PmmlValidationError("GeneralRegressionModel linkFunction \"%s\" requires a linkParameter" % plan.link)
+        if plan.link == "negbin" and plan.distParameter is None:
+            raise defs.PmmlValidationError("GeneralRegressionModel linkFunction \"negbin\" requires a distParameter")
+
+        plan.probability = len(self.xpath("pmml:Output/pmml:OutputField[@feature='probability']")) > 0
+
+        return plan
+
+    def calculateScore(self, dataTable, functionTable, performanceTable):
+        """Calculate the score of this model.
+
+        This method is called by C{calculate} to separate operations
+        that are performed by all models (in C{calculate}) from
+        operations that are performed by specific models (in
+        C{calculateScore}).
+
+        @type subTable: DataTable
+        @param subTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: A DataColumn containing the score.
+        """
+
+        performanceTable.begin("GeneralRegressionModel")
+
+        performanceTable.begin("set up")
+        plan = self.plan()
+        performanceTable.end("set up")
+
+        performanceTable.begin("linear predictors")
+        linear = self._linearPredictors(plan, dataTable)
+        performanceTable.end("linear predictors")
+
+        scoreMask = None
+        for fieldName in plan.fields:
+            mask = dataTable.fields[fieldName].mask
+            if mask is not None:
+                if scoreMask is None:
+                    scoreMask = NP("array", mask, dtype=defs.maskType)
+                else:
+                    NP("maximum", scoreMask, mask, scoreMask)
+        if scoreMask is not None and not scoreMask.any():
+            scoreMask = None
+
+        performanceTable.begin("link function")
+
+        if plan.modelType == "generalizedLinear":
+            if plan.offsetVariable is not None:
+                linear[0] += dataTable.fields[plan.offsetVariable].data
+            elif plan.offsetValue != 0.0:
+                linear[0] += plan.offsetValue
+
+            self._inverseLink(plan.link, linear[0], plan.linkParameter, plan.distParameter)
+
+            if plan.trialsVariable is not None:
+                linear[0] *= dataTable.fields[plan.trialsVariable].data
+            elif plan.trialsValue is not None:
+                linear[0] *= plan.trialsValue
+
+            result = linear
+
+        elif plan.modelType == "multinomialLogistic":
+            if len(plan.rows) == len(plan.categories):
+                result = linear
+            else:
+                result = NP("zeros", (len(plan.categories), len(dataTable)), dtype=NP.dtype(float))
+                result[plan.rows] = linear
+            result -= NP("amax", result, axis=0)
+            NP("exp", result, result)
+            result /= NP("sum", result, axis=0)
+
+        elif plan.modelType == "ordinalMultinomial":
+            self._inverseLink(plan.cumulativeLink, linear, None, None)
+            result = NP("empty", (len(plan.categories), len(dataTable)), dtype=NP.dtype(float))
+            result[0] = linear[0]
+            NP("subtract", linear[1:], linear[:-1], result[1:-1])
+            NP("subtract", 1.0, linear[-1], result[-1])
+
+        else:
+            result = linear
+
+        performanceTable.end("link function")
+
+        performanceTable.begin("set scores")
+        score = {}
+
+        if self["functionName"] == "regression":
+            score[None] = DataColumn(FakeFieldType("double", "continuous"), result[0], scoreMask)
+
+        else:
+            fieldType = FakeFieldType("string", "categorical")
+            categories = NP("array", [fieldType.stringToValue(category) for category in plan.categories], dtype=fieldType.dtype)
+            best = NP("argmax", result, axis=0)
+            score[None] = DataColumn(fieldType, categories[best], scoreMask)
+
+            if self.subFields["probability"] or plan.probability:
+                fieldType = FakeFieldType("double", "continuous")
+                score["probability"] = DataColumn(fieldType, result[best, NP("arange", len(dataTable))], scoreMask)
+                for index, category in enumerate(plan.categories):
+                    score["probability.%s" % category] = DataColumn(fieldType, result[index], scoreMask)
+
+        performanceTable.end("set scores")
+        performanceTable.end("GeneralRegressionModel")
+        return score
+
+    def _linearPredictors(self, plan, dataTable):
+        """Compute the linear predictor (before the link function) of
+        each row of the ParamMatrix.
+
+        @type plan: GeneralRegressionModel._Plan
+        @param plan: The compiled PPMatrix and ParamMatrix.
+        @type dataTable: DataTable
+        @param dataTable: The DataTable representing this model's lexical scope.
+        @rtype: 2d Numpy array
+        @return: One row per entry in C{plan.rows}, one column per row of C{dataTable}.
+        """
+
+        length = len(dataTable)
+        linear = NP("empty", (len(plan.rows), length), dtype=NP.dtype(float))
+        linear[:] = plan.intercepts[:,NP.newaxis]
+
+        columns = []
+        active = []
+        for index, cells in enumerate(plan.columns):
+            resolved = []
+            for fieldName, value, exponent in cells:
+                dataColumn = dataTable.fields[fieldName]
+                if value is not None:
+                    try:
+                        value = dataColumn.fieldType.stringToValue(value)
+                    except (ValueError, TypeError):
+                        break                                # this category can never match; the term is zero
+                resolved.append((dataColumn.data, value, exponent))
+            else:
+                columns.append(resolved)
+                active.append(index)
+
+        matrix = plan.matrix[:,active]
+        numberOfColumns = len(columns)
+
+        if numberOfColumns == 0:
+            pass
+
+        elif len(plan.rows) == 1:
+            term = NP("empty", length, dtype=NP.dtype(float))
+            for cells, coefficient in zip(columns, matrix[0]):
+                self._fillTerm(term, cells, 0, length)
+                term *= coefficient
+                linear[0] += term
+
+        else:
+            blockSize = max(1, min(length, self.blockSize // numberOfColumns))
+            design = NP("empty", (numberOfColumns, blockSize), dtype=NP.dtype(float))   # each design column is a contiguous row
+            for start in xrange(0, length, blockSize):
+                stop = min(start + blockSize, length)
+                x = design[:,:stop - start]
+                for index, cells in enumerate(columns):
+                    self._fillTerm(x[index], cells, start, stop)
+                linear[:,start:stop] += NP("dot", matrix, x)
+
+        for fieldName, values, coefficients in plan.factors:
+            dataColumn = dataTable.fields[fieldName]
+            keys = []
+            rows = []
+            for index, value in enumerate(values):
+                try:
+                    keys.append(dataColumn.fieldType.stringToValue(value))
+                except (ValueError, TypeError):
+                    pass
+                else:
+                    rows.append(index)
+            if len(keys) > 0:
+                keys = NP("array", keys, dtype=dataColumn.fieldType.dtype)
+                order = NP("argsort", keys, kind="mergesort")
+                rows = NP("append", NP("array", rows, dtype=NP.dtype(int))[order], len(values))
+                keys = keys[order]
+
+                data = dataColumn.data
+                position = NP("searchsorted", keys, data)
+                NP("minimum", position, len(keys) - 1, position)
+                position[NP(keys[position] != data)] = len(keys)
+                linear += coefficients[:,rows[position]]
+
+        return linear
+
+    @staticmethod
+    def _fillTerm(out, cells, start, stop):
+        """Fill a row of the design matrix with the product of
+        covariate powers and factor indicators.
+
+        @type out: 1d Numpy array
+        @param out: The row to fill, with length C{stop - start}.
+        @type cells: list of (1d Numpy array, value, exponent)
+        @param cells: The data for each PPCell, with the internal value of the category for factors (exponent is None) or the exponent for covariates (value is None).
+        @type start: int
+        @param start: First row of the fields to use.
+        @type stop: int
+        @param stop: Last row (exclusive) of the fields to use.
+        """
+
+        for index, (data, value, exponent) in enumerate(cells):
+            x = data[start:stop]
+            if exponent is None:
+                x = NP(x == value)
+            elif exponent != 1.0:
+                x = NP("power", x, exponent)
+            if index == 0:
+                out[:] = x
+            else:
+                out *= x
+
+    @staticmethod
+    def _inverseLink(link, y, linkParameter, distParameter):
+        """Apply the inverse of a link function in place.
+
+        @type link: string
+        @param link: The PMML linkFunction or cumulativeLink.
+        @type y: Numpy array
+        @param y: Linear predictors, overwritten with the mean response.
+        @type linkParameter: number or None
+        @param linkParameter: Parameter of the "oddspower" and "power" links.
+        @type distParameter: number or None
+        @param distParameter: Parameter of the "negbin" link.
+        @raise PmmlValidationError: If the link function is not supported.
+        """
+
+        if link == "identity":
+            pass
+
+        elif link == "log":
+            NP("exp", y, y)
+
+        elif link == "logc":
+            NP("expm1", y, y)
+            NP("negative", y, y)
+
+        elif link == "logit" or (link == "oddspower" and linkParameter == 0.0):
+            NP("negative", y, y)
+            NP("exp", y, y)
+            y += 1.0
+            NP("reciprocal", y, y)
+
+        elif link == "oddspower":
+            y *= linkParameter
+            y += 1.0
+            NP("power", y, -1.0/linkParameter, y)
+            y += 1.0
+            NP("reciprocal", y, y)
+
+        elif link == "power":
+            if linkParameter == 0.0:
+                NP("exp", y, y)
+            else:
+                NP("power", y, 1.0/linkParameter, y)
+
+        elif link == "negbin":
+            NP("negative", y, y)
+            NP("expm1", y, y)
+            y *= distParameter
+            NP("reciprocal", y, y)
+
+        elif link == "probit":
+            y *= 1.0/math.sqrt(2.0)
+            y[:] = erf(y)
+            y += 1.0
+            y *= 0.5
+
+        elif link == "cloglog":
+            NP("exp", y, y)
+            NP("negative", y, y)
+            NP("expm1", y, y)
+            NP("negative", y, y)
+
+        elif link == "loglog":
+            NP("negative", y, y)
+            NP("exp", y, y)
+            NP("negative", y, y)
+            NP("exp", y, y)
+
+        elif link == "cauchit":
+            NP("arctan", y, y)
+            y *= 1.0/math.pi
+            y += 0.5
+
+        else:
+            raise defs.PmmlValidationError("GeneralRegressionModel link function \"%s\" is not supported" % link)
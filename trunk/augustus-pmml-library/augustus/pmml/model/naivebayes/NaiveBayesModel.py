@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the NaiveBayesModel class."""
+
+from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP
+from augustus.core.PmmlModel import PmmlModel
+from augustus.core.FakeFieldType import FakeFieldType
+from augustus.core.FieldType import FieldType
+from augustus.core.DataColumn import DataColumn
+from augustus.pmml.DerivedField import DerivedField
+
+class NaiveBayesModel(PmmlModel):
+    """NaiveBayesModel implements naive Bayes classifiers in PMML,
+    which multiply the conditional probabilities of each input given
+    each target category.
+
+    U{PMML specification<http://www.dmg.org/v4-1/NaiveBayes.html>}.
+
+    The BayesInputs are compiled once into a table of
+    log-probabilities with one row per target category and one column
+    per (input, value) pair, plus one column of zeros per input for
+    missing or unrecognized values (which PMML ignores).  Zero counts
+    are replaced by the model's threshold.  A DataTable is scored by
+    converting each input to column indexes in this table and summing
+    the gathered log-probabilities, which does not underflow when
+    there are many inputs.  Continuous inputs are discretized by the
+    BayesInput's DerivedField.
+
+    @type subFields: dict
+    @param subFields: To globally turn on the calculation of "probability" (the probability of the predicted category and "probability.CATEGORY" for each category), set C{subFields["probability"]} to True.  It is also turned on by any OutputField with feature="probability".
+    @type blockSize: int
+    @param blockSize: Maximum number of elements (rows times inputs) in each block of the calculation, which bounds its working memory.
+    @type denseLookupSize: int
+    @param denseLookupSize: Inputs with integer internal values (including categorical strings) whose PairCounts values span at most this range are converted to column indexes with a direct lookup table, rather than a binary search.
+    """
+
+    subFields = {"probability": False}
+    blockSize = 1048576
+    denseLookupSize = 65536
+    scoreType = FakeFieldType("string", "categorical")
+
+    class _Plan(object):
+        """Compiled form of the BayesInputs and BayesOutput."""
+        pass
+
+    def plan(self):
+        """Return the compiled BayesInputs and BayesOutput, building
+        them on first use.
+
+        @rtype: NaiveBayesModel._Plan
+        @return: An object with the following attributes: C{categories} (target category strings), C{logPriors} (1d array of log target counts), C{inputs} (list of (fieldName, DerivedField or None, its FieldType or None, value strings, offset of the first column in C{table})), C{table} (2d array of log-probabilities with one row per category), and C{probability} (whether probabilities are requested by an OutputField).
+        @raise PmmlValidationError: If the counts are inconsistent.
+        """
+
+        return self.cached("plan", self._compile)
+
+    def _compile(self):
+        if self["functionName"] != "classification":
+            raise defs.PmmlValidationError("NaiveBayesModel functionName may only be \"classification\", not \"%s\"" % self["functionName"])
+
+        threshold = float(self["threshold"])
+
+        categories = []
+        targetCounts = []
+        for targetValueCount in self.xpath("pmml:BayesOutput/pmml:TargetValueCounts/pmml:TargetValueCount"):
+            if targetValueCount["value"] in categories:
+                raise defs.PmmlValidationError("BayesOutput has more than one TargetValueCount for \"%s\"%s" % (targetValueCount["value"], targetValueCount.sourcelineAsString()))
+            categories.append(targetValueCount["value"])
+            targetCounts.append(float(targetValueCount["count"]))
+
+        categoryIndex = dict((category, index) for index, category in enumerate(categories))
+        targetCounts = NP("array", targetCounts, dtype=NP.dtype(float))
+        if (targetCounts < 0.0).any():
+            raise defs.PmmlValidationError("BayesOutput TargetValueCounts must be non-negative")
+
+        plan = self._Plan()
+        plan.categories = categories
+        plan.logPriors = NP("log", targetCounts)
+        plan.inputs = []
+
+        blocks = []
+        offset = 0
+        for bayesInput in self.xpath("pmml:BayesInputs/pmml:BayesInput"):
+            pairCounts = bayesInput.childrenOfTag("PairCounts")
+            values = [pairCount["value"] for pairCount in pairCounts]
+
+            counts = NP("zeros", (len(categories), len(values) + 1), dtype=NP.dtype(float))
+            for index, pairCount in enumerate(pairCounts):
+                for targetValueCount in pairCount.xpath("pmml:TargetValueCounts/pmml:TargetValueCount"):
+                    try:
+                        counts[categoryIndex[targetValueCount["value"]], index] += float(targetValueCount["count"])
+                    except KeyError:
+                        raise defs.PmmlValidationError("TargetValueCount \"%s\" is not a category in the BayesOutput%s" % (targetValueCount["value"], targetValueCount.sourcelineAsString()))
+
+            probabilities = NP(counts / targetCounts[:,NP.newaxis])
+            probabilities[NP(probabilities <= 0.0)] = threshold
+            probabilities[NP(targetCounts == 0.0), :] = 1.0        # these categories already have zero prior probability
+            probabilities[:,-1] = 1.0                              # missing or unrecognized values are ignored
+            blocks.append(NP("log", probabilities))
+
+            derivedField = bayesInput.childOfClass(DerivedField)
+            if derivedField is None:
+                fieldType = None
+            else:
+                fieldType = FieldType(derivedField)
+            plan.inputs.append((bayesInput["fieldName"], derivedField, fieldType, values, offset))
+            offset += len(values) + 1
+
+        if len(blocks) > 0:
+            plan.table = NP("hstack", blocks)
+        else:
+            plan.table = NP("zeros", (len(categories), 0), dtype=NP.dtype(float))
+
+        plan.probability = len(self.xpath("pmml:Output/pmml:OutputField[@feature='probability']")) > 0
+
+        return plan
+
+    def calculateScore(self, dataTable, functionTable, performanceTable):
+        """Calculate the score of this model.
+
+        This method is called by C{calculate} to separate operations
+        that are performed by all models (in C{calculate}) from
+        operations that are performed by specific models (in
+        C{calculateScore}).
+
+        @type subTable: DataTable
+        @param subTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: A DataColumn containing the score.
+        """
+
+        performanceTable.begin("NaiveBayesModel")
+
+        performanceTable.begin("set up")
+        plan = self.plan()
+        length = len(dataTable)
+
+        inputs = []
+        for fieldName, derivedField, fieldType, values, offset in plan.inputs:
+            if derivedField is None:
+                dataColumn = dataTable.fields[fieldName]
+            else:
+                # nested DerivedFields are usually unnamed, so they are not added to the DataTable
+                performanceTable.pause("set up")
+                dataColumn = derivedField.evaluate(dataTable, functionTable, performanceTable, fieldType)
+                performanceTable.unpause("set up")
+
+            keys = []
+            columns = []
+            for index, value in enumerate(values):
+                try:
+                    keys.append(dataColumn.fieldType.stringToValue(value))
+                except (ValueError, TypeError):
+                    pass
+                else:
+                    columns.append(offset + index)
+
+            if len(keys) > 0:
+                keys = NP("array", keys, dtype=dataColumn.fieldType.dtype)
+                order = NP("argsort", keys, kind="mergesort")
+                keys = keys[order]
+                columns = NP("append", NP("array", columns, dtype=NP.dtype(int))[order], offset + len(values))
+
+                if keys.dtype.kind in "iu" and keys[-1] - keys[0] < self.denseLookupSize:
+                    low = keys[0]
+                    span = int(keys[-1] - low) + 1
+                    lookup = NP("empty", span + 2, dtype=NP.dtype(int))   # one extra slot on each side for values out of range
+                    lookup[:] = columns[-1]
+                    lookup[NP(keys - low) + 1] = columns[:-1]
+                    inputs.append((dataColumn, None, (low, span, lookup), columns[-1]))
+                else:
+                    inputs.append((dataColumn, keys, columns, columns[-1]))
+
+        performanceTable.end("set up")
+
+        performanceTable.begin("log-likelihood")
+        logLikelihood = NP("empty", (len(plan.categories), length), dtype=NP.dtype(float))
+        logLikelihood[:] = plan.logPriors[:,NP.newaxis]
+
+        if len(inputs) > 0:
+            blockSize = max(1, min(length, self.blockSize // len(inputs)))
+            codes = NP("empty", (len(inputs), blockSize), dtype=NP.dtype(int))
+
+            for start in xrange(0, length, blockSize):
+                stop = min(start + blockSize, length)
+                block = codes[:,:stop - start]
+
+                for index, (dataColumn, keys, columns, ignored) in enumerate(inputs):
+                    data = dataColumn.data[start:stop]
+                    if keys is None:
+                        low, span, lookup = columns
+                        position = NP("subtract", data, low)
+                        NP("clip", position, -1, span, position)
+                        position += 1
+                        NP("take", lookup, position, out=block[index])
+                    else:
+                        position = NP("searchsorted", keys, data)
+                        NP("minimum", position, len(keys) - 1, position)
+                        position[NP(keys[position] != data)] = len(keys)
+                        NP("take", columns, position, out=block[index])
+                    if dataColumn.mask is not None:
+                        block[index][NP(dataColumn.mask[start:stop] != defs.VALID)] = ignored
+
+                logLikelihood[:,start:stop] += NP("sum", NP("take", plan.table, block, axis=1), axis=1)
+
+        performanceTable.end("log-likelihood")
+
+        performanceTable.begin("normalization")
+        probabilities = logLikelihood
+        probabilities -= NP("amax", probabilities, axis=0)
+        NP("exp", probabilities, probabilities)
+        probabilities /= NP("sum", probabilities, axis=0)
+        performanceTable.end("normalization")
+
+        performanceTable.begin("set scores")
+        score = {}
+
+        fieldType = FakeFieldType("string", "categorical")
+        categories = NP("array", [fieldType.stringToValue(category) for category in plan.categories], dtype=fieldType.dtype)
+        best = NP("argmax", probabilities, axis=0)
+        score[None] = DataColumn(fieldType, categories[best], None)
+
+        if self.subFields["probability"] or plan.probability:
+            fieldType = FakeFieldType("double", "continuous")
+            score["probability"] = DataColumn(fieldType, probabilities[best, NP("arange", length)], None)
+            for index, category in enumerate(plan.categories):
+                score["probability.%s" % category] = DataColumn(fieldType, probabilities[index], None)
+
+        performanceTable.end("set scores")
+        performanceTable.end("NaiveBayesModel")
+        return score
@@ -0,0 +1,566 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the NearestNeighborModel class."""
+
+from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP
+from augustus.core.PmmlModel import PmmlModel
+from augustus.core.TableInterface import TableInterface
+from augustus.core.FakeFieldType import FakeFieldType
+from augustus.core.DataColumn import DataColumn
+from augustus.pmml.model.clustering.ComparisonMeasure import ComparisonMeasure
+from augustus.pmml.model.clustering.PmmlClusteringMetric import PmmlClusteringMetric
+from augustus.pmml.model.clustering.PmmlClusteringMetricBinary import PmmlClusteringMetricBinary
+
+class NearestNeighborModel(PmmlModel):
+    """NearestNeighborModel implements k-nearest neighbor models in
+    PMML, which score each row with the targets of the k most similar
+    TrainingInstances.
+
+    U{PMML specification<http://www.dmg.org/v4-1/KNN.html>}.
+
+    The TrainingInstances are read once into arrays.  If the metric
+    is euclidean, squaredEuclidean, cityBlock, chebychev, or
+    minkowski and every KNNInput is compared with absDiff, a KD-tree
+    is also built: the instances are split at the median of their
+    widest (weighted) dimension into leaves of at most C{leafSize}
+    instances, each with a bounding box.  A block of query rows is
+    answered by visiting each row's leaves in order of their distance
+    lower bound, all rows at once, until no unvisited leaf can contain
+    a closer instance than the k-th found so far.  Other metrics and
+    compare functions are answered by exhaustive search.  In both
+    cases, the distances of the neighbors are computed by the same
+    ComparisonMeasure metrics as ClusteringModel.  Binary similarity
+    metrics (jaccard, tanimoto, simpleMatching, and binarySimilarity)
+    count the KNNInputs that are 1 or 0 in the query and in each
+    instance, as in ClusteringModel; they ignore compare functions and
+    field weights.
+
+    The index can be written to a file with C{saveIndex} and restored
+    with C{loadIndex} to skip rebuilding it when a large model is
+    loaded again.
+
+    Continuous targets are scored by average, median, or
+    weightedAverage (weights 1/(distance + threshold)) of the
+    neighbors' values; categorical targets by majorityVote or
+    weightedMajorityVote, with ties going to the category that
+    appears first in the TrainingInstances.  With a similarity
+    measure, the weights are the similarities.  Rows with an invalid
+    or missing input are scored as missing.  OutputFields with
+    feature="entityId" or "entityAffinity" and a rank report the
+    instanceIdVariable (or 1-based instance number) and distance of
+    the neighbor of that rank.
+
+    @type blockSize: int
+    @param blockSize: Maximum number of elements (query rows times instances, leaves, or leaf elements) in each block of the search, which bounds its working memory.
+    @type leafSize: int
+    @param leafSize: Maximum number of TrainingInstances in a leaf of the KD-tree.
+    @type leafBatch: int
+    @param leafBatch: Number of leaves visited at a time by each query that has not yet finished.
+    """
+
+    blockSize = 1048576
+    leafSize = 64
+    leafBatch = 4
+
+    _kdMetrics = {"euclidean": 2.0, "squaredEuclidean": 2.0, "cityBlock": 1.0, "chebychev": None, "minkowski": None}
+
+    @property
+    def scoreType(self):
+        if self.get("functionName") == "regression":
+            return FakeFieldType("double", "continuous")
+        else:
+            return FakeFieldType("string", "categorical")
+
+    class _Plan(object):
+        """Compiled form of the TrainingInstances and KNNInputs."""
+        pass
+
+    class _Index(object):
+        """KD-tree over the TrainingInstances."""
+        pass
+
+    class _State(object):
+        """State of a ComparisonMeasure metric calculation."""
+        pass
+
+    def plan(self):
+        """Return the compiled model, building it on first use.
+
+        @rtype: NearestNeighborModel._Plan
+        @return: An object with the following attributes: C{fields} (KNNInput field names), C{weights} (1d array of fieldWeights), C{compareFunctions}, C{metric} (PmmlClusteringMetric), C{similarity} (whether larger values are closer), C{power} (exponent of the KD-tree distance, or None for chebychev), C{numberOfNeighbors}, C{training} (list of lists of value strings, one per KNNInput), C{points} (2d array of numeric instances, or None), C{targets} (1d array of floats, or of category indexes for classification), C{categories}, C{ids} (list of strings), C{index} (NearestNeighborModel._Index or None), and C{ranks} (deepest rank requested by an OutputField).
+        @raise PmmlValidationError: If the model is not well-formed.
+        """
+
+        return self.cached("plan", self._compile)
+
+    def _compile(self):
+        plan = self._Plan()
+
+        comparisonMeasure = self.childOfClass(ComparisonMeasure)
+        plan.metric = comparisonMeasure.childOfClass(PmmlClusteringMetric)
+        if plan.metric is None:
+            plan.metric = comparisonMeasure.childOfClass(PmmlClusteringMetricBinary)
+        plan.similarity = comparisonMeasure.get("kind") == "similarity"
+        defaultCompareFunction = comparisonMeasure.get("compareFunction", defaultFromXsd=True)
+
+        knnInputs = self.xpath("pmml:KNNInputs/pmml:KNNInput")
+        plan.fields = [knnInput["field"] for knnInput in knnInputs]
+        plan.weights = NP("array", [float(knnInput.get("fieldWeight", 1.0)) for knnInput in knnInputs], dtype=NP.dtype(float))
+        plan.compareFunctions = [knnInput.get("compareFunction", defaultCompareFunction) for knnInput in knnInputs]
+        for compareFunction in plan.compareFunctions:
+            if compareFunction not in ("absDiff", "delta", "equal"):
+                raise defs.PmmlValidationError("KNNInput compareFunction \"%s\" is not supported, since a KNNInput cannot have a similarityScale or Comparisons matrix" % compareFunction)
+
+        plan.numberOfNeighbors = int(self["numberOfNeighbors"])
+        if plan.numberOfNeighbors < 1:
+            raise defs.PmmlValidationError("numberOfNeighbors must be at least 1, not %d" % plan.numberOfNeighbors)
+
+        trainingInstances = self.childOfTag("TrainingInstances")
+        columns = dict((instanceField["field"], instanceField.get("column", instanceField["field"])) for instanceField in trainingInstances.xpath("pmml:InstanceFields/pmml:InstanceField"))
+        rows = list(trainingInstances.childOfClass(TableInterface).iterate())
+        if len(rows) == 0:
+            raise defs.PmmlValidationError("TrainingInstances must have at least one row")
+
+        def column(fieldName):
+            if fieldName not in columns:
+                raise defs.PmmlValidationError("No InstanceField for field \"%s\"" % fieldName)
+            try:
+                return [row[columns[fieldName]] for row in rows]
+            except KeyError:
+                raise defs.PmmlValidationError("TrainingInstances are missing column \"%s\"" % columns[fieldName])
+
+        plan.training = [column(fieldName) for fieldName in plan.fields]
+
+        predicted = self.xpath("pmml:MiningSchema/pmml:MiningField[@usageType='predicted' or @usageType='target']")
+        if len(predicted) != 1:
+            raise defs.PmmlValidationError("NearestNeighborModel requires exactly one predicted MiningField, not %d" % len(predicted))
+        targets = column(predicted[0]["name"])
+
+        plan.categories = []
+        if self["functionName"] == "regression":
+            try:
+                plan.targets = NP("array", [float(x) for x in targets], dtype=NP.dtype(float))
+            except ValueError:
+                raise defs.PmmlValidationError("TrainingInstances of a regression NearestNeighborModel must have numerical targets")
+        elif self["functionName"] == "classification":
+            categoryIndex = {}
+            for target in targets:
+                if target not in categoryIndex:
+                    categoryIndex[target] = len(plan.categories)
+                    plan.categories.append(target)
+            plan.targets = NP("array", [categoryIndex[x] for x in targets], dtype=NP.dtype(int))
+        else:
+            raise defs.PmmlValidationError("NearestNeighborModel functionName may only be \"classification\" or \"regression\", not \"%s\"" % self["functionName"])
+
+        instanceIdVariable = self.get("instanceIdVariable")
+        if instanceIdVariable is None:
+            plan.ids = ["%d" % (index + 1) for index in xrange(len(rows))]
+        else:
+            plan.ids = column(instanceIdVariable)
+
+        plan.points = None
+        plan.power = None
+        plan.index = None
+        if plan.metric.t in self._kdMetrics and not plan.similarity and all(x == "absDiff" for x in plan.compareFunctions):
+            try:
+                plan.points = NP("array", plan.training, dtype=NP.dtype(float)).T
+            except ValueError:
+                raise defs.PmmlValidationError("KNNInputs compared with absDiff must have numerical TrainingInstances")
+
+            if plan.metric.t == "minkowski":
+                plan.power = plan.metric.get("p-parameter", convertType=True)
+            else:
+                plan.power = self._kdMetrics[plan.metric.t]
+            plan.index = self._buildIndex(plan)
+
+        plan.ranks = 0
+        for outputField in self.xpath("pmml:Output/pmml:OutputField[@feature='entityId' or @feature='entityAffinity']"):
+            plan.ranks = max(plan.ranks, int(outputField.get("rank", defaultFromXsd=True)))
+
+        return plan
+
+    def _buildIndex(self, plan):
+        """Build a KD-tree over the numeric TrainingInstances.
+
+        @type plan: NearestNeighborModel._Plan
+        @param plan: The compiled model, with C{points} and C{power}.
+        @rtype: NearestNeighborModel._Index
+        @return: An object with the following attributes: C{leaves} (2d array of instance indexes with one row per leaf, padded with -1), C{low} and C{high} (2d arrays of the leaf bounding boxes).
+        """
+
+        points = plan.points
+        if plan.power is None:
+            scale = plan.weights
+        else:
+            scale = NP("power", plan.weights, 1.0 / plan.power)
+
+        leaves = []
+        stack = [NP("arange", len(points))]
+        while len(stack) > 0:
+            indexes = stack.pop()
+            if len(indexes) <= self.leafSize:
+                leaves.append(indexes)
+                continue
+
+            subset = points[indexes]
+            spread = NP(NP(NP("amax", subset, axis=0) - NP("amin", subset, axis=0)) * scale)
+            dimension = NP("argmax", spread)
+            half = len(indexes) // 2
+            order = NP("argpartition", subset[:,dimension], half)
+            stack.append(indexes[order[half:]])
+            stack.append(indexes[order[:half]])
+
+        index = self._Index()
+        index.leaves = NP("empty", (len(leaves), self.leafSize), dtype=NP.dtype(int))
+        index.leaves[:] = -1
+        index.low = NP("empty", (len(leaves), points.shape[1]), dtype=NP.dtype(float))
+        index.high = NP("empty", (len(leaves), points.shape[1]), dtype=NP.dtype(float))
+        for leaf, indexes in enumerate(leaves):
+            index.leaves[leaf,:len(indexes)] = indexes
+            index.low[leaf] = NP("amin", points[indexes], axis=0)
+            index.high[leaf] = NP("amax", points[indexes], axis=0)
+        return index
+
+    def saveIndex(self, fileName):
+        """Write the KD-tree to a file, so that it does not need to be
+        rebuilt the next time this model is loaded.
+
+        @type fileName: string
+        @param fileName: Name of the file (Numpy C{.npz} format).
+        @raise ValueError: If this model does not use a KD-tree.
+        """
+
+        plan = self.plan()
+        if plan.index is None:
+            raise ValueError("This NearestNeighborModel does not use a KD-tree (the metric or compareFunctions do not support one)")
+        NP("savez", fileName, leaves=plan.index.leaves, low=plan.index.low, high=plan.index.high)
+
+    def loadIndex(self, fileName):
+        """Replace the KD-tree with one previously written by
+        C{saveIndex}.
+
+        @type fileName: string
+        @param fileName: Name of the file (Numpy C{.npz} format).
+        @raise ValueError: If this model does not use a KD-tree or the file does not match its TrainingInstances.
+        """
+
+        plan = self.plan()
+        if plan.index is None:
+            raise ValueError("This NearestNeighborModel does not use a KD-tree (the metric or compareFunctions do not support one)")
+
+        arrays = NP("load", fileName)
+        index = self._Index()
+        index.leaves = arrays["leaves"]
+        index.low = arrays["low"]
+        index.high = arrays["high"]
+
+        numberOfInstances, numberOfFields = plan.points.shape
+        members = index.leaves[NP(index.leaves >= 0)]
+        if index.low.shape != (len(index.leaves), numberOfFields) or index.high.shape != index.low.shape or len(members) != numberOfInstances or not NP(NP("sort", members) == NP("arange", numberOfInstances)).all():
+            raise ValueError("KD-tree in \"%s\" does not match this model's TrainingInstances" % fileName)
+        for leaf in xrange(len(index.leaves)):
+            indexes = index.leaves[leaf][NP(index.leaves[leaf] >= 0)]
+            if len(indexes) > 0 and (NP(plan.points[indexes] < index.low[leaf]).any() or NP(plan.points[indexes] > index.high[leaf]).any()):
+                raise ValueError("KD-tree in \"%s\" does not match this model's TrainingInstances" % fileName)
+
+        plan.index = index
+
+    def _aggregate(self, plan, displacements):
+        """Combine per-field absolute displacements into a distance
+        that is monotonic with the metric.
+
+        @type plan: NearestNeighborModel._Plan
+        @param plan: The compiled model.
+        @type displacements: Numpy array
+        @param displacements: Absolute displacements or lower bounds, with fields along the last axis.  This array is modified.
+        @rtype: Numpy array
+        @return: Weighted sum of powers (or maximum, for chebychev) over the last axis.
+        """
+
+        if plan.power is None:
+            displacements *= plan.weights
+            return NP("amax", displacements, axis=-1)
+        else:
+            if plan.power == 2.0:
+                NP("multiply", displacements, displacements, displacements)
+            elif plan.power != 1.0:
+                NP("power", displacements, plan.power, displacements)
+            return NP("dot", displacements, plan.weights)
+
+    def _searchIndex(self, plan, queries, numberOfNeighbors):
+        """Find the nearest TrainingInstances with the KD-tree.
+
+        @type plan: NearestNeighborModel._Plan
+        @param plan: The compiled model.
+        @type queries: 2d Numpy array
+        @param queries: Input values with one row per query and one column per KNNInput.
+        @type numberOfNeighbors: int
+        @param numberOfNeighbors: The number of neighbors to find.
+        @rtype: 2d Numpy array
+        @return: Instance indexes with one row per query, in no particular order.
+        """
+
+        index = plan.index
+        numberOfQueries = len(queries)
+        numberOfLeaves, leafSize = index.leaves.shape
+        rows = NP("arange", numberOfQueries)[:,NP.newaxis]
+
+        gaps = NP("maximum", NP(index.low[NP.newaxis,:,:] - queries[:,NP.newaxis,:]), NP(queries[:,NP.newaxis,:] - index.high[NP.newaxis,:,:]))
+        NP("maximum", gaps, 0.0, gaps)
+        allBounds = self._aggregate(plan, gaps)
+        del gaps
+
+        # most queries finish within their nearest few leaves, so only those are sorted unless more are needed
+        sortedLeaves = min(numberOfLeaves, 8 * self.leafBatch)
+        if sortedLeaves < numberOfLeaves:
+            order = NP("argpartition", allBounds, sortedLeaves - 1, axis=1)[:,:sortedLeaves]
+            order = order[rows, NP("argsort", allBounds[rows, order], axis=1)]
+        else:
+            order = NP("argsort", allBounds, axis=1)
+        bounds = allBounds[rows, order]
+
+        bestDistances = NP("empty", (numberOfQueries, numberOfNeighbors), dtype=NP.dtype(float))
+        bestDistances[:] = NP.inf
+        bestIndexes = NP("zeros", (numberOfQueries, numberOfNeighbors), dtype=NP.dtype(int))
+        kth = NP("empty", numberOfQueries, dtype=NP.dtype(float))
+        kth[:] = NP.inf
+
+        for rank in xrange(0, numberOfLeaves, self.leafBatch):
+            if rank >= order.shape[1]:
+                allBounds[rows, order] = -NP.inf       # leaves already visited stay in front
+                order = NP("argsort", allBounds, axis=1)
+                bounds = allBounds[rows, order]
+
+            active = NP("nonzero", NP(bounds[:,rank] <= kth))[0]
+            if len(active) == 0:
+                break
+
+            members = index.leaves[order[active, rank:rank + self.leafBatch]].reshape(len(active), -1)
+            displacements = NP("absolute", NP(plan.points[members] - queries[active][:,NP.newaxis,:]))
+            distances = self._aggregate(plan, displacements)
+            distances[NP(members < 0)] = NP.inf
+
+            candidates = NP("concatenate", (bestDistances[active], distances), axis=1)
+            candidateIndexes = NP("concatenate", (bestIndexes[active], members), axis=1)
+            keep = NP("argpartition", candidates, numberOfNeighbors - 1, axis=1)[:,:numberOfNeighbors]
+            within = NP("arange", len(active))[:,NP.newaxis]
+            bestDistances[active] = candidates[within, keep]
+            bestIndexes[active] = candidateIndexes[within, keep]
+            kth[active] = NP("amax", bestDistances[active], axis=1)
+
+        return bestIndexes
+
+    def _metricDistances(self, plan, queries, neighbors, training):
+        """Compute distances between queries and TrainingInstances
+        with the ComparisonMeasure metric.
+
+        @type plan: NearestNeighborModel._Plan
+        @param plan: The compiled model.
+        @type queries: list of 1d Numpy arrays
+        @param queries: Input values, one array per KNNInput.
+        @type neighbors: 2d Numpy array
+        @param neighbors: Instance indexes with one row per query.
+        @type training: list of 1d Numpy arrays
+        @param training: TrainingInstance values, one array per KNNInput.
+        @rtype: 2d Numpy array
+        @return: Distances (or similarities) with the shape of C{neighbors}.
+        """
+
+        shape = neighbors.shape
+        state = self._State()
+        plan.metric.initialize(state, shape[0] * shape[1], len(queries), False)
+
+        binary = isinstance(plan.metric, PmmlClusteringMetricBinary)
+
+        for query, values, compareFunction, fieldWeight in zip(queries, training, plan.compareFunctions, plan.weights):
+            x = query[:,NP.newaxis]
+            y = values[neighbors]
+            if binary:
+                data1 = NP(x == 1)
+                data0 = NP(x == 0)
+                instance1 = NP(y == 1)
+                instance0 = NP(y == 0)
+                state.a11 += NP("logical_and", data1, instance1).reshape(-1)
+                state.a10 += NP("logical_and", data1, instance0).reshape(-1)
+                state.a01 += NP("logical_and", data0, instance1).reshape(-1)
+                state.a00 += NP("logical_and", data0, instance0).reshape(-1)
+                continue
+
+            if compareFunction == "absDiff":
+                cxy = NP("absolute", NP(x - y))
+            elif compareFunction == "delta":
+                cxy = NP(NP(x != y) * 1.0)
+            else:
+                cxy = NP(NP(x == y) * 1.0)
+            plan.metric.accumulate(state, cxy.reshape(-1), fieldWeight, False)
+
+        return plan.metric.finalizeDistance(state, None, False, None).reshape(shape)
+
+    def calculateScore(self, dataTable, functionTable, performanceTable):
+        """Calculate the score of this model.
+
+        This method is called by C{calculate} to separate operations
+        that are performed by all models (in C{calculate}) from
+        operations that are performed by specific models (in
+        C{calculateScore}).
+
+        @type subTable: DataTable
+        @param subTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: A DataColumn containing the score.
+        """
+
+        performanceTable.begin("NearestNeighborModel")
+
+        performanceTable.begin("set up")
+        plan = self.plan()
+        length = len(dataTable)
+        numberOfInstances = len(plan.targets)
+        numberOfNeighbors = min(plan.numberOfNeighbors, numberOfInstances)
+
+        queries = []
+        training = []
+        scoreMask = None
+        for fieldName, values in zip(plan.fields, plan.training):
+            dataColumn = dataTable.fields[fieldName]
+            data = dataColumn.data
+            if dataColumn.mask is not None:
+                invalid = NP(dataColumn.mask != defs.VALID)
+                if invalid.any():
+                    data = NP("copy", data)
+                    data[invalid] = data[NP("argmin", invalid)] if not invalid.all() else 0
+                    if scoreMask is None:
+                        scoreMask = NP(invalid * defs.MISSING)
+                    else:
+                        NP("maximum", scoreMask, NP(invalid * defs.MISSING), scoreMask)
+            queries.append(data)
+
+            if plan.points is None:
+                try:
+                    training.append(NP("array", [dataColumn.fieldType.stringToValue(x) for x in values], dtype=dataColumn.fieldType.dtype))
+                except (ValueError, TypeError):
+                    raise defs.PmmlValidationError("TrainingInstances for field \"%s\" cannot be converted to %r" % (fieldName, dataColumn.fieldType))
+
+        if plan.points is not None:
+            training = [plan.points[:,index] for index in xrange(len(plan.fields))]
+        performanceTable.end("set up")
+
+        neighbors = NP("empty", (length, numberOfNeighbors), dtype=NP.dtype(int))
+        distances = NP("empty", (length, numberOfNeighbors), dtype=NP.dtype(float))
+
+        if plan.index is not None:
+            performanceTable.begin("KD-tree search")
+            numberOfLeaves, leafSize = plan.index.leaves.shape
+            blockSize = max(1, min(length, self.blockSize // (max(numberOfLeaves, leafSize + numberOfNeighbors) * max(len(plan.fields), 1))))
+            for start in xrange(0, length, blockSize):
+                stop = min(start + blockSize, length)
+                block = NP("empty", (stop - start, len(plan.fields)), dtype=NP.dtype(float))
+                for index, data in enumerate(queries):
+                    block[:,index] = data[start:stop]
+                neighbors[start:stop] = self._searchIndex(plan, block, numberOfNeighbors)
+            performanceTable.end("KD-tree search")
+
+        else:
+            performanceTable.begin("exhaustive search")
+            blockSize = max(1, min(length, self.blockSize // numberOfInstances))
+            everything = NP("arange", numberOfInstances)
+            for start in xrange(0, length, blockSize):
+                stop = min(start + blockSize, length)
+                candidates = NP("empty", (stop - start, numberOfInstances), dtype=NP.dtype(int))
+                candidates[:] = everything
+                values = self._metricDistances(plan, [data[start:stop] for data in queries], candidates, training)
+                if plan.similarity:
+                    NP("negative", values, values)
+                if numberOfNeighbors < numberOfInstances:
+                    neighbors[start:stop] = NP("argpartition", values, numberOfNeighbors - 1, axis=1)[:,:numberOfNeighbors]
+                else:
+                    neighbors[start:stop] = candidates
+            performanceTable.end("exhaustive search")
+
+        performanceTable.begin(plan.metric.t)
+        for start in xrange(0, length, max(1, self.blockSize // numberOfNeighbors)):
+            stop = min(start + max(1, self.blockSize // numberOfNeighbors), length)
+            distances[start:stop] = self._metricDistances(plan, [data[start:stop] for data in queries], neighbors[start:stop], training)
+
+        rows = NP("arange", length)[:,NP.newaxis]
+        if plan.similarity:
+            order = NP("argsort", NP("negative", distances), axis=1, kind="mergesort")
+        else:
+            order = NP("argsort", distances, axis=1, kind="mergesort")
+        neighbors = neighbors[rows, order]
+        distances = distances[rows, order]
+        performanceTable.end(plan.metric.t)
+
+        performanceTable.begin("set scores")
+        if self.get("continuousScoringMethod", defaultFromXsd=True) == "weightedAverage" or self.get("categoricalScoringMethod", defaultFromXsd=True) == "weightedMajorityVote":
+            if plan.similarity:
+                weights = distances
+            else:
+                weights = NP(1.0 / NP(distances + float(self.get("threshold", defaultFromXsd=True))))
+
+        score = {}
+        targets = plan.targets[neighbors]
+
+        if self["functionName"] == "regression":
+            continuousScoringMethod = self.get("continuousScoringMethod", defaultFromXsd=True)
+            if continuousScoringMethod == "average":
+                data = NP("mean", targets, axis=1)
+            elif continuousScoringMethod == "median":
+                data = NP("median", targets, axis=1)
+            else:
+                data = NP(NP("sum", NP(targets * weights), axis=1) / NP("sum", weights, axis=1))
+            score[None] = DataColumn(FakeFieldType("double", "continuous"), data, scoreMask)
+
+        else:
+            votes = NP("zeros", (len(plan.categories), length), dtype=NP.dtype(float))
+            columns = NP("arange", length)
+            for rank in xrange(numberOfNeighbors):
+                if self.get("categoricalScoringMethod", defaultFromXsd=True) == "weightedMajorityVote":
+                    votes[targets[:,rank], columns] += weights[:,rank]
+                else:
+                    votes[targets[:,rank], columns] += 1.0
+
+            fieldType = FakeFieldType("string", "categorical")
+            categories = NP("array", [fieldType.stringToValue(category) for category in plan.categories], dtype=fieldType.dtype)
+            score[None] = DataColumn(fieldType, categories[NP("argmax", votes, axis=0)], scoreMask)
+
+        if plan.ranks > 0:
+            fieldType = FakeFieldType("string", "categorical")
+            ids = NP("array", [fieldType.stringToValue(x) for x in plan.ids], dtype=fieldType.dtype)
+            missing = NP(NP("ones", length, dtype=defs.maskType) * defs.MISSING)
+            for rank in xrange(plan.ranks):
+                if rank < numberOfNeighbors:
+                    score["entityId.%d" % (rank + 1)] = DataColumn(fieldType, ids[neighbors[:,rank]], scoreMask)
+                    score["entityAffinity.%d" % (rank + 1)] = DataColumn(FakeFieldType("double", "continuous"), distances[:,rank], scoreMask)
+                else:
+                    score["entityId.%d" % (rank + 1)] = DataColumn(fieldType, NP("zeros", length, dtype=fieldType.dtype), missing)
+                    score["entityAffinity.%d" % (rank + 1)] = DataColumn(FakeFieldType("double", "continuous"), NP("zeros", length, dtype=NP.dtype(float)), missing)
+            score["entityId"] = score["entityId.1"]
+            score["entityAffinity"] = score["entityAffinity.1"]
+
+        performanceTable.end("set scores")
+        performanceTable.end("NearestNeighborModel")
+        return score
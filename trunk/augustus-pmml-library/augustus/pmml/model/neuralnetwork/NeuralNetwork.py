@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the NeuralNetwork class."""
+
+import math
+
+from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP
+from augustus.core.PmmlModel import PmmlModel
+from augustus.core.PmmlExpression import PmmlExpression
+from augustus.core.FakeFieldType import FakeFieldType
+from augustus.core.FieldType import FieldType
+from augustus.core.DataColumn import DataColumn
+from augustus.pmml.DerivedField import DerivedField
+
+class NeuralNetwork(PmmlModel):
+    """NeuralNetwork implements feed-forward neural networks in PMML.
+
+    U{PMML specification<http://www.dmg.org/v4-1/NeuralNetwork.html>}.
+
+    The NeuralLayers are compiled once into dense weight matrices and
+    bias vectors, with one matrix for each layer (or earlier layer,
+    if a Con skips over layers) that feeds a given layer.  NeuralInputs
+    are evaluated by their DerivedFields, so NormContinuous and
+    NormDiscrete have their usual meaning.  The forward pass is a
+    sequence of matrix products on blocks of rows, with neurons
+    along the first axis.
+
+    A NeuralOutput whose DerivedField is a NormDiscrete gives the
+    probability of one target category; a FieldRef or NormContinuous
+    gives the predicted value of a continuous target (NormContinuous
+    is inverted, extrapolating linearly beyond the outermost
+    LinearNorms).  Rows with an invalid or missing input are scored
+    as missing.
+
+    @type subFields: dict
+    @param subFields: To globally turn on the calculation of "probability" (the probability of the predicted category and "probability.CATEGORY" for each category), set C{subFields["probability"]} to True.  It is also turned on by any OutputField with feature="probability".
+    @type blockSize: int
+    @param blockSize: Maximum number of elements (rows times neurons, summed over all layers) in each block of the forward pass, which bounds its working memory.
+    """
+
+    subFields = {"probability": False}
+    blockSize = 1048576
+
+    @property
+    def scoreType(self):
+        if self.get("functionName") == "regression":
+            return FakeFieldType("double", "continuous")
+        else:
+            return FakeFieldType("string", "categorical")
+
+    class _Plan(object):
+        """Compiled form of the network."""
+        pass
+
+    class _Layer(object):
+        """Compiled form of one NeuralLayer."""
+        pass
+
+    def plan(self):
+        """Return the compiled network, building it on first use.
+
+        @rtype: NeuralNetwork._Plan
+        @return: An object with the following attributes: C{inputs} (list of (NeuralInput id, DerivedField, its FieldType), one per input neuron), C{layers} (list of NeuralNetwork._Layer), C{numberOfNeurons} (total over inputs and layers), C{target} (name of the target field), C{outputs} (list of (layer index, neuron index) of the output neurons, where layer 0 is the inputs), C{categories} (target categories for classification, in the order of C{outputs}), C{inverse} (C{orig}, C{norm} arrays of the NormContinuous to invert for regression, or None), and C{probability} (whether probabilities are requested by an OutputField).
+        @raise PmmlValidationError: If the network is not well-formed.
+        """
+
+        return self.cached("plan", self._compile)
+
+    def _compile(self):
+        plan = self._Plan()
+        neurons = {}
+
+        plan.inputs = []
+        for neuralInput in self.xpath("pmml:NeuralInputs/pmml:NeuralInput"):
+            if neuralInput["id"] in neurons:
+                raise defs.PmmlValidationError("Neuron id \"%s\" is not unique%s" % (neuralInput["id"], neuralInput.sourcelineAsString()))
+            neurons[neuralInput["id"]] = (0, len(plan.inputs))
+            derivedField = neuralInput.childOfClass(DerivedField)
+            plan.inputs.append((neuralInput["id"], derivedField, FieldType(derivedField)))
+
+        activationFunction = self["activationFunction"]
+        threshold = float(self.get("threshold", 0.0))
+        width = self.get("width")
+        altitude = float(self.get("altitude", 1.0))
+        normalizationMethod = self.get("normalizationMethod", "none")
+        sizes = [len(plan.inputs)]
+
+        plan.layers = []
+        for layerIndex, neuralLayer in enumerate(self.childrenOfTag("NeuralLayer")):
+            layer = self._Layer()
+            layer.activationFunction = neuralLayer.get("activationFunction", activationFunction)
+            layer.threshold = float(neuralLayer.get("threshold", threshold))
+            layer.normalizationMethod = neuralLayer.get("normalizationMethod", normalizationMethod)
+            layerWidth = neuralLayer.get("width", width)
+            layerAltitude = float(neuralLayer.get("altitude", altitude))
+
+            neuronsInLayer = neuralLayer.childrenOfTag("Neuron")
+            size = len(neuronsInLayer)
+            idsInLayer = set()
+            for neuron in neuronsInLayer:
+                if neuron["id"] in neurons or neuron["id"] in idsInLayer:
+                    raise defs.PmmlValidationError("Neuron id \"%s\" is not unique%s" % (neuron["id"], neuron.sourcelineAsString()))
+                idsInLayer.add(neuron["id"])
+
+            weights = {}
+            layer.bias = NP("zeros", size, dtype=NP.dtype(float))
+            layer.width = NP("ones", size, dtype=NP.dtype(float))
+            layer.logAltitude = NP("zeros", size, dtype=NP.dtype(float))
+            fanIn = NP("zeros", size, dtype=NP.dtype(float))
+
+            for index, neuron in enumerate(neuronsInLayer):
+                layer.bias[index] = float(neuron.get("bias", 0.0))
+
+                for con in neuron.childrenOfTag("Con"):
+                    try:
+                        source, sourceIndex = neurons[con["from"]]
+                    except KeyError:
+                        raise defs.PmmlValidationError("Con refers to unknown or later neuron \"%s\"%s" % (con["from"], con.sourcelineAsString()))
+                    if source not in weights:
+                        weights[source] = (NP("zeros", (size, sizes[source]), dtype=NP.dtype(float)), NP("zeros", (size, sizes[source]), dtype=NP.dtype(float)))
+                    weights[source][0][index, sourceIndex] += float(con["weight"])
+                    weights[source][1][index, sourceIndex] = 1.0
+                    fanIn[index] += 1.0
+
+                if layer.activationFunction == "radialBasis":
+                    neuronWidth = neuron.get("width", layerWidth)
+                    if neuronWidth is None:
+                        raise defs.PmmlValidationError("Neuron with radialBasis activation requires a width (on the Neuron, NeuralLayer, or NeuralNetwork)%s" % neuron.sourcelineAsString())
+                    layer.width[index] = float(neuronWidth)
+                    layer.logAltitude[index] = fanIn[index] * math.log(float(neuron.get("altitude", layerAltitude)))
+
+            if layer.activationFunction == "radialBasis":
+                # ||a - w||^2 over the connected inputs = C.(a^2) - 2 W.a + sum of W^2
+                layer.bias = NP("zeros", size, dtype=NP.dtype(float))
+                layer.sources = []
+                for source, (matrix, connected) in sorted(weights.items()):
+                    layer.bias += NP("sum", NP(matrix**2), axis=1)
+                    layer.sources.append((source, NP(-2.0 * matrix), connected))
+                layer.scale = NP(1.0 / NP(2.0 * NP(layer.width**2)))
+            else:
+                layer.sources = [(source, matrix, None) for source, (matrix, connected) in sorted(weights.items())]
+
+            layerNumber = layerIndex + 1
+            for index, neuron in enumerate(neuronsInLayer):
+                neurons[neuron["id"]] = (layerNumber, index)
+            sizes.append(size)
+            plan.layers.append(layer)
+
+        if len(plan.layers) == 0:
+            raise defs.PmmlValidationError("NeuralNetwork must have at least one NeuralLayer")
+        plan.numberOfNeurons = sum(sizes)
+
+        predicted = self.xpath("pmml:MiningSchema/pmml:MiningField[@usageType='predicted' or @usageType='target']")
+        plan.target = predicted[0]["name"] if len(predicted) > 0 else None
+
+        plan.outputs = []
+        plan.categories = []
+        plan.inverse = None
+        for neuralOutput in self.xpath("pmml:NeuralOutputs/pmml:NeuralOutput"):
+            expression = neuralOutput.childOfClass(DerivedField).childOfClass(PmmlExpression)
+            if expression.t not in ("NormDiscrete", "NormContinuous", "FieldRef"):
+                raise defs.PmmlValidationError("NeuralOutput with %s is not supported; only NormDiscrete, NormContinuous, and FieldRef are%s" % (expression.t, neuralOutput.sourcelineAsString()))
+
+            if plan.target is None:
+                plan.target = expression["field"]
+            if expression["field"] != plan.target:
+                continue
+
+            try:
+                plan.outputs.append(neurons[neuralOutput["outputNeuron"]])
+            except KeyError:
+                raise defs.PmmlValidationError("NeuralOutput refers to unknown neuron \"%s\"%s" % (neuralOutput["outputNeuron"], neuralOutput.sourcelineAsString()))
+
+            if self["functionName"] == "classification":
+                if expression.t != "NormDiscrete":
+                    raise defs.PmmlValidationError("NeuralOutputs of a classification NeuralNetwork must be NormDiscrete, not %s%s" % (expression.t, neuralOutput.sourcelineAsString()))
+                plan.categories.append(expression["value"])
+            else:
+                if expression.t == "NormDiscrete":
+                    raise defs.PmmlValidationError("NeuralOutputs of a regression NeuralNetwork must be FieldRef or NormContinuous, not NormDiscrete%s" % neuralOutput.sourcelineAsString())
+                if expression.t == "NormContinuous":
+                    plan.inverse = expression.knots()
+
+        if self["functionName"] == "classification":
+            if len(plan.outputs) == 0:
+                raise defs.PmmlValidationError("NeuralNetwork has no NeuralOutputs for the target field")
+        elif self["functionName"] == "regression":
+            if len(plan.outputs) != 1:
+                raise defs.PmmlValidationError("Regression NeuralNetwork must have exactly one NeuralOutput for the target field, not %d" % len(plan.outputs))
+        else:
+            raise defs.PmmlValidationError("NeuralNetwork functionName may only be \"classification\" or \"regression\", not \"%s\"" % self["functionName"])
+
+        plan.probability = any(outputField.get("feature") == "probability" for outputField in self.xpath("pmml:Output/pmml:OutputField"))
+
+        return plan
+
+    @staticmethod
+    def _activate(layer, z):
+        """Apply a layer's activation function and normalization in
+        place.
+
+        @type layer: NeuralNetwork._Layer
+        @param layer: The compiled layer.
+        @type z: 2d Numpy array
+        @param z: Net input, with one row per neuron; for radialBasis, the squared distance divided by 2 width^2.
+        """
+
+        activationFunction = layer.activationFunction
+
+        if activationFunction == "threshold":
+            z[:] = NP(z > layer.threshold)
+        elif activationFunction == "logistic":
+            NP("negative", z, z)
+            NP("minimum", z, 700.0, z)              # exp(-z) would overflow for z < -709
+            NP("exp", z, z)
+            z += 1.0
+            NP("reciprocal", z, z)
+        elif activationFunction == "tanh":
+            NP("tanh", z, z)
+        elif activationFunction == "identity":
+            pass
+        elif activationFunction == "exponential":
+            NP("exp", z, z)
+        elif activationFunction == "reciprocal":
+            NP("reciprocal", z, z)
+        elif activationFunction == "square":
+            NP("multiply", z, z, z)
+        elif activationFunction == "Gauss":
+            NP("multiply", z, z, z)
+            NP("negative", z, z)
+            NP("exp", z, z)
+        elif activationFunction == "sine":
+            NP("sin", z, z)
+        elif activationFunction == "cosine":
+            NP("cos", z, z)
+        elif activationFunction == "Elliott":
+            z /= NP(NP("absolute", z) + 1.0)
+        elif activationFunction == "arctan":
+            NP("arctan", z, z)
+            z *= 2.0 / math.pi
+        elif activationFunction == "radialBasis":
+            NP("subtract", layer.logAltitude[:,NP.newaxis], z, z)
+            NP("exp", z, z)
+        else:
+            raise defs.PmmlValidationError("Unrecognized activationFunction: \"%s\"" % activationFunction)
+
+        if layer.normalizationMethod == "softmax":
+            z -= NP("amax", z, axis=0)
+            NP("exp", z, z)
+            z /= NP("sum", z, axis=0)
+        elif layer.normalizationMethod == "simplemax":
+            z /= NP("sum", z, axis=0)
+        elif layer.normalizationMethod != "none":
+            raise defs.PmmlValidationError("Unrecognized normalizationMethod: \"%s\"" % layer.normalizationMethod)
+
+    def calculateScore(self, dataTable, functionTable, performanceTable):
+        """Calculate the score of this model.
+
+        This method is called by C{calculate} to separate operations
+        that are performed by all models (in C{calculate}) from
+        operations that are performed by specific models (in
+        C{calculateScore}).
+
+        @type subTable: DataTable
+        @param subTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: A DataColumn containing the score.
+        """
+
+        performanceTable.begin("NeuralNetwork")
+
+        performanceTable.begin("set up")
+        plan = self.plan()
+        length = len(dataTable)
+
+        inputs = []
+        scoreMask = None
+        for neuronId, derivedField, fieldType in plan.inputs:
+            # NeuralInput DerivedFields are usually unnamed, so they are not added to the DataTable
+            performanceTable.pause("set up")
+            dataColumn = derivedField.evaluate(dataTable, functionTable, performanceTable, fieldType)
+            performanceTable.unpause("set up")
+
+            if dataColumn.fieldType.dataType in ("object", "string", "boolean"):
+                raise defs.PmmlValidationError("The DerivedField of NeuralInput \"%s\" must be numeric, not %s" % (neuronId, dataColumn.fieldType.dataType))
+            inputs.append(dataColumn.data)
+
+            if dataColumn.mask is not None:
+                if scoreMask is None:
+                    scoreMask = NP(NP(dataColumn.mask != defs.VALID) * defs.MISSING)
+                else:
+                    NP("maximum", scoreMask, NP(NP(dataColumn.mask != defs.VALID) * defs.MISSING), scoreMask)
+
+        if scoreMask is not None and not scoreMask.any():
+            scoreMask = None
+        performanceTable.end("set up")
+
+        performanceTable.begin("forward pass")
+        outputs = NP("empty", (len(plan.outputs), length), dtype=NP.dtype(float))
+
+        blockSize = max(1, min(length, self.blockSize // plan.numberOfNeurons))
+        for start in xrange(0, length, blockSize):
+            stop = min(start + blockSize, length)
+
+            activations = [NP("empty", (len(inputs), stop - start), dtype=NP.dtype(float))]
+            for index, data in enumerate(inputs):
+                activations[0][index] = data[start:stop]
+
+            for layer in plan.layers:
+                z = NP("empty", (len(layer.bias), stop - start), dtype=NP.dtype(float))
+                z[:] = layer.bias[:,NP.newaxis]
+                for source, matrix, connected in layer.sources:
+                    z += NP("dot", matrix, activations[source])
+                    if connected is not None:
+                        z += NP("dot", connected, NP(activations[source]**2))
+                if layer.activationFunction == "radialBasis":
+                    z *= layer.scale[:,NP.newaxis]
+
+                self._activate(layer, z)
+                activations.append(z)
+
+            for index, (source, neuron) in enumerate(plan.outputs):
+                outputs[index,start:stop] = activations[source][neuron]
+
+        performanceTable.end("forward pass")
+
+        performanceTable.begin("set scores")
+        score = {}
+
+        if self["functionName"] == "regression":
+            data = outputs[0]
+            if plan.inverse is not None:
+                orig, norm = plan.inverse
+                data = self._invert(data, orig, norm)
+            score[None] = DataColumn(FakeFieldType("double", "continuous"), data, scoreMask)
+
+        else:
+            fieldType = FakeFieldType("string", "categorical")
+            categories = NP("array", [fieldType.stringToValue(category) for category in plan.categories], dtype=fieldType.dtype)
+            best = NP("argmax", outputs, axis=0)
+            score[None] = DataColumn(fieldType, categories[best], scoreMask)
+
+            if self.subFields["probability"] or plan.probability:
+                fieldType = FakeFieldType("double", "continuous")
+                score["probability"] = DataColumn(fieldType, outputs[best, NP("arange", length)], scoreMask)
+                for index, category in enumerate(plan.categories):
+                    score["probability.%s" % category] = DataColumn(fieldType, outputs[index], scoreMask)
+
+        performanceTable.end("set scores")
+        performanceTable.end("NeuralNetwork")
+        return score
+
+    @staticmethod
+    def _invert(data, orig, norm):
+        """Invert a NormContinuous transformation, extrapolating
+        linearly beyond the first and last LinearNorms.
+
+        @type data: 1d Numpy array
+        @param data: Normalized values.
+        @type orig: 1d Numpy array
+        @param orig: The C{orig} values of the LinearNorms, in increasing order.
+        @type norm: 1d Numpy array
+        @param norm: The corresponding C{norm} values, which must be monotonic.
+        @rtype: 1d Numpy array
+        @return: Values in the original scale.
+        @raise PmmlValidationError: If C{norm} is not monotonic.
+        """
+
+        steps = NP("diff", norm)
+        if (steps < 0.0).all():
+            orig = orig[::-1]
+            norm = norm[::-1]
+        elif not (steps > 0.0).all():
+            raise defs.PmmlValidationError("NormContinuous in a NeuralOutput must be strictly monotonic to be inverted")
+
+        result = NP("interp", data, norm, orig)
+
+        below = NP(data < norm[0])
+        if below.any():
+            slope = (orig[1] - orig[0]) / (norm[1] - norm[0])
+            result[below] = NP(NP(NP(data[below] - norm[0]) * slope) + orig[0])
+        above = NP(data > norm[-1])
+        if above.any():
+            slope = (orig[-1] - orig[-2]) / (norm[-1] - norm[-2])
+            result[above] = NP(NP(NP(data[above] - norm[-1]) * slope) + orig[-1])
+
+        return result
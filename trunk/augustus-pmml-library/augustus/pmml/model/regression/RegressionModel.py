@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the RegressionModel class."""
+
+import math
+
+from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP, erf
+from augustus.core.PmmlModel import PmmlModel
+from augustus.core.FakeFieldType import FakeFieldType
+from augustus.core.DataColumn import DataColumn
+
+class RegressionModel(PmmlModel):
+    """RegressionModel implements linear, polynomial, and logistic
+    regression models in PMML, which are sums of predictor terms
+    passed through a normalization function.
+
+    U{PMML specification<http://www.dmg.org/v4-1/Regression.html>}.
+
+    The RegressionTables are compiled once into a dense coefficient
+    matrix (one row per distinct numeric predictor or PredictorTerm,
+    one column per RegressionTable) and, for each categorical field,
+    a table of coefficients indexed by category.  A DataTable is then
+    scored with one matrix product per block of rows, a lookup for
+    each categorical field, and a vectorized normalization.
+
+    @type subFields: dict
+    @param subFields: To globally turn on the calculation of "probability" (the probability of the predicted category and "probability.CATEGORY" for each category), set C{subFields["probability"]} to True.  It is also turned on by any OutputField with feature="probability".
+    @type blockSize: int
+    @param blockSize: Maximum number of elements (rows times numeric predictors) in each block of the design matrix, which bounds the working memory of the calculation.
+    """
+
+    subFields = {"probability": False}
+    blockSize = 1048576
+
+    @property
+    def scoreType(self):
+        if self.get("functionName") == "classification":
+            return FakeFieldType("string", "categorical")
+        else:
+            return FakeFieldType("double", "continuous")
+
+    class _Plan(object):
+        """Compiled form of the RegressionTables."""
+        pass
+
+    def plan(self):
+        """Return the compiled RegressionTables, building them on
+        first use.
+
+        @rtype: RegressionModel._Plan
+        @return: An object with the following attributes: C{categories} (targetCategory strings, one per table), C{intercepts} (1d array), C{columns} (list of (fieldNames, exponent): one field name for a NumericPredictor, several for a PredictorTerm), C{matrix} (2d array with one row per table and one column per entry in C{columns}), C{categorical} (list of (fieldName, value strings, 2d array with one row per table and one column per value, plus a column of zeros)), C{fields} (all referenced field names), and C{probability} (whether probabilities are requested by an OutputField).
+        @raise PmmlValidationError: If the RegressionTables are inconsistent with the functionName or normalizationMethod.
+        """
+
+        return self.cached("plan", self._compile)
+
+    def _compile(self):
+        functionName = self["functionName"]
+        normalizationMethod = self.get("normalizationMethod", defaultFromXsd=True)
+        regressionTables = self.childrenOfTag("RegressionTable")
+
+        if functionName == "regression":
+            if len(regressionTables) != 1:
+                raise defs.PmmlValidationError("RegressionModel with functionName \"regression\" must have exactly one RegressionTable, not %d" % len(regressionTables))
+            if normalizationMethod == "simplemax":
+                raise defs.PmmlValidationError("RegressionModel with functionName \"regression\" cannot have normalizationMethod \"simplemax\"")
+
+        elif functionName == "classification":
+            if len(regressionTables) < 2:
+                raise defs.PmmlValidationError("RegressionModel with functionName \"classification\" must have at least two RegressionTables")
+            for regressionTable in regressionTables:
+                if regressionTable.get("targetCategory") is None:
+                    raise defs.PmmlValidationError("RegressionTables in a classification RegressionModel must have a targetCategory%s" % regressionTable.sourcelineAsString())
+
+        else:
+            raise defs.PmmlValidationError("RegressionModel functionName may only be \"classification\" or \"regression\", not \"%s\"" % functionName)
+
+        numberOfTables = len(regressionTables)
+        columnIndex = {}
+        columnRows = []
+        categoricalIndex = {}
+        categoricalRows = []
+
+        for tableIndex, regressionTable in enumerate(regressionTables):
+            for predictor in regressionTable.childrenOfTag("NumericPredictor"):
+                key = ((predictor["name"],), int(predictor.get("exponent", "1")))
+                if key not in columnIndex:
+                    columnIndex[key] = len(columnRows)
+                    columnRows.append(key)
+
+            for predictor in regressionTable.childrenOfTag("PredictorTerm"):
+                key = (tuple(fieldRef["field"] for fieldRef in predictor.childrenOfTag("FieldRef")), 1)
+                if key not in columnIndex:
+                    columnIndex[key] = len(columnRows)
+                    columnRows.append(key)
+
+            for predictor in regressionTable.childrenOfTag("CategoricalPredictor"):
+                fieldName = predictor["name"]
+                if fieldName not in categoricalIndex:
+                    categoricalIndex[fieldName] = (len(categoricalRows), {})
+                    categoricalRows.append((fieldName, []))
+                values = categoricalIndex[fieldName][1]
+                if predictor["value"] not in values:
+                    values[predictor["value"]] = len(values)
+                    categoricalRows[categoricalIndex[fieldName][0]][1].append(predictor["value"])
+
+        plan = self._Plan()
+        plan.normalizationMethod = normalizationMethod
+        plan.categories = [regressionTable.get("targetCategory") for regressionTable in regressionTables]
+        plan.intercepts = NP("empty", numberOfTables, dtype=NP.dtype(float))
+        plan.columns = columnRows
+        plan.matrix = NP("zeros", (numberOfTables, len(columnRows)), dtype=NP.dtype(float))
+        plan.categorical = [(fieldName, values, NP("zeros", (numberOfTables, len(values) + 1), dtype=NP.dtype(float))) for fieldName, values in categoricalRows]
+
+        for tableIndex, regressionTable in enumerate(regressionTables):
+            plan.intercepts[tableIndex] = float(regressionTable["intercept"])
+
+            for predictor in regressionTable.childrenOfTag("NumericPredictor"):
+                key = ((predictor["name"],), int(predictor.get("exponent", "1")))
+                plan.matrix[tableIndex, columnIndex[key]] += float(predictor["coefficient"])
+
+            for predictor in regressionTable.childrenOfTag("PredictorTerm"):
+                key = (tuple(fieldRef["field"] for fieldRef in predictor.childrenOfTag("FieldRef")), 1)
+                plan.matrix[tableIndex, columnIndex[key]] += float(predictor["coefficient"])
+
+            for predictor in regressionTable.childrenOfTag("CategoricalPredictor"):
+                index, values = categoricalIndex[predictor["name"]]
+                plan.categorical[index][2][tableIndex, values[predictor["value"]]] += float(predictor["coefficient"])
+
+        plan.fields = set()
+        for fieldNames, exponent in plan.columns:
+            plan.fields.update(fieldNames)
+        for fieldName, values, coefficients in plan.categorical:
+            plan.fields.add(fieldName)
+
+        plan.probability = len(self.xpath("pmml:Output/pmml:OutputField[@feature='probability']")) > 0
+
+        return plan
+
+    def calculateScore(self, dataTable, functionTable, performanceTable):
+        """Calculate the score of this model.
+
+        This method is called by C{calculate} to separate operations
+        that are performed by all models (in C{calculate}) from
+        operations that are performed by specific models (in
+        C{calculateScore}).
+
+        @type subTable: DataTable
+        @param subTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: A DataColumn containing the score.
+        """
+
+        performanceTable.begin("RegressionModel")
+
+        performanceTable.begin("set up")
+        plan = self.plan()
+        performanceTable.end("set up")
+
+        performanceTable.begin("linear predictors")
+        linear = self._linearPredictors(plan, dataTable)
+        performanceTable.end("linear predictors")
+
+        scoreMask = None
+        for fieldName in plan.fields:
+            mask = dataTable.fields[fieldName].mask
+            if mask is not None:
+                if scoreMask is None:
+                    scoreMask = NP("array", mask, dtype=defs.maskType)
+                else:
+                    NP("maximum", scoreMask, mask, scoreMask)
+        if scoreMask is not None and not scoreMask.any():
+            scoreMask = None
+
+        performanceTable.begin("normalization %s" % plan.normalizationMethod)
+        self._normalize(plan.normalizationMethod, linear, self["functionName"] == "classification")
+        performanceTable.end("normalization %s" % plan.normalizationMethod)
+
+        performanceTable.begin("set scores")
+        score = {}
+
+        if self["functionName"] == "regression":
+            score[None] = DataColumn(FakeFieldType("double", "continuous"), linear[0], scoreMask)
+
+        else:
+            fieldType = FakeFieldType("string", "categorical")
+            categories = NP("array", [fieldType.stringToValue(category) for category in plan.categories], dtype=fieldType.dtype)
+            best = NP("argmax", linear, axis=0)
+            score[None] = DataColumn(fieldType, categories[best], scoreMask)
+
+            if self.subFields["probability"] or plan.probability:
+                fieldType = FakeFieldType("double", "continuous")
+                score["probability"] = DataColumn(fieldType, linear[best, NP("arange", len(dataTable))], scoreMask)
+                for index, category in enumerate(plan.categories):
+                    score["probability.%s" % category] = DataColumn(fieldType, linear[index], scoreMask)
+
+        performanceTable.end("set scores")
+        performanceTable.end("RegressionModel")
+        return score
+
+    def _linearPredictors(self, plan, dataTable):
+        """Compute the un-normalized value of each RegressionTable.
+
+        @type plan: RegressionModel._Plan
+        @param plan: The compiled RegressionTables.
+        @type dataTable: DataTable
+        @param dataTable: The DataTable representing this model's lexical scope.
+        @rtype: 2d Numpy array
+        @return: One row per RegressionTable, one column per row of C{dataTable}.
+        """
+
+        length = len(dataTable)
+        numberOfColumns = len(plan.columns)
+        linear = NP("empty", (len(plan.intercepts), length), dtype=NP.dtype(float))
+        intercepts = plan.intercepts[:,NP.newaxis]
+
+        columns = [([dataTable.fields[fieldName].data for fieldName in fieldNames], exponent) for fieldNames, exponent in plan.columns]
+
+        lookups = []
+        for fieldName, values, coefficients in plan.categorical:
+            dataColumn = dataTable.fields[fieldName]
+            keys = []
+            rows = []
+            for index, value in enumerate(values):
+                try:
+                    keys.append(dataColumn.fieldType.stringToValue(value))
+                except (ValueError, TypeError):
+                    pass
+                else:
+                    rows.append(index)
+            if len(keys) > 0:
+                keys = NP("array", keys, dtype=dataColumn.fieldType.dtype)
+                order = NP("argsort", keys, kind="mergesort")
+                rows = NP("array", rows + [len(values)], dtype=NP.dtype(int))
+                lookups.append((dataColumn.data, keys[order], NP("append", rows[order], rows[-1]), coefficients))
+
+        if numberOfColumns == 0:
+            linear[:] = intercepts
+
+        elif len(plan.intercepts) == 1:
+            # a matrix-vector product would copy every predictor into the design
+            # matrix and read it back once; accumulating them directly is cheaper
+            linear[0] = plan.intercepts[0]
+            term = NP("empty", length, dtype=NP.dtype(float))
+            for (data, exponent), coefficient in zip(columns, plan.matrix[0]):
+                self._fillTerm(term, data, exponent, 0, length)
+                term *= coefficient
+                linear[0] += term
+
+        else:
+            blockSize = max(1, min(length, self.blockSize // numberOfColumns))
+            design = NP("empty", (numberOfColumns, blockSize), dtype=NP.dtype(float))   # each predictor is a contiguous row
+            for start in xrange(0, length, blockSize):
+                stop = min(start + blockSize, length)
+                x = design[:,:stop - start]
+                for index, (data, exponent) in enumerate(columns):
+                    self._fillTerm(x[index], data, exponent, start, stop)
+                block = linear[:,start:stop]
+                block[:] = NP("dot", plan.matrix, x)
+                block += intercepts
+
+        for data, keys, rows, coefficients in lookups:
+            position = NP("searchsorted", keys, data)
+            NP("minimum", position, len(keys) - 1, position)
+            position[NP(keys[position] != data)] = len(keys)
+            linear += coefficients[:,rows[position]]
+
+        return linear
+
+    @staticmethod
+    def _fillTerm(out, data, exponent, start, stop):
+        """Fill a row of the design matrix with one predictor.
+
+        @type out: 1d Numpy array
+        @param out: The row to fill, with length C{stop - start}.
+        @type data: list of 1d Numpy arrays
+        @param data: The fields that are multiplied together (just one for a NumericPredictor).
+        @type exponent: int
+        @param exponent: The power to which the product is raised.
+        @type start: int
+        @param start: First row of the fields to use.
+        @type stop: int
+        @param stop: Last row (exclusive) of the fields to use.
+        """
+
+        out[:] = data[0][start:stop]
+        for d in data[1:]:
+            out *= d[start:stop]
+        if exponent != 1:
+            NP("power", out, exponent, out)
+
+    def _normalize(self, normalizationMethod, linear, classification):
+        """Apply the normalizationMethod to the linear predictors in
+        place.
+
+        For regression, the single column is transformed by the
+        inverse link function.  For classification, "softmax" and
+        "simplemax" normalize across all tables; the other methods
+        transform all but the last table and assign the last table
+        one minus their sum.
+
+        @type normalizationMethod: string
+        @param normalizationMethod: The PMML normalizationMethod.
+        @type linear: 2d Numpy array
+        @param linear: Output of C{_linearPredictors}, overwritten with the normalized values.
+        @type classification: bool
+        @param classification: If True, normalize as probabilities of categories.
+        """
+
+        if classification and normalizationMethod == "softmax":
+            linear -= NP("amax", linear, axis=0)
+            NP("exp", linear, linear)
+            linear /= NP("sum", linear, axis=0)
+            return
+
+        if classification and normalizationMethod == "simplemax":
+            linear /= NP("sum", linear, axis=0)
+            return
+
+        if classification:
+            y = linear[:-1]
+        else:
+            y = linear
+
+        if normalizationMethod in ("softmax", "logit"):
+            NP("negative", y, y)
+            NP("exp", y, y)
+            y += 1.0
+            NP("reciprocal", y, y)
+
+        elif normalizationMethod == "probit":
+            y *= 1.0/math.sqrt(2.0)
+            y[:] = erf(y)
+            y += 1.0
+            y *= 0.5
+
+        elif normalizationMethod == "cloglog":
+            NP("exp", y, y)
+            NP("negative", y, y)
+            NP("expm1", y, y)
+            NP("negative", y, y)
+
+        elif normalizationMethod == "loglog":
+            NP("negative", y, y)
+            NP("exp", y, y)
+            NP("negative", y, y)
+            NP("exp", y, y)
+
+        elif normalizationMethod == "cauchit":
+            NP("arctan", y, y)
+            y *= 1.0/math.pi
+            y += 0.5
+
+        elif normalizationMethod == "exp":
+            NP("exp", y, y)
+
+        if classification:
+            linear[-1] = 1.0
+            linear[-1] -= NP("sum", y, axis=0)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the RuleSetModel class."""
+
+from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP
+from augustus.core.PmmlModel import PmmlModel
+from augustus.core.PmmlPredicate import PmmlPredicate
+from augustus.core.FakeFieldType import FakeFieldType
+from augustus.core.DataColumn import DataColumn
+from augustus.pmml.predicate.CompoundPredicate import CompoundPredicate
+
+class RuleSetModel(PmmlModel):
+    """RuleSetModel implements rule set models in PMML, which assign
+    a score based on which of a set of rules are true.
+
+    U{PMML specification<http://www.dmg.org/v4-1/RuleSet.html>}.
+
+    The rules are compiled once into a graph of distinct predicates:
+    predicates with the same structure (wherever they appear, including
+    inside CompoundPredicates and on CompoundRules) are evaluated only
+    once per DataTable.  A SimpleRule fires if its predicate and the
+    predicates of all enclosing CompoundRules are true (not false or
+    unknown).  The winning rule or score of each row is then chosen
+    with array operations on the matrix of fired rules, using the
+    first RuleSelectionMethod.
+
+    PMML 4.1 has no "confidence" output feature, so the confidence of
+    the winning rule (or, for weightedSum, the summed weight of the
+    winning score divided by the number of rules that fired) is
+    reported as "probability".
+
+    @type subFields: dict
+    @param subFields: To globally turn on the calculation of "probability" or "entityId" (the id of the winning rule, or its 1-based index in document order, for firstHit and weightedMax), set C{subFields["XXX"]} to True.  They are also turned on by OutputFields with these features.
+
+    @type blockSize: int
+    @param blockSize: Maximum number of elements (rows times rules) converted to floating point at a time for weightedSum, which bounds the working memory of the calculation.
+    """
+
+    subFields = {"probability": False, "entityId": False}
+    blockSize = 1048576
+
+    @property
+    def scoreType(self):
+        if self.get("functionName") == "regression":
+            return FakeFieldType("double", "continuous")
+        else:
+            return FakeFieldType("string", "categorical")
+
+    class _Plan(object):
+        """Compiled form of the RuleSet."""
+        pass
+
+    def plan(self):
+        """Return the compiled RuleSet, building it on first use.
+
+        @rtype: RuleSetModel._Plan
+        @return: An object with the following attributes: C{criterion} (the RuleSelectionMethod), C{nodes} (list of (PmmlPredicate, indexes of sub-predicate nodes or None), in evaluation order), C{gates} (list of (index of enclosing gate or None, node index): the conjunction of predicates down to a rule), C{ruleGates} (gate index of each SimpleRule), C{ruleOrder} (order of the rules in the matrix of fired rules: document order, or descending weight for weightedMax, so that the first rule to fire is the winner), C{scores} (distinct score strings, followed by the defaultScore if any), C{ruleScores}, C{weights}, C{confidences} (1d arrays, one per SimpleRule), C{ruleIds} (strings), C{defaultScore} (index in C{scores} or None), C{defaultConfidence}, and C{features} (set of subFields requested by OutputFields).
+        @raise PmmlValidationError: If the RuleSet is not well-formed.
+        """
+
+        return self.cached("plan", self._compile)
+
+    def _compile(self):
+        ruleSet = self.childOfTag("RuleSet")
+
+        plan = self._Plan()
+        plan.criterion = ruleSet.childrenOfTag("RuleSelectionMethod")[0]["criterion"]
+        if plan.criterion not in ("firstHit", "weightedMax", "weightedSum"):
+            raise defs.PmmlValidationError("Unrecognized RuleSelectionMethod criterion: \"%s\"" % plan.criterion)
+        plan.nodes = []
+        plan.gates = []
+        nodeIndex = {}
+        gateIndex = {}
+
+        def addNode(predicate):
+            key = predicate.structuralKey()
+            if key not in nodeIndex:
+                if isinstance(predicate, CompoundPredicate):
+                    children = [addNode(x) for x in predicate.childrenOfClass(PmmlPredicate)]
+                else:
+                    children = None
+                nodeIndex[key] = len(plan.nodes)
+                plan.nodes.append((predicate, children))
+            return nodeIndex[key]
+
+        rules = []
+        def addRules(parent, enclosingGate):
+            for rule in parent.iterchildren():
+                if not isinstance(rule.tag, basestring) or rule.t not in ("SimpleRule", "CompoundRule"):
+                    continue
+
+                predicate = rule.childOfClass(PmmlPredicate)
+                if predicate is None:
+                    raise defs.PmmlValidationError("%s must have a predicate%s" % (rule.t, rule.sourcelineAsString()))
+
+                key = (enclosingGate, addNode(predicate))
+                if key not in gateIndex:
+                    gateIndex[key] = len(plan.gates)
+                    plan.gates.append(key)
+
+                if rule.t == "SimpleRule":
+                    rules.append((gateIndex[key], rule))
+                else:
+                    addRules(rule, gateIndex[key])
+
+        addRules(ruleSet, None)
+
+        plan.ruleGates = [gate for gate, rule in rules]
+        plan.ruleIds = [rule.get("id", "%d" % (index + 1)) for index, (gate, rule) in enumerate(rules)]
+        plan.weights = NP("array", [float(rule.get("weight", 1.0)) for gate, rule in rules], dtype=NP.dtype(float))
+        plan.confidences = NP("array", [float(rule.get("confidence", 1.0)) for gate, rule in rules], dtype=NP.dtype(float))
+
+        if plan.criterion == "weightedMax":
+            plan.ruleOrder = NP("argsort", -plan.weights, kind="mergesort")   # stable: ties go to the first rule in the document
+        else:
+            plan.ruleOrder = NP("arange", len(rules))
+
+        plan.scores = []
+        scoreIndex = {}
+        for gate, rule in rules:
+            if rule["score"] not in scoreIndex:
+                scoreIndex[rule["score"]] = len(plan.scores)
+                plan.scores.append(rule["score"])
+        plan.ruleScores = NP("array", [scoreIndex[rule["score"]] for gate, rule in rules], dtype=NP.dtype(int))
+
+        defaultScore = ruleSet.get("defaultScore")
+        if defaultScore is None:
+            plan.defaultScore = None
+        else:
+            plan.defaultScore = len(plan.scores)
+            plan.scores.append(defaultScore)
+        plan.defaultConfidence = float(ruleSet.get("defaultConfidence", 0.0))
+
+        if self["functionName"] == "regression":
+            try:
+                [float(score) for score in plan.scores]
+            except ValueError:
+                raise defs.PmmlValidationError("RuleSetModel with functionName \"regression\" must have numerical scores")
+
+        plan.features = set(outputField.get("feature") for outputField in self.xpath("pmml:Output/pmml:OutputField"))
+
+        return plan
+
+    def calculateScore(self, dataTable, functionTable, performanceTable):
+        """Calculate the score of this model.
+
+        This method is called by C{calculate} to separate operations
+        that are performed by all models (in C{calculate}) from
+        operations that are performed by specific models (in
+        C{calculateScore}).
+
+        @type subTable: DataTable
+        @param subTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: A DataColumn containing the score.
+        """
+
+        performanceTable.begin("RuleSetModel")
+
+        performanceTable.begin("set up")
+        plan = self.plan()
+        length = len(dataTable)
+        performanceTable.end("set up")
+
+        fired = self._firedRules(plan, dataTable, functionTable, performanceTable)
+
+        performanceTable.begin(plan.criterion)
+
+        anyFired = NP("any", fired, axis=0)
+        numberOfRules = len(plan.ruleOrder)
+        winner = None
+
+        if numberOfRules == 0:
+            scores = NP("zeros", length, dtype=NP.dtype(int))
+            confidence = NP("zeros", length, dtype=NP.dtype(float))
+
+        elif plan.criterion in ("firstHit", "weightedMax"):
+            winner = plan.ruleOrder[NP("argmax", fired, axis=0)]
+            scores = plan.ruleScores[winner]
+            confidence = plan.confidences[winner]
+
+        else:
+            numberOfScores = len(plan.scores)
+            indicator = NP("zeros", (numberOfScores + 1, numberOfRules), dtype=NP.dtype(float))
+            indicator[plan.ruleScores[plan.ruleOrder], NP("arange", numberOfRules)] = plan.weights[plan.ruleOrder]
+            indicator[numberOfScores,:] = 1.0   # last row counts the rules that fired
+
+            scores = NP("empty", length, dtype=NP.dtype(int))
+            confidence = NP("empty", length, dtype=NP.dtype(float))
+
+            blockSize = max(1, min(length, self.blockSize // numberOfRules))
+            for start in xrange(0, length, blockSize):
+                stop = min(start + blockSize, length)
+                block = fired[:,start:stop].view(NP.uint8).astype(NP.dtype(float))   # much faster than casting from bool
+                totals = NP("dot", indicator, block)
+                best = NP("argmax", totals[:numberOfScores], axis=0)
+                numberFired = totals[numberOfScores]
+                NP("maximum", numberFired, 1.0, numberFired)
+                scores[start:stop] = best
+                confidence[start:stop] = NP(totals[best, NP("arange", stop - start)] / numberFired)
+
+        if anyFired.all():
+            scoreMask = None
+        else:
+            noneFired = NP("logical_not", anyFired)
+            if plan.defaultScore is None:
+                scoreMask = NP(noneFired * defs.MISSING)
+            else:
+                scoreMask = None
+                scores[noneFired] = plan.defaultScore
+                confidence[noneFired] = plan.defaultConfidence
+
+        performanceTable.end(plan.criterion)
+
+        performanceTable.begin("set scores")
+        score = {}
+
+        if self["functionName"] == "regression":
+            fieldType = FakeFieldType("double", "continuous")
+            values = NP("array", [float(x) for x in plan.scores], dtype=fieldType.dtype)
+        else:
+            fieldType = FakeFieldType("string", "categorical")
+            values = NP("array", [fieldType.stringToValue(x) for x in plan.scores], dtype=fieldType.dtype)
+        if len(values) == 0:
+            values = NP("zeros", 1, dtype=fieldType.dtype)
+        score[None] = DataColumn(fieldType, values[scores], scoreMask)
+
+        if self.subFields["probability"] or "probability" in plan.features:
+            score["probability"] = DataColumn(FakeFieldType("double", "continuous"), confidence, scoreMask)
+
+        if (self.subFields["entityId"] or "entityId" in plan.features) and winner is not None:
+            fieldType = FakeFieldType("string", "categorical")
+            ruleIds = NP("array", [fieldType.stringToValue(x) for x in plan.ruleIds], dtype=fieldType.dtype)
+            if anyFired.all():
+                mask = None
+            else:
+                mask = NP(NP("logical_not", anyFired) * defs.MISSING)
+            score["entityId"] = DataColumn(fieldType, ruleIds[winner], mask)
+
+        performanceTable.end("set scores")
+        performanceTable.end("RuleSetModel")
+        return score
+
+    def _firedRules(self, plan, dataTable, functionTable, performanceTable):
+        """Evaluate each distinct predicate once and determine which
+        rules fire.
+
+        @type plan: RuleSetModel._Plan
+        @param plan: The compiled RuleSet.
+        @type dataTable: DataTable
+        @param dataTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: 2d Numpy array of bool
+        @return: One row per SimpleRule, in the order of C{plan.ruleOrder}, one column per row of C{dataTable}.
+        """
+
+        performanceTable.begin("predicates")
+
+        results = []
+        for predicate, children in plan.nodes:
+            performanceTable.pause("predicates")
+            if children is None:
+                result = predicate.evaluate(dataTable, functionTable, performanceTable, returnUnknowns=True)
+            else:
+                predicates = [results[index] for index in children]
+                selection, unknowns, encounteredUnknowns = predicates[0]
+                predicates[0] = NP("copy", selection), NP("copy", unknowns), encounteredUnknowns   # combine modifies the first in place
+                result = predicate.combine(predicates, performanceTable, returnUnknowns=True)
+            performanceTable.unpause("predicates")
+            results.append(result)
+
+        performanceTable.count("distinct predicates evaluated", len(plan.nodes))
+
+        performanceTable.end("predicates")
+        performanceTable.begin("rules")
+
+        gates = []
+        for enclosingGate, node in plan.gates:
+            selection, unknowns, encounteredUnknowns = results[node]
+            gate = NP("logical_and", selection, NP("logical_not", unknowns))
+            if enclosingGate is not None:
+                NP("logical_and", gate, gates[enclosingGate], gate)
+            gates.append(gate)
+
+        fired = NP("empty", (len(plan.ruleOrder), len(dataTable)), dtype=NP.dtype(bool))
+        for index, rule in enumerate(plan.ruleOrder):
+            fired[index] = gates[plan.ruleGates[rule]]
+
+        performanceTable.end("rules")
+        return fired
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the Scorecard class."""
+
+from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP
+from augustus.core.PmmlModel import PmmlModel
+from augustus.core.PmmlPredicate import PmmlPredicate
+from augustus.core.FakeFieldType import FakeFieldType
+from augustus.core.DataColumn import DataColumn
+
+class Scorecard(PmmlModel):
+    """Scorecard implements scorecard models in PMML, which add up
+    partial scores from the first matching Attribute of each
+    Characteristic and explain the result with reason codes.
+
+    U{PMML specification<http://www.dmg.org/v4-1/Scorecard.html>}.
+
+    The Characteristics are compiled once into tables with one row
+    per Characteristic and one column per Attribute (plus a column
+    for rows that match no Attribute): partial scores, differences
+    from the baseline score, and reason code indexes.  A DataTable is
+    scored by finding the first matching Attribute of each
+    Characteristic, gathering from these tables, and summing the
+    differences by reason code.  The top-ranked reason codes of all
+    rows are then selected at once with C{argpartition}, so ranking
+    is linear in the number of reason codes.  Among reason codes with
+    equal differences, the first to appear in the Scorecard is ranked
+    higher, except that ties at the last requested rank are broken
+    arbitrarily.
+
+    A Characteristic with no matching Attribute (including Attributes
+    whose predicates are unknown because of missing data) makes the
+    row's score missing.
+
+    @type subFields: dict
+    @param subFields: To globally turn on the calculation of "reasonCode" (the first-ranked reason code), set C{subFields["reasonCode"]} to True.  OutputFields with feature="reasonCode" turn on reason codes down to their rank, which are reported as "reasonCode.RANK".
+    """
+
+    subFields = {"reasonCode": False}
+    scoreType = FakeFieldType("double", "continuous")
+
+    class _Plan(object):
+        """Compiled form of the Characteristics."""
+        pass
+
+    def plan(self):
+        """Return the compiled Characteristics, building them on
+        first use.
+
+        @rtype: Scorecard._Plan
+        @return: An object with the following attributes: C{initialScore}, C{predicates} (list of lists of PmmlPredicates, one list per Characteristic), C{unmatched} (column index for rows that match no Attribute), C{partialScores}, C{differences} (2d arrays of floats), C{codes} (2d array of indexes into C{reasonCodes}), C{reasonCodes} (distinct reason code strings, or None if reason codes are not used), and C{ranks} (the deepest rank requested by an OutputField).
+        @raise PmmlValidationError: If the Scorecard is not well-formed.
+        """
+
+        return self.cached("plan", self._compile)
+
+    def _compile(self):
+        plan = self._Plan()
+        plan.initialScore = float(self.get("initialScore", 0.0))
+
+        useReasonCodes = self.get("useReasonCodes", "true") in ("true", "1")
+        pointsAbove = self.get("reasonCodeAlgorithm", "pointsBelow") == "pointsAbove"
+        baselineScore = self.get("baselineScore")
+
+        characteristics = self.xpath("pmml:Characteristics/pmml:Characteristic")
+        plan.predicates = []
+        for characteristic in characteristics:
+            predicates = []
+            for attribute in characteristic.childrenOfTag("Attribute"):
+                predicate = attribute.childOfClass(PmmlPredicate)
+                if predicate is None:
+                    raise defs.PmmlValidationError("Attribute must have a predicate%s" % attribute.sourcelineAsString())
+                predicates.append(predicate)
+            plan.predicates.append(predicates)
+
+        plan.unmatched = max([len(predicates) for predicates in plan.predicates] + [0])
+        shape = (len(characteristics), plan.unmatched + 1)
+        plan.partialScores = NP("zeros", shape, dtype=NP.dtype(float))
+        plan.differences = NP("zeros", shape, dtype=NP.dtype(float))
+        plan.codes = NP("zeros", shape, dtype=NP.dtype(int))
+        plan.reasonCodes = [] if useReasonCodes else None
+        codeIndex = {}
+
+        for row, characteristic in enumerate(characteristics):
+            baseline = characteristic.get("baselineScore", baselineScore)
+            if useReasonCodes and baseline is None:
+                raise defs.PmmlValidationError("Characteristic requires a baselineScore (on the Characteristic or the Scorecard) when useReasonCodes is true%s" % characteristic.sourcelineAsString())
+
+            for column, attribute in enumerate(characteristic.childrenOfTag("Attribute")):
+                partialScore = attribute.get("partialScore")
+                if partialScore is None:
+                    raise defs.PmmlValidationError("Attribute requires a partialScore%s" % attribute.sourcelineAsString())
+                plan.partialScores[row, column] = float(partialScore)
+
+                if useReasonCodes:
+                    reasonCode = attribute.get("reasonCode", characteristic.get("reasonCode"))
+                    if reasonCode is None:
+                        raise defs.PmmlValidationError("Attribute requires a reasonCode (on the Attribute or the Characteristic) when useReasonCodes is true%s" % attribute.sourcelineAsString())
+                    if reasonCode not in codeIndex:
+                        codeIndex[reasonCode] = len(plan.reasonCodes)
+                        plan.reasonCodes.append(reasonCode)
+                    plan.codes[row, column] = codeIndex[reasonCode]
+
+                    if pointsAbove:
+                        plan.differences[row, column] = float(partialScore) - float(baseline)
+                    else:
+                        plan.differences[row, column] = float(baseline) - float(partialScore)
+
+        plan.ranks = 0
+        for outputField in self.xpath("pmml:Output/pmml:OutputField[@feature='reasonCode']"):
+            plan.ranks = max(plan.ranks, int(outputField.get("rank", defaultFromXsd=True)))
+
+        return plan
+
+    def calculateScore(self, dataTable, functionTable, performanceTable):
+        """Calculate the score of this model.
+
+        This method is called by C{calculate} to separate operations
+        that are performed by all models (in C{calculate}) from
+        operations that are performed by specific models (in
+        C{calculateScore}).
+
+        @type subTable: DataTable
+        @param subTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: A DataColumn containing the score.
+        """
+
+        performanceTable.begin("Scorecard")
+
+        performanceTable.begin("set up")
+        plan = self.plan()
+        length = len(dataTable)
+        performanceTable.end("set up")
+
+        performanceTable.begin("attributes")
+        chosen = NP("empty", (len(plan.predicates), length), dtype=NP.dtype(int))
+        for row, predicates in enumerate(plan.predicates):
+            chosen[row] = plan.unmatched
+            for column in xrange(len(predicates) - 1, -1, -1):     # the first true Attribute is assigned last
+                performanceTable.pause("attributes")
+                selection = predicates[column].evaluate(dataTable, functionTable, performanceTable)
+                performanceTable.unpause("attributes")
+                NP("putmask", chosen[row], selection, column)
+        performanceTable.end("attributes")
+
+        performanceTable.begin("total score")
+        characteristics = NP("arange", len(plan.predicates))[:,NP.newaxis]
+        total = NP(NP("sum", plan.partialScores[characteristics, chosen], axis=0) + plan.initialScore)
+
+        unmatched = NP("any", NP(chosen == plan.unmatched), axis=0)
+        if unmatched.any():
+            scoreMask = NP(unmatched * defs.MISSING)
+        else:
+            scoreMask = None
+
+        score = {None: DataColumn(self.scoreType, total, scoreMask)}
+        performanceTable.end("total score")
+
+        ranks = max(plan.ranks, 1 if self.subFields["reasonCode"] else 0)
+        if plan.reasonCodes is not None and ranks > 0:
+            performanceTable.begin("reason codes")
+
+            numberOfCodes = len(plan.reasonCodes)
+            columns = NP("arange", length)
+            totals = NP("zeros", (numberOfCodes, length), dtype=NP.dtype(float))
+            for row in xrange(len(plan.predicates)):
+                totals[plan.codes[row][chosen[row]], columns] += plan.differences[row][chosen[row]]
+
+            depth = min(ranks, numberOfCodes)
+            if depth < numberOfCodes:
+                candidates = NP("argpartition", NP("negative", totals), depth - 1, axis=0)[:depth]
+            else:
+                candidates = NP("empty", (numberOfCodes, length), dtype=NP.dtype(int))
+                candidates[:] = NP("arange", numberOfCodes)[:,NP.newaxis]
+
+            order = NP("lexsort", (candidates, NP("negative", totals[candidates, columns])), axis=0)
+            ranked = candidates[order, columns]
+
+            fieldType = FakeFieldType("string", "categorical")
+            reasonCodes = NP("array", [fieldType.stringToValue(reasonCode) for reasonCode in plan.reasonCodes], dtype=fieldType.dtype)
+            for rank in xrange(ranks):
+                if rank < depth:
+                    dataColumn = DataColumn(fieldType, reasonCodes[ranked[rank]], scoreMask)
+                else:
+                    dataColumn = DataColumn(fieldType, NP("zeros", length, dtype=fieldType.dtype), NP(NP("ones", length, dtype=defs.maskType) * defs.MISSING))
+                score["reasonCode.%d" % (rank + 1)] = dataColumn
+            score["reasonCode"] = score["reasonCode.1"]
+
+            performanceTable.end("reason codes")
+
+        performanceTable.end("Scorecard")
+        return score
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the SupportVectorMachineModel class."""
+
+from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP
+from augustus.core.PmmlModel import PmmlModel
+from augustus.core.PmmlArray import PmmlArray
+from augustus.core.FakeFieldType import FakeFieldType
+from augustus.core.DataColumn import DataColumn
+from augustus.core.PmmlSparseArray import PmmlSparseArray
+
+class SupportVectorMachineModel(PmmlModel):
+    """SupportVectorMachineModel implements support vector machines
+    in PMML for classification and regression.
+
+    U{PMML specification<http://www.dmg.org/v4-1/SupportVectorMachineModel.html>}.
+
+    The support vectors of the VectorDictionary are compiled once into
+    a dense matrix or, if they are sparse enough, a compressed sparse
+    row (CSR) structure, and the Coefficients of all
+    SupportVectorMachines into one matrix with a column per machine.
+    A DataTable is scored in blocks of rows: the kernel between the
+    block and every support vector is computed at once, and all
+    decision functions follow from a single matrix product, so
+    support vectors shared among machines are only evaluated once.
+
+    For OneAgainstAll classification, the category of the machine
+    with the smallest decision value is predicted.  For OneAgainstOne,
+    each machine votes for its targetCategory if its decision value
+    is less than its threshold and its alternateTargetCategory
+    otherwise, and the category with the most votes (the first to
+    appear, if tied) is predicted.  A single machine with an
+    alternateTargetCategory is a binary classifier under either
+    method.  Rows with an invalid or missing input are scored as
+    missing.
+
+    @type blockSize: int
+    @param blockSize: Maximum number of elements (rows times support vectors, stored support vector entries, or input fields, whichever is largest) in each block of the calculation, which bounds its working memory.
+    @type sparseDensity: float
+    @param sparseDensity: Support vectors are stored in CSR form if the fraction of nonzero entries is less than this.
+    """
+
+    blockSize = 1048576
+    sparseDensity = 0.02
+
+    @property
+    def scoreType(self):
+        if self.get("functionName") == "classification":
+            return FakeFieldType("string", "categorical")
+        else:
+            return FakeFieldType("double", "continuous")
+
+    class _Plan(object):
+        """Compiled form of the VectorDictionary and SupportVectorMachines."""
+        pass
+
+    def plan(self):
+        """Return the compiled model, building it on first use.
+
+        @rtype: SupportVectorMachineModel._Plan
+        @return: An object with the following attributes: C{fields} (list of FieldRefs), C{kernel} (kernel element tag), C{gamma}, C{coef0}, C{degree}, C{vectors} (2d array with one row per support vector, or None), C{sparse} (CSR data, column indexes, start of each non-empty vector, and indexes of the non-empty vectors; or None), C{squaredNorms} (of the support vectors, for the radial basis kernel), C{coefficients} (2d array with one row per support vector, or per field for the Coefficients representation, and one column per machine), C{intercepts}, C{thresholds}, C{categories} (distinct target categories), C{targets} and C{alternates} (category indexes per machine, the latter -1 if absent), and C{oneAgainstOne} (whether to vote).
+        @raise PmmlValidationError: If the model is not well-formed.
+        """
+
+        return self.cached("plan", self._compile)
+
+    def _compile(self):
+        plan = self._Plan()
+
+        vectorDictionary = self.childOfTag("VectorDictionary")
+        plan.fields = vectorDictionary.childOfTag("VectorFields").childrenOfTag("FieldRef")
+        numberOfFields = len(plan.fields)
+
+        for kernel in "LinearKernelType", "PolynomialKernelType", "RadialBasisKernelType", "SigmoidKernelType":
+            kernelType = self.childOfTag(kernel)
+            if kernelType is not None:
+                plan.kernel = kernel
+                plan.gamma = float(kernelType.get("gamma", 1.0))
+                plan.coef0 = float(kernelType.get("coef0", 1.0))
+                plan.degree = float(kernelType.get("degree", 1.0))
+                break
+
+        machines = self.childrenOfTag("SupportVectorMachine")
+        representation = self.get("svmRepresentation", "SupportVectors")
+        plan.vectors = None
+        plan.sparse = None
+        plan.squaredNorms = None
+
+        if representation == "Coefficients":
+            if plan.kernel != "LinearKernelType":
+                raise defs.PmmlValidationError("svmRepresentation \"Coefficients\" requires a LinearKernelType")
+
+            plan.coefficients = NP("zeros", (numberOfFields, len(machines)), dtype=NP.dtype(float))
+            for index, machine in enumerate(machines):
+                coefficients = machine.childOfTag("Coefficients").childrenOfTag("Coefficient")
+                if len(coefficients) != numberOfFields:
+                    raise defs.PmmlValidationError("SupportVectorMachine has %d Coefficients but there are %d VectorFields%s" % (len(coefficients), numberOfFields, machine.sourcelineAsString()))
+                plan.coefficients[:,index] = [float(x.get("value", 0.0)) for x in coefficients]
+
+        else:
+            instances = dict((instance["id"], instance) for instance in vectorDictionary.childrenOfTag("VectorInstance"))
+
+            rows = {}
+            order = []
+            pairs = []
+            for index, machine in enumerate(machines):
+                supportVectors = machine.xpath("pmml:SupportVectors/pmml:SupportVector")
+                coefficients = machine.childOfTag("Coefficients").childrenOfTag("Coefficient")
+                if len(coefficients) != len(supportVectors):
+                    raise defs.PmmlValidationError("SupportVectorMachine has %d Coefficients but %d SupportVectors%s" % (len(coefficients), len(supportVectors), machine.sourcelineAsString()))
+
+                for supportVector, coefficient in zip(supportVectors, coefficients):
+                    vectorId = supportVector["vectorId"]
+                    if vectorId not in instances:
+                        raise defs.PmmlValidationError("SupportVector refers to unknown VectorInstance \"%s\"%s" % (vectorId, supportVector.sourcelineAsString()))
+                    if vectorId not in rows:
+                        rows[vectorId] = len(order)
+                        order.append(vectorId)
+                    pairs.append((rows[vectorId], index, float(coefficient.get("value", 0.0))))
+
+            plan.coefficients = NP("zeros", (len(order), len(machines)), dtype=NP.dtype(float))
+            for row, index, value in pairs:
+                plan.coefficients[row, index] += value
+
+            data = []
+            columns = []
+            starts = []
+            nonEmpty = []
+            for row, vectorId in enumerate(order):
+                array = instances[vectorId].childOfClass(PmmlArray)
+                if isinstance(array, PmmlSparseArray):
+                    n, indices, entries, defaultValue = array.sparseValues()
+                    if defaultValue != 0:
+                        values = [float(defaultValue)] * n
+                        for i, x in zip(indices, entries):
+                            values[i] = float(x)
+                        indices = range(n)
+                        entries = values
+                else:
+                    values = array.values(convertType=True)
+                    n = len(values)
+                    indices = [i for i, x in enumerate(values) if x != 0]
+                    entries = [float(values[i]) for i in indices]
+
+                if n != numberOfFields:
+                    raise defs.PmmlValidationError("VectorInstance \"%s\" has %d components but there are %d VectorFields" % (vectorId, n, numberOfFields))
+
+                if len(indices) > 0:
+                    starts.append(len(data))
+                    nonEmpty.append(row)
+                    data.extend(entries)
+                    columns.extend(indices)
+
+            data = NP("array", data, dtype=NP.dtype(float))
+            columns = NP("array", columns, dtype=NP.dtype(int))
+
+            if len(data) < self.sparseDensity * len(order) * numberOfFields:
+                plan.sparse = data, columns, NP("array", starts, dtype=NP.dtype(int)), NP("array", nonEmpty, dtype=NP.dtype(int))
+            else:
+                plan.vectors = NP("zeros", (len(order), numberOfFields), dtype=NP.dtype(float))
+                for start, stop, row in zip(starts, starts[1:] + [len(data)], nonEmpty):
+                    plan.vectors[row, columns[start:stop]] = data[start:stop]
+
+            if plan.kernel == "RadialBasisKernelType":
+                plan.squaredNorms = NP("zeros", len(order), dtype=NP.dtype(float))
+                for start, stop, row in zip(starts, starts[1:] + [len(data)], nonEmpty):
+                    plan.squaredNorms[row] = NP("sum", NP(data[start:stop]**2))
+
+        threshold = float(self.get("threshold", 0.0))
+        plan.intercepts = NP("array", [float(machine.childOfTag("Coefficients").get("absoluteValue", 0.0)) for machine in machines], dtype=NP.dtype(float))
+        plan.thresholds = NP("array", [float(machine.get("threshold", threshold)) for machine in machines], dtype=NP.dtype(float))
+
+        plan.categories = []
+        plan.targets = []
+        plan.alternates = []
+        plan.oneAgainstOne = False
+
+        if self["functionName"] == "classification":
+            categoryIndex = {}
+            def category(name):
+                if name not in categoryIndex:
+                    categoryIndex[name] = len(plan.categories)
+                    plan.categories.append(name)
+                return categoryIndex[name]
+
+            for machine in machines:
+                targetCategory = machine.get("targetCategory")
+                if targetCategory is None:
+                    raise defs.PmmlValidationError("SupportVectorMachine for classification requires a targetCategory%s" % machine.sourcelineAsString())
+                plan.targets.append(category(targetCategory))
+
+                alternateTargetCategory = machine.get("alternateTargetCategory")
+                plan.alternates.append(-1 if alternateTargetCategory is None else category(alternateTargetCategory))
+
+            if self.get("classificationMethod", "OneAgainstAll") == "OneAgainstOne" or (len(machines) == 1 and plan.alternates[0] != -1):
+                plan.oneAgainstOne = True
+                if -1 in plan.alternates:
+                    raise defs.PmmlValidationError("OneAgainstOne SupportVectorMachines require an alternateTargetCategory")
+            elif len(machines) < 2:
+                raise defs.PmmlValidationError("OneAgainstAll classification requires at least two SupportVectorMachines")
+
+        elif self["functionName"] == "regression":
+            if len(machines) != 1:
+                raise defs.PmmlValidationError("SupportVectorMachineModel for regression must have exactly one SupportVectorMachine, not %d" % len(machines))
+
+        else:
+            raise defs.PmmlValidationError("SupportVectorMachineModel functionName may only be \"classification\" or \"regression\", not \"%s\"" % self["functionName"])
+
+        return plan
+
+    def _kernel(self, plan, block):
+        """Compute the kernel between a block of rows and every
+        support vector.
+
+        @type plan: SupportVectorMachineModel._Plan
+        @param plan: The compiled model.
+        @type block: 2d Numpy array
+        @param block: Input values with one row per data row and one column per VectorField.
+        @rtype: 2d Numpy array
+        @return: Kernel values with one row per data row and one column per support vector.
+        """
+
+        if plan.sparse is None:
+            kernel = NP("dot", block, plan.vectors.T)
+        else:
+            data, columns, starts, nonEmpty = plan.sparse
+            kernel = NP("zeros", (len(block), len(plan.coefficients)), dtype=NP.dtype(float))
+            if len(data) > 0:
+                products = NP(block[:,columns] * data)
+                kernel[:,nonEmpty] = NP.add.reduceat(products, starts, axis=1)
+
+        if plan.kernel == "LinearKernelType":
+            pass
+
+        elif plan.kernel == "PolynomialKernelType":
+            kernel *= plan.gamma
+            kernel += plan.coef0
+            NP("power", kernel, plan.degree, kernel)
+
+        elif plan.kernel == "RadialBasisKernelType":
+            kernel *= -2.0
+            kernel += NP("sum", NP(block**2), axis=1)[:,NP.newaxis]
+            kernel += plan.squaredNorms
+            NP("maximum", kernel, 0.0, kernel)     # guard against rounding below zero
+            kernel *= -plan.gamma
+            NP("exp", kernel, kernel)
+
+        elif plan.kernel == "SigmoidKernelType":
+            kernel *= plan.gamma
+            kernel += plan.coef0
+            NP("tanh", kernel, kernel)
+
+        return kernel
+
+    def calculateScore(self, dataTable, functionTable, performanceTable):
+        """Calculate the score of this model.
+
+        This method is called by C{calculate} to separate operations
+        that are performed by all models (in C{calculate}) from
+        operations that are performed by specific models (in
+        C{calculateScore}).
+
+        @type subTable: DataTable
+        @param subTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: A DataColumn containing the score.
+        """
+
+        performanceTable.begin("SupportVectorMachineModel")
+
+        performanceTable.begin("set up")
+        plan = self.plan()
+        length = len(dataTable)
+
+        inputs = []
+        scoreMask = None
+        for fieldRef in plan.fields:
+            performanceTable.pause("set up")
+            dataColumn = fieldRef.evaluate(dataTable, functionTable, performanceTable)
+            performanceTable.unpause("set up")
+
+            if dataColumn.fieldType.dataType in ("object", "string", "boolean"):
+                raise defs.PmmlValidationError("VectorField \"%s\" must be numeric, not %s" % (fieldRef["field"], dataColumn.fieldType.dataType))
+            inputs.append(dataColumn.data)
+
+            if dataColumn.mask is not None:
+                if scoreMask is None:
+                    scoreMask = NP(NP(dataColumn.mask != defs.VALID) * defs.MISSING)
+                else:
+                    NP("maximum", scoreMask, NP(NP(dataColumn.mask != defs.VALID) * defs.MISSING), scoreMask)
+
+        if scoreMask is not None and not scoreMask.any():
+            scoreMask = None
+        performanceTable.end("set up")
+
+        performanceTable.begin(plan.kernel)
+        numberOfMachines = len(plan.intercepts)
+        decisions = NP("empty", (length, numberOfMachines), dtype=NP.dtype(float))
+
+        if plan.sparse is None:
+            width = len(plan.coefficients)
+        else:
+            width = max(len(plan.coefficients), len(plan.sparse[0]))
+        blockSize = max(1, min(length, self.blockSize // max(width, len(inputs), 1)))
+        block = NP("empty", (blockSize, len(inputs)), dtype=NP.dtype(float))
+
+        for start in xrange(0, length, blockSize):
+            stop = min(start + blockSize, length)
+            rows = block[:stop - start]
+            for index, data in enumerate(inputs):
+                rows[:,index] = data[start:stop]
+
+            if plan.vectors is None and plan.sparse is None:
+                kernel = rows                       # Coefficients representation: one coefficient per field
+            else:
+                kernel = self._kernel(plan, rows)
+            decisions[start:stop] = NP("dot", kernel, plan.coefficients)
+
+        decisions += plan.intercepts
+        performanceTable.end(plan.kernel)
+
+        performanceTable.begin("set scores")
+        score = {}
+
+        if self["functionName"] == "regression":
+            score[None] = DataColumn(FakeFieldType("double", "continuous"), decisions[:,0], scoreMask)
+
+        else:
+            fieldType = FakeFieldType("string", "categorical")
+            categories = NP("array", [fieldType.stringToValue(category) for category in plan.categories], dtype=fieldType.dtype)
+
+            if plan.oneAgainstOne:
+                votes = NP("zeros", (len(plan.categories), length), dtype=NP.dtype(int))
+                for index in xrange(numberOfMachines):
+                    forTarget = NP(decisions[:,index] < plan.thresholds[index])
+                    votes[plan.targets[index]] += forTarget
+                    votes[plan.alternates[index]] += NP("logical_not", forTarget)
+                best = NP("argmax", votes, axis=0)
+            else:
+                targets = NP("array", plan.targets, dtype=NP.dtype(int))
+                best = targets[NP("argmin", decisions, axis=1)]
+
+            score[None] = DataColumn(fieldType, categories[best], scoreMask)
+
+        performanceTable.end("set scores")
+        performanceTable.end("SupportVectorMachineModel")
+        return score
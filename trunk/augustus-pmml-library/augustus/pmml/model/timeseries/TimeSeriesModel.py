@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the TimeSeriesModel class."""
+
+from augustus.core.defs import defs
+from augustus.core.NumpyInterface import NP
+from augustus.core.PmmlModel import PmmlModel
+from augustus.core.FakeFieldType import FakeFieldType
+from augustus.core.DataColumn import DataColumn
+from augustus.pmml.Array import Array
+
+class TimeSeriesModel(PmmlModel):
+    """TimeSeriesModel implements time series forecasting in PMML.
+    Only the ExponentialSmoothing algorithm is implemented; other
+    values of C{bestFit} and the polynomial_exponential trend are
+    reported as validation errors.
+
+    U{PMML specification<http://www.dmg.org/v4-1/TimeSeriesModel.html>}.
+
+    The smoothing state consists of the Level, the optional
+    Trend_ExpoSmooth (additive, damped_additive, multiplicative, or
+    damped_multiplicative), and the optional Seasonality_ExpoSmooth
+    (additive or multiplicative), whose array holds one seasonal
+    index per step of the period.  The step after the last smoothed
+    value uses element C{phase} (default 0) of the array.
+
+    Each row is one time step.  The forecast for a row is made C{h}
+    steps ahead, where C{h} is the value of the active MiningField
+    (1 if there is none), with the closed-form expression of the
+    model's trend and seasonality, evaluated for all rows at once.
+    If the predicted MiningField is also in the DataTable, each row's
+    value is first smoothed into the state with the Holt-Winters
+    updates (alpha, gamma, delta, and phi for damped trends), so each
+    row is forecast from all of the data up to and including itself.
+    Rows with a missing value do not advance the state.
+
+    With additive or no trend and seasonality, one update is a linear
+    map of the state vector (level, trend, and seasonal indexes), so a
+    block of rows is smoothed at once with a doubling scan: log2(rows)
+    steps of matrix products rather than a loop over rows.
+    Multiplicative models are updated row by row.
+
+    To continue the smoothing through multiple calls to C{calculate},
+    give the TimeSeriesModel a C{stateId} attribute and reuse the
+    DataTableState.  The state is stored under that key as a dict of
+    "level", "trend", and "season" (rotated so that its first element
+    applies to the next step), so its size does not depend on the
+    number of rows.  The C{stateId} is not valid in strict PMML, but
+    it can be inserted after validation or used in custom-ODG models
+    (C{from augustus.odg import *}).
+
+    @type blockSize: int
+    @param blockSize: Maximum number of elements (rows times state variables) in each block of the calculation, which bounds its working memory.
+    """
+
+    blockSize = 1048576
+    scoreType = FakeFieldType("double", "continuous")
+
+    class _Plan(object):
+        """Compiled form of the ExponentialSmoothing."""
+        pass
+
+    def plan(self):
+        """Return the compiled ExponentialSmoothing, building it on
+        first use.
+
+        @rtype: TimeSeriesModel._Plan
+        @return: An object with the following attributes: C{transformation}, C{alpha}, C{level}, C{trendType} (None if there is no trend), C{gamma}, C{phi} (1 for undamped trends), C{trend}, C{seasonType} (None if there is no seasonality), C{delta}, C{season} (1d array, rotated so that the first element applies to the next step), C{linear} (whether the updates are linear), and C{transition} and C{response} (the matrix and vector of the linear update, or None).
+        @raise PmmlValidationError: If the ExponentialSmoothing is not well-formed.
+        """
+
+        return self.cached("plan", self._compile)
+
+    def _compile(self):
+        if self["bestFit"] != "ExponentialSmoothing":
+            raise defs.PmmlValidationError("TimeSeriesModel with bestFit=\"%s\" is not supported; only ExponentialSmoothing is" % self["bestFit"])
+
+        exponentialSmoothing = self.childOfTag("ExponentialSmoothing")
+        if exponentialSmoothing is None:
+            raise defs.PmmlValidationError("TimeSeriesModel with bestFit=\"ExponentialSmoothing\" requires an ExponentialSmoothing element")
+
+        plan = self._Plan()
+        plan.transformation = exponentialSmoothing.get("transformation", "none")
+
+        level = exponentialSmoothing.childOfTag("Level")
+        if level.get("smoothedValue") is None:
+            raise defs.PmmlValidationError("Level requires a smoothedValue to forecast")
+        plan.level = float(level["smoothedValue"])
+        plan.alpha = self._parameter(level, "alpha")
+
+        trend = exponentialSmoothing.childOfTag("Trend_ExpoSmooth")
+        if trend is None:
+            plan.trendType = None
+            plan.gamma = None
+            plan.phi = 1.0
+            plan.trend = 0.0
+        else:
+            plan.trendType = trend.get("trend", "additive")
+            if plan.trendType == "polynomial_exponential":
+                raise defs.PmmlValidationError("Trend_ExpoSmooth with trend=\"polynomial_exponential\" is not supported%s" % trend.sourcelineAsString())
+            if trend.get("smoothedValue") is None:
+                raise defs.PmmlValidationError("Trend_ExpoSmooth requires a smoothedValue to forecast")
+            plan.trend = float(trend["smoothedValue"])
+            plan.gamma = self._parameter(trend, "gamma")
+            if plan.trendType.startswith("damped_"):
+                plan.phi = float(trend.get("phi", 1.0))
+            else:
+                plan.phi = 1.0
+
+        seasonality = exponentialSmoothing.childOfTag("Seasonality_ExpoSmooth")
+        if seasonality is None:
+            plan.seasonType = None
+            plan.delta = None
+            plan.season = NP("empty", 0, dtype=NP.dtype(float))
+        else:
+            plan.seasonType = seasonality["type"]
+            plan.delta = self._parameter(seasonality, "delta")
+            period = int(seasonality["period"])
+            season = NP("array", seasonality.childOfClass(Array).values(convertType=True), dtype=NP.dtype(float))
+            if period < 1 or len(season) != period:
+                raise defs.PmmlValidationError("Seasonality_ExpoSmooth requires an array of period (%d) seasonal indexes, not %d" % (period, len(season)))
+            plan.season = NP("roll", season, -int(seasonality.get("phase", 0)))
+
+        plan.linear = plan.trendType in (None, "additive", "damped_additive") and plan.seasonType in (None, "additive")
+        plan.transition = None
+        plan.response = None
+        if plan.linear and self._updatable(plan):
+            plan.transition, plan.response = self._linearize(plan)
+
+        return plan
+
+    def _parameter(self, element, name):
+        """Get an optional smoothing parameter.
+
+        @type element: PmmlBinding
+        @param element: The Level, Trend_ExpoSmooth, or Seasonality_ExpoSmooth.
+        @type name: string
+        @param name: The attribute name.
+        @rtype: float or None
+        @return: The value, or None if the attribute is absent.
+        """
+
+        value = element.get(name)
+        if value is None:
+            return None
+        else:
+            return float(value)
+
+    def _updatable(self, plan):
+        """Determine whether the model has all of the smoothing
+        parameters that updating the state requires.
+
+        @type plan: TimeSeriesModel._Plan
+        @param plan: The compiled model.
+        @rtype: bool
+        @return: True if alpha, gamma (with a trend), and delta (with seasonality) are all defined.
+        """
+
+        return plan.alpha is not None and (plan.trendType is None or plan.gamma is not None) and (plan.seasonType is None or plan.delta is not None)
+
+    def _update(self, plan, level, trend, seasonal, value):
+        """Smooth one value into the state.
+
+        @type plan: TimeSeriesModel._Plan
+        @param plan: The compiled model.
+        @type level: number
+        @param level: Level before the update.
+        @type trend: number
+        @param trend: Trend before the update (ignored if there is no trend).
+        @type seasonal: number
+        @param seasonal: Seasonal index of this step (ignored if there is no seasonality).
+        @type value: number
+        @param value: The (transformed) observed value.
+        @rtype: 3-tuple of numbers
+        @return: The new level, trend, and seasonal index of this step for one period later.
+        """
+
+        if plan.seasonType == "additive":
+            adjusted = value - seasonal
+        elif plan.seasonType == "multiplicative":
+            adjusted = value / seasonal
+        else:
+            adjusted = value
+
+        if plan.trendType is None:
+            projected = level
+        elif plan.trendType in ("additive", "damped_additive"):
+            projected = level + plan.phi * trend
+        else:
+            projected = level * trend**plan.phi
+
+        newLevel = plan.alpha * adjusted + (1.0 - plan.alpha) * projected
+
+        if plan.trendType in ("additive", "damped_additive"):
+            trend = plan.gamma * (newLevel - level) + (1.0 - plan.gamma) * plan.phi * trend
+        elif plan.trendType in ("multiplicative", "damped_multiplicative"):
+            trend = plan.gamma * (newLevel / level) + (1.0 - plan.gamma) * trend**plan.phi
+
+        if plan.seasonType == "additive":
+            seasonal = plan.delta * (value - newLevel) + (1.0 - plan.delta) * seasonal
+        elif plan.seasonType == "multiplicative":
+            seasonal = plan.delta * (value / newLevel) + (1.0 - plan.delta) * seasonal
+
+        return newLevel, trend, seasonal
+
+    def _linearize(self, plan):
+        """Express a linear update as a matrix acting on the state
+        vector (level, trend, and the seasonal indexes of the next
+        period of steps), plus a vector acting on the value.
+
+        @type plan: TimeSeriesModel._Plan
+        @param plan: The compiled model, which must have linear updates.
+        @rtype: 2-tuple of Numpy arrays
+        @return: The transition matrix and response vector.
+        """
+
+        period = len(plan.season)
+        size = 2 + period
+        transition = NP("zeros", (size, size), dtype=NP.dtype(float))
+        response = NP("zeros", size, dtype=NP.dtype(float))
+
+        # the update is linear and homogeneous, so it is determined by its response to each unit input
+        for column, inputs in enumerate([(1.0, 0.0, 0.0, 0.0), (0.0, 1.0, 0.0, 0.0), (0.0, 0.0, 1.0, 0.0), (0.0, 0.0, 0.0, 1.0)]):
+            level, trend, seasonal = self._update(plan, *inputs)
+            if column == 3:
+                target = response
+            elif column == 2:
+                if period == 0:
+                    continue
+                target = transition[:,2]
+            else:
+                target = transition[:,column]
+            target[0] = level
+            target[1] = trend
+            if period > 0:
+                target[1 + period] = seasonal
+
+        for index in xrange(period - 1):
+            transition[2 + index, 3 + index] = 1.0            # the other seasonal indexes move one step closer
+
+        if plan.trendType is None:
+            transition[:,1] = 0.0
+            transition[1,:] = 0.0
+            response[1] = 0.0
+
+        return transition, response
+
+    def _scan(self, plan, state, values):
+        """Apply the linear update to a sequence of values.
+
+        @type plan: TimeSeriesModel._Plan
+        @param plan: The compiled model, which must have linear updates.
+        @type state: 1d Numpy array
+        @param state: State vector before the first value.
+        @type values: 1d Numpy array
+        @param values: The (transformed) observed values.
+        @rtype: 2d Numpy array
+        @return: State vector after each value, one row per value.
+        """
+
+        # row i starts as the response to value i alone; after the step with stride s, it includes
+        # the values back to i - 2s + 1, and the transition to apply to rows s back is transition**s
+        states = NP("outer", values, plan.response)
+        if len(values) > 0:
+            states[0] += NP("dot", plan.transition, state)
+
+        power = plan.transition
+        stride = 1
+        while stride < len(values):
+            states[stride:] += NP("dot", states[:-stride], power.T)
+            power = NP("dot", power, power)
+            stride *= 2
+
+        return states
+
+    def _forecast(self, plan, level, trend, seasonal, horizon):
+        """Forecast from the state with the closed-form expression.
+
+        @type plan: TimeSeriesModel._Plan
+        @param plan: The compiled model.
+        @type level: 1d Numpy array
+        @param level: Level of each row.
+        @type trend: 1d Numpy array
+        @param trend: Trend of each row.
+        @type seasonal: 1d Numpy array
+        @param seasonal: Seasonal index of each row's forecast step.
+        @type horizon: 1d Numpy array of int
+        @param horizon: Number of steps ahead of each row.
+        @rtype: 1d Numpy array
+        @return: The forecasts, with the transformation inverted.
+        """
+
+        if plan.phi == 1.0:
+            steps = horizon
+        else:
+            steps = NP(NP(plan.phi * NP(1.0 - NP("power", plan.phi, horizon))) / (1.0 - plan.phi))
+
+        if plan.trendType in ("additive", "damped_additive"):
+            forecast = NP(level + NP(steps * trend))
+        elif plan.trendType in ("multiplicative", "damped_multiplicative"):
+            forecast = NP(level * NP("power", trend, steps))
+        else:
+            forecast = NP("array", level, dtype=NP.dtype(float))
+
+        if plan.seasonType == "additive":
+            forecast += seasonal
+        elif plan.seasonType == "multiplicative":
+            forecast *= seasonal
+
+        if plan.transformation == "logarithmic":
+            NP("exp", forecast, forecast)
+        elif plan.transformation == "squareroot":
+            NP("square", forecast, forecast)
+        return forecast
+
+    def calculateScore(self, dataTable, functionTable, performanceTable):
+        """Calculate the score of this model.
+
+        This method is called by C{calculate} to separate operations
+        that are performed by all models (in C{calculate}) from
+        operations that are performed by specific models (in
+        C{calculateScore}).
+
+        @type subTable: DataTable
+        @param subTable: The DataTable representing this model's lexical scope.
+        @type functionTable: FunctionTable or None
+        @param functionTable: A table of functions.
+        @type performanceTable: PerformanceTable or None
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @rtype: DataColumn
+        @return: A DataColumn containing the score.
+        """
+
+        performanceTable.begin("TimeSeriesModel")
+
+        performanceTable.begin("set up")
+        plan = self.plan()
+        length = len(dataTable)
+        period = len(plan.season)
+
+        stateId = self.get("stateId")
+        state = None
+        if stateId is not None:
+            state = dataTable.state.get(stateId)
+        if state is None:
+            level, trend, season = plan.level, plan.trend, NP("copy", plan.season)
+        else:
+            level, trend, season = state["level"], state["trend"], NP("array", state["season"], dtype=NP.dtype(float))
+
+        mask = None
+        horizonFields = self.xpath("pmml:MiningSchema/pmml:MiningField[not(@usageType) or @usageType='active']")
+        if len(horizonFields) > 1:
+            raise defs.PmmlValidationError("TimeSeriesModel may have at most one active MiningField (the forecast horizon), not %d" % len(horizonFields))
+        if len(horizonFields) == 1:
+            dataColumn = dataTable.fields[horizonFields[0]["name"]]
+            horizon = NP("array", dataColumn.data, dtype=NP.dtype(int))
+            invalid = NP(horizon < 1)
+            if dataColumn.mask is not None:
+                NP("logical_or", invalid, NP(dataColumn.mask != defs.VALID), invalid)
+            if invalid.any():
+                horizon[invalid] = 1
+                mask = NP(invalid * defs.MISSING)
+        else:
+            horizon = NP("ones", length, dtype=NP.dtype(int))
+
+        observed = None
+        predictedFields = self.xpath("pmml:MiningSchema/pmml:MiningField[@usageType='predicted' or @usageType='target']")
+        if len(predictedFields) == 1 and predictedFields[0]["name"] in dataTable.fields:
+            dataColumn = dataTable.fields[predictedFields[0]["name"]]
+            values = NP("array", dataColumn.data, dtype=NP.dtype(float))
+            if plan.transformation == "logarithmic":
+                values = NP("log", values)
+            elif plan.transformation == "squareroot":
+                values = NP("sqrt", values)
+            valid = NP("isfinite", values)
+            if dataColumn.mask is not None:
+                NP("logical_and", valid, NP(dataColumn.mask == defs.VALID), valid)
+            observed = NP("flatnonzero", valid)
+            if len(observed) > 0 and not self._updatable(plan):
+                raise defs.PmmlValidationError("ExponentialSmoothing requires alpha (and gamma and delta, if it has a trend and seasonality) to smooth new values")
+        performanceTable.end("set up")
+
+        levels = NP("empty", length, dtype=NP.dtype(float))
+        trends = NP("empty", length, dtype=NP.dtype(float))
+        seasonals = NP("ones", length, dtype=NP.dtype(float))
+        slots = NP(NP(horizon - 1) % max(period, 1))
+
+        if observed is None or len(observed) == 0:
+            levels[:] = level
+            trends[:] = trend
+            if period > 0:
+                seasonals = season[slots]
+
+        elif plan.linear:
+            performanceTable.begin("smoothing scan")
+            vector = NP("concatenate", ([level, trend], season))
+            blockSize = max(1, min(length, self.blockSize // len(vector)))
+            for start in xrange(0, length, blockSize):
+                stop = min(start + blockSize, length)
+                here = observed[NP("searchsorted", observed, start):NP("searchsorted", observed, stop)]
+                states = NP("vstack", ([vector], self._scan(plan, vector, values[here])))
+
+                # each row takes the state after the last value at or before it (row 0 of states if none)
+                which = NP("searchsorted", here, NP("arange", start, stop), side="right")
+                levels[start:stop] = states[which, 0]
+                trends[start:stop] = states[which, 1]
+                if period > 0:
+                    seasonals[start:stop] = states[which, 2 + slots[start:stop]]
+                vector = states[-1]
+            level, trend, season = vector[0], vector[1], vector[2:]
+            performanceTable.end("smoothing scan")
+
+        else:
+            performanceTable.begin("smoothing loop")
+            season = season.tolist()
+            phase = 0
+            for index, isValid, value, slot in zip(xrange(length), valid.tolist(), values.tolist(), slots.tolist()):
+                if isValid:
+                    if period > 0:
+                        level, trend, season[phase] = self._update(plan, level, trend, season[phase], value)
+                        phase = (phase + 1) % period
+                    else:
+                        level, trend, ignored = self._update(plan, level, trend, 1.0, value)
+                levels[index] = level
+                trends[index] = trend
+                if period > 0:
+                    seasonals[index] = season[(phase + slot) % period]
+            season = NP("roll", NP("array", season, dtype=NP.dtype(float)), -phase)
+            performanceTable.end("smoothing loop")
+
+        performanceTable.begin("forecast")
+        forecast = self._forecast(plan, levels, trends, seasonals, horizon)
+        performanceTable.end("forecast")
+
+        if stateId is not None:
+            dataTable.state[stateId] = {"level": float(level), "trend": float(trend), "season": season}
+
+        performanceTable.end("TimeSeriesModel")
+        return {None: DataColumn(self.scoreType, forecast, mask)}
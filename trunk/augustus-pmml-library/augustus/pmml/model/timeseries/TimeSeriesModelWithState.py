@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module defines the TimeSeriesModelWithState class."""
+
+from augustus.pmml.model.timeseries.TimeSeriesModel import TimeSeriesModel
+
+class TimeSeriesModelWithState(TimeSeriesModel):
+    """This customized TimeSeriesModel class adds a stateId attribute,
+    so that users can continue exponential smoothing across
+    calculations."""
+
+    xsd = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+    <xs:element name="TimeSeriesModel">
+        <xs:complexType>
+            <xs:sequence>
+                <xs:element maxOccurs="unbounded" ref="Extension" minOccurs="0" />
+                <xs:element ref="MiningSchema" />
+                <xs:element ref="Output" minOccurs="0" />
+                <xs:element ref="ModelStats" minOccurs="0" />
+                <xs:element ref="ModelExplanation" minOccurs="0" />
+                <xs:element ref="LocalTransformations" minOccurs="0" />
+                <xs:element maxOccurs="3" ref="TimeSeries" minOccurs="0" />
+                <xs:element maxOccurs="1" ref="SpectralAnalysis" minOccurs="0" />
+                <xs:element maxOccurs="1" ref="ARIMA" minOccurs="0" />
+                <xs:element maxOccurs="1" ref="ExponentialSmoothing" minOccurs="0" />
+                <xs:element maxOccurs="1" ref="SeasonalTrendDecomposition" minOccurs="0" />
+                <xs:element ref="ModelVerification" minOccurs="0" />
+                <xs:element maxOccurs="unbounded" ref="Extension" minOccurs="0" />
+            </xs:sequence>
+            <xs:attribute use="optional" type="xs:string" name="modelName" />
+            <xs:attribute use="required" type="MINING-FUNCTION" name="functionName" />
+            <xs:attribute use="optional" type="xs:string" name="algorithmName" />
+            <xs:attribute use="required" type="TIMESERIES-ALGORITHM" name="bestFit" />
+            <xs:attribute default="true" type="xs:boolean" name="isScorable" />
+            <xs:attribute name="stateId" type="xs:string" use="optional" />   <!-- added stateId -->
+        </xs:complexType>
+    </xs:element>
+</xs:schema>
+"""
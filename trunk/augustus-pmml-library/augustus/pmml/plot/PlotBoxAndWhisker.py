@@ -20,14 +20,13 @@
 
 """This module defines the PlotBoxAndWhisker class."""
 
-import itertools
-
 from augustus.core.defs import defs
 from augustus.core.SvgBinding import SvgBinding
 from augustus.core.NumpyInterface import NP
 from augustus.core.FakeFieldType import FakeFieldType
 from augustus.core.plot.PmmlPlotContent import PmmlPlotContent
 from augustus.core.plot.PlotStyle import PlotStyle
+from augustus.core.plot.PlotQuantileSketch import PlotQuantileSketch
 from augustus.pmml.plot.PlotHistogram import PlotHistogram
 
 class PlotBoxAndWhisker(PmmlPlotContent):
@@ -64,8 +63,21 @@ class PlotBoxAndWhisker(PmmlPlotContent):
       - vertical: if "true", plot the "sliced" expression on the
         x axis and the "profiled" expression on the y axis.
       - gap: size of the space between boxes in SVG coordinates.
+      - compression: the distribution in each bin is summarized by
+        a PlotQuantileSketch with this compression parameter, which
+        keeps about this many centroids per bin.  Once a bin is
+        compressed, its quantiles are accurate to about
+        M{pi sqrt(q(1 - q))/compression} in rank (1.6% at the median
+        for the default of 100).
+      - exactLimit: each bin keeps up to this many values verbatim
+        (so that quantiles are exact) before it starts compressing.
       - style: CSS style properties.
 
+    With a stateId, the DataTableState holds one PlotQuantileSketch
+    per bin, rather than all of the values, so memory use does not
+    grow with the number of rows.  Sketches from different workers
+    can be combined with C{PlotQuantileSketch.merge}.
+
     CSS properties:
 
       - fill, fill-opacity: color of the box.
@@ -116,6 +128,8 @@ class PlotBoxAndWhisker(PmmlPlotContent):
             <xs:attribute name="highWhisker" type="xs:double" use="optional" default="100" />
             <xs:attribute name="vertical" type="xs:boolean" use="optional" default="true" />
             <xs:attribute name="gap" type="xs:double" use="optional" default="10" />
+            <xs:attribute name="compression" type="xs:double" use="optional" default="100" />
+            <xs:attribute name="exactLimit" type="xs:nonNegativeInteger" use="optional" default="10000" />
             <xs:attribute name="style" type="xs:string" use="optional" default="%s" />
         </xs:complexType>
     </xs:element>
@@ -187,6 +201,18 @@ class PlotBoxAndWhisker(PmmlPlotContent):
         intervals = self.xpath("pmml:Interval")
         values = self.xpath("pmml:Value")
 
+        compression = self.get("compression", defaultFromXsd=True, convertType=True)
+        exactLimit = self.get("exactLimit", defaultFromXsd=True, convertType=True)
+
+        def newSketch():
+            return PlotQuantileSketch.new(compression, exactLimit)
+
+        def asSketch(distribution):
+            if isinstance(distribution, dict):
+                return distribution
+            else:
+                return PlotQuantileSketch.fromArray(distribution, compression, exactLimit)   # state saved before sketches
+
         if "binType" not in persistentState:
             performanceTable.begin("establish binType")
 
@@ -194,10 +220,10 @@ class PlotBoxAndWhisker(PmmlPlotContent):
             persistentState["binType"] = binType
 
             if binType == "nonuniform":
-                persistentState["distributions"] = [NP("empty", 0, dtype=profiledDataColumn.fieldType.dtype) for x in xrange(len(intervals))]
+                persistentState["distributions"] = [newSketch() for x in xrange(len(intervals))]
 
             elif binType == "explicit":
-                persistentState["distributions"] = [NP("empty", 0, dtype=profiledDataColumn.fieldType.dtype) for x in xrange(len(values))]
+                persistentState["distributions"] = [newSketch() for x in xrange(len(values))]
 
             elif binType == "unique":
                 persistentState["distributions"] = {}
@@ -212,14 +238,14 @@ class PlotBoxAndWhisker(PmmlPlotContent):
                 persistentState["low"] = low
                 persistentState["high"] = high
                 persistentState["numBins"] = numBins
-                persistentState["distributions"] = [NP("empty", 0, dtype=profiledDataColumn.fieldType.dtype) for x in xrange(numBins)]
+                persistentState["distributions"] = [newSketch() for x in xrange(numBins)]
 
             performanceTable.end("establish binType")
 
         if persistentState["binType"] == "nonuniform":
             performanceTable.begin("binType nonuniform")
 
-            distributions = [None] * len(intervals)
+            distributions = [asSketch(x) for x in persistentState["distributions"]]
             state.edges = []
             lastLimitPoint = None
             lastClosed = None
@@ -229,12 +255,11 @@ class PlotBoxAndWhisker(PmmlPlotContent):
                 selection, lastLimitPoint, lastClosed, lastInterval = PlotHistogram.selectInterval(slicedDataColumn.fieldType, slicedArray, index, len(intervals) - 1, interval, state.edges, lastLimitPoint, lastClosed, lastInterval)
 
                 if selection is None:
-                    distributions[index] = profiledArray
+                    PlotQuantileSketch.update(distributions[index], profiledArray)
                 else:
-                    distributions[index] = profiledArray[selection]
+                    PlotQuantileSketch.update(distributions[index], profiledArray[selection])
 
-            persistentState["distributions"] = [NP("concatenate", [x, y]) for x, y in itertools.izip(persistentState["distributions"], distributions)]
-            distributions = persistentState["distributions"]
+            persistentState["distributions"] = distributions
             lowEdge = min(low for low, high in state.edges if low is not None)
             highEdge = max(high for low, high in state.edges if high is not None)
             state.slicedFieldType = self.fieldTypeNumeric
@@ -244,7 +269,7 @@ class PlotBoxAndWhisker(PmmlPlotContent):
         elif persistentState["binType"] == "explicit":
             performanceTable.begin("binType explicit")
 
-            distributions = [None] * len(values)
+            distributions = [asSketch(x) for x in persistentState["distributions"]]
             displayValues = []
 
             for index, value in enumerate(values):
@@ -252,10 +277,9 @@ class PlotBoxAndWhisker(PmmlPlotContent):
                 displayValues.append(value.get("displayValue", slicedDataColumn.fieldType.valueToString(internalValue, displayValue=True)))
 
                 selection = NP(slicedArray == internalValue)
-                distributions[index] = profiledArray[selection]
-                
-            persistentState["distributions"] = [NP("concatenate", [x, y]) for x, y in itertools.izip(persistentState["distributions"], distributions)]
-            distributions = persistentState["distributions"]
+                PlotQuantileSketch.update(distributions[index], profiledArray[selection])
+
+            persistentState["distributions"] = distributions
             state.edges = displayValues
             state.slicedFieldType = slicedDataColumn.fieldType
 
@@ -265,25 +289,26 @@ class PlotBoxAndWhisker(PmmlPlotContent):
             performanceTable.begin("binType unique")
 
             uniques, inverse = NP("unique", slicedArray, return_inverse=True)
+            order = NP("argsort", inverse, kind="mergesort")
+            starts = NP("searchsorted", inverse[order], NP("arange", len(uniques) + 1))
 
             persistentDistributions = persistentState["distributions"]
             for i, u in enumerate(uniques):
                 string = slicedDataColumn.fieldType.valueToString(u, displayValue=False)
-                selection = NP(inverse == i)
-
                 if string in persistentDistributions:
-                    persistentDistributions[string] = NP("concatenate", [persistentDistributions[string], profiledArray[selection]])
+                    persistentDistributions[string] = asSketch(persistentDistributions[string])
                 else:
-                    persistentDistributions[string] = profiledArray[selection]
+                    persistentDistributions[string] = newSketch()
+                PlotQuantileSketch.update(persistentDistributions[string], profiledArray[order[starts[i]:starts[i + 1]]])
 
-            tosort = [(len(distribution), string) for string, distribution in persistentDistributions.items()]
+            tosort = [(distribution["count"] if isinstance(distribution, dict) else len(distribution), string) for string, distribution in persistentDistributions.items()]
             tosort.sort(reverse=True)
 
             numBins = self.get("numBins", convertType=True)
             if numBins is not None:
                 tosort = tosort[:numBins]
 
-            distributions = [persistentDistributions[string] for count, string in tosort]
+            distributions = [asSketch(persistentDistributions[string]) for count, string in tosort]
             state.edges = [slicedDataColumn.fieldType.valueToString(slicedDataColumn.fieldType.stringToValue(string), displayValue=True) for count, string in tosort]
             state.slicedFieldType = slicedDataColumn.fieldType
             
@@ -298,14 +323,14 @@ class PlotBoxAndWhisker(PmmlPlotContent):
             binWidth = (high - low) / float(numBins)
 
             binAssignments = NP("array", NP("floor", NP(NP(slicedArray - low)/binWidth)), dtype=NP.dtype(int))
-            distributions = [None] * numBins
+            order = NP("argsort", binAssignments, kind="mergesort")
+            starts = NP("searchsorted", binAssignments[order], NP("arange", numBins + 1))
+            distributions = [asSketch(x) for x in persistentState["distributions"]]
 
             for index in xrange(numBins):
-                selection = NP(binAssignments == index)
-                distributions[index] = profiledArray[selection]
-                
-            persistentState["distributions"] = [NP("concatenate", [x, y]) for x, y in itertools.izip(persistentState["distributions"], distributions)]
-            distributions = persistentState["distributions"]
+                PlotQuantileSketch.update(distributions[index], profiledArray[order[starts[index]:starts[index + 1]]])
+
+            persistentState["distributions"] = distributions
             state.edges = [(low + i*binWidth, low + (i + 1)*binWidth) for i in xrange(numBins)]
             lowEdge = low
             highEdge = high
@@ -325,14 +350,14 @@ class PlotBoxAndWhisker(PmmlPlotContent):
         maxProfiled = None
         for distribution in distributions:
             if levels == "percentage":
-                if len(distribution) > 0:
-                    state.ranges.append(NP("percentile", distribution, [lowWhisker, lowBox, midLine, highBox, highWhisker]))
+                if distribution["count"] > 0:
+                    state.ranges.append(PlotQuantileSketch.quantiles(distribution, [lowWhisker, lowBox, midLine, highBox, highWhisker]))
                 else:
                     state.ranges.append(None)
 
             elif levels == "standardDeviation":
-                mu = NP("mean", distribution)
-                sigma = NP("std", distribution, ddof=1)
+                mu = distribution["mean"]
+                sigma = PlotQuantileSketch.standardDeviation(distribution)
 
                 if NP("isfinite", sigma) and sigma > 0.0:
                     state.ranges.append([(lowWhisker - mu)/sigma, (lowBox - mu)/sigma, (midLine - mu)/sigma, (highBox - mu)/sigma, (highWhisker - mu)/sigma])
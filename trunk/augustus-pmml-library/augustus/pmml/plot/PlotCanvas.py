@@ -30,7 +30,9 @@ from augustus.core.plot.PlotStyleable import PlotStyleable
 from augustus.core.plot.PlotCoordinates import PlotCoordinates
 from augustus.core.plot.PlotContentBox import PlotContentBox
 from augustus.core.plot.PlotDefinitions import PlotDefinitions
+from augustus.core.plot.PlotScheduler import PlotScheduler
 from augustus.core.DataTable import DataTable
+from augustus.core.DataTableExpressions import DataTableExpressions
 from augustus.core.FunctionTable import FunctionTable
 from augustus.core.FakePerformanceTable import FakePerformanceTable
 
@@ -54,6 +56,10 @@ class PlotCanvas(PmmlCalculable, PlotStyleable):
       - fileName: if present, evaluating the PlotCanvas causes
         an SVG file to be written out with this name.
       - isPlotable: if "true", draw the plot; if "false", don't.
+      - processes: number of worker processes used to prepare the
+        plot elements (see PlotScheduler); with the default of 1,
+        they are prepared one after another.  Either way, the SVG
+        output is the same.
     
     See the source code for the full XSD.
 
@@ -77,6 +83,7 @@ class PlotCanvas(PmmlCalculable, PlotStyleable):
             <xs:attribute name="plotName" type="xs:string" use="optional" />
             <xs:attribute name="fileName" type="xs:string" use="optional" />
             <xs:attribute name="isPlotable" type="xs:boolean" use="optional" default="true" />
+            <xs:attribute name="processes" type="xs:positiveInteger" use="optional" default="1" />
         </xs:complexType>
     </xs:element>
 </xs:schema>
@@ -209,8 +216,17 @@ class PlotCanvas(PmmlCalculable, PlotStyleable):
         plotContentBox = PlotContentBox(0, 0, width, height)
         plotDefinitions = PlotDefinitions()
 
+        # plot expressions and selections are shared among the plot elements of this canvas, but not kept after it is drawn
+        expressions = dataTable.expressions
+        dataTable.expressions = DataTableExpressions(expressions)
+
         performanceTable.pause("PlotCanvas")
-        content = [x.frame(dataTable, functionTable, performanceTable, plotCoordinates, plotContentBox, plotDefinitions) for x in self.childrenOfClass(PmmlPlotFrame)]
+        try:
+            PlotScheduler.prepareAll(self, dataTable, functionTable, performanceTable, self.get("processes", defaultFromXsd=True, convertType=True))
+            content = [x.frame(dataTable, functionTable, performanceTable, plotCoordinates, plotContentBox, plotDefinitions) for x in self.childrenOfClass(PmmlPlotFrame)]
+        finally:
+            PlotScheduler.discard(dataTable)
+            dataTable.expressions = expressions
         performanceTable.unpause("PlotCanvas")
 
         content = [svg.defs(*plotDefinitions.values())] + content
@@ -21,7 +21,6 @@
 """This module defines the PlotCurve class."""
 
 import math
-import itertools
 
 from augustus.core.defs import defs
 from augustus.core.SvgBinding import SvgBinding
@@ -29,6 +28,7 @@ from augustus.core.NumpyInterface import NP
 from augustus.core.DataTable import DataTable
 from augustus.core.plot.PmmlPlotContent import PmmlPlotContent
 from augustus.core.plot.PlotStyle import PlotStyle
+from augustus.core.plot.PlotNumberFormat import PlotNumberFormat
 from augustus.core.FakeFieldType import FakeFieldType
 from augustus.pmml.odg.Formula import Formula
 
@@ -65,8 +65,12 @@ class PlotCurve(PmmlPlotContent):
       - high: high edge of domain (in x or t) for mathematical
         formulae.
       - numSamples: number of locations to sample for mathematical
-        formulae.
-      - samplingMethod: "uniform", "random", or "adaptive".
+        formulae (the initial grid if samplingMethod is "adaptive").
+      - samplingMethod: "uniform", "random", or "adaptive"; an
+        adaptive curve is refined until straight lines between its
+        samples are within C{adaptiveTolerance} pixels of the
+        formula, and it is drawn with those straight lines
+        (derivative formulae are not used).
       - loop: if "true", draw a closed loop that connects the first
         and last points.
       - smooth: if "false", draw a jagged line between each data
@@ -82,6 +86,19 @@ class PlotCurve(PmmlPlotContent):
         stroke-width: properties of the line drawing.
 
     See the source code for the full XSD.
+
+    @type smoothingBins: int
+    @param smoothingBins: Number of grid cells per smoothingScale used to bin data points for smooth curves.
+    @type smoothingWindow: number
+    @param smoothingWindow: Number of smoothingScales beyond which data points do not contribute to a smooth curve.
+    @type adaptiveTolerance: number
+    @param adaptiveTolerance: Largest distance, in pixels, between an adaptively sampled formula and the straight lines that connect its samples.
+    @type adaptiveResolution: number
+    @param adaptiveResolution: Number of pixels assumed to span the extent of an adaptively sampled curve in x and in y (the default width of a PlotCanvas).
+    @type adaptiveDepth: int
+    @param adaptiveDepth: Maximum number of times that an interval of the initial grid is halved by adaptive sampling.
+    @type coordinateFormat: string
+    @param coordinateFormat: Format for SVG coordinates in the curve's path data.
     """
 
     styleProperties = ["fill", "fill-opacity", 
@@ -127,6 +144,13 @@ class PlotCurve(PmmlPlotContent):
 """ % PlotStyle.toString(styleDefaults)
 
     xfieldType = FakeFieldType("double", "continuous")
+    smoothingBins = 20
+    smoothingWindow = 5.0
+    smoothingMinPoints = 20
+    adaptiveTolerance = 0.5
+    adaptiveResolution = 1200.0
+    adaptiveDepth = 10
+    coordinateFormat = "%.3f"
 
     @classmethod
     def expressionsToPoints(cls, expression, derivative, samples, loop, functionTable, performanceTable):
@@ -299,32 +323,153 @@ class PlotCurve(PmmlPlotContent):
         return xlist, ylist, dxlist, dylist, xfieldType, yfieldType
 
     @staticmethod
-    def pointsToSmoothCurve(xarray, yarray, samples, smoothingScale, loop):
-        """Fit a smooth line through a set of given numeric points
-        with a characteristic smoothing scale.
+    def _evaluateFormulae(parsed, samples, logarithmic, functionTable, performanceTable):
+        """Used by C{adaptiveSamples} to compute the points of a
+        curve in the coordinates in which it is drawn (log10 for a
+        logarithmic axis)."""
 
-        This is a non-parametric locally linear fit, used to plot data
-        as a smooth line.
+        if len(parsed) == 1:
+            sampleTable = DataTable({"x": "double"}, {"x": samples})
+            roles = ("y(x)",)
+        else:
+            sampleTable = DataTable({"t": "double"}, {"t": samples})
+            roles = ("x(t)", "y(t)")
+
+        valid = NP("ones", len(samples), dtype=NP.dtype(bool))
+        points = []
+        for formula, role in zip(parsed, roles):
+            dataColumn = formula.evaluate(sampleTable, functionTable, performanceTable)
+            if not dataColumn.fieldType.isnumeric() and not dataColumn.fieldType.istemporal():
+                raise defs.PmmlValidationError("PlotFormula %s must return a numeric expression, not %r" % (role, dataColumn.fieldType))
+            if dataColumn.mask is not None:
+                NP("logical_and", valid, NP(dataColumn.mask == defs.VALID), valid)
+            points.append(NP("array", dataColumn.data, dtype=NP.dtype(float)))
+
+        if len(parsed) == 1:
+            points.insert(0, NP("array", samples, dtype=NP.dtype(float)))
+
+        for index in xrange(2):
+            NP("logical_and", valid, NP("isfinite", points[index]), valid)
+            if logarithmic[index]:
+                NP("logical_and", valid, NP(points[index] > 0.0), valid)
+                points[index][valid] = NP("log10", points[index][valid])
+            points[index][NP("logical_not", valid)] = 0.0
+
+        return points[0], points[1], valid
 
-        @type xarray: 1d Numpy array of numbers
-        @param xarray: Array of x values.
-        @type yarray: 1d Numpy array of numbers
-        @param yarray: Array of y values.
-        @type samples: 1d Numpy array of numbers
-        @param samples: Locations at which to fit the C{xarray} and C{yarray} with best-fit positions and derivatives.
-        @type smoothingScale: number
-        @param smoothingScale: Standard deviation of the Gaussian kernel used to smooth the locally linear fit.
-        @type loop: bool
-        @param loop: If False, disconnect the end of the fitted curve from the beginning.
-        @rtype: 4-tuple of 1d Numpy arrays
-        @return: C{xlist}, C{ylist}, C{dxlist}, C{dylist} appropriate for C{formatPathdata}.
+    @classmethod
+    def adaptiveSamples(cls, expression, samples, logarithmic, functionTable, performanceTable):
+        """Refine a grid of samples wherever straight lines between
+        them would visibly deviate from the curve.
+
+        Each level of refinement evaluates the formulae at the
+        midpoints of all of the intervals under consideration in one
+        batch.  A midpoint is kept if its distance from the straight
+        segment between the ends of its interval exceeds
+        C{adaptiveTolerance}, measured in pixels with
+        C{adaptiveResolution} pixels across the extent of the curve
+        seen so far; only the halves of those intervals are
+        considered in the next level, for at most C{adaptiveDepth}
+        levels.  Intervals that cross an edge of the formulae's
+        domain (where they are missing, invalid, infinite, or
+        non-positive on a logarithmic axis) are always split, to
+        locate the edge.
+
+        Deviations are measured relative to the extent of the curve
+        because the final coordinate system is not known until all
+        plot elements have been prepared, so a curve drawn in a
+        window that is zoomed in beyond its extent may be less
+        precise than C{adaptiveTolerance}.
+
+        @type expression: 1- or 2-tuple of strings
+        @param expression: If a 1-tuple, the string is passed to Formula and interpreted as y(x); if a 2-tuple, the strings are passed to Formula and interpreted as x(t), y(t).
+        @type samples: 1d Numpy array
+        @param samples: Sorted initial values of x or t.
+        @type logarithmic: 2-tuple of bool
+        @param logarithmic: Whether the x and y axes are logarithmic.
+        @type functionTable: FunctionTable
+        @param functionTable: Functions that may be used to perform the calculation.
+        @type performanceTable: PerformanceTable
+        @param performanceTable: Measures and records performance (time and memory consumption) of the process.
+        @rtype: 1d Numpy array
+        @return: Sorted values of x or t, including the initial samples.
         """
 
+        parsed = [Formula.parse(x) for x in expression]
+
+        x, y, valid = cls._evaluateFormulae(parsed, samples, logarithmic, functionTable, performanceTable)
+        t0, t1 = samples[:-1], samples[1:]
+        x0, x1 = x[:-1], x[1:]
+        y0, y1 = y[:-1], y[1:]
+        valid0, valid1 = valid[:-1], valid[1:]
+
+        xmin, xmax, ymin, ymax = None, None, None, None
+        output = [samples]
+        for level in xrange(cls.adaptiveDepth):
+            if len(t0) == 0:
+                break
+
+            tm = NP(NP(t0 + t1) / 2.0)
+            xm, ym, validm = cls._evaluateFormulae(parsed, tm, logarithmic, functionTable, performanceTable)
+
+            for xarray, yarray, varray in (x0, y0, valid0), (x1, y1, valid1), (xm, ym, validm):
+                if varray.any():
+                    xmin = min(xmin, xarray[varray].min()) if xmin is not None else xarray[varray].min()
+                    xmax = max(xmax, xarray[varray].max()) if xmax is not None else xarray[varray].max()
+                    ymin = min(ymin, yarray[varray].min()) if ymin is not None else yarray[varray].min()
+                    ymax = max(ymax, yarray[varray].max()) if ymax is not None else yarray[varray].max()
+            if xmin is None:
+                break
+
+            xscale = cls.adaptiveResolution / (xmax - xmin) if xmax > xmin else cls.adaptiveResolution
+            yscale = cls.adaptiveResolution / (ymax - ymin) if ymax > ymin else cls.adaptiveResolution
+
+            # distance in pixels from the midpoint to the segment between the ends of the interval
+            dx = NP(NP(x1 - x0) * xscale)
+            dy = NP(NP(y1 - y0) * yscale)
+            px = NP(NP(xm - x0) * xscale)
+            py = NP(NP(ym - y0) * yscale)
+            length2 = NP(NP(dx * dx) + NP(dy * dy))
+            degenerate = NP(length2 == 0.0)
+            length2[degenerate] = 1.0
+            u = NP(NP(NP(px * dx) + NP(py * dy)) / length2)
+            NP("clip", u, 0.0, 1.0, u)
+            distance = NP("hypot", NP(px - NP(u * dx)), NP(py - NP(u * dy)))
+
+            allValid = NP("logical_and", NP("logical_and", valid0, valid1), validm)
+            anyValid = NP("logical_or", NP("logical_or", valid0, valid1), validm)
+            split = NP("logical_or", NP("logical_and", allValid, NP(distance > cls.adaptiveTolerance)), NP("logical_and", anyValid, NP("logical_not", allValid)))
+
+            # intervals that are too small to be divided in floating point
+            NP("logical_and", split, NP(tm > t0), split)
+            NP("logical_and", split, NP(tm < t1), split)
+
+            output.append(tm[split])
+
+            t0, tm, t1 = t0[split], tm[split], t1[split]
+            x0, xm, x1 = x0[split], xm[split], x1[split]
+            y0, ym, y1 = y0[split], ym[split], y1[split]
+            valid0, validm, valid1 = valid0[split], validm[split], valid1[split]
+
+            t0, t1 = NP("concatenate", (t0, tm)), NP("concatenate", (tm, t1))
+            x0, x1 = NP("concatenate", (x0, xm)), NP("concatenate", (xm, x1))
+            y0, y1 = NP("concatenate", (y0, ym)), NP("concatenate", (ym, y1))
+            valid0, valid1 = NP("concatenate", (valid0, validm)), NP("concatenate", (validm, valid1))
+
+        output = NP("concatenate", output)
+        output.sort()
+        performanceTable.count("PlotCurve adaptive samples", len(output))
+        return output
+
+    @staticmethod
+    def _exactLocalLinear(xarray, yarray, samples, smoothingScale):
+        """Used by C{pointsToSmoothCurve} for samples that have too little data nearby."""
+
         ylist = []
         dylist = []
 
         for sample in samples:
-            weights = NP(NP(NP("exp", NP(NP(-0.5 * NP("power", NP(xarray - sample), 2)) / NP(smoothingScale * smoothingScale))) / smoothingScale) / (math.sqrt(2.0*math.pi)))
+            weights = NP("exp", NP(NP(-0.5 * NP("power", NP(xarray - sample), 2)) / NP(smoothingScale * smoothingScale)))
             sum1 = weights.sum()
             sumx = NP(weights * xarray).sum()
             sumxx = NP(weights * NP(xarray * xarray)).sum()
@@ -338,10 +483,107 @@ class PlotCurve(PmmlPlotContent):
             ylist.append(intercept + (sample * slope))
             dylist.append(slope)
 
+        return NP("array", ylist, dtype=NP.dtype(float)), NP("array", dylist, dtype=NP.dtype(float))
+
+    @classmethod
+    def pointsToSmoothCurve(cls, xarray, yarray, samples, smoothingScale, loop):
+        """Fit a smooth line through a set of given numeric points
+        with a characteristic smoothing scale.
+
+        This is a non-parametric locally linear fit, used to plot data
+        as a smooth line.
+
+        The points are first binned on a grid of C{smoothingBins}
+        cells per C{smoothingScale}, keeping the count, mean x, mean
+        y, and the second moments about the means of each occupied
+        cell.  The five Gaussian-weighted sums of the fit are then
+        computed for all samples at once from the cells within
+        C{smoothingWindow} smoothing scales, evaluating the kernel at
+        each cell's mean x.  Relative to the exact weighted fit over
+        all points, this changes each weight by a fraction of order
+        M{(1/smoothingBins)^2 / 24} and drops the Gaussian tails
+        beyond C{smoothingWindow}; with the defaults, fitted values
+        typically agree with the exact fit to within 1e-4 of the
+        range of y (a few times 1e-3 near sparse data) and slopes to
+        within a few times 1e-3.  Samples with fewer than
+        C{smoothingMinPoints} points within half of the window, or too
+        little data to constrain a line, are fitted exactly, so sparse
+        data reproduce the exact fit.
+
+        @type xarray: 1d Numpy array of numbers
+        @param xarray: Array of x values.
+        @type yarray: 1d Numpy array of numbers
+        @param yarray: Array of y values.
+        @type samples: 1d Numpy array of numbers
+        @param samples: Locations at which to fit the C{xarray} and C{yarray} with best-fit positions and derivatives.
+        @type smoothingScale: number
+        @param smoothingScale: Standard deviation of the Gaussian kernel used to smooth the locally linear fit.
+        @type loop: bool
+        @param loop: If False, disconnect the end of the fitted curve from the beginning.
+        @rtype: 4-tuple of 1d Numpy arrays
+        @return: C{xlist}, C{ylist}, C{dxlist}, C{dylist} appropriate for C{formatPathdata}.
+        """
+
+        xarray = NP("asarray", xarray, dtype=NP.dtype(float))
+        yarray = NP("asarray", yarray, dtype=NP.dtype(float))
+        samples = NP("asarray", samples, dtype=NP.dtype(float))
+
+        ylist = NP("empty", len(samples), dtype=NP.dtype(float))
+        dylist = NP("empty", len(samples), dtype=NP.dtype(float))
+
+        if len(xarray) > 0 and len(samples) > 0:
+            cellWidth = smoothingScale / float(cls.smoothingBins)
+            origin = xarray.min()
+
+            cells = NP("floor", NP(NP(xarray - origin) / cellWidth)).astype(NP.dtype(int))
+            occupied, inverse = NP("unique", cells, return_inverse=True)
+
+            count = NP("bincount", inverse).astype(NP.dtype(float))
+            meanx = NP(NP("bincount", inverse, weights=xarray) / count)
+            meany = NP(NP("bincount", inverse, weights=yarray) / count)
+            deviationx = NP(xarray - meanx[inverse])
+            sxx = NP("bincount", inverse, weights=NP(deviationx * deviationx))
+            sxy = NP("bincount", inverse, weights=NP(deviationx * NP(yarray - meany[inverse])))
+
+            reach = int(math.ceil(cls.smoothingWindow * cls.smoothingBins)) + 1
+            sampleCells = NP("floor", NP(NP(samples - origin) / cellWidth))
+            low = NP("searchsorted", occupied, NP(sampleCells - reach))
+            high = NP("searchsorted", occupied, NP(sampleCells + reach), side="right")
+
+            span = max(1, int(NP(high - low).max()))
+            window = NP(low[:,NP.newaxis] + NP("arange", span))
+            inWindow = NP(window < high[:,NP.newaxis])
+            NP("minimum", window, len(occupied) - 1, window)
+
+            u = NP(meanx[window] - samples[:,NP.newaxis])
+            kernel = NP("exp", NP(-0.5 * NP("square", NP(u / smoothingScale))))
+            kernel[NP("logical_not", inWindow)] = 0.0
+            weight = NP(kernel * count[window])
+
+            wu = NP(weight * u)
+            sum1 = weight.sum(axis=1)
+            sumu = wu.sum(axis=1)
+            sumuu = NP(NP(wu * u) + NP(kernel * sxx[window])).sum(axis=1)
+            sumy = NP(weight * meany[window]).sum(axis=1)
+            sumuy = NP(NP(wu * meany[window]) + NP(kernel * sxy[window])).sum(axis=1)
+
+            # fit y = value + slope * (x - sample) about each sample, for numerical stability
+            delta = NP(NP(sum1 * sumuu) - NP(sumu * sumu))
+            ylist[:] = NP(NP(NP(sumuu * sumy) - NP(sumu * sumuy)) / delta)
+            dylist[:] = NP(NP(NP(sum1 * sumuy) - NP(sumu * sumy)) / delta)
+
+            # where data are sparse, the truncated tails can be as heavy as the nearest points and the line is barely constrained,
+            # so fit exactly if fewer than smoothingMinPoints are within half of the window or the sums are too degenerate to solve
+            nearby = NP(NP(kernel >= math.exp(-0.5 * (cls.smoothingWindow / 2.0)**2)) * count[window]).sum(axis=1)
+            degenerate = NP(nearby < cls.smoothingMinPoints)
+            NP("logical_or", degenerate, NP(delta <= NP(1e-8 * NP("square", NP(sum1 * smoothingScale)))), degenerate)
+            degenerate = NP("nonzero", degenerate)[0]
+            if len(degenerate) > 0:
+                ylist[degenerate], dylist[degenerate] = cls._exactLocalLinear(xarray, yarray, samples[degenerate], smoothingScale)
+
         xlist = samples
-        ylist = NP("array", ylist, dtype=NP.dtype(float))
         dxlist = NP((NP("roll", xlist, -1) - NP("roll", xlist, 1)) / 2.0)
-        dylist = NP("array", dylist, dtype=NP.dtype(float)) * dxlist
+        dylist = NP(dylist * dxlist)
         if not loop:
             dxlist[0] = 0.0
             dxlist[-1] = 0.0
@@ -350,10 +592,14 @@ class PlotCurve(PmmlPlotContent):
 
         return xlist, ylist, dxlist, dylist
 
-    @staticmethod
-    def formatPathdata(xlist, ylist, dxlist, dylist, plotCoordinates, loop, smooth):
+    @classmethod
+    def formatPathdata(cls, xlist, ylist, dxlist, dylist, plotCoordinates, loop, smooth):
         """Compute SVG path data from position and derivatives lists.
 
+        All of the segments are formatted in one vectorized operation
+        with C{PlotNumberFormat.formatArrays}, using
+        C{coordinateFormat} for each coordinate.
+
         @type xlist: 1d Numpy array of numbers
         @param xlist: Array of x values at each point t.
         @type ylist: 1d Numpy array of numbers
@@ -372,20 +618,14 @@ class PlotCurve(PmmlPlotContent):
         @return: When concatenated with spaces, the return type is appropriate for an SVG path's C{d} attribute.
         """
 
-        pathdata = []
-        if not smooth:
-            X, Y = plotCoordinates(xlist, ylist)
-
-            nextIsMoveto = True
-            for x, y in itertools.izip(X, Y):
-                if nextIsMoveto:
-                    pathdata.append("M %r %r" % (x, y))
-                    nextIsMoveto = False
-                else:
-                    pathdata.append("L %r %r" % (x, y))
+        c = cls.coordinateFormat
+        X, Y = plotCoordinates(xlist, ylist)
+        if len(X) == 0:
+            return ["Z"] if loop else []
 
-            if loop:
-                pathdata.append("Z")
+        pathdata = ["M %s %s" % (c, c) % (X[0], Y[0])]
+        if not smooth:
+            segments = PlotNumberFormat.formatArrays("L %s %s\n" % (c, c), X[1:], Y[1:])
 
         else:
             C1x = NP("roll", xlist, 1) + NP("roll", dxlist, 1) / 3.0
@@ -393,20 +633,16 @@ class PlotCurve(PmmlPlotContent):
             C2x = xlist - dxlist / 3.0
             C2y = ylist - dylist / 3.0
 
-            X, Y = plotCoordinates(xlist, ylist)
             C1X, C1Y = plotCoordinates(C1x, C1y)
             C2X, C2Y = plotCoordinates(C2x, C2y)
-            
-            nextIsMoveto = True
-            for x, y, c1x, c1y, c2x, c2y in itertools.izip(X, Y, C1X, C1Y, C2X, C2Y):
-                if nextIsMoveto:
-                    pathdata.append("M %r %r" % (x, y))
-                    nextIsMoveto = False
-                else:
-                    pathdata.append("C %r %r %r %r %r %r" % (c1x, c1y, c2x, c2y, x, y))
 
-            if loop:
-                pathdata.append("Z")
+            segments = PlotNumberFormat.formatArrays("C %s %s %s %s %s %s\n" % (c, c, c, c, c, c), C1X[1:], C1Y[1:], C2X[1:], C2Y[1:], X[1:], Y[1:])
+
+        # one string per segment, as callers splice the moveto and the last segment
+        pathdata.extend(segments.split("\n")[:-1])
+
+        if loop:
+            pathdata.append("Z")
 
         return pathdata
 
@@ -418,21 +654,18 @@ class PlotCurve(PmmlPlotContent):
         @type high: number
         @param high: Maximum value to sample.
         @rtype: 1d Numpy array
-        @return: An array of uniform, random, or adaptive samples of an interval.
+        @return: An array of uniform or random samples of an interval, or the initial uniform grid for adaptive sampling.
         """
 
         numSamples = self.get("numSamples", defaultFromXsd=True, convertType=True)
         samplingMethod = self.get("samplingMethod", defaultFromXsd=True)
 
-        if samplingMethod == "uniform":
-            samples = NP("linspace", low, high, numSamples, endpoint=True)
-
-        elif samplingMethod == "random":
+        if samplingMethod == "random":
             samples = NP(NP(NP(NP.random.rand(numSamples)) * (high - low)) + low)
             samples.sort()
 
         else:
-            raise NotImplementedError("TODO: add 'adaptive'")
+            samples = NP("linspace", low, high, numSamples, endpoint=True)
 
         return samples
 
@@ -506,7 +739,19 @@ class PlotCurve(PmmlPlotContent):
             samples = self.generateSamples(low, high)
 
             loop = self.get("loop", defaultFromXsd=True, convertType=True)
-            state.x, state.y, state.dx, state.dy, xfieldType, yfieldType = self.expressionsToPoints(expression, derivative, samples, loop, functionTable, performanceTable)
+            if self.get("samplingMethod", defaultFromXsd=True) == "adaptive":
+                if plotRange is not None:
+                    logarithmic = plotRange.xStrictlyPositive, plotRange.yStrictlyPositive
+                else:
+                    logarithmic = False, False
+                samples = self.adaptiveSamples(expression, samples, logarithmic, functionTable, performanceTable)
+
+                # the samples are close enough for straight lines, so derivatives are not needed
+                state.x, state.y, state.dx, state.dy, xfieldType, yfieldType = self.expressionsToPoints(expression, (None,) * len(expression), samples, loop, functionTable, performanceTable)
+                state.dx, state.dy = None, None
+
+            else:
+                state.x, state.y, state.dx, state.dy, xfieldType, yfieldType = self.expressionsToPoints(expression, derivative, samples, loop, functionTable, performanceTable)
 
         else:
             performanceTable.pause("PlotCurve prepare")
@@ -680,10 +925,11 @@ class PlotCurve(PmmlPlotContent):
 
                 X0, Y0 = plotCoordinates(state.x[0], state.y[0])
 
-                pathdata2 = ["M %r %r" % firstPoint]
-                pathdata2.append("L %r %r" % (X0, Y0))
+                c = self.coordinateFormat
+                pathdata2 = ["M %s %s" % (c, c) % firstPoint]
+                pathdata2.append("L %s %s" % (c, c) % (X0, Y0))
                 pathdata2.extend(pathdata[1:])
-                pathdata2.append("L %r %r" % lastPoint)
+                pathdata2.append("L %s %s" % (c, c) % lastPoint)
 
                 output.append(svg.path(d=" ".join(pathdata2), style=PlotStyle.toString(fillStyle)))
 
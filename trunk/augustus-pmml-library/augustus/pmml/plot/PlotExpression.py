@@ -65,4 +65,4 @@ class PlotExpression(PmmlBinding):
         @return: The result of the expression as a DataColumn.
         """
 
-        return self.childOfClass(PmmlExpression).evaluate(dataTable, functionTable, performanceTable)
+        return self.childOfClass(PmmlExpression).evaluateCached(dataTable, functionTable, performanceTable, "plot expressions")
@@ -66,5 +66,20 @@ class PlotFormula(PmmlBinding):
         @return: The result of the expression as a DataColumn.
         """
 
-        parsed = Formula.parse(self.text)
-        return parsed.evaluate(dataTable, functionTable, performanceTable)
+        parsed = self.cached("parsed", lambda: Formula.parse(self.text))
+        fieldNames = self.cached("referencedFields", lambda: self._referencedFields(parsed))
+        return dataTable.expressions.reuse(("PlotFormula", repr(parsed)), fieldNames, lambda: parsed.evaluate(dataTable, functionTable, performanceTable), dataTable, functionTable, performanceTable, "plot expressions")
+
+    @staticmethod
+    def _referencedFields(parsed):
+        """Used by C{evaluate}."""
+
+        output = set()
+        stack = [parsed]
+        while len(stack) > 0:
+            node = stack.pop()
+            if isinstance(node, Formula.FieldRef):
+                output.add(node.name)
+            elif isinstance(node, Formula.Apply):
+                stack.extend(node.arguments)
+        return tuple(sorted(output))
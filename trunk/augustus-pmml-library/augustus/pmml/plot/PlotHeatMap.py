@@ -29,6 +29,7 @@ from augustus.core.DataTable import DataTable
 from augustus.core.plot.PmmlPlotContent import PmmlPlotContent
 from augustus.core.FakeFieldType import FakeFieldType
 from augustus.core.ArrayToPng import ArrayToPng
+from augustus.core.plot.PlotQuantileSketch import PlotQuantileSketch
 from augustus.pmml.odg.Formula import Formula
 
 class PlotHeatMap(PmmlPlotContent):
@@ -71,6 +72,16 @@ class PlotHeatMap(PmmlPlotContent):
         of many SVG viewers that blend the borders of a raster
         image into the background.
 
+    For 2d histograms and means, the bins are fixed by the first
+    chunk of data: any of xbins, ybins, xlow, ylow, xhigh, yhigh
+    that are not specified are derived from the extremes and a
+    bounded-size PlotQuantileSketch of the selected data (with the
+    Freedman-Diaconis rule for the number of bins).  After that,
+    each chunk only adds to the sums in each bin, so the
+    DataTableState does not grow with the number of rows, and
+    states from separate chunks or MapReduce workers can be
+    combined with C{mergeStates}.
+
     See the source code for the full XSD.
     """
 
@@ -112,6 +123,160 @@ class PlotHeatMap(PmmlPlotContent):
     xyfieldType = FakeFieldType("double", "continuous")
     zfieldType = FakeFieldType("double", "continuous")
 
+    @staticmethod
+    def determineBins(bins, low, high, array):
+        """Determine the number of bins and the range of one axis of
+        a 2d histogram from explicitly set values where available
+        and the first chunk of data where necessary.
+
+        The implicit C{low} and C{high} are the extrema of the data
+        and the implicit number of bins follows the Freedman-Diaconis
+        rule, using quartiles from a PlotQuantileSketch of the data.
+
+        @type bins: int or None
+        @param bins: Input number of bins.
+        @type low: number or None
+        @param low: Low edge.
+        @type high: number or None
+        @param high: High edge.
+        @type array: 1d Numpy array of numbers
+        @param array: Finite, selected values to use to implicitly derive the others.
+        @rtype: 3-tuple
+        @return: C{bins}, C{low}, C{high}
+        """
+
+        if len(array) > 0:
+            if low is None: low = float(NP("amin", array))
+            if high is None: high = float(NP("amax", array))
+        else:
+            if low is None: low = 0.0
+            if high is None: high = 1.0
+
+        if bins is None:
+            sketch = PlotQuantileSketch.fromArray(array)
+            q1, q3 = PlotQuantileSketch.quantiles(sketch, [25.0, 75.0])
+            binWidth = 2.0 * (q3 - q1) / math.pow(max(sketch["count"], 1.0), 1.0/3.0)
+            if binWidth > 0.0:
+                bins = max(10, int(math.ceil((high - low)/binWidth)))
+            else:
+                bins = 10
+
+        return bins, low, high
+
+    @staticmethod
+    def binIndexes(xarray, yarray, mask, xbins, xlow, xhigh, ybins, ylow, yhigh):
+        """Find the bin of each data point, linearized as
+        C{ybin*xbins + xbin}.
+
+        Bins include their low edges; the last bin also includes
+        its high edge.
+
+        @type xarray: 1d Numpy array
+        @param xarray: The x values.
+        @type yarray: 1d Numpy array
+        @param yarray: The y values.
+        @type mask: 1d Numpy array of bool
+        @param mask: Which points to consider.
+        @type xbins: int
+        @param xbins: Number of bins in x.
+        @type xlow: number
+        @param xlow: Low edge in x.
+        @type xhigh: number
+        @param xhigh: High edge in x.
+        @type ybins: int
+        @param ybins: Number of bins in y.
+        @type ylow: number
+        @param ylow: Low edge in y.
+        @type yhigh: number
+        @param yhigh: High edge in y.
+        @rtype: 2-tuple
+        @return: The linearized bin indexes of the points in range, and a 1d Numpy array of bool indicating which of the input points those are.
+        """
+
+        selection = NP("logical_and", mask, NP("logical_and", NP(xarray >= xlow), NP(xarray <= xhigh)))
+        NP("logical_and", selection, NP("logical_and", NP(yarray >= ylow), NP(yarray <= yhigh)), selection)
+
+        xindex = PlotHeatMap._axisIndexes(xarray[selection], xbins, xlow, xhigh)
+        yindex = PlotHeatMap._axisIndexes(yarray[selection], ybins, ylow, yhigh)
+
+        return NP(NP(yindex * xbins) + xindex), selection
+
+    @staticmethod
+    def _axisIndexes(array, bins, low, high):
+        """Used by C{binIndexes}."""
+
+        index = NP("floor", NP(NP(array - low) * (bins / float(high - low)))).astype(NP.dtype(int))
+        NP("clip", index, 0, bins - 1, index)
+
+        # correct roundoff at the edges, so that the bins are exactly those of numpy.histogram2d
+        edges = NP("linspace", low, high, bins + 1)
+        NP("subtract", index, NP(array < edges[index]), index)
+        NP("add", index, NP("logical_and", NP(array >= edges[index + 1]), NP(index < bins - 1)), index)
+        return index
+
+    @staticmethod
+    def accumulate(persistentState, key, indexes, weights, xbins, ybins):
+        """Add the (weighted) number of points in each bin to a sum
+        in a DataTableState.
+
+        @type persistentState: dict
+        @param persistentState: The DataTableState entry of this PlotHeatMap.  Modified in place.
+        @type key: string
+        @param key: Name of the sum, such as "histogram", "numer", or "denom".
+        @type indexes: 1d Numpy array of int
+        @param indexes: Linearized bin indexes from C{binIndexes}.
+        @type weights: 1d Numpy array or None
+        @param weights: Weights of the points; if None, count each point once.
+        @type xbins: int
+        @param xbins: Number of bins in x.
+        @type ybins: int
+        @param ybins: Number of bins in y.
+        """
+
+        counts = NP("bincount", indexes, weights=weights, minlength=xbins*ybins).astype(NP.dtype(float))
+        counts = NP("reshape", counts, (ybins, xbins))
+
+        if key in persistentState:
+            persistentState[key] = NP(persistentState[key] + counts)
+        else:
+            persistentState[key] = counts
+
+    @staticmethod
+    def mergeStates(persistentState, other):
+        """Combine the DataTableStates of two 2d histograms (or
+        means) that were filled from separate parts of a dataset.
+
+        Merging is associative and commutative, so the parts can be
+        filled in parallel and combined in any order.  Neither input
+        is modified.
+
+        @type persistentState: dict
+        @param persistentState: The state of one PlotHeatMap, as stored in C{dataTable.state[stateId]}.
+        @type other: dict
+        @param other: The state of the other PlotHeatMap.
+        @rtype: dict
+        @return: A new state representing both.
+        @raise PmmlValidationError: If the states have different bins or contents.
+        """
+
+        if "xbins" not in persistentState:
+            return dict(other)
+        if "xbins" not in other:
+            return dict(persistentState)
+
+        binning = ("xbins", "xlow", "xhigh", "ybins", "ylow", "yhigh")
+        if [persistentState[x] for x in binning] != [other[x] for x in binning]:
+            raise defs.PmmlValidationError("Cannot merge PlotHeatMap states with different bins; specify xbins, xlow, xhigh, ybins, ylow, and yhigh to fill them in parallel")
+
+        sums = [x for x in ("histogram", "numer", "denom") if x in persistentState or x in other]
+        if any(x not in persistentState or x not in other for x in sums):
+            raise defs.PmmlValidationError("Cannot merge PlotHeatMap states of different types")
+
+        output = dict((x, persistentState[x]) for x in binning)
+        for x in sums:
+            output[x] = NP(persistentState[x] + other[x])
+        return output
+
     def prepare(self, state, dataTable, functionTable, performanceTable, plotRange):
         """Prepare a plot element for drawing.
 
@@ -198,45 +363,16 @@ class PlotHeatMap(PmmlPlotContent):
             ydataColumn = yexpr[0].evaluate(dataTable, functionTable, performanceTable)
             performanceTable.unpause("PlotHeatMap prepare")
 
-            xbins = self.get("xbins", convertType=True)
-            xlow = self.get("xlow", convertType=True)
-            xhigh = self.get("xhigh", convertType=True)
-            ybins = self.get("ybins", convertType=True)
-            ylow = self.get("ylow", convertType=True)
-            yhigh = self.get("yhigh", convertType=True)
-
-            if len(xdataColumn) > 0:
-                if xlow is None: xlow = NP("nanmin", xdataColumn.data)
-                if xhigh is None: xhigh = NP("nanmax", xdataColumn.data)
-                if ylow is None: ylow = NP("nanmin", ydataColumn.data)
-                if yhigh is None: yhigh = NP("nanmax", ydataColumn.data)
-            else:
-                if xlow is None: xlow = 0.0
-                if xhigh is None: xhigh = 1.0
-                if ylow is None: ylow = 0.0
-                if yhigh is None: yhigh = 1.0
-
-            if xbins is None:
-                q1, q3 = NP("percentile", xdataColumn.data, [25.0, 75.0])
-                binWidth = 2.0 * (q3 - q1) / math.pow(len(xdataColumn.data), 1.0/3.0)
-                if binWidth > 0.0:
-                    xbins = max(10, int(math.ceil((xhigh - xlow)/binWidth)))
-                else:
-                    xbins = 10
-
-            if ybins is None:
-                q1, q3 = NP("percentile", ydataColumn.data, [25.0, 75.0])
-                binWidth = 2.0 * (q3 - q1) / math.pow(len(ydataColumn.data), 1.0/3.0)
-                if binWidth > 0.0:
-                    ybins = max(10, int(math.ceil((yhigh - ylow)/binWidth)))
-                else:
-                    ybins = 10
-
-            if xlow >= xhigh or ylow >= yhigh:
-                raise defs.PmmlValidationError("xlow must be less than xhigh and ylow must be less than yhigh")
+            mask = NP("ones", len(dataTable), dtype=NP.dtype(bool))
+            if xdataColumn.mask is not None:
+                NP("logical_and", mask, NP(xdataColumn.mask == defs.VALID), mask)
+            if ydataColumn.mask is not None:
+                NP("logical_and", mask, NP(ydataColumn.mask == defs.VALID), mask)
 
-            if plotRange.xStrictlyPositive or plotRange.yStrictlyPositive:
-                raise defs.PmmlValidationError("PlotHeatMap can only be properly displayed in linear x, y coordinates")
+            if len(cutExpression) == 1:
+                performanceTable.pause("PlotHeatMap prepare")
+                NP("logical_and", mask, cutExpression[0].select(dataTable, functionTable, performanceTable), mask)
+                performanceTable.unpause("PlotHeatMap prepare")
 
             persistentState = {}
             stateId = self.get("stateId")
@@ -246,46 +382,32 @@ class PlotHeatMap(PmmlPlotContent):
                 else:
                     dataTable.state[stateId] = persistentState
 
-            if len(zmean) == 0:
-                if "xbins" in persistentState: xbins = persistentState["xbins"]
-                if "xlow" in persistentState: xlow = persistentState["xlow"]
-                if "xhigh" in persistentState: xhigh = persistentState["xhigh"]
-                if "ybins" in persistentState: ybins = persistentState["ybins"]
-                if "ylow" in persistentState: ylow = persistentState["ylow"]
-                if "yhigh" in persistentState: yhigh = persistentState["yhigh"]
-
-                persistentState["xbins"] = xbins
-                persistentState["xlow"] = xlow
-                persistentState["xhigh"] = xhigh
-                persistentState["ybins"] = ybins
-                persistentState["ylow"] = ylow
-                persistentState["yhigh"] = yhigh
-                
-            xbinWidth = (xhigh - xlow) / float(xbins)
-            ybinWidth = (yhigh - ylow) / float(ybins)
+            if "xbins" not in persistentState:
+                performanceTable.begin("establish bins")
+                finite = NP("logical_and", mask, NP("logical_and", NP("isfinite", xdataColumn.data), NP("isfinite", ydataColumn.data)))
+                persistentState["xbins"], persistentState["xlow"], persistentState["xhigh"] = self.determineBins(self.get("xbins", convertType=True), self.get("xlow", convertType=True), self.get("xhigh", convertType=True), xdataColumn.data[finite])
+                persistentState["ybins"], persistentState["ylow"], persistentState["yhigh"] = self.determineBins(self.get("ybins", convertType=True), self.get("ylow", convertType=True), self.get("yhigh", convertType=True), ydataColumn.data[finite])
+                performanceTable.end("establish bins")
 
-            mask = NP("ones", len(dataTable), dtype=NP.dtype(float))
-            if xdataColumn.mask is not None:
-                NP("multiply", mask, (xdataColumn.mask == defs.VALID), mask)
-            if ydataColumn.mask is not None:
-                NP("multiply", mask, (ydataColumn.mask == defs.VALID), mask)
+            xbins = persistentState["xbins"]
+            xlow = persistentState["xlow"]
+            xhigh = persistentState["xhigh"]
+            ybins = persistentState["ybins"]
+            ylow = persistentState["ylow"]
+            yhigh = persistentState["yhigh"]
 
-            if len(cutExpression) == 1:
-                performanceTable.pause("PlotHeatMap prepare")
-                NP("multiply", mask, cutExpression[0].select(dataTable, functionTable, performanceTable), mask)
-                performanceTable.unpause("PlotHeatMap prepare")
+            if xlow >= xhigh or ylow >= yhigh:
+                raise defs.PmmlValidationError("xlow must be less than xhigh and ylow must be less than yhigh")
 
-            if len(zmean) == 0 and len(zweight) == 0:
-                histogram, xedges, yedges = NP("histogram2d", ydataColumn.data, xdataColumn.data, bins=(ybins, xbins), range=[[ylow, yhigh], [xlow, xhigh]], weights=mask)
-                if len(dataTable) == 0:
-                    # work around Numpy <= 1.6.1 bug
-                    histogram = NP("zeros", (ybins, xbins), dtype=NP.dtype(float))
+            if plotRange.xStrictlyPositive or plotRange.yStrictlyPositive:
+                raise defs.PmmlValidationError("PlotHeatMap can only be properly displayed in linear x, y coordinates")
 
-                if "histogram" in persistentState:
-                    persistentState["histogram"] = NP(persistentState["histogram"] + histogram)
-                else:
-                    persistentState["histogram"] = histogram
+            performanceTable.begin("binning")
+            indexes, selection = self.binIndexes(xdataColumn.data, ydataColumn.data, mask, xbins, xlow, xhigh, ybins, ylow, yhigh)
+            performanceTable.end("binning")
 
+            if len(zmean) == 0 and len(zweight) == 0:
+                self.accumulate(persistentState, "histogram", indexes, None, xbins, ybins)
                 histogram = persistentState["histogram"]
 
                 if plotRange.zStrictlyPositive:
@@ -303,17 +425,13 @@ class PlotHeatMap(PmmlPlotContent):
                 weightsDataColumn = zweight[0].evaluate(dataTable, functionTable, performanceTable)
                 performanceTable.unpause("PlotHeatMap prepare")
 
+                weights = weightsDataColumn.data[selection]
                 if weightsDataColumn.mask is not None:
-                    NP("multiply", mask, (weightsDataColumn.mask == defs.VALID), mask)
-                weights = NP(weightsDataColumn.data * mask)
-
-                histogram, xedges, yedges = NP("histogram2d", ydataColumn.data, xdataColumn.data, bins=(ybins, xbins), range=[[ylow, yhigh], [xlow, xhigh]], weights=weights)
-
-                if "histogram" in persistentState:
-                    persistentState["histogram"] = NP(persistentState["histogram"] + histogram)
-                else:
-                    persistentState["histogram"] = histogram
+                    valid = NP(weightsDataColumn.mask[selection] == defs.VALID)
+                    indexes = indexes[valid]
+                    weights = weights[valid]
 
+                self.accumulate(persistentState, "histogram", indexes, weights, xbins, ybins)
                 histogram = persistentState["histogram"]
 
                 if plotRange.zStrictlyPositive:
@@ -335,19 +453,14 @@ class PlotHeatMap(PmmlPlotContent):
                 zdataColumn = zmean[0].evaluate(dataTable, functionTable, performanceTable)
                 performanceTable.unpause("PlotHeatMap prepare")
 
+                weights = zdataColumn.data[selection]
                 if zdataColumn.mask is not None:
-                    NP("multiply", mask, (zdataColumn.mask == defs.VALID), mask)
-                weights = NP(zdataColumn.data * mask)
-
-                numer, xedges, yedges = NP("histogram2d", ydataColumn.data, xdataColumn.data, bins=(ybins, xbins), range=[[ylow, yhigh], [xlow, xhigh]], weights=weights)
-                denom, xedges, yedges = NP("histogram2d", ydataColumn.data, xdataColumn.data, bins=(ybins, xbins), range=[[ylow, yhigh], [xlow, xhigh]], weights=mask)
+                    valid = NP(zdataColumn.mask[selection] == defs.VALID)
+                    indexes = indexes[valid]
+                    weights = weights[valid]
 
-                if "numer" in persistentState:
-                    persistentState["numer"] = NP(persistentState["numer"] + numer)
-                    persistentState["denom"] = NP(persistentState["denom"] + denom)
-                else:
-                    persistentState["numer"] = numer
-                    persistentState["denom"] = denom
+                self.accumulate(persistentState, "numer", indexes, weights, xbins, ybins)
+                self.accumulate(persistentState, "denom", indexes, None, xbins, ybins)
 
                 numer = persistentState["numer"]
                 denom = persistentState["denom"]
@@ -423,10 +536,10 @@ class PlotHeatMap(PmmlPlotContent):
         ylow = state.ylow
         yhigh = state.yhigh
 
-        reddata = NP("empty", len(state.zdata), dtype=NP.uint8)
-        greendata = NP("empty", len(state.zdata), dtype=NP.uint8)
-        bluedata = NP("empty", len(state.zdata), dtype=NP.uint8)
-        alphadata = NP("empty", len(state.zdata), dtype=NP.uint8)
+        reddata = NP("zeros", len(state.zdata), dtype=NP.uint8)
+        greendata = NP("zeros", len(state.zdata), dtype=NP.uint8)
+        bluedata = NP("zeros", len(state.zdata), dtype=NP.uint8)
+        alphadata = NP("zeros", len(state.zdata), dtype=NP.uint8)
 
         if len(plotCoordinates.gradient) == 0:
             offsets = [0.0, 1.0]
@@ -29,6 +29,7 @@ from augustus.core.NumpyInterface import NP
 from augustus.core.FakeFieldType import FakeFieldType
 from augustus.core.plot.PmmlPlotContent import PmmlPlotContent
 from augustus.core.plot.PlotStyle import PlotStyle
+from augustus.core.plot.PlotQuantileSketch import PlotQuantileSketch
 from augustus.core.plot.PlotCoordinates import PlotCoordinates
 from augustus.pmml.plot.PlotCurve import PlotCurve
 from augustus.pmml.plot.PlotScatter import PlotScatter
@@ -71,6 +72,18 @@ class PlotHistogram(PmmlPlotContent):
         coordinates.
       - marker: marker to use for "points" visualization (see
         PlotScatter).
+      - compression: if numerical data have no explicit C{low} and
+        C{high}, the distribution is summarized by a
+        PlotQuantileSketch with this compression parameter and the
+        bins are derived from the summary.
+      - exactLimit: number of values that the PlotQuantileSketch
+        keeps verbatim before it starts compressing.  Up to this
+        limit, the histogram is exact.
+      - maxUnique: maximum number of distinct values kept for
+        string data without explicit Values.  Beyond this limit,
+        the counts are reduced with the Misra-Gries algorithm, which
+        underestimates each count by at most the total count divided
+        by C{maxUnique + 1}.
       - style: CSS style properties.
         
     CSS properties:
@@ -81,6 +94,13 @@ class PlotHistogram(PmmlPlotContent):
       - marker-size, marker-outline: marker style for "points"
         visualization.
 
+    The DataTableState has a bounded size for all binTypes: fixed
+    bins ("nonuniform", "explicit", and "scale" with explicit C{low}
+    and C{high}) are kept as arrays of counts, implicit "scale" bins
+    as a PlotQuantileSketch, and "unique" bins as at most
+    C{maxUnique} counts.  States from separate processes or
+    MapReduce reducers can be combined with C{mergeStates}.
+
     See the source code for the full XSD.
     """
 
@@ -126,6 +146,9 @@ class PlotHistogram(PmmlPlotContent):
             </xs:attribute>
             <xs:attribute name="gap" type="xs:double" use="optional" default="0.0" />
             <xs:attribute name="marker" type="PLOT-MARKER-TYPE" use="optional" default="circle" />
+            <xs:attribute name="compression" type="xs:double" use="optional" default="1000" />
+            <xs:attribute name="exactLimit" type="xs:nonNegativeInteger" use="optional" default="10000" />
+            <xs:attribute name="maxUnique" type="xs:positiveInteger" use="optional" default="1000" />
             <xs:attribute name="style" type="xs:string" use="optional" default="%s" />
         </xs:complexType>
     </xs:element>
@@ -187,8 +210,8 @@ class PlotHistogram(PmmlPlotContent):
         @param low: Low edge.
         @type high: number or None
         @param high: High edge.
-        @type array: 1d Numpy array of numbers
-        @param array: Dataset to use to implicitly derive values.
+        @type array: 1d Numpy array of numbers or dict
+        @param array: Dataset to use to implicitly derive values, or a PlotQuantileSketch that summarizes it.
         @rtype: 3-tuple
         @return: C{numBins}, C{low}, C{high}
         """
@@ -196,8 +219,15 @@ class PlotHistogram(PmmlPlotContent):
         generateLow = (low is None)
         generateHigh = (high is None)
 
-        if generateLow: low = float(array.min())
-        if generateHigh: high = float(array.max())
+        if isinstance(array, dict):
+            minimum, maximum, length = array["min"], array["max"], array["count"]
+            percentile = lambda p: PlotQuantileSketch.quantiles(array, p)
+        else:
+            minimum, maximum, length = array.min(), array.max(), len(array)
+            percentile = lambda p: NP("percentile", array, p)
+
+        if generateLow: low = float(minimum)
+        if generateHigh: high = float(maximum)
 
         if low == high:
             low, high = low - 1.0, high + 1.0
@@ -218,8 +248,8 @@ class PlotHistogram(PmmlPlotContent):
 
         if numBins is None:
             # the Freedman-Diaconis rule
-            q1, q3 = NP("percentile", array, [25.0, 75.0])
-            binWidth = 2.0 * (q3 - q1) / math.pow(len(array), 1.0/3.0)
+            q1, q3 = percentile([25.0, 75.0])
+            binWidth = 2.0 * (q3 - q1) / math.pow(length, 1.0/3.0)
             if binWidth > 0.0:
                 numBins = max(10, int(math.ceil((high - low)/binWidth)))
             else:
@@ -317,6 +347,90 @@ class PlotHistogram(PmmlPlotContent):
 
         return selection, lastLimitPoint, lastClosed, lastInterval
 
+    @staticmethod
+    def reduceUnique(count, maxUnique):
+        """Bound the number of distinct values in a "unique"
+        histogram with the Misra-Gries algorithm.
+
+        If there are more than C{maxUnique} values, the
+        (C{maxUnique} + 1)th largest count is subtracted from all
+        counts and values whose count is no longer positive are
+        dropped.  This keeps every value whose share of the total is
+        larger than 1/(C{maxUnique} + 1), and reducing after adding
+        two summaries gives a valid summary of the combined data.
+
+        @type count: dict
+        @param count: Counts (or total weights) of each value, keyed by string.
+        @type maxUnique: int or None
+        @param maxUnique: Maximum number of values to keep; if None, do not reduce.
+        @rtype: 2-tuple
+        @return: The reduced counts (a new dict) and the total count that was removed.
+        """
+
+        if maxUnique is None or len(count) <= maxUnique:
+            return count, 0.0
+
+        threshold = sorted(count.values(), reverse=True)[maxUnique]
+        reduced = dict((string, value - threshold) for string, value in count.items() if value > threshold)
+        return reduced, float(sum(count.values()) - sum(reduced.values()))
+
+    @classmethod
+    def mergeStates(cls, persistentState, other):
+        """Combine the DataTableStates of two PlotHistograms that
+        were filled from separate parts of a dataset.
+
+        Merging is associative and commutative (up to the accuracy
+        of the adaptive summaries), so histograms of partitioned data
+        can be filled in parallel and combined in any order.  Neither
+        input is modified.
+
+        @type persistentState: dict
+        @param persistentState: The state of one PlotHistogram, as stored in C{dataTable.state[stateId]}.
+        @type other: dict
+        @param other: The state of the other PlotHistogram.
+        @rtype: dict
+        @return: A new state representing both.
+        @raise PmmlValidationError: If the states have different binTypes or incompatible fixed bins.
+        """
+
+        binType = persistentState.get("binType")
+        if binType is None:
+            return dict(other)
+        if other.get("binType") is None:
+            return dict(persistentState)
+
+        if binType != other["binType"]:
+            raise defs.PmmlValidationError("Cannot merge PlotHistogram states with binType \"%s\" and \"%s\"" % (binType, other["binType"]))
+
+        output = {"binType": binType}
+
+        if binType == "unique":
+            count = dict(persistentState["count"])
+            for string, value in other["count"].items():
+                count[string] = count.get(string, 0.0) + value
+
+            maxUnique = persistentState.get("maxUnique", other.get("maxUnique"))
+            output["count"], discarded = cls.reduceUnique(count, maxUnique)
+            output["discarded"] = persistentState.get("discarded", 0.0) + other.get("discarded", 0.0) + discarded
+            output["maxUnique"] = maxUnique
+
+        elif binType == "scale" and "sketch" in persistentState and "sketch" in other:
+            output["sketch"] = PlotQuantileSketch.merge(persistentState["sketch"], other["sketch"])
+
+        else:
+            if binType == "scale" and ("sketch" in persistentState or "sketch" in other or \
+                                       [persistentState[x] for x in ("numBins", "low", "high")] != [other[x] for x in ("numBins", "low", "high")]):
+                raise defs.PmmlValidationError("Cannot merge PlotHistogram states with different bins")
+            if len(persistentState["count"]) != len(other["count"]):
+                raise defs.PmmlValidationError("Cannot merge PlotHistogram states with different numbers of bins")
+
+            for key in "numBins", "low", "high":
+                if key in persistentState:
+                    output[key] = persistentState[key]
+            output["count"] = NP(NP("array", persistentState["count"], dtype=NP.dtype(float)) + NP("array", other["count"], dtype=NP.dtype(float)))
+
+        return output
+
     def prepare(self, state, dataTable, functionTable, performanceTable, plotRange):
         """Prepare a plot element for drawing.
 
@@ -393,25 +507,33 @@ class PlotHistogram(PmmlPlotContent):
             persistentState["binType"] = binType
 
             if binType == "nonuniform":
-                persistentState["count"] = [0.0] * len(intervals)
+                persistentState["count"] = NP("zeros", len(intervals), dtype=NP.dtype(float))
 
             elif binType == "explicit":
-                persistentState["count"] = [0.0] * len(values)
+                persistentState["count"] = NP("zeros", len(values), dtype=NP.dtype(float))
 
             elif binType == "unique":
                 persistentState["count"] = {}
+                persistentState["discarded"] = 0.0
+                persistentState["maxUnique"] = self.get("maxUnique", defaultFromXsd=True, convertType=True)
 
             elif binType == "scale":
                 numBins = self.get("numBins", convertType=True)
                 low = self.get("low", convertType=True)
                 high = self.get("high", convertType=True)
 
-                numBins, low, high = self.determineScaleBins(numBins, low, high, array)
+                if low is not None and high is not None:
+                    numBins, low, high = self.determineScaleBins(numBins, low, high, array)
 
-                persistentState["low"] = low
-                persistentState["high"] = high
-                persistentState["numBins"] = numBins
-                persistentState["count"] = [0.0] * numBins
+                    persistentState["low"] = low
+                    persistentState["high"] = high
+                    persistentState["numBins"] = numBins
+                    persistentState["count"] = NP("zeros", numBins, dtype=NP.dtype(float))
+
+                else:
+                    compression = self.get("compression", defaultFromXsd=True, convertType=True)
+                    exactLimit = self.get("exactLimit", defaultFromXsd=True, convertType=True)
+                    persistentState["sketch"] = PlotQuantileSketch.new(compression, exactLimit)
 
             performanceTable.end("establish binType")
 
@@ -419,7 +541,7 @@ class PlotHistogram(PmmlPlotContent):
         if persistentState["binType"] == "nonuniform":
             performanceTable.begin("binType nonuniform")
 
-            count = [0.0] * len(intervals)
+            count = NP("zeros", len(intervals), dtype=NP.dtype(float))
             edges = []
             lastLimitPoint = None
             lastClosed = None
@@ -434,7 +556,7 @@ class PlotHistogram(PmmlPlotContent):
                     else:
                         count[index] += weight[selection].sum()
 
-            persistentState["count"] = [x + y for x, y in itertools.izip(count, persistentState["count"])]
+            persistentState["count"] = NP(NP("array", persistentState["count"], dtype=NP.dtype(float)) + count)
 
             state.fieldType = self.fieldTypeNumeric
             state.count = persistentState["count"]
@@ -447,7 +569,7 @@ class PlotHistogram(PmmlPlotContent):
         elif persistentState["binType"] == "explicit":
             performanceTable.begin("binType explicit")
 
-            count = [0.0] * len(values)
+            count = NP("zeros", len(values), dtype=NP.dtype(float))
             displayValues = []
 
             for index, value in enumerate(values):
@@ -461,7 +583,7 @@ class PlotHistogram(PmmlPlotContent):
                 else:
                     count[index] += weight[selection].sum()
 
-            persistentState["count"] = [x + y for x, y in itertools.izip(count, persistentState["count"])]
+            persistentState["count"] = NP(NP("array", persistentState["count"], dtype=NP.dtype(float)) + count)
 
             state.fieldType = dataColumn.fieldType
             state.count = persistentState["count"]
@@ -483,16 +605,23 @@ class PlotHistogram(PmmlPlotContent):
                 string = dataColumn.fieldType.valueToString(u, displayValue=False)
 
                 if string in persistentCount:
-                    persistentCount[string] += counts[i]
+                    persistentCount[string] += float(counts[i])
                 else:
-                    persistentCount[string] = counts[i]
+                    persistentCount[string] = float(counts[i])
+
+            if "maxUnique" not in persistentState:
+                persistentState["maxUnique"] = self.get("maxUnique", defaultFromXsd=True, convertType=True)
+            persistentCount, discarded = self.reduceUnique(persistentCount, persistentState["maxUnique"])
+            persistentState["count"] = persistentCount
+            persistentState["discarded"] = persistentState.get("discarded", 0.0) + discarded
+            missingSum = persistentState["discarded"]
 
             tosort = [(count, string) for string, count in persistentCount.items()]
             tosort.sort(reverse=True)
 
             numBins = self.get("numBins", convertType=True)
             if numBins is not None:
-                missingSum = sum(count for count, string in tosort[numBins:])
+                missingSum += sum(count for count, string in tosort[numBins:])
                 tosort = tosort[:numBins]
 
             state.fieldType = dataColumn.fieldType
@@ -504,33 +633,37 @@ class PlotHistogram(PmmlPlotContent):
         elif persistentState["binType"] == "scale":
             performanceTable.begin("binType scale")
 
-            numBins = persistentState["numBins"]
-            low = persistentState["low"]
-            high = persistentState["high"]
-            binWidth = (high - low) / float(numBins)
+            if "sketch" in persistentState:
+                PlotQuantileSketch.update(persistentState["sketch"], array, weight)
+
+                numBins = self.get("numBins", convertType=True)
+                low = self.get("low", convertType=True)
+                high = self.get("high", convertType=True)
+                numBins, low, high = self.determineScaleBins(numBins, low, high, persistentState["sketch"])
+
+                count = PlotQuantileSketch.histogram(persistentState["sketch"], numBins, low, high)
 
-            binAssignments = NP("array", NP("floor", NP(NP(array - low)/binWidth)), dtype=NP.dtype(int))
-            binAssignments[NP(binAssignments > numBins)] = numBins
-            binAssignments[NP(binAssignments < 0)] = numBins
-            
-            if len(binAssignments) == 0:
-                count = NP("empty", 0, dtype=NP.dtype(float))
             else:
+                numBins = persistentState["numBins"]
+                low = persistentState["low"]
+                high = persistentState["high"]
+                binWidth = (high - low) / float(numBins)
+
+                binAssignments = NP("array", NP("floor", NP(NP(array - low)/binWidth)), dtype=NP.dtype(int))
+                selection = NP("logical_and", NP(binAssignments >= 0), NP(binAssignments < numBins))
+
                 if weight is None:
-                    count = NP("bincount", binAssignments)
+                    count = NP("bincount", binAssignments[selection], minlength=numBins)
                 else:
-                    count = NP("bincount", binAssignments, weights=weight)
+                    count = NP("bincount", binAssignments[selection], weights=weight[selection], minlength=numBins)
 
-            if len(count) < numBins:
-                padded = NP("zeros", numBins, dtype=NP.dtype(float))
-                padded[:len(count)] = count
-            else:
-                padded = count
+                persistentState["count"] = NP(NP("array", persistentState["count"], dtype=NP.dtype(float)) + count)
+                count = persistentState["count"]
 
-            persistentState["count"] = [x + y for x, y in itertools.izip(padded, persistentState["count"])]
+            binWidth = (high - low) / float(numBins)
 
             state.fieldType = self.fieldTypeNumeric
-            state.count = persistentState["count"]
+            state.count = count
             state.edges = [(low + i*binWidth, low + (i + 1)*binWidth) for i in xrange(numBins)]
             lowEdge = low
             highEdge = high
@@ -756,10 +889,11 @@ class PlotHistogram(PmmlPlotContent):
                         firstPoint = plotCoordinates(0.0, Ay[0])
                         lastPoint = plotCoordinates(0.0, Dy[-1])
                         
-                    pathdata2 = ["M %r %r" % firstPoint, pathdata[0].replace("M", "L")]
+                    c = PlotCurve.coordinateFormat
+                    pathdata2 = ["M %s %s" % (c, c) % firstPoint, pathdata[0].replace("M", "L")]
                     pathdata2.extend(pathdata[1:])
                     pathdata2.append(pathdata[-1])
-                    pathdata2.append("L %r %r" % lastPoint)
+                    pathdata2.append("L %s %s" % (c, c) % lastPoint)
 
                     output.append(svg.path(d=" ".join(pathdata2), style=PlotStyle.toString(fillStyle)))
 
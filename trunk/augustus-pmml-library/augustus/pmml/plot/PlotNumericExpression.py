@@ -72,7 +72,7 @@ class PlotNumericExpression(PmmlBinding):
         @raise PmmlValidationError: If the expression is not numeric, this method raises an error.
         """
 
-        dataColumn = self.childOfClass(PmmlExpression).evaluate(dataTable, functionTable, performanceTable)
+        dataColumn = self.childOfClass(PmmlExpression).evaluateCached(dataTable, functionTable, performanceTable, "plot expressions")
 
         if not dataColumn.fieldType.isnumeric() and not dataColumn.fieldType.istemporal():
             raise defs.PmmlValidationError("PlotNumericExpression must evaluate to a number, not %s" % dataColumn.fieldType)
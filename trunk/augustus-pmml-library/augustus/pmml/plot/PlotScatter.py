@@ -22,14 +22,15 @@
 
 import math
 import random
-import itertools
 import copy
+from xml.sax.saxutils import escape
 
 from augustus.core.defs import defs
 from augustus.core.SvgBinding import SvgBinding
 from augustus.core.NumpyInterface import NP
 from augustus.core.plot.PmmlPlotContent import PmmlPlotContent
 from augustus.core.plot.PlotStyle import PlotStyle
+from augustus.core.plot.PlotNumberFormat import PlotNumberFormat
 from augustus.pmml.plot.PlotSvgAnnotation import PlotSvgAnnotation
 
 class PlotScatter(PmmlPlotContent):
@@ -63,7 +64,24 @@ class PlotScatter(PmmlPlotContent):
       - marker: type of marker, must be one of PLOT-MARKER-TYPE.
       - limit: optional number specifying the maximum number of data
         points to generate.  If the true number of data points exceeds
-        this limit, points will be randomly chosen.
+        this limit, points will be randomly chosen.  With "reservoir"
+        or "stratified" sampling, this is also the number of points
+        kept in the DataTableState.
+      - sampling: how points are kept between chunks of data; one of
+        "all" (every point is kept in buffers that grow with the
+        stream), "reservoir" (a uniform random sample of at most
+        C{limit} points), or "stratified" (every Nth point of the
+        stream, with N doubling as needed to keep at most C{limit}
+        points).  The "reservoir" and "stratified" modes require a
+        C{limit} and use a fixed amount of memory.
+      - overplotResolution: optional cell size in SVG coordinates.
+        If specified, markers (and error bars) that fall into the
+        same cell are drawn only once, with their weights stacked as
+        opacities.  With opaque markers, a value of about one pixel
+        does not change the appearance of the plot.  Translucent
+        markers (fill-opacity or stroke-opacity less than 1) look
+        darker where they are stacked, which a single marker cannot
+        reproduce, so they are never collapsed.
       - style: CSS style properties.
 
     CSS properties:
@@ -77,6 +95,11 @@ class PlotScatter(PmmlPlotContent):
       - marker-outline: optional outline for the marker.
 
     See the source code for the full XSD.
+
+    @type coordinateFormat: string
+    @param coordinateFormat: Format for SVG coordinates of markers and error bars.
+    @type opacityFormat: string
+    @param opacityFormat: Format for the opacities of weighted markers and error bars.
     """
 
     styleProperties = ["fill", "fill-opacity", 
@@ -99,6 +122,16 @@ class PlotScatter(PmmlPlotContent):
             <xs:attribute name="stateId" type="xs:string" use="optional" />
             <xs:attribute name="marker" type="PLOT-MARKER-TYPE" use="optional" default="circle" />
             <xs:attribute name="limit" type="INT-NUMBER" use="optional" />
+            <xs:attribute name="sampling" use="optional" default="all">
+                <xs:simpleType>
+                    <xs:restriction base="xs:string">
+                        <xs:enumeration value="all" />
+                        <xs:enumeration value="reservoir" />
+                        <xs:enumeration value="stratified" />
+                    </xs:restriction>
+                </xs:simpleType>
+            </xs:attribute>
+            <xs:attribute name="overplotResolution" type="xs:double" use="optional" />
             <xs:attribute name="style" type="xs:string" use="optional" default="%s" />
         </xs:complexType>
     </xs:element>
@@ -107,6 +140,11 @@ class PlotScatter(PmmlPlotContent):
 
     xsdRemove = ["PLOT-MARKER-TYPE", "PlotSvgMarker"]
 
+    columnNames = ["x", "y", "exup", "exdown", "eyup", "eydown", "weight"]
+
+    coordinateFormat = "%.3f"
+    opacityFormat = "%.3g"
+
     xsdAppend = ["""<xs:simpleType name="PLOT-MARKER-TYPE" xmlns:xs="http://www.w3.org/2001/XMLSchema">
     <xs:restriction base="xs:string">
         <xs:enumeration value="circle" />
@@ -206,10 +244,20 @@ class PlotScatter(PmmlPlotContent):
             return svg.g(copy.deepcopy(svgBinding), id=svgIdMarker, transform=transform)
 
     @staticmethod
-    def drawErrorbars(xarray, yarray, exup, exdown, eyup, eydown, markerSize, strokeStyle, weight=None):
-        """Draw a set of error bars, given values in global SVG
+    def _literal(text):
+        """Used by C{errorbarFragments} and C{markerFragments}."""
+
+        return escape(text, {"\"": "&quot;"}).replace("%", "%%")
+
+    @classmethod
+    def errorbarFragments(cls, xarray, yarray, exup, exdown, eyup, eydown, markerSize, strokeStyle, weight=None):
+        """Serialize a set of error bars, given values in global SVG
         coordinates.
 
+        All of the paths are formatted in one vectorized operation
+        with C{PlotNumberFormat.formatArrays}, which is much faster
+        than building an SVG element for each one.
+
         @type xarray: 1d Numpy array
         @param xarray: The X positions in global SVG coordinates.
         @type yarray: 1d Numpy array
@@ -228,38 +276,285 @@ class PlotScatter(PmmlPlotContent):
         @param strokeStyle: CSS style attributes appropriate for stroking (not filling) in dictionary form.
         @type weight: 1d Numpy array or None
         @param weight: The opacity of each point (if None, the opacity is not specified and is therefore fully opaque).
+        @rtype: string
+        @return: Serialized SVG C{<path>} elements, one per point.
         """
 
-        svg = SvgBinding.elementMaker
-        output = []
-        
+        if exup is None and eyup is None:
+            return ""
+
         strokeStyle = copy.copy(strokeStyle)
         strokeStyle["fill"] = "none"
+        strokeStyle.pop("opacity", None)
+
+        c = cls.coordinateFormat
+        segment = "M %s %s L %s %s" % (c, c, c, c)
+        segments = []
+        arrays = []
+
+        if exup is not None:
+            segments.extend([segment] * 3)
+            arrays.extend([exdown, yarray, exup, yarray])
+            arrays.extend([exdown, NP(yarray - markerSize), exdown, NP(yarray + markerSize)])
+            arrays.extend([exup, NP(yarray - markerSize), exup, NP(yarray + markerSize)])
+
+        if eyup is not None:
+            segments.extend([segment] * 3)
+            arrays.extend([xarray, eydown, xarray, eyup])
+            arrays.extend([NP(xarray - markerSize), eydown, NP(xarray + markerSize), eydown])
+            arrays.extend([NP(xarray - markerSize), eyup, NP(xarray + markerSize), eyup])
+
+        template = "<path d=\"%s\" style=\"%s" % (" ".join(segments), cls._literal(PlotStyle.toString(strokeStyle)))
         if weight is not None:
-            strokeStyle["opacity"] = "1"
+            template += "; opacity: %s" % cls.opacityFormat
+            arrays.append(weight)
+        template += "\"/>"
 
-        for i in xrange(len(xarray)):
-            x = xarray[i]
-            y = yarray[i]
+        return PlotNumberFormat.formatArrays(template, *arrays)
 
-            pathdata = []
+    @classmethod
+    def markerFragments(cls, xarray, yarray, markerReference, weight=None):
+        """Serialize a set of references to a marker, given values in
+        global SVG coordinates.
 
-            if exup is not None:
-                pathdata.append("M %r %r L %r %r" % (exdown[i], y             ,   exup[i], y             ))
-                pathdata.append("M %r %r L %r %r" % (exdown[i], y - markerSize, exdown[i], y + markerSize))
-                pathdata.append("M %r %r L %r %r" % (  exup[i], y - markerSize,   exup[i], y + markerSize))
+        @type xarray: 1d Numpy array
+        @param xarray: The X positions in global SVG coordinates.
+        @type yarray: 1d Numpy array
+        @param yarray: The Y positions in global SVG coordinates.
+        @type markerReference: string
+        @param markerReference: The XLink reference to the marker, such as "#id".
+        @type weight: 1d Numpy array or None
+        @param weight: The opacity of each point (if None, the opacity is not specified and is therefore fully opaque).
+        @rtype: string
+        @return: Serialized SVG C{<use>} elements, one per point.
+        """
 
-            if eyup is not None:
-                pathdata.append("M %r %r L %r %r" % (x             , eydown[i], x             ,   eyup[i]))
-                pathdata.append("M %r %r L %r %r" % (x - markerSize, eydown[i], x + markerSize, eydown[i]))
-                pathdata.append("M %r %r L %r %r" % (x - markerSize, eyup[i],   x + markerSize,   eyup[i]))
+        c = cls.coordinateFormat
+        if weight is None:
+            template = "<use x=\"%s\" y=\"%s\" xlink:href=\"%s\"/>" % (c, c, cls._literal(markerReference))
+            return PlotNumberFormat.formatArrays(template, xarray, yarray)
+        else:
+            template = "<use x=\"%s\" y=\"%s\" style=\"opacity: %s;\" xlink:href=\"%s\"/>" % (c, c, cls.opacityFormat, cls._literal(markerReference))
+            return PlotNumberFormat.formatArrays(template, xarray, yarray, weight)
 
-            if len(pathdata) > 0:
-                if weight is not None:
-                    strokeStyle["opacity"] = repr(weight[i])
-                output.append(svg.path(d=" ".join(pathdata), style=PlotStyle.toString(strokeStyle)))
+    @classmethod
+    def drawErrorbars(cls, xarray, yarray, exup, exdown, eyup, eydown, markerSize, strokeStyle, weight=None):
+        """Draw a set of error bars, given values in global SVG
+        coordinates.
 
-        return output
+        @type xarray: 1d Numpy array
+        @param xarray: The X positions in global SVG coordinates.
+        @type yarray: 1d Numpy array
+        @param yarray: The Y positions in global SVG coordinates.
+        @type exup: 1d Numpy array or None
+        @param exup: The upper ends of the X error bars in global SVG coordinates (already added to the X positions).
+        @type exdown: 1d Numpy array or None
+        @param exdown: The lower ends of the X error bars in global SVG coordinates (already added to the X positions).
+        @type eyup: 1d Numpy array or None
+        @param eyup: The upper ends of the Y error bars in global SVG coordinates (already added to the Y positions).
+        @type eydown: 1d Numpy array or None
+        @param eydown: The lower ends of the Y error bars in global SVG coordinates (already added to the Y positions).
+        @type markerSize: number
+        @param markerSize: Size of the marker in SVG coordinates.
+        @type strokeStyle: dict
+        @param strokeStyle: CSS style attributes appropriate for stroking (not filling) in dictionary form.
+        @type weight: 1d Numpy array or None
+        @param weight: The opacity of each point (if None, the opacity is not specified and is therefore fully opaque).
+        @rtype: list of SvgBinding
+        @return: SVG C{<path>} elements, one per point.
+        """
+
+        return list(SvgBinding.loadFragments(cls.errorbarFragments(xarray, yarray, exup, exdown, eyup, eydown, markerSize, strokeStyle, weight)))
+
+    @staticmethod
+    def _growPoints(persistentState, columns, capacityLimit=None):
+        """Used by C{appendPoints}, C{reservoirPoints}, and C{stratifiedPoints}."""
+
+        length = persistentState["length"]
+        needed = length + len(columns["x"])
+
+        for name, selected in columns.iteritems():
+            buffer = persistentState.get(name)
+
+            if buffer is None or length == 0:
+                if capacityLimit is not None:
+                    selected = NP("array", selected)   # don't hold a reference to the whole chunk
+                buffer = selected
+            elif needed > len(buffer):
+                capacity = max(needed, 2 * len(buffer))
+                if capacityLimit is not None:
+                    capacity = max(needed, min(capacity, capacityLimit))
+                newBuffer = NP("empty", capacity, dtype=buffer.dtype)
+                newBuffer[:length] = buffer[:length]
+                newBuffer[length:needed] = selected
+                buffer = newBuffer
+            else:
+                buffer[length:needed] = selected
+
+            persistentState[name] = buffer
+
+        persistentState["length"] = needed
+
+    @staticmethod
+    def _initializePoints(persistentState):
+        """Used by C{appendPoints}, C{reservoirPoints}, and C{stratifiedPoints}."""
+
+        if "length" not in persistentState:
+            if "x" in persistentState:
+                persistentState["length"] = len(persistentState["x"])   # state saved before buffers had a length
+            else:
+                persistentState["length"] = 0
+        if "seen" not in persistentState:
+            persistentState["seen"] = persistentState["length"]
+
+    @classmethod
+    def appendPoints(cls, persistentState, columns):
+        """Append a chunk of points to the buffers in a persistent
+        state.
+
+        The buffers grow geometrically, so appending is amortized
+        O(1) per point, and only the first C{persistentState["length"]}
+        items of each buffer are valid.
+
+        @type persistentState: dict
+        @param persistentState: Persistent state with a buffer for each column and the keys "length" (number of valid points) and "seen" (number of points observed).  Modified in place.
+        @type columns: dict of 1d Numpy arrays
+        @param columns: New values for each column (e.g. "x", "y"), all with the same length.
+        """
+
+        cls._initializePoints(persistentState)
+        length = len(columns["x"])
+        cls._growPoints(persistentState, columns)
+        persistentState["seen"] += length
+
+    @classmethod
+    def reservoirPoints(cls, persistentState, columns, limit):
+        """Update a uniform random sample of at most C{limit} points
+        with a chunk of new points (reservoir sampling).
+
+        Each point observed so far has the same probability of being
+        in the sample, regardless of how the stream was divided into
+        chunks.
+
+        @type persistentState: dict
+        @param persistentState: Persistent state, as in C{appendPoints}.  Modified in place.
+        @type columns: dict of 1d Numpy arrays
+        @param columns: New values for each column (e.g. "x", "y"), all with the same length.
+        @type limit: int
+        @param limit: Maximum number of points to keep.
+        """
+
+        cls._initializePoints(persistentState)
+        length = len(columns["x"])
+        seen = persistentState["seen"]
+
+        fill = max(0, min(length, limit - persistentState["length"]))
+        if fill > 0:
+            cls._growPoints(persistentState, dict((name, array[:fill]) for name, array in columns.iteritems()), limit)
+
+        if length > fill:
+            index = NP(NP("arange", seen + fill, seen + length, dtype=NP.dtype(float)) + 1.0)
+            slots = NP(NP.random.random_sample(length - fill) * index).astype(NP.dtype(int))
+            items = NP("nonzero", NP(slots < limit))[0]
+            slots = slots[items]
+            items += fill
+
+            # when two new points land in the same slot, the later one wins
+            slots, last = NP("unique", slots[::-1], return_index=True)
+            items = items[::-1][last]
+
+            for name, array in columns.iteritems():
+                persistentState[name][slots] = array[items]
+
+        persistentState["seen"] = seen + length
+
+    @classmethod
+    def stratifiedPoints(cls, persistentState, columns, limit):
+        """Update a systematic sample of at most C{limit} points with
+        a chunk of new points.
+
+        The sample keeps every point whose position in the stream is
+        a multiple of a stride, which starts at 1 and doubles (keeping
+        every other point in the sample) whenever the sample would
+        exceed C{limit}.  Unlike C{reservoirPoints}, the sample is
+        deterministic and spread evenly over the stream.
+
+        @type persistentState: dict
+        @param persistentState: Persistent state, as in C{appendPoints}, with an additional "stride" key.  Modified in place.
+        @type columns: dict of 1d Numpy arrays
+        @param columns: New values for each column (e.g. "x", "y"), all with the same length.
+        @type limit: int
+        @param limit: Maximum number of points to keep.
+        """
+
+        cls._initializePoints(persistentState)
+        length = len(columns["x"])
+        seen = persistentState["seen"]
+        stride = persistentState.get("stride", 1)
+        kept = persistentState["length"]
+
+        while kept + ((seen + length - 1) // stride - (seen - 1) // stride) > max(limit, 1):
+            if kept > 0:
+                kept = (kept + 1) // 2
+                for name in columns:
+                    buffer = persistentState[name]
+                    buffer[:kept] = buffer[:2*kept:2]
+            stride *= 2
+
+        persistentState["length"] = kept
+        persistentState["stride"] = stride
+
+        first = -(-seen // stride) * stride
+        cls._growPoints(persistentState, dict((name, array[first - seen::stride]) for name, array in columns.iteritems()), limit)
+        persistentState["seen"] = seen + length
+
+    @staticmethod
+    def collapseOverplotted(resolution, arrays, weight=None):
+        """Find points that would be drawn on top of one another at a
+        given resolution.
+
+        Points are grouped by the cell of a square grid (in global SVG
+        coordinates) that each of their coordinates falls into, and
+        only the first point of each group is drawn.  If the points
+        have weights (opacities), the representative of each group
+        gets the opacity of all of its members stacked,
+        M{1 - prod(1 - w)}.  This only preserves the appearance of
+        markers that are otherwise opaque: an unweighted stack of
+        markers with fill-opacity M{a} is darker than one such marker,
+        and no opacity of a single marker can reproduce it when the
+        stack is opaque enough, so C{draw} does not collapse
+        translucent markers.
+
+        @type resolution: number
+        @param resolution: Size of a grid cell in global SVG coordinates.
+        @type arrays: list of 1d Numpy arrays
+        @param arrays: Coordinates that must all fall into the same cells for two points to be collapsed (positions and error bar ends).
+        @type weight: 1d Numpy array or None
+        @param weight: The opacity of each point.
+        @rtype: 2-tuple of 1d Numpy arrays
+        @return: Indexes of the points to draw (in their original order) and their new weights (or None if C{weight} is None).
+        """
+
+        keys = [NP("floor", NP(array / resolution)).astype(NP.dtype(int)) for array in arrays]
+        order = NP("lexsort", keys[::-1])
+
+        newGroup = NP("zeros", len(order), dtype=NP.dtype(bool))
+        newGroup[0] = True
+        for key in keys:
+            sortedKey = key[order]
+            newGroup[1:] |= NP(sortedKey[1:] != sortedKey[:-1])
+
+        representatives = order[newGroup]
+        reorder = NP("argsort", representatives)
+
+        if weight is None:
+            return representatives[reorder], None
+
+        group = NP("empty", len(order), dtype=NP.dtype(int))
+        group[order] = NP("cumsum", newGroup) - 1
+        transparency = NP("bincount", group, weights=NP("log1p", NP("negative", NP("clip", weight, 0.0, 1.0))), minlength=len(representatives))
+        combined = NP(1.0 - NP("exp", transparency))
+        return representatives[reorder], combined[reorder]
 
     def _makeMarker(self, plotDefinitions):
         """Used by C{draw}."""
@@ -372,59 +667,46 @@ class PlotScatter(PmmlPlotContent):
         if eydown is not None and eydown.mask is not None:
             NP("logical_and", selection, NP(eydown.mask == defs.VALID), selection)
 
-        state.x = xValues.data[selection]
-        state.y = yValues.data[selection]
-
-        state.exup, state.exdown, state.eyup, state.eydown = None, None, None, None
+        columns = {"x": xValues.data[selection], "y": yValues.data[selection]}
         if exup is not None:
-            state.exup = exup.data[selection]
+            columns["exup"] = exup.data[selection]
         if exdown is not None:
-            state.exdown = exdown.data[selection]
+            columns["exdown"] = exdown.data[selection]
         if eyup is not None:
-            state.eyup = eyup.data[selection]
+            columns["eyup"] = eyup.data[selection]
         if eydown is not None:
-            state.eydown = eydown.data[selection]
-
-        state.weight = None
+            columns["eydown"] = eydown.data[selection]
         if weight is not None:
-            state.weight = weight.data[selection]
+            columns["weight"] = weight.data[selection]
+
+        sampling = self.get("sampling", defaultFromXsd=True)
+        limit = self.get("limit")
+        if limit is not None:
+            limit = int(limit)
+        elif sampling != "all":
+            raise defs.PmmlValidationError("PlotScatter with sampling=\"%s\" requires a limit" % sampling)
 
+        persistentState = {}
         stateId = self.get("stateId")
         if stateId is not None:
-            persistentState = dataTable.state.get(stateId)
-            if persistentState is None:
-                persistentState = {}
+            if stateId in dataTable.state:
+                persistentState = dataTable.state[stateId]
+            else:
                 dataTable.state[stateId] = persistentState
+
+        if sampling == "all":
+            self.appendPoints(persistentState, columns)
+        elif sampling == "reservoir":
+            self.reservoirPoints(persistentState, columns, limit)
+        elif sampling == "stratified":
+            self.stratifiedPoints(persistentState, columns, limit)
+
+        length = persistentState["length"]
+        for name in self.columnNames:
+            if name in persistentState:
+                setattr(state, name, persistentState[name][:length])
             else:
-                state.x = NP("concatenate", (persistentState["x"], state.x))
-                state.y = NP("concatenate", (persistentState["y"], state.y))
-
-                if exup is not None:
-                    state.exup = NP("concatenate", (persistentState["exup"], state.exup))
-                if exdown is not None:
-                    state.exdown = NP("concatenate", (persistentState["exdown"], state.exdown))
-                if eyup is not None:
-                    state.eyup = NP("concatenate", (persistentState["eyup"], state.eyup))
-                if eydown is not None:
-                    state.eydown = NP("concatenate", (persistentState["eydown"], state.eydown))
-
-                if weight is not None:
-                    state.weight = NP("concatenate", (persistentState["weight"], state.weight))
-
-            persistentState["x"] = state.x
-            persistentState["y"] = state.y
-
-            if exup is not None:
-                persistentState["exup"] = state.exup
-            if exdown is not None:
-                persistentState["exdown"] = state.exdown
-            if eyup is not None:
-                persistentState["eyup"] = state.eyup
-            if eydown is not None:
-                persistentState["eydown"] = state.eydown
-
-            if weight is not None:
-                persistentState["weight"] = state.weight
+                setattr(state, name, None)
 
         plotRange.expand(state.x, state.y, xValues.fieldType, yValues.fieldType)
         performanceTable.end("PlotScatter prepare")
@@ -447,11 +729,8 @@ class PlotScatter(PmmlPlotContent):
         @return: An SVG fragment representing the fully drawn plot element.
         """
 
-        svg = SvgBinding.elementMaker
         performanceTable.begin("PlotScatter draw")
 
-        output = svg.g()
-
         marker = self._makeMarker(plotDefinitions)
         plotDefinitions[marker.get("id")] = marker
 
@@ -521,14 +800,26 @@ class PlotScatter(PmmlPlotContent):
         plotx, ploty = plotCoordinates(plotx, ploty)
 
         style = self.getStyleState()
+
+        overplotResolution = self.get("overplotResolution", convertType=True)
+        translucent = any(style.get(x) is not None and float(style[x]) < 1.0 for x in ("fill-opacity", "stroke-opacity"))
+        if overplotResolution is not None and not translucent and len(plotx) > 0:
+            arrays = [x for x in (plotx, ploty, plotexup, plotexdown, ploteyup, ploteydown) if x is not None]
+            indexes, plotweight = self.collapseOverplotted(overplotResolution, arrays, plotweight)
+            plotx = plotx[indexes]
+            ploty = ploty[indexes]
+            if plotexup is not None:
+                plotexup = plotexup[indexes]
+                plotexdown = plotexdown[indexes]
+            if ploteyup is not None:
+                ploteyup = ploteyup[indexes]
+                ploteydown = ploteydown[indexes]
+
         strokeStyle = dict((x, style[x]) for x in style if x.startswith("stroke"))
-        output.extend(self.drawErrorbars(plotx, ploty, plotexup, plotexdown, ploteyup, ploteydown, float(style["marker-size"]), strokeStyle, weight=plotweight))
+        errorbars = self.errorbarFragments(plotx, ploty, plotexup, plotexdown, ploteyup, ploteydown, float(style["marker-size"]), strokeStyle, weight=plotweight)
+        markers = self.markerFragments(plotx, ploty, "#" + marker.get("id"), weight=plotweight)
 
-        markerReference = "#" + marker.get("id")
-        if plotweight is None:
-            output.extend(svg.use(**{"x": repr(x), "y": repr(y), defs.XLINK_HREF: markerReference}) for x, y in itertools.izip(plotx, ploty))
-        else:
-            output.extend(svg.use(**{"x": repr(x), "y": repr(y), "style": "opacity: %r;" % w, defs.XLINK_HREF: markerReference}) for x, y, w in itertools.izip(plotx, ploty, plotweight))
+        output = SvgBinding.loadFragments(errorbars + markers)
 
         svgId = self.get("svgId")
         if svgId is not None:
@@ -64,21 +64,37 @@ class PlotSelection(PmmlBinding):
         @type performanceTable: PerformanceTable
         @param performanceTable: Measures and records performance (time and memory consumption) of the drawing process.
         @rtype: 1d Numpy array of bool
-        @return: The result of the expression or predicate as a Numpy mask.
+        @return: The result of the expression or predicate as a Numpy mask, which the caller may modify.
         """
 
-        predicate = self.childOfClass(PmmlPredicate)
-        if predicate is not None:
-            return predicate.evaluate(dataTable, functionTable, performanceTable)
+        child = self.childOfClass(PmmlPredicate)
+        if child is None:
+            child = self.childOfClass(PmmlExpression)
 
-        expression = self.childOfClass(PmmlExpression)
-        dataColumn = expression.evaluate(dataTable, functionTable, performanceTable)
+        calculate = lambda: self._select(child, dataTable, functionTable, performanceTable)
+
+        key = child.structuralKey()
+        if key is None:
+            selection = calculate()
+        else:
+            # selections of the same data with the same predicate are shared by all plot elements of a PlotCanvas
+            selection = dataTable.expressions.reuse(("PlotSelection", key), child.referencedFields(), calculate, dataTable, functionTable, performanceTable, "plot selections")
+
+        return selection.copy()
+
+    @staticmethod
+    def _select(child, dataTable, functionTable, performanceTable):
+        """Used by C{select}."""
+
+        if isinstance(child, PmmlPredicate):
+            return child.evaluate(dataTable, functionTable, performanceTable)
+
+        dataColumn = child.evaluate(dataTable, functionTable, performanceTable)
 
         if not dataColumn.fieldType.isboolean():
             raise defs.PmmlValidationError("PlotSelection must evaluate to boolean, not %r" % dataColumn.fieldType)
 
-        dataColumn._unlock()
         if dataColumn.mask is not None:
-            NP("logical_and", dataColumn.data, NP(dataColumn.mask == defs.VALID), dataColumn.data)
-
-        return dataColumn.data
+            return NP("logical_and", dataColumn.data, NP(dataColumn.mask == defs.VALID))
+        else:
+            return dataColumn.data
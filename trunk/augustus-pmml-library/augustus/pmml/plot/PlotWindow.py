@@ -32,6 +32,7 @@ from augustus.core.plot.PlotContentBox import PlotContentBox
 from augustus.core.plot.PlotCoordinatesOffset import PlotCoordinatesOffset
 from augustus.core.plot.PlotCoordinatesWindow import PlotCoordinatesWindow
 from augustus.core.plot.PlotRange import PlotRange
+from augustus.core.plot.PlotScheduler import PlotScheduler
 from augustus.core.plot.PlotTickMarks import PlotTickMarks
 from augustus.core.plot.PmmlPlotContentAnnotation import PmmlPlotContentAnnotation
 from augustus.pmml.plot.PlotOverlay import PlotOverlay
@@ -335,7 +336,7 @@ class PlotWindow(PmmlPlotFrame):
                 performanceTable.pause("PlotWindow")
                 for plotContent in plotContents:
                     states[plotContent] = self._State()
-                    plotContent.prepare(states[plotContent], dataTable, functionTable, performanceTable, plotRange)
+                    PlotScheduler.prepare(plotContent, states[plotContent], dataTable, functionTable, performanceTable, plotRange)
                 performanceTable.unpause("PlotWindow")
 
                 xmin, ymin, xmax, ymax = plotRange.ranges()
@@ -46,6 +46,24 @@ class CompoundPredicate(PmmlPredicate):
         """
 
         predicates = [x.evaluate(dataTable, functionTable, performanceTable, returnUnknowns=True) for x in self.childrenOfClass(PmmlPredicate)]
+        return self.combine(predicates, performanceTable, returnUnknowns)
+
+    def combine(self, predicates, performanceTable, returnUnknowns=False):
+        """Combine the results of already-evaluated sub-predicates.
+
+        This allows sub-predicates that are shared among many
+        predicates to be evaluated only once.  The arrays in
+        C{predicates[0]} are modified in place.
+
+        @type predicates: list of 3-tuples of 1d Numpy arrays of bool
+        @param predicates: The selection, unknowns, encounteredUnknowns of each sub-predicate, in document order.
+        @type performanceTable: PerformanceTable
+        @param performanceTable: A PerformanceTable for measuring the efficiency of the calculation.
+        @type returnUnknowns: bool
+        @param returnUnknowns: If True, return a "mask" for the selection that indicates which rows are unknown, rather than True or False.
+        @rtype: 1d Numpy array of bool or 3-tuple of arrays
+        @return: Either a simple selection array or selection, unknowns, encounteredUnknowns
+        """
 
         performanceTable.begin("CompoundPredicate")
 
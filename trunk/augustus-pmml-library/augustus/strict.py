@@ -37,6 +37,7 @@ from augustus.core.DataTable import DataTable
 from augustus.core.DataTableFields import DataTableFields
 from augustus.core.DataTableState import DataTableState
 from augustus.core.DataTablePlots import DataTablePlots
+from augustus.core.DataTableExpressions import DataTableExpressions
 from augustus.core.FakeFieldType import FakeFieldType
 
 ### functions
@@ -116,5 +117,25 @@ from augustus.pmml.model.trees.strict import *
 register(modelLoader)
 from augustus.pmml.model.clustering.strict import *
 register(modelLoader)
+from augustus.pmml.model.regression.strict import *
+register(modelLoader)
+from augustus.pmml.model.generalregression.strict import *
+register(modelLoader)
+from augustus.pmml.model.naivebayes.strict import *
+register(modelLoader)
+from augustus.pmml.model.ruleset.strict import *
+register(modelLoader)
+from augustus.pmml.model.neuralnetwork.strict import *
+register(modelLoader)
+from augustus.pmml.model.svm.strict import *
+register(modelLoader)
+from augustus.pmml.model.scorecard.strict import *
+register(modelLoader)
+from augustus.pmml.model.nearestneighbor.strict import *
+register(modelLoader)
+from augustus.pmml.model.association.strict import *
+register(modelLoader)
+from augustus.pmml.model.timeseries.strict import *
+register(modelLoader)
 
 del register
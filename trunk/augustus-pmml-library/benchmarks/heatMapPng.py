@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Time the PNG encoding of 4096x4096 heatmaps and report the size
+of the result.
+
+The images are two Gaussian peaks, colored with a 2-stop and a
+4-stop gradient, with and without Poisson noise like that of a
+filled histogram.  They are encoded with ArrayToPng exactly as
+PlotHeatMap does.
+
+To compare two revisions, check out the older one elsewhere (for
+instance with C{git worktree add}) and run this script against both
+trees:
+
+    python heatMapPng.py --library /path/to/old/augustus-pmml-library
+    python heatMapPng.py
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+parser = OptionParser(usage="%prog [options]")
+parser.add_option("--library", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."), help="directory containing the augustus package to time (default: this tree)")
+parser.add_option("--size", type="int", default=4096, help="width and height of the heatmaps in pixels (default: %default)")
+parser.add_option("--compressionLevel", type="int", help="zlib compression level, if ArrayToPng has one (default: ArrayToPng's default)")
+options, args = parser.parse_args()
+sys.path.insert(0, options.library)
+
+import numpy
+from augustus.core.ArrayToPng import ArrayToPng
+
+if options.compressionLevel is not None:
+    if not hasattr(ArrayToPng, "compressionLevel"):
+        parser.error("this ArrayToPng has no compressionLevel")
+    ArrayToPng.compressionLevel = options.compressionLevel
+
+gradients = [("2-stop", [(0.0, (255, 255, 255, 255)), (1.0, (0, 0, 255, 255))]),
+             ("4-stop", [(0.0, (0, 0, 128, 255)), (0.3, (0, 200, 255, 255)), (0.7, (255, 230, 0, 255)), (1.0, (160, 0, 0, 255))])]
+
+size = options.size
+y, x = numpy.mgrid[0:size, 0:size] / float(size)
+peaks = numpy.exp(-((x - 0.3)**2 + (y - 0.4)**2) / 0.02) + 0.6 * numpy.exp(-((x - 0.7)**2 + (y - 0.6)**2) / 0.005)
+del x, y
+
+for noise in False, True:
+    z = peaks
+    if noise:
+        z = z + numpy.random.RandomState(0).poisson(20, size=z.shape) / 200.0
+    z = (z - z.min()) / (z.max() - z.min())
+
+    for name, stops in gradients:
+        offsets = [offset for offset, color in stops]
+        red, green, blue, alpha = [numpy.interp(z, offsets, [color[i] for offset, color in stops]).astype(numpy.uint8).ravel() for i in xrange(4)]
+
+        startTime = time.time()
+        arrayToPng = ArrayToPng()
+        arrayToPng.putdata(size, size, red, green, blue, alpha, flipy=True, onePixelBeyondBorder=False)
+        encodeTime = time.time() - startTime
+
+        print "%-13s %s gradient: %6.2f s %6.2f MB" % ("Poisson noise," if noise else "noise-free,", name, encodeTime, len(arrayToPng.file.getvalue()) / 1e6)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Time NormContinuous on 10-million-row columns, with 3 and with 20
+LinearNorm knots.
+
+To compare two revisions, check out the older one elsewhere (for
+instance with C{git worktree add}) and run this script against both
+trees, saving the results of one and comparing them with the other:
+
+    python normContinuous.py --library /path/to/old/augustus-pmml-library --save old.npz
+    python normContinuous.py --compare old.npz
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+parser = OptionParser(usage="%prog [options]")
+parser.add_option("--library", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."), help="directory containing the augustus package to time (default: this tree)")
+parser.add_option("--length", type="int", default=10000000, help="number of rows (default: %default)")
+parser.add_option("--repeat", type="int", default=5, help="number of evaluations to average (default: %default)")
+parser.add_option("--save", help="save the results to this .npz file")
+parser.add_option("--compare", help="report the largest difference from results saved with --save")
+options, args = parser.parse_args()
+sys.path.insert(0, options.library)
+
+import numpy
+from augustus.strict import *
+from augustus.core.FakePerformanceTable import FakePerformanceTable
+
+document = """<PMML version="4.1" xmlns="http://www.dmg.org/PMML-4_1">
+<Header/>
+<DataDictionary>
+  <DataField name="x" optype="continuous" dataType="double"/>
+</DataDictionary>
+<TransformationDictionary>
+  <DerivedField name="nx" optype="continuous" dataType="double">
+    <NormContinuous field="x" outliers="asIs">
+%s
+    </NormContinuous>
+  </DerivedField>
+</TransformationDictionary>
+</PMML>"""
+
+cases = [("3 knots", [(0.0, 0.0), (10.0, 0.5), (20.0, 2.0)], -5.0, 25.0),
+         ("20 knots", [(float(i), i * i * 0.01) for i in xrange(0, 40, 2)], -5.0, 45.0)]
+
+results = {}
+for name, knots, low, high in cases:
+    pmml = modelLoader.loadXml(document % "\n".join("      <LinearNorm orig=\"%r\" norm=\"%r\"/>" % knot for knot in knots))
+    normContinuous = pmml.xpath("//pmml:NormContinuous")[0]
+    dataTable = DataTable(pmml, {"x": numpy.random.RandomState(12345).uniform(low, high, options.length)})
+    functionTable = FunctionTable()
+    performanceTable = FakePerformanceTable()
+
+    # the first evaluation includes any one-time compilation of the knots
+    startTime = time.time()
+    dataColumn = normContinuous.evaluate(dataTable, functionTable, performanceTable)
+    firstTime = time.time() - startTime
+
+    startTime = time.time()
+    for i in xrange(options.repeat):
+        dataColumn = normContinuous.evaluate(dataTable, functionTable, performanceTable)
+    print "%-8s  first %.3f s  then %.3f s per evaluation" % (name, firstTime, (time.time() - startTime) / options.repeat)
+    results[name.replace(" ", "")] = dataColumn.data
+
+if options.save is not None:
+    numpy.savez(options.save, **results)
+
+if options.compare is not None:
+    saved = numpy.load(options.compare)
+    for name, data in sorted(results.items()):
+        print "%-8s  largest difference from %s: %g" % (name, options.compare, abs(data - saved[name]).max())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Time RegressionModel on 10 million rows with 500 double
+predictors, against a per-predictor NumPy loop with the same mask
+handling.
+
+The rows are scored in DataTables of C{--chunk} rows, so that the
+whole table does not have to fit in memory; the same block of random
+inputs is scored repeatedly.  Each case is a number of
+RegressionTables and a normalizationMethod, and every chunk's result
+is checked against the loop (values for regression, the predicted
+category for classification).
+
+    python regressionModel.py
+    python regressionModel.py --rows 1000000 --case 3:softmax
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+parser = OptionParser(usage="%prog [options]")
+parser.add_option("--library", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."), help="directory containing the augustus package to time (default: this tree)")
+parser.add_option("--rows", type="int", default=10000000, help="total number of rows (default: %default)")
+parser.add_option("--chunk", type="int", default=50000, help="number of rows per DataTable (default: %default)")
+parser.add_option("--predictors", type="int", default=500, help="number of NumericPredictors (default: %default)")
+parser.add_option("--case", action="append", help="TABLES:NORMALIZATION to time, may be repeated (default: 1:none, 1:logit, 3:softmax, 5:softmax)")
+options, args = parser.parse_args()
+sys.path.insert(0, options.library)
+
+import numpy
+from augustus.strict import *
+from augustus.core.FakePerformanceTable import FakePerformanceTable
+
+if options.case is None:
+    options.case = ["1:none", "1:logit", "3:softmax", "5:softmax"]
+
+document = """<PMML version="4.1" xmlns="http://www.dmg.org/PMML-4_1">
+<Header/>
+<DataDictionary>
+%s
+</DataDictionary>
+<RegressionModel functionName="%s" normalizationMethod="%s">
+  <MiningSchema>
+%s
+  </MiningSchema>
+%s
+</RegressionModel>
+</PMML>"""
+
+def makeModel(coefficients, normalization):
+    numberOfTables, numberOfPredictors = coefficients.shape
+    dataFields = "\n".join("  <DataField name=\"x%d\" optype=\"continuous\" dataType=\"double\"/>" % i for i in xrange(numberOfPredictors))
+    miningFields = "\n".join("    <MiningField name=\"x%d\"/>" % i for i in xrange(numberOfPredictors))
+    regressionTables = "\n".join("  <RegressionTable intercept=\"0.1\" targetCategory=\"c%d\">%s</RegressionTable>" % (j, "".join("<NumericPredictor name=\"x%d\" coefficient=\"%r\"/>" % (i, coefficients[j, i]) for i in xrange(numberOfPredictors))) for j in xrange(numberOfTables))
+    functionName = "regression" if numberOfTables == 1 else "classification"
+    return modelLoader.loadXml(document % (dataFields, functionName, normalization, miningFields, regressionTables))
+
+def perPredictorLoop(dataTable, coefficients, normalization):
+    numberOfTables, numberOfPredictors = coefficients.shape
+    result = numpy.zeros((numberOfTables, len(dataTable))) + 0.1
+    for j in xrange(numberOfTables):
+        for i in xrange(numberOfPredictors):
+            result[j] += coefficients[j, i] * dataTable.fields["x%d" % i].data
+
+    mask = numpy.zeros(len(dataTable), dtype=defs.maskType)
+    for i in xrange(numberOfPredictors):
+        if dataTable.fields["x%d" % i].mask is not None:
+            numpy.maximum(mask, dataTable.fields["x%d" % i].mask, mask)
+
+    if normalization == "logit":
+        result = 1.0 / (1.0 + numpy.exp(-result))
+    elif normalization == "softmax":
+        result = numpy.exp(result - result.max(axis=0))
+        result /= result.sum(axis=0)
+    return result
+
+random = numpy.random.RandomState(12345)
+block = random.normal(0.0, 1.0, (options.chunk, options.predictors))
+inputs = dict(("x%d" % i, numpy.ascontiguousarray(block[:,i])) for i in xrange(options.predictors))
+del block
+
+for case in options.case:
+    numberOfTables, normalization = case.split(":")
+    numberOfTables = int(numberOfTables)
+    if normalization not in ("none", "logit", "softmax"):
+        parser.error("the per-predictor loop only implements none, logit, and softmax")
+
+    coefficients = random.normal(0.0, 0.01, (numberOfTables, options.predictors))
+    pmml = makeModel(coefficients, normalization)
+    model = pmml.xpath("pmml:RegressionModel")[0]
+    dataTable = DataTable(pmml, inputs)
+    functionTable = FunctionTable()
+    performanceTable = FakePerformanceTable()
+
+    compiledTime = 0.0
+    loopTime = 0.0
+    for chunk in xrange(options.rows // options.chunk):
+        startTime = time.time()
+        score = model.calculateScore(dataTable, functionTable, performanceTable)
+        compiledTime += time.time() - startTime
+
+        startTime = time.time()
+        expected = perPredictorLoop(dataTable, coefficients, normalization)
+        loopTime += time.time() - startTime
+
+        if numberOfTables == 1:
+            assert numpy.allclose(score[None].data, expected[0])
+        else:
+            predicted = numpy.array([int(score[None].fieldType.valueToString(x)[1:]) for x in score[None].data])
+            assert numpy.array_equal(predicted, expected.argmax(axis=0))
+
+    label = "%d table%s, %s:" % (numberOfTables, "" if numberOfTables == 1 else "s", normalization)
+    print "%-18s RegressionModel %6.2f s   per-predictor loop %6.2f s" % (label, compiledTime, loopTime)
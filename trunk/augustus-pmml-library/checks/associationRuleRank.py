@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Check that AssociationModel OutputFields select the same ruleValue
+feature however their rank is spelled."""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from augustus.strict import *
+
+document = """<PMML version="4.1" xmlns="http://www.dmg.org/PMML-4_1">
+<Header/>
+<DataDictionary>
+  <DataField name="f0" optype="categorical" dataType="string"/>
+  <DataField name="f1" optype="categorical" dataType="string"/>
+</DataDictionary>
+<AssociationModel functionName="associationRules" numberOfTransactions="10" minimumSupport="0.1" minimumConfidence="0.1" numberOfItems="3" numberOfItemsets="3" numberOfRules="3">
+  <MiningSchema><MiningField name="f0"/><MiningField name="f1"/></MiningSchema>
+  <Output>
+    <OutputField name="first" feature="ruleValue" algorithm="recommendation" rankBasis="confidence" rankOrder="descending" rank="1" ruleFeature="consequent"/>
+    <OutputField name="firstPadded" feature="ruleValue" algorithm="recommendation" rankBasis="confidence" rankOrder="descending" rank="01" ruleFeature="consequent"/>
+    <OutputField name="second" feature="ruleValue" algorithm="recommendation" rankBasis="confidence" rankOrder="descending" rank="2" ruleFeature="consequent"/>
+    <OutputField name="secondPadded" feature="ruleValue" algorithm="recommendation" rankBasis="confidence" rankOrder="descending" rank="002" ruleFeature="consequent"/>
+  </Output>
+  <Item id="1" value="a"/>
+  <Item id="2" value="b"/>
+  <Item id="3" value="c"/>
+  <Itemset id="A"><ItemRef itemRef="1"/></Itemset>
+  <Itemset id="B"><ItemRef itemRef="2"/></Itemset>
+  <Itemset id="C"><ItemRef itemRef="3"/></Itemset>
+  <AssociationRule antecedent="A" consequent="B" support="0.3" confidence="0.8"/>
+  <AssociationRule antecedent="A" consequent="C" support="0.2" confidence="0.6"/>
+  <AssociationRule antecedent="B" consequent="C" support="0.2" confidence="0.7"/>
+</AssociationModel>
+</PMML>"""
+
+def check():
+    pmml = modelLoader.loadXml(document)
+    dataTable = DataTable(pmml, {"f0": ["a", "a", "b", "c"], "f1": ["b", "c", "c", "c"]})
+    pmml.calculate(dataTable)
+
+    for name in "first", "second":
+        expected = dataTable.output[name]
+        padded = dataTable.output[name + "Padded"]
+        assert [expected.fieldType.valueToString(x) for x in expected.data] == [padded.fieldType.valueToString(x) for x in padded.data], name
+        assert numpy.array_equal(expected.mask, padded.mask) if expected.mask is not None else padded.mask is None, name
+
+    return [dataTable.output["first"].fieldType.valueToString(x) for x in dataTable.output["first"].data]
+
+if __name__ == "__main__":
+    print "rank-1 consequents: %s" % ", ".join(check())
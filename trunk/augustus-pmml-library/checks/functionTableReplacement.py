@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Check that an Apply sees functions that are replaced in a
+FunctionTable after it has been evaluated with that table."""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from augustus.strict import *
+from augustus.core.FunctionTable import FunctionTable
+
+document = """<PMML version="4.1" xmlns="http://www.dmg.org/PMML-4_1">
+<Header/>
+<DataDictionary>
+  <DataField name="x" optype="continuous" dataType="double"/>
+</DataDictionary>
+<TransformationDictionary>
+  <DerivedField name="y" optype="continuous" dataType="double">
+    <Apply function="f"><FieldRef field="x"/></Apply>
+  </DerivedField>
+</TransformationDictionary>
+</PMML>"""
+
+def check(length=1000):
+    x = numpy.random.RandomState(12345).uniform(1.0, 10.0, length)
+
+    pmml = modelLoader.loadXml(document)
+    functionTable = FunctionTable()
+    version = functionTable.version
+
+    functionTable["f"] = FunctionTable.Exponential()
+    dataTable = DataTable(pmml, {"x": x})
+    pmml.calculate(dataTable, functionTable)
+    assert numpy.array_equal(dataTable.fields["y"].data, numpy.exp(x))
+
+    # assigning the same function again does not invalidate compiled plans
+    version = functionTable.version
+    functionTable["f"] = functionTable["f"]
+    assert functionTable.version == version
+
+    functionTable["f"] = FunctionTable.SquareRoot()
+    assert functionTable.version != version
+    dataTable = DataTable(pmml, {"x": x})
+    pmml.calculate(dataTable, functionTable)
+    assert numpy.array_equal(dataTable.fields["y"].data, numpy.sqrt(x))
+
+    return abs(dataTable.fields["y"].data - numpy.sqrt(x)).max()
+
+if __name__ == "__main__":
+    print "largest difference after replacing the function: %g" % check()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Check a multinomial logistic GeneralRegressionModel whose PPCells
+have targetCategories against a direct calculation of the category
+probabilities."""
+
+import os
+import sys
+import math
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from augustus.strict import *
+
+document = """<PMML version="4.1" xmlns="http://www.dmg.org/PMML-4_1">
+<Header/>
+<DataDictionary>
+  <DataField name="x" optype="continuous" dataType="double"/>
+  <DataField name="w" optype="continuous" dataType="double"/>
+  <DataField name="c" optype="categorical" dataType="string"/>
+  <DataField name="t" optype="categorical" dataType="string"><Value value="A"/><Value value="B"/><Value value="C"/></DataField>
+</DataDictionary>
+<GeneralRegressionModel functionName="classification" modelType="multinomialLogistic" targetReferenceCategory="C">
+  <MiningSchema><MiningField name="x"/><MiningField name="w"/><MiningField name="c"/><MiningField name="t" usageType="predicted"/></MiningSchema>
+  <Output><OutputField name="pA" feature="probability" value="A"/><OutputField name="pB" feature="probability" value="B"/></Output>
+  <ParameterList><Parameter name="p0"/><Parameter name="p1"/><Parameter name="p2"/></ParameterList>
+  <FactorList><Predictor name="c"/></FactorList>
+  <CovariateList><Predictor name="x"/><Predictor name="w"/></CovariateList>
+  <PPMatrix>
+    <PPCell value="1" predictorName="x" parameterName="p1" targetCategory="A"/>
+    <PPCell value="1" predictorName="w" parameterName="p1" targetCategory="B"/>
+    <PPCell value="u" predictorName="c" parameterName="p2"/>
+    <PPCell value="2" predictorName="x" parameterName="p2" targetCategory="B"/>
+  </PPMatrix>
+  <ParamMatrix>
+    <PCell targetCategory="A" parameterName="p0" beta="0.3"/>
+    <PCell targetCategory="B" parameterName="p0" beta="-0.2"/>
+    <PCell targetCategory="A" parameterName="p1" beta="0.5"/>
+    <PCell targetCategory="B" parameterName="p1" beta="-0.7"/>
+    <PCell targetCategory="A" parameterName="p2" beta="0.4"/>
+    <PCell targetCategory="B" parameterName="p2" beta="0.9"/>
+  </ParamMatrix>
+</GeneralRegressionModel>
+</PMML>"""
+
+def check(length=1000):
+    random = numpy.random.RandomState(12345)
+    x = random.uniform(-1.0, 2.0, length)
+    w = random.normal(0.0, 1.0, length)
+    c = numpy.array(["u", "v"])[random.randint(0, 2, length)]
+
+    pmml = modelLoader.loadXml(document)
+    dataTable = DataTable(pmml, {"x": x, "w": w, "c": c, "t": ["A"] * length})
+    pmml.calculate(dataTable)
+
+    worst = 0.0
+    for i in xrange(length):
+        # for A, p1 is x and p2 is (c == u); for B, p1 is w and p2 is (c == u) * x**2
+        etaA = 0.3 + 0.5 * x[i] + 0.4 * (c[i] == "u")
+        etaB = -0.2 - 0.7 * w[i] + 0.9 * (c[i] == "u") * x[i]**2
+        denominator = math.exp(etaA) + math.exp(etaB) + 1.0
+        worst = max(worst, abs(dataTable.output["pA"].data[i] - math.exp(etaA) / denominator), abs(dataTable.output["pB"].data[i] - math.exp(etaB) / denominator))
+
+    assert worst < 1e-12, worst
+    return worst
+
+if __name__ == "__main__":
+    print "largest difference in probability: %g" % check()
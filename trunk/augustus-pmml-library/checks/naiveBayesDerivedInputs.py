@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Check a NaiveBayesModel with two BayesInputs that are discretized
+by unnamed DerivedFields against a direct calculation of the
+posterior probabilities."""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from augustus.strict import *
+
+document = """<PMML version="4.1" xmlns="http://www.dmg.org/PMML-4_1">
+<Header/>
+<DataDictionary>
+  <DataField name="a" optype="categorical" dataType="string"/>
+  <DataField name="x" optype="continuous" dataType="double"/>
+  <DataField name="y" optype="continuous" dataType="double"/>
+  <DataField name="t" optype="categorical" dataType="string"/>
+</DataDictionary>
+<NaiveBayesModel functionName="classification" threshold="0.001">
+  <MiningSchema><MiningField name="a"/><MiningField name="x"/><MiningField name="y"/><MiningField name="t" usageType="predicted"/></MiningSchema>
+  <Output><OutputField name="pR" feature="probability" value="R"/><OutputField name="p" feature="probability"/></Output>
+  <BayesInputs>
+    <BayesInput fieldName="a">
+      <PairCounts value="u"><TargetValueCounts><TargetValueCount value="R" count="10"/><TargetValueCount value="S" count="3"/><TargetValueCount value="T" count="0"/></TargetValueCounts></PairCounts>
+      <PairCounts value="v"><TargetValueCounts><TargetValueCount value="R" count="5"/><TargetValueCount value="S" count="12"/><TargetValueCount value="T" count="7"/></TargetValueCounts></PairCounts>
+    </BayesInput>
+    <BayesInput fieldName="x">
+      <DerivedField optype="categorical" dataType="string">
+        <Discretize field="x"><DiscretizeBin binValue="lo"><Interval closure="openOpen" rightMargin="0"/></DiscretizeBin><DiscretizeBin binValue="hi"><Interval closure="closedOpen" leftMargin="0"/></DiscretizeBin></Discretize>
+      </DerivedField>
+      <PairCounts value="lo"><TargetValueCounts><TargetValueCount value="R" count="3"/><TargetValueCount value="S" count="9"/><TargetValueCount value="T" count="2"/></TargetValueCounts></PairCounts>
+      <PairCounts value="hi"><TargetValueCounts><TargetValueCount value="R" count="12"/><TargetValueCount value="S" count="6"/><TargetValueCount value="T" count="5"/></TargetValueCounts></PairCounts>
+    </BayesInput>
+    <BayesInput fieldName="y">
+      <DerivedField optype="categorical" dataType="string">
+        <Discretize field="y"><DiscretizeBin binValue="lo"><Interval closure="openOpen" rightMargin="1"/></DiscretizeBin><DiscretizeBin binValue="hi"><Interval closure="closedOpen" leftMargin="1"/></DiscretizeBin></Discretize>
+      </DerivedField>
+      <PairCounts value="lo"><TargetValueCounts><TargetValueCount value="R" count="14"/><TargetValueCount value="S" count="4"/><TargetValueCount value="T" count="6"/></TargetValueCounts></PairCounts>
+      <PairCounts value="hi"><TargetValueCounts><TargetValueCount value="R" count="1"/><TargetValueCount value="S" count="11"/><TargetValueCount value="T" count="1"/></TargetValueCounts></PairCounts>
+    </BayesInput>
+  </BayesInputs>
+  <BayesOutput fieldName="t"><TargetValueCounts><TargetValueCount value="R" count="15"/><TargetValueCount value="S" count="15"/><TargetValueCount value="T" count="7"/></TargetValueCounts></BayesOutput>
+</NaiveBayesModel>
+</PMML>"""
+
+categories = "RST"
+priors = (15.0, 15.0, 7.0)
+pairCounts = [{"u": (10, 3, 0), "v": (5, 12, 7)},
+              {"lo": (3, 9, 2), "hi": (12, 6, 5)},
+              {"lo": (14, 4, 6), "hi": (1, 11, 1)}]
+
+def discretize(value, cut):
+    if value != value:
+        return None
+    return "lo" if value < cut else "hi"
+
+def check(length=1000):
+    random = numpy.random.RandomState(12345)
+    a = numpy.array(["u", "v", "w"])[random.randint(0, 3, length)]
+    x = random.normal(0.0, 1.0, length)
+    y = random.normal(1.0, 1.0, length)
+    x[::17] = float("nan")
+
+    pmml = modelLoader.loadXml(document)
+    pmml.calculate(DataTable(pmml, {"a": a, "x": x, "y": y, "t": ["R"] * length}))
+
+    # the second calculation reuses the compiled plan
+    dataTable = DataTable(pmml, {"a": a, "x": x, "y": y, "t": ["R"] * length})
+    pmml.calculate(dataTable)
+
+    worst = 0.0
+    for i in xrange(length):
+        likelihoods = [prior / sum(priors) for prior in priors]
+        for table, value in zip(pairCounts, (a[i], discretize(x[i], 0.0), discretize(y[i], 1.0))):
+            if value in table:
+                for j in xrange(len(categories)):
+                    probability = table[value][j] / priors[j]
+                    likelihoods[j] *= probability if probability > 0.0 else 0.001
+        posteriors = [likelihood / sum(likelihoods) for likelihood in likelihoods]
+
+        worst = max(worst, abs(dataTable.output["pR"].data[i] - posteriors[0]), abs(dataTable.output["p"].data[i] - max(posteriors)))
+        assert dataTable.score.fieldType.valueToString(dataTable.score.data[i]) == categories[posteriors.index(max(posteriors))], i
+
+    assert worst < 1e-12, worst
+    assert None not in dataTable.fields
+    return worst
+
+if __name__ == "__main__":
+    print "largest difference in probability: %g" % check()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Check a NearestNeighborModel with binary similarity metrics
+against a direct calculation of the similarities of the nearest
+TrainingInstances."""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from augustus.strict import *
+
+document = """<PMML version="4.1" xmlns="http://www.dmg.org/PMML-4_1">
+<Header/>
+<DataDictionary>
+%(dataFields)s
+  <DataField name="t" optype="categorical" dataType="string"/>
+</DataDictionary>
+<NearestNeighborModel functionName="classification" numberOfNeighbors="3">
+  <MiningSchema>
+%(miningFields)s
+    <MiningField name="t" usageType="predicted"/>
+  </MiningSchema>
+  <Output><OutputField name="a1" feature="entityAffinity" rank="1"/><OutputField name="a2" feature="entityAffinity" rank="2"/><OutputField name="a3" feature="entityAffinity" rank="3"/></Output>
+  <TrainingInstances>
+    <InstanceFields>
+%(instanceFields)s
+      <InstanceField field="t"/>
+    </InstanceFields>
+    <InlineTable>
+%(rows)s
+    </InlineTable>
+  </TrainingInstances>
+  <ComparisonMeasure kind="similarity">%(metric)s</ComparisonMeasure>
+  <KNNInputs>
+%(knnInputs)s
+  </KNNInputs>
+</NearestNeighborModel>
+</PMML>"""
+
+metrics = {"<jaccard/>": lambda a11, a10, a01, a00: a11 / (a11 + a10 + a01),
+           "<simpleMatching/>": lambda a11, a10, a01, a00: (a11 + a00) / (a11 + a10 + a01 + a00),
+           "<tanimoto/>": lambda a11, a10, a01, a00: (a11 + a00) / (a11 + 2.0 * (a10 + a01) + a00),
+           "<binarySimilarity c00-parameter=\"0.5\" c01-parameter=\"0\" c10-parameter=\"0\" c11-parameter=\"1\" d00-parameter=\"0.5\" d01-parameter=\"1\" d10-parameter=\"1\" d11-parameter=\"1\"/>": lambda a11, a10, a01, a00: (a11 + 0.5 * a00) / (a11 + a10 + a01 + 0.5 * a00)}
+
+def check(numberOfFields=8, numberOfInstances=200, length=500):
+    random = numpy.random.RandomState(12345)
+    training = random.randint(0, 2, (numberOfInstances, numberOfFields))
+    training[:,0] = 1      # so that jaccard is always defined
+    queries = random.randint(0, 2, (length, numberOfFields))
+    queries[:,0] = 1
+
+    fields = ["b%d" % j for j in xrange(numberOfFields)]
+    parts = {"dataFields": "\n".join("  <DataField name=\"%s\" optype=\"continuous\" dataType=\"integer\"/>" % x for x in fields),
+             "miningFields": "\n".join("    <MiningField name=\"%s\"/>" % x for x in fields),
+             "instanceFields": "\n".join("      <InstanceField field=\"%s\"/>" % x for x in fields),
+             "rows": "\n".join("      <row>%s<t>%s</t></row>" % ("".join("<%s>%d</%s>" % (x, value, x) for x, value in zip(fields, instance)), "AB"[instance[1]]) for instance in training),
+             "knnInputs": "\n".join("    <KNNInput field=\"%s\"/>" % x for x in fields)}
+
+    worst = 0.0
+    for metric, similarity in metrics.items():
+        parts["metric"] = metric
+        pmml = modelLoader.loadXml(document % parts)
+        inputs = dict((x, queries[:,j]) for j, x in enumerate(fields))
+        inputs["t"] = ["A"] * length
+        dataTable = DataTable(pmml, inputs)
+        pmml.calculate(dataTable)
+
+        q = queries[:,numpy.newaxis,:]
+        t = training[numpy.newaxis,:,:]
+        a11 = ((q == 1) & (t == 1)).sum(axis=2) * 1.0
+        a10 = ((q == 1) & (t == 0)).sum(axis=2) * 1.0
+        a01 = ((q == 0) & (t == 1)).sum(axis=2) * 1.0
+        a00 = ((q == 0) & (t == 0)).sum(axis=2) * 1.0
+        expected = -numpy.sort(-similarity(a11, a10, a01, a00), axis=1)[:,:3]
+
+        for rank in xrange(3):
+            difference = abs(dataTable.output["a%d" % (rank + 1)].data - expected[:,rank]).max()
+            assert difference < 1e-12, (metric, rank, difference)
+            worst = max(worst, difference)
+
+    return worst
+
+if __name__ == "__main__":
+    print "largest difference in similarity: %g" % check()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Check a NeuralNetwork whose NeuralInputs have unnamed
+DerivedFields against a direct calculation of the forward pass, and
+check that duplicate Neuron ids are rejected."""
+
+import os
+import sys
+import math
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from augustus.strict import *
+
+document = """<PMML version="4.1" xmlns="http://www.dmg.org/PMML-4_1">
+<Header/>
+<DataDictionary>
+  <DataField name="x1" optype="continuous" dataType="double"/>
+  <DataField name="x2" optype="continuous" dataType="double"/>
+  <DataField name="c" optype="categorical" dataType="string"/>
+  <DataField name="y" optype="continuous" dataType="double"/>
+</DataDictionary>
+<NeuralNetwork functionName="regression" activationFunction="tanh">
+  <MiningSchema><MiningField name="x1"/><MiningField name="x2"/><MiningField name="c"/><MiningField name="y" usageType="predicted"/></MiningSchema>
+  <NeuralInputs>
+    <NeuralInput id="i1"><DerivedField optype="continuous" dataType="double"><NormContinuous field="x1"><LinearNorm orig="0" norm="-1"/><LinearNorm orig="10" norm="1"/></NormContinuous></DerivedField></NeuralInput>
+    <NeuralInput id="i2"><DerivedField optype="continuous" dataType="double"><FieldRef field="x2"/></DerivedField></NeuralInput>
+    <NeuralInput id="i3"><DerivedField optype="continuous" dataType="double"><NormDiscrete field="c" value="a"/></DerivedField></NeuralInput>
+  </NeuralInputs>
+  <NeuralLayer>
+    <Neuron id="h1" bias="0.1"><Con from="i1" weight="0.5"/><Con from="i2" weight="-0.3"/><Con from="i3" weight="0.8"/></Neuron>
+    <Neuron id="h2" bias="-0.2"><Con from="i1" weight="-0.7"/><Con from="i2" weight="0.4"/></Neuron>
+  </NeuralLayer>
+  <NeuralLayer activationFunction="identity">
+    <Neuron id="o1" bias="0.05"><Con from="h1" weight="1.5"/><Con from="h2" weight="-0.5"/></Neuron>
+  </NeuralLayer>
+  <NeuralOutputs>
+    <NeuralOutput outputNeuron="o1"><DerivedField optype="continuous" dataType="double"><FieldRef field="y"/></DerivedField></NeuralOutput>
+  </NeuralOutputs>
+</NeuralNetwork>
+</PMML>"""
+
+def forward(x1, x2, c):
+    i1 = -1.0 + 2.0 * x1 / 10.0
+    i3 = 1.0 if c == "a" else 0.0
+    h1 = math.tanh(0.1 + 0.5 * i1 - 0.3 * x2 + 0.8 * i3)
+    h2 = math.tanh(-0.2 - 0.7 * i1 + 0.4 * x2)
+    return 0.05 + 1.5 * h1 - 0.5 * h2
+
+def check(length=1000):
+    random = numpy.random.RandomState(12345)
+    x1 = random.uniform(0.0, 10.0, length)
+    x2 = random.normal(0.0, 1.0, length)
+    c = numpy.array(["a", "b"])[random.randint(0, 2, length)]
+
+    pmml = modelLoader.loadXml(document)
+    pmml.calculate(DataTable(pmml, {"x1": x1, "x2": x2, "c": c, "y": numpy.zeros(length)}))
+
+    # the second calculation reuses the compiled plan
+    dataTable = DataTable(pmml, {"x1": x1, "x2": x2, "c": c, "y": numpy.zeros(length)})
+    pmml.calculate(dataTable)
+
+    worst = max(abs(dataTable.score.data[i] - forward(x1[i], x2[i], c[i])) for i in xrange(length))
+    assert worst < 1e-12, worst
+    assert None not in dataTable.fields
+
+    # a neuron id that is repeated within a layer would silently replace the first neuron
+    duplicated = modelLoader.loadXml(document.replace("<Neuron id=\"h2\"", "<Neuron id=\"h1\" bias=\"0.3\"><Con from=\"i1\" weight=\"1\"/></Neuron><Neuron id=\"h2\""))
+    try:
+        duplicated.calculate(DataTable(duplicated, {"x1": x1, "x2": x2, "c": c, "y": numpy.zeros(length)}))
+    except defs.PmmlValidationError:
+        pass
+    else:
+        raise AssertionError("duplicate Neuron id was not detected")
+
+    return worst
+
+if __name__ == "__main__":
+    print "largest difference in score: %g" % check()
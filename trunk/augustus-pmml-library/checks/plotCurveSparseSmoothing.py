@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Check that PlotCurve's binned smoother reproduces the exact
+locally linear fit on sparse data."""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from augustus.pmml.plot.PlotCurve import PlotCurve
+
+def check(trials=100):
+    samples = numpy.linspace(-1.0, 6.0, 200)
+    worst = 0.0
+
+    # five points, much sparser than the window, with smoothingScale 0.5
+    xarray = numpy.array([0.0, 0.4, 1.7, 3.2, 4.1])
+    yarray = numpy.array([1.0, -2.0, 0.5, 3.0, -1.0])
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        xlist, ylist, dxlist, dylist = PlotCurve.pointsToSmoothCurve(xarray, yarray, samples, 0.5, False)
+        yexact, dyexact = PlotCurve._exactLocalLinear(xarray, yarray, samples, 0.5)
+    assert numpy.allclose(ylist, yexact, rtol=1e-12, atol=1e-12)
+    worst = max(worst, abs(ylist - yexact).max() / (yarray.max() - yarray.min()))
+
+    random = numpy.random.RandomState(12345)
+    for trial in xrange(trials):
+        length = random.randint(3, 40)
+        xarray = numpy.sort(random.uniform(0.0, 5.0, length))
+        yarray = random.normal(0.0, 1.0, length)
+        for smoothingScale in 0.1, 0.5, 1.0, 3.0:
+            # far from narrow kernels every weight underflows, so compare only where the exact fit is defined
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                xlist, ylist, dxlist, dylist = PlotCurve.pointsToSmoothCurve(xarray, yarray, samples, smoothingScale, False)
+                yexact, dyexact = PlotCurve._exactLocalLinear(xarray, yarray, samples, smoothingScale)
+            defined = numpy.isfinite(yexact)
+            difference = abs(ylist[defined] - yexact[defined]).max() / (yarray.max() - yarray.min())
+            assert difference < 1e-2, (trial, smoothingScale, difference)
+            worst = max(worst, difference)
+
+    return worst
+
+if __name__ == "__main__":
+    print "largest difference relative to the range of y: %g" % check()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Check that transformation pruning is off by default and that
+callers can opt in, either per calculation or with the PMML class
+attribute, without changing the model's results."""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from augustus.strict import *
+from augustus.pmml.PMML import PMML
+
+document = """<PMML version="4.1" xmlns="http://www.dmg.org/PMML-4_1">
+<Header/>
+<DataDictionary>
+  <DataField name="x" optype="continuous" dataType="double"/>
+  <DataField name="y" optype="continuous" dataType="double"/>
+</DataDictionary>
+<TransformationDictionary>
+  <DerivedField name="dead" optype="continuous" dataType="double">
+    <NormContinuous field="x"><LinearNorm orig="0" norm="0"/><LinearNorm orig="1" norm="10"/></NormContinuous>
+  </DerivedField>
+  <DerivedField name="used" optype="continuous" dataType="double">
+    <NormContinuous field="x"><LinearNorm orig="0" norm="0"/><LinearNorm orig="10" norm="0.5"/><LinearNorm orig="20" norm="2"/></NormContinuous>
+  </DerivedField>
+</TransformationDictionary>
+<RegressionModel functionName="regression">
+  <MiningSchema><MiningField name="x"/><MiningField name="used"/><MiningField name="y" usageType="predicted"/></MiningSchema>
+  <RegressionTable intercept="1.5"><NumericPredictor name="used" coefficient="3"/></RegressionTable>
+</RegressionModel>
+</PMML>"""
+
+def calculate(pmml, x, **kwds):
+    dataTable = DataTable(pmml, {"x": x, "y": numpy.zeros(len(x))})
+    performanceTable = PerformanceTable()
+    pmml.calculate(dataTable, performanceTable=performanceTable, **kwds)
+    return dataTable, performanceTable.report().get("Counts", {})
+
+def check(length=1000):
+    x = numpy.random.RandomState(12345).uniform(-5.0, 25.0, length)
+    pmml = modelLoader.loadXml(document)
+    assert pmml.transformationReport() == {"Evaluated": ["used"], "Dead": ["dead"]}
+
+    # by default, every DerivedField is calculated and can be read by the caller
+    full, statistics = calculate(pmml, x)
+    assert "dead" in full.fields and "used" in full.fields
+    assert "DerivedFields pruned" not in statistics
+
+    # opting in for one calculation
+    pruned, statistics = calculate(pmml, x, pruneTransformations=True)
+    assert "dead" not in pruned.fields and "used" in pruned.fields
+    assert statistics["DerivedFields pruned"] == 1
+    assert numpy.array_equal(pruned.score.data, full.score.data)
+
+    # opting in for all calculations, including those that go through calc
+    PMML.pruneTransformations = True
+    try:
+        pruned, statistics = calculate(pmml, x)
+        assert "dead" not in pruned.fields
+        assert "dead" not in pmml.calc({"x": x, "y": numpy.zeros(length)}).fields
+        full, statistics = calculate(pmml, x, pruneTransformations=False)
+        assert "dead" in full.fields
+    finally:
+        PMML.pruneTransformations = False
+
+    return abs(pruned.score.data - full.score.data).max()
+
+if __name__ == "__main__":
+    print "largest difference in score with pruning: %g" % check()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Check that PlotQuantileSketch quantiles stay within the
+documented rank error, both for streamed and merged sketches."""
+
+import os
+import sys
+import math
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from augustus.core.plot.PlotQuantileSketch import PlotQuantileSketch
+
+def rankError(sketch, sortedData, percentiles):
+    estimates = PlotQuantileSketch.quantiles(sketch, percentiles)
+    low = numpy.searchsorted(sortedData, estimates, "left") * 100.0 / len(sortedData)
+    high = numpy.searchsorted(sortedData, estimates, "right") * 100.0 / len(sortedData)
+    return numpy.where(percentiles < low, low - percentiles, numpy.where(percentiles > high, percentiles - high, 0.0))
+
+def check(length=300000, trials=3):
+    percentiles = numpy.array([1.0, 5.0, 25.0, 50.0, 75.0, 95.0, 99.0])
+    q = percentiles / 100.0
+    bound = 100.0 * math.pi * numpy.sqrt(q * (1.0 - q)) / 100.0
+    worst = 0.0
+
+    random = numpy.random.RandomState(12345)
+    for trial in xrange(trials):
+        for data in random.exponential(1.0, length), random.normal(0.0, 1.0, length), random.lognormal(0.0, 2.0, length):
+            sortedData = numpy.sort(data)
+            for numChunks in 3, 37, 300:
+                sketch = PlotQuantileSketch.new()
+                for chunk in numpy.array_split(data, numChunks):
+                    PlotQuantileSketch.update(sketch, chunk)
+                error = rankError(sketch, sortedData, percentiles)
+                assert (error < bound).all(), (trial, numChunks, error)
+                worst = max(worst, (error / bound).max())
+
+            merged = reduce(PlotQuantileSketch.merge, [PlotQuantileSketch.fromArray(chunk, exactLimit=1000) for chunk in numpy.array_split(data, 16)])
+            error = rankError(merged, sortedData, percentiles)
+            assert (error < bound).all(), (trial, error)
+            worst = max(worst, (error / bound).max())
+
+            exact = PlotQuantileSketch.fromArray(data[:5000])
+            assert numpy.allclose(PlotQuantileSketch.quantiles(exact, percentiles), numpy.percentile(data[:5000], percentiles), rtol=1e-12, atol=0.0)
+
+    return worst
+
+if __name__ == "__main__":
+    print "largest rank error as a fraction of the documented bound: %g" % check()
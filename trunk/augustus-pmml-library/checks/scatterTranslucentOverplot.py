@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2006-2013  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Augustus.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Check that PlotScatter's overplotResolution collapses opaque
+markers but leaves translucent ones alone."""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from augustus.strict import *
+from augustus.plot import addPlotting
+addPlotting(modelLoader)
+from augustus.producer.PlotToolkit import PlotToolkit
+
+def check(length=5000):
+    plotToolkit = PlotToolkit(modelLoader)
+    random = numpy.random.RandomState(12345)
+    x = random.normal(0.0, 1.0, length)
+    y = random.normal(0.0, 1.0, length)
+
+    uses = {}
+    for style in None, "fill-opacity: 1; stroke-opacity: 1", "fill-opacity: 0.3", "stroke-opacity: 0.5":
+        canvas = plotToolkit.scatter("x", "y", overplotResolution=2.0, limit=length)
+        if style is not None:
+            canvas.xpath("//pmml:PlotScatter", namespaces={"pmml": defs.PMML_NAMESPACE})[0]["style"] = style
+        plot = canvas.calc({"x": x, "y": y})
+        uses[style] = len(plot.xpath("//svg:use", namespaces={"svg": defs.SVG_NAMESPACE}))
+
+    assert uses[None] < length, uses
+    assert uses["fill-opacity: 1; stroke-opacity: 1"] == uses[None], uses
+    assert uses["fill-opacity: 0.3"] == length, uses
+    assert uses["stroke-opacity: 0.5"] == length, uses
+    return uses
+
+if __name__ == "__main__":
+    print "markers drawn by style: %r" % check()
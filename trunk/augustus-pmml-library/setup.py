@@ -98,9 +98,19 @@ setup(name="augustus",
                 "augustus.pmml",
                 "augustus.pmml.expression",
                 "augustus.pmml.model",
+                "augustus.pmml.model.association",
                 "augustus.pmml.model.baseline",
                 "augustus.pmml.model.clustering",
+                "augustus.pmml.model.generalregression",
+                "augustus.pmml.model.naivebayes",
+                "augustus.pmml.model.nearestneighbor",
+                "augustus.pmml.model.neuralnetwork",
+                "augustus.pmml.model.regression",
+                "augustus.pmml.model.ruleset",
+                "augustus.pmml.model.scorecard",
                 "augustus.pmml.model.segmentation",
+                "augustus.pmml.model.svm",
+                "augustus.pmml.model.timeseries",
                 "augustus.pmml.model.trees",
                 "augustus.pmml.odg",
                 "augustus.pmml.plot",